@@ -0,0 +1,84 @@
+"""SpiceChain backend.
+
+Only ``create_app`` lives at package level; models, blueprints and
+extensions are imported inside the factory so that ``import spicechain``
+stays cheap for tooling and test workers.
+"""
+import os
+
+
+def create_app(config=None):
+    """Build a configured Flask application.
+
+    ``config`` may be a config name (``'development'``, ``'testing'``), a
+    config class/object, or a plain dict of overrides.
+    """
+    from flask import Flask
+
+    from .config import configs
+    from .extensions import cors, db
+    from .rawjson import RawJSONProvider
+
+    app = Flask(__name__)
+    app.json = RawJSONProvider(app)
+
+    if config is None:
+        config = os.environ.get('SPICECHAIN_CONFIG', 'default')
+    if isinstance(config, str):
+        app.config.from_object(configs[config])
+    elif isinstance(config, dict):
+        app.config.from_object(configs['default'])
+        app.config.update(config)
+    else:
+        app.config.from_object(config)
+
+    if not app.config.get('UPLOAD_FOLDER'):
+        app.config['UPLOAD_FOLDER'] = os.path.join(os.getcwd(), "uploads", "harvests")
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    db.init_app(app)
+    cors.init_app(app, supports_credentials=True, origins=app.config['CORS_ORIGINS'])
+
+    from . import models  # noqa: F401  (register tables on db.metadata)
+    from .blueprints import register_blueprints
+    from .cli import register_commands
+    from . import (archive, composition, events, ids, instrumentation, jobs, passwords, refdata, reports,
+                   slow_queries, tokens, trace_tokens)
+
+    events.init_app(app)
+    archive.init_app(app)
+    composition.init_app(app)
+    tokens.init_app(app)
+    trace_tokens.init_app(app)
+    passwords.init_app(app)
+    ids.init_app(app)
+    refdata.init_app(app)
+    reports.init_app(app)
+    jobs.init_app(app)
+    register_blueprints(app)
+    instrumentation.init_app(app)
+    slow_queries.init_app(app)
+    register_commands(app)
+    register_error_handlers(app)
+
+    return app
+
+
+def register_error_handlers(app):
+    from flask import jsonify
+
+    from .extensions import db
+    from .fieldsets import FieldsetError
+
+    @app.errorhandler(FieldsetError)
+    def bad_fieldset(error):
+        return jsonify({'error': str(error)}), 400
+
+    @app.errorhandler(404)
+    def not_found(error):
+        return jsonify({'error': 'Endpoint not found'}), 404
+
+    @app.errorhandler(500)
+    def internal_error(error):
+        db.session.rollback()
+        return jsonify({'error': 'Internal server error'}), 500
@@ -0,0 +1,286 @@
+"""Mass-balance and price anomaly scan.
+
+The scan pulls the few columns it needs from ``Batches``, ``Package``,
+``BatchComposition`` and ``Transactions`` as NumPy arrays and does all
+per-batch and per-group arithmetic with ``bincount``/``unique``, so a
+million rows cost a handful of array passes rather than a Python loop.
+
+- ``overdrawn_batch``: more kg left a batch (sub-batches, packages, merge
+  contributions) than it was created with. Batches the ledger has not
+  opened yet are skipped until ``flask stock reconcile`` (or their next
+  stock movement) opens them.
+- ``price_outlier``: a sale whose price per kg is more than
+  ``ANOMALY_PRICE_Z_THRESHOLD`` standard deviations from the other sales of
+  the same spice in the same month (leave-one-out, so a single extreme
+  price cannot hide itself by inflating the deviation).
+
+Incremental runs start from per-table id watermarks and only recheck the
+batches and spice/months that new rows can affect; ``--full`` rechecks
+everything.
+"""
+import json
+from datetime import datetime
+
+import click
+from flask import current_app
+
+from . import jobs
+from .extensions import db
+from .models import Anomaly, BatchComposition, BatchStock, Batches, Package, StockLedger, Transactions, Watermark
+
+JOB = 'anomalies'
+SOURCES = {
+    'batches': Batches,
+    'packages': Package,
+    'compositions': BatchComposition,
+    'ledger': StockLedger,
+    'transactions': Transactions,
+}
+
+
+def columns(statement, dtypes, chunk_size=100000):
+    """Execute ``statement`` and return one NumPy array per column,
+    converting the result in chunks as it streams in."""
+    import numpy as np
+
+    result = db.session.execute(statement, execution_options={'yield_per': chunk_size})
+    parts = [[] for _ in dtypes]
+    for rows in result.partitions():
+        for part, values, dtype in zip(parts, zip(*rows), dtypes):
+            part.append(np.array(values, dtype=dtype))
+    return [np.concatenate(part) if part else np.array([], dtype=dtype) for part, dtype in zip(parts, dtypes)]
+
+
+def _high_marks():
+    return {name: db.session.execute(db.select(db.func.coalesce(db.func.max(model.id), 0))).scalar()
+            for name, model in SOURCES.items()}
+
+
+def _watermarks():
+    stored = dict(db.session.execute(
+        db.select(Watermark.name, Watermark.last_id).where(Watermark.name.like(f'{JOB}:%'))
+    ).all())
+    return {name: stored.get(f'{JOB}:{name}', 0) for name in SOURCES}
+
+
+def _new_rows(name, low, high):
+    model = SOURCES[name]
+    return (model.id > low[name], model.id <= high[name])
+
+
+def _affected_batches(low, high):
+    return db.union(
+        db.select(Batches.id).where(*_new_rows('batches', low, high)),
+        db.select(Batches.parent_batch_id).where(*_new_rows('batches', low, high),
+                                                 Batches.parent_batch_id.isnot(None)),
+        db.select(Package.batch_id).where(*_new_rows('packages', low, high)),
+        db.select(BatchComposition.source_batch_id).where(*_new_rows('compositions', low, high)),
+        db.select(StockLedger.batch_id).where(*_new_rows('ledger', low, high), StockLedger.reason == 'opening'),
+    )
+
+
+def scan_mass_balance(affected=None, tolerance=0.001):
+    """Return ``(checked batch ids, anomalies)`` for the batches selected by
+    ``affected`` (a SELECT of ids), or all batches when it is None."""
+    import numpy as np
+
+    def within(column):
+        return column.in_(affected) if affected is not None else column.isnot(None)
+
+    ids, spice, capacity = columns(
+        db.select(Batches.id, Batches.spice_id, Batches.quantity_kg).where(within(Batches.id)).order_by(Batches.id),
+        [np.int64, np.int64, np.float64]
+    )
+    if not len(ids):
+        return ids, []
+    parent, child_kg, child_at = columns(
+        db.select(Batches.parent_batch_id, Batches.quantity_kg, Batches.created_at)
+        .where(within(Batches.parent_batch_id)),
+        [np.int64, np.float64, 'datetime64[us]']
+    )
+    package_batch, package_kg = columns(
+        db.select(Package.batch_id, Package.quantity_kg).where(within(Package.batch_id)),
+        [np.int64, np.float64]
+    )
+    source, merged_kg, merged_at = columns(
+        db.select(BatchComposition.source_batch_id, BatchComposition.quantity_kg, BatchComposition.created_at)
+        .where(within(BatchComposition.source_batch_id)),
+        [np.int64, np.float64, 'datetime64[us]']
+    )
+    opened_batch, opened_at = columns(
+        db.select(StockLedger.batch_id, db.func.min(StockLedger.created_at))
+        .where(within(StockLedger.batch_id), StockLedger.reason == 'opening')
+        .group_by(StockLedger.batch_id),
+        [np.int64, 'datetime64[us]']
+    )
+    stocked, = columns(db.select(BatchStock.batch_id).where(within(BatchStock.batch_id)), [np.int64])
+
+    n = len(ids)
+    parent_idx, package_idx = np.searchsorted(ids, parent), np.searchsorted(ids, package_batch)
+    source_idx, opened_idx = np.searchsorted(ids, source), np.searchsorted(ids, opened_batch)
+    divided = np.bincount(parent_idx, weights=child_kg, minlength=n)
+    packaged = np.bincount(package_idx, weights=package_kg, minlength=n)
+    merged = np.bincount(source_idx, weights=merged_kg, minlength=n)
+
+    # Batches older than the ledger had quantity_kg reduced in place by each
+    # division/merge; add those back to get what the batch started with
+    opened = np.full(n, np.datetime64('NaT'), dtype='datetime64[us]')
+    opened[opened_idx] = opened_at
+    legacy_child = child_at < opened[parent_idx]
+    legacy_merge = merged_at < opened[source_idx]
+    capacity = (capacity
+                + np.bincount(parent_idx[legacy_child], weights=child_kg[legacy_child], minlength=n)
+                + np.bincount(source_idx[legacy_merge], weights=merged_kg[legacy_merge], minlength=n))
+
+    excess = divided + packaged + merged - capacity
+    # Batches the ledger has never opened (registered before it and not yet
+    # reconciled) have no trustworthy starting quantity; opening them adds
+    # an 'opening' ledger row, which brings them back into a scan
+    excess[~np.isin(ids, stocked)] = 0
+    anomalies = [{
+        'kind': 'overdrawn_batch',
+        'entity_type': 'batch',
+        'entity_id': int(ids[i]),
+        'spice_id': int(spice[i]),
+        'score': round(float(excess[i]), 3),
+        'details': json.dumps({
+            'capacity_kg': round(float(capacity[i]), 3),
+            'divided_kg': round(float(divided[i]), 3),
+            'packaged_kg': round(float(packaged[i]), 3),
+            'merged_kg': round(float(merged[i]), 3)
+        })
+    } for i in np.flatnonzero(excess > tolerance)]
+    return ids, anomalies
+
+
+def _spice_and_month():
+    package_batch = db.aliased(Batches)
+    spice = db.func.coalesce(Batches.spice_id, package_batch.spice_id)
+    month = (db.extract('year', Transactions.transaction_date) * 12
+             + db.extract('month', Transactions.transaction_date) - 1)
+    joins = lambda statement: (statement
+                               .outerjoin(Batches, Batches.id == Transactions.batch_id)
+                               .outerjoin(Package, Package.id == Transactions.package_id)
+                               .outerjoin(package_batch, package_batch.id == Package.batch_id))
+    return spice, month, joins
+
+
+def scan_prices(low=None, high=None, threshold=3.0, min_group=5):
+    """Return ``(checked transaction ids, anomalies)``; with watermarks only
+    the spice/months that received new sales are rescored."""
+    import numpy as np
+
+    spice, month, joins = _spice_and_month()
+    priced = (Transactions.price_per_kg > 0, Transactions.transaction_type == 'sale')
+    statement = joins(db.select(Transactions.id, spice, month, Transactions.price_per_kg)
+                      .select_from(Transactions)).where(*priced)
+    touched = None
+    if low is not None:
+        touched = db.session.execute(
+            joins(db.select(spice, month).select_from(Transactions).distinct())
+            .where(*priced, *_new_rows('transactions', low, high))
+        ).all()
+        if not touched:
+            return np.array([], dtype=np.int64), []
+        first_month = min(m for _, m in touched)
+        statement = statement.where(
+            Transactions.transaction_date >= datetime(int(first_month) // 12, int(first_month) % 12 + 1, 1)
+        )
+
+    ids, spices, months, price = columns(statement, [np.int64, np.int64, np.int64, np.float64])
+    # Month indexes stay far below this, so (spice, month) packs into one int
+    group_key = spices * 1000000 + months
+    if touched is not None:
+        keep = np.isin(group_key, [int(s) * 1000000 + int(m) for s, m in touched])
+        ids, spices, months, price, group_key = ids[keep], spices[keep], months[keep], price[keep], group_key[keep]
+    if not len(ids):
+        return ids, []
+
+    groups, inverse = np.unique(group_key, return_inverse=True)
+    count = np.bincount(inverse)[inverse]
+    total = np.bincount(inverse, weights=price)[inverse]
+    squares = np.bincount(inverse, weights=price * price)[inverse]
+
+    # Mean and deviation of the *other* sales in the group
+    scored = count >= min_group
+    others = np.maximum(count - 1, 1)
+    mean = (total - price) / others
+    std = np.sqrt(np.maximum((squares - price * price) / others - mean * mean, 0))
+    std = np.maximum(std, np.abs(mean) * 1e-6 + 1e-9)
+    z = (price - mean) / std
+
+    anomalies = [{
+        'kind': 'price_outlier',
+        'entity_type': 'transaction',
+        'entity_id': int(ids[i]),
+        'spice_id': int(spices[i]),
+        'score': round(float(abs(z[i])), 3),
+        'details': json.dumps({
+            'price_per_kg': float(price[i]),
+            'group_mean': round(float(mean[i]), 3),
+            'group_std': round(float(std[i]), 3),
+            'group_size': int(count[i]),
+            'month': f'{months[i] // 12}-{months[i] % 12 + 1:02d}'
+        })
+    } for i in np.flatnonzero(scored & (np.abs(z) > threshold))]
+    return ids, anomalies
+
+
+def _replace(kind, checked, anomalies, full):
+    """Swap the stored findings of ``kind`` for the rows just rechecked."""
+    if full:
+        db.session.execute(db.delete(Anomaly).where(Anomaly.kind == kind))
+    else:
+        checked = [int(entity_id) for entity_id in checked]
+        for start in range(0, len(checked), 1000):
+            db.session.execute(db.delete(Anomaly).where(
+                Anomaly.kind == kind, Anomaly.entity_id.in_(checked[start:start + 1000])
+            ))
+    if anomalies:
+        now = datetime.utcnow()
+        db.session.execute(db.insert(Anomaly), [{**anomaly, 'detected_at': now} for anomaly in anomalies])
+
+
+@jobs.task('anomalies')
+def run(full=False):
+    """Scan rows added since the last run (or everything), store the
+    findings and advance the watermarks in one transaction."""
+    config = current_app.config
+    high = _high_marks()
+    low = None if full else _watermarks()
+
+    batch_ids, overdrawn = scan_mass_balance(
+        None if full else _affected_batches(low, high), config['ANOMALY_MASS_TOLERANCE_KG']
+    )
+    _replace('overdrawn_batch', batch_ids, overdrawn, full)
+
+    transaction_ids, outliers = scan_prices(
+        low, high, config['ANOMALY_PRICE_Z_THRESHOLD'], config['ANOMALY_PRICE_MIN_GROUP']
+    )
+    _replace('price_outlier', transaction_ids, outliers, full)
+
+    for name, last_id in high.items():
+        db.session.merge(Watermark(name=f'{JOB}:{name}', last_id=last_id, updated_at=datetime.utcnow()))
+    db.session.commit()
+    return {
+        'batches_checked': len(batch_ids),
+        'transactions_checked': len(transaction_ids),
+        'overdrawn_batch': len(overdrawn),
+        'price_outlier': len(outliers)
+    }
+
+
+@click.group('anomalies')
+def anomalies_group():
+    """Mass-balance and price anomaly scan."""
+
+
+@anomalies_group.command('scan')
+@click.option('--full', is_flag=True, help='Recheck every row instead of only new ones.')
+def scan_command(full):
+    """Flag overdrawn batches and off-market prices. Batches registered
+    before the stock ledger are only checked once `flask stock reconcile`
+    has opened them."""
+    report = run(full)
+    click.echo(f"checked {report['batches_checked']} batches and {report['transactions_checked']} sales: "
+               f"{report['overdrawn_batch']} overdrawn batches, {report['price_outlier']} price outliers")
@@ -0,0 +1,441 @@
+"""Monthly partitions of the timeline and audit log, and their cold tier.
+
+Rows stay in the ``timeline`` and ``audit_log`` tables (the hot tier) for
+the table's ``hot_months`` in ``ARCHIVE_POLICIES``. ``flask archive run``
+moves each older month into its own zstd-compressed Parquet file under
+``ARCHIVE_DIR``, catalogued in ``archive_partition``, and deletes the
+month from the table in the same transaction, so the tables only ever
+hold recent activity. Files are sorted by the lookup key (batch for the
+timeline, user for the audit log), so Parquet row-group statistics skip
+most of a file on a lookup. Partitions older than ``keep_months`` are
+deleted, and actions listed in ``discard_actions`` are dropped instead of
+archived.
+
+Readers go through ``timeline_events`` and ``audit_entries``, which query
+the table and only those archived months that overlap the requested time
+range; hot and archived rows come back as the same named tuples, with
+usernames and batch/package codes resolved (archives store them, so they
+need no joins). Metadata stays JSON text for ``rawjson`` pass-through.
+``iter_timeline_events`` yields the same events a chunk at a time for
+histories too long to hold in memory.
+"""
+import os
+import uuid
+from collections import namedtuple
+from datetime import date, datetime
+
+import click
+from flask import current_app
+from sqlalchemy import or_
+
+from . import refdata
+from .cache import TTLCache
+from .extensions import db
+from .models import (TIMELINE_INDEXED_KEYS, ArchivePartition, AuditLog, Batches, Package, Timeline, User,
+                     json_text)
+from .rawjson import raw_column
+
+TIMELINE_FIELDS = ('id', 'batch_id', 'package_id', 'event_type', 'description', 'user_id', 'location',
+                   'timestamp', 'metadata', 'username', 'batch_code', 'package_code')
+AUDIT_FIELDS = ('id', 'user_id', 'username', 'action', 'resource_type', 'resource_id', 'old_values',
+                'new_values', 'ip_address', 'timestamp')
+# Fields a caller did not ask for are None
+Event = namedtuple('Event', TIMELINE_FIELDS, defaults=(None,) * len(TIMELINE_FIELDS))
+AuditEntry = namedtuple('AuditEntry', AUDIT_FIELDS)
+
+_INT_FIELDS = {'id', 'batch_id', 'package_id', 'user_id'}
+
+
+def _month(value):
+    return date(value.year, value.month, 1)
+
+
+def _add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _start(month):
+    return datetime(month.year, month.month, 1)
+
+
+# What each table archives: labelled columns, the joins they need, and
+# the sort order of the files
+
+def _timeline_columns():
+    return [
+        Timeline.id, Timeline.batch_id, Timeline.package_id, Timeline.event_type,
+        Timeline.event_description.label('description'), Timeline.user_id, Timeline.location,
+        Timeline.timestamp, raw_column(Timeline.event_metadata).label('metadata'), User.username,
+        Batches.batch_id.label('batch_code'), Package.package_id.label('package_code')
+    ]
+
+
+def _timeline_select(columns):
+    # Joined only for the name columns actually selected
+    keys = {column.key for column in columns}
+    query = db.select(*columns).select_from(Timeline)
+    if 'username' in keys:
+        query = query.outerjoin(User, User.id == Timeline.user_id)
+    if 'batch_code' in keys:
+        query = query.outerjoin(Batches, Batches.id == Timeline.batch_id)
+    if 'package_code' in keys:
+        query = query.outerjoin(Package, Package.id == Timeline.package_id)
+    return query
+
+
+def _audit_columns():
+    return [
+        AuditLog.id, AuditLog.user_id, User.username, AuditLog.action, AuditLog.resource_type,
+        AuditLog.resource_id, raw_column(AuditLog.old_values).label('old_values'),
+        raw_column(AuditLog.new_values).label('new_values'), AuditLog.ip_address, AuditLog.timestamp
+    ]
+
+
+def _audit_select(columns):
+    return db.select(*columns).select_from(AuditLog).outerjoin(User, User.id == AuditLog.user_id)
+
+
+_TABLES = {
+    'timeline': {
+        'model': Timeline,
+        # Metadata keys become columns of their own so lookups by them can
+        # be filtered inside the file
+        'columns': lambda: _timeline_columns() + [json_text(Timeline.event_metadata, key).label(f'meta_{key}')
+                                                  for key in TIMELINE_INDEXED_KEYS],
+        'select': _timeline_select,
+        'order': (Timeline.batch_id, Timeline.package_id, Timeline.timestamp),
+        'action': None,
+    },
+    'audit_log': {
+        'model': AuditLog,
+        'columns': _audit_columns,
+        'select': _audit_select,
+        'order': (AuditLog.user_id, AuditLog.timestamp),
+        'action': AuditLog.action,
+    },
+}
+
+
+def _schema(columns):
+    import pyarrow as pa
+
+    return pa.schema([
+        (column.key, pa.int64() if column.key in _INT_FIELDS else
+         pa.timestamp('us') if column.key == 'timestamp' else pa.string())
+        for column in columns
+    ])
+
+
+def _archive_dir():
+    return current_app.config['ARCHIVE_DIR']
+
+
+# Reading
+
+def _partitions(table, since=None, until=None):
+    query = ArchivePartition.query.filter_by(table_name=table)
+    if since is not None:
+        query = query.filter(ArchivePartition.month >= _month(since))
+    if until is not None:
+        query = query.filter(ArchivePartition.month <= _month(until))
+    return query.order_by(ArchivePartition.month, ArchivePartition.id).all()
+
+
+def _footer(path):
+    """Parquet metadata of an archive file, cached: files never change."""
+    import pyarrow.parquet as pq
+
+    cache = current_app.extensions['archive_footers']
+    metadata = cache.get(path)
+    if metadata is None:
+        metadata = pq.read_metadata(path)
+        cache.set(path, metadata)
+    return metadata
+
+
+def _may_match(statistics, op, value):
+    if statistics is None or not statistics.has_min_max:
+        # No min/max means no values or no stats; only all-null can be ruled out
+        return statistics is None or statistics.null_count != statistics.num_values
+    if op == 'in':
+        return any(statistics.min <= item <= statistics.max for item in value)
+    if op == '=':
+        return statistics.min <= value <= statistics.max
+    return statistics.max >= value if op == '>=' else statistics.min <= value
+
+
+def _row_groups(metadata, filters):
+    """Row groups whose column statistics allow a match for ``filters``."""
+    positions = {metadata.schema.column(i).name: i for i in range(metadata.num_columns)}
+    selected = []
+    for index in range(metadata.num_row_groups):
+        group = metadata.row_group(index)
+        if any(all(_may_match(group.column(positions[column]).statistics, op, value)
+                   for column, op, value in conjunction) for conjunction in filters):
+            selected.append(index)
+    return selected
+
+
+def _mask(table, filters):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    mask = None
+    for conjunction in filters:
+        terms = None
+        for column, op, value in conjunction:
+            values = table[column]
+            term = (pc.is_in(values, value_set=pa.array(value, type=values.type)) if op == 'in' else
+                    pc.equal(values, value) if op == '=' else
+                    pc.greater_equal(values, value) if op == '>=' else pc.less_equal(values, value))
+            terms = term if terms is None else pc.and_(terms, term)
+        mask = terms if mask is None else pc.or_(mask, terms)
+    return mask
+
+
+def _iter_cold(table, fields, filters, since=None, until=None):
+    """Rows of the archived months overlapping [since, until] that match
+    ``filters`` (disjunctive normal form: a list of lists of
+    ``(column, op, value)``, op one of in, =, >=, <=), as dicts in time
+    order. Only row groups whose statistics could match are read, and only
+    one month's matches are held at a time."""
+    partitions = _partitions(table, since, until)
+    if not partitions:
+        return
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    keys = sorted({column for conjunction in filters for column, _, _ in conjunction})
+    rows, month = [], None
+    for partition in partitions:
+        if partition.month != month:
+            # Months never overlap, so each one can be sorted on its own
+            rows.sort(key=lambda row: row['timestamp'])
+            yield from rows
+            rows, month = [], partition.month
+        path = os.path.join(_archive_dir(), partition.path)
+        metadata = _footer(path)
+        groups = _row_groups(metadata, filters)
+        if not groups:
+            continue
+        parquet = pq.ParquetFile(path, metadata=metadata)
+        # Statistics only bound a group; decode the key columns first and
+        # the wide ones only for groups that really hold a match
+        matching = [group for group in groups
+                    if pc.any(_mask(parquet.read_row_group(group, columns=keys), filters)).as_py()]
+        if not matching:
+            continue
+        data = parquet.read_row_groups(matching, columns=list(dict.fromkeys([*fields, *keys])))
+        rows += data.filter(_mask(data, filters)).select(list(fields)).to_pylist()
+    rows.sort(key=lambda row: row['timestamp'])
+    yield from rows
+
+
+def read_partitions(table, columns):
+    """Every archived partition of ``table`` as ``(month, Arrow table of
+    columns)``, oldest first."""
+    import pyarrow.parquet as pq
+
+    for partition in _partitions(table):
+        yield partition.month, pq.read_table(os.path.join(_archive_dir(), partition.path), columns=columns)
+
+
+def _read_cold(table, fields, filters, since=None, until=None):
+    return list(_iter_cold(table, fields, filters, since, until))
+
+
+def timeline_events(any_of, since=None, fields=TIMELINE_FIELDS):
+    """Timeline events matching any of ``any_of``, oldest first. Keys are
+    ``batch_id``/``package_id`` (ids) or ``metadata.<key>`` for a key in
+    ``TIMELINE_INDEXED_KEYS``; values are lists. Archived months before
+    ``since`` (e.g. the batch's creation) are not read. Only ``fields``
+    (and the timestamp) are loaded; the rest of each ``Event`` is None."""
+    return list(iter_timeline_events(any_of, since, fields))
+
+
+def iter_timeline_events(any_of, since=None, fields=TIMELINE_FIELDS, chunk_size=None):
+    """``timeline_events`` as a generator for histories too long to hold:
+    archived months are read one at a time and the table ``chunk_size``
+    rows (``STREAM_CHUNK_ROWS``) per fetch, so memory stays bounded
+    however many events match."""
+    conditions, filters = [], []
+    for field, values in any_of.items():
+        values = list(values)
+        if not values:
+            continue
+        if field.startswith('metadata.'):
+            key = field[len('metadata.'):]
+            conditions.append(json_text(Timeline.event_metadata, key).in_(values))
+            filters.append([(f'meta_{key}', 'in', values)])
+        else:
+            conditions.append(getattr(Timeline, field).in_(values))
+            filters.append([(field, 'in', values)])
+    if not conditions:
+        return
+
+    fields = [field for field in TIMELINE_FIELDS if field in fields or field == 'timestamp']
+    for row in _iter_cold('timeline', fields, filters, since):
+        yield Event(**row)
+    # Archived months are all older than anything still in the table.
+    # Usernames of live rows come from the reference data cache, not a join
+    selected = set(fields) - {'username'} | ({'user_id'} if 'username' in fields else set())
+    result = db.session.execute(
+        _timeline_select([column for column in _timeline_columns() if column.key in selected])
+        .where(or_(*conditions)).order_by(Timeline.timestamp)
+        .execution_options(yield_per=chunk_size or current_app.config['STREAM_CHUNK_ROWS'])
+    )
+    for chunk in result.partitions():
+        rows = [row._asdict() for row in chunk]
+        if 'username' in fields:
+            names = refdata.usernames(row['user_id'] for row in rows)
+            for row in rows:
+                row['username'] = names.get(row['user_id'])
+                if 'user_id' not in fields:
+                    del row['user_id']
+        for row in rows:
+            yield Event(**row)
+
+
+def audit_entries(user_id, since=None, until=None):
+    """A user's audit entries within [since, until], oldest first."""
+    conditions, filters = [AuditLog.user_id == user_id], [('user_id', '=', user_id)]
+    if since is not None:
+        conditions.append(AuditLog.timestamp >= since)
+        filters.append(('timestamp', '>=', since))
+    if until is not None:
+        conditions.append(AuditLog.timestamp <= until)
+        filters.append(('timestamp', '<=', until))
+
+    cold = [AuditEntry(**row) for row in _read_cold('audit_log', AUDIT_FIELDS, [filters], since, until)]
+    hot = db.session.execute(
+        _audit_select(_audit_columns()).where(*conditions).order_by(AuditLog.timestamp)
+    ).all()
+    return cold + hot
+
+
+# Archiving
+
+def archive_month(table, month, discard_actions=()):
+    """Move one month of ``table`` into a Parquet partition. Returns
+    ``(archived, discarded)`` row counts."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    spec = _TABLES[table]
+    model = spec['model']
+    in_month = db.and_(model.timestamp >= _start(month), model.timestamp < _start(_add_months(month, 1)))
+    kept = in_month
+    if discard_actions:
+        kept = db.and_(in_month, spec['action'].notin_(discard_actions))
+
+    columns = spec['columns']()
+    schema = _schema(columns)
+    relative = os.path.join(table, f'{month:%Y-%m}-{uuid.uuid4().hex[:8]}.parquet')
+    path = os.path.join(_archive_dir(), relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    chunk = current_app.config['ARCHIVE_ROW_GROUP_SIZE']
+
+    archived = 0
+    try:
+        with pq.ParquetWriter(path + '.tmp', schema, compression='zstd') as writer:
+            result = db.session.execute(
+                spec['select'](columns).where(kept).order_by(*spec['order'])
+                .execution_options(yield_per=chunk)
+            )
+            for rows in result.partitions():
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)],
+                    schema=schema
+                ), row_group_size=chunk)
+                archived += len(rows)
+        os.replace(path + '.tmp', path)
+
+        discarded = 0
+        if discard_actions:
+            discarded = db.session.execute(
+                db.select(db.func.count()).select_from(model).where(in_month, spec['action'].in_(discard_actions))
+            ).scalar()
+        deleted = db.session.execute(
+            db.delete(model).where(in_month).execution_options(synchronize_session=False)
+        ).rowcount
+        if deleted != archived + discarded:
+            raise RuntimeError(f'{table} {month:%Y-%m} changed while archiving; nothing was archived')
+        if archived:
+            db.session.add(ArchivePartition(table_name=table, month=month, path=relative, row_count=archived,
+                                            size_bytes=os.path.getsize(path)))
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        for leftover in (path, path + '.tmp'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+    if not archived:
+        os.remove(path)
+    return archived, discarded
+
+
+def apply_policies(today=None, dry_run=False):
+    """Archive every month past its table's hot window and drop archived
+    partitions past their retention. Returns one line per action."""
+    this_month = _month(today or datetime.utcnow())
+    report = []
+    for table, policy in current_app.config['ARCHIVE_POLICIES'].items():
+        model = _TABLES[table]['model']
+        cutoff = _add_months(this_month, -policy['hot_months'])
+        oldest = db.session.execute(
+            db.select(db.func.min(model.timestamp)).where(model.timestamp < _start(cutoff))
+        ).scalar()
+        month = _month(oldest) if oldest else cutoff
+        while month < cutoff:
+            rows = db.session.execute(db.select(db.func.count()).select_from(model).where(
+                model.timestamp >= _start(month), model.timestamp < _start(_add_months(month, 1))
+            )).scalar()
+            if rows and dry_run:
+                report.append(f'{table} {month:%Y-%m}: would archive {rows} rows')
+            elif rows:
+                archived, discarded = archive_month(table, month, policy.get('discard_actions', ()))
+                report.append(f'{table} {month:%Y-%m}: archived {archived} rows, discarded {discarded}')
+            month = _add_months(month, 1)
+
+        if policy.get('keep_months') is not None:
+            expired = ArchivePartition.query.filter(
+                ArchivePartition.table_name == table,
+                ArchivePartition.month < _add_months(this_month, -policy['keep_months'])
+            ).all()
+            for partition in expired:
+                report.append(f'{table} {partition.month:%Y-%m}: '
+                              f"{'would delete' if dry_run else 'deleted'} partition of {partition.row_count} rows")
+                if not dry_run:
+                    db.session.delete(partition)
+                    db.session.commit()
+                    path = os.path.join(_archive_dir(), partition.path)
+                    if os.path.exists(path):
+                        os.remove(path)
+    return report
+
+
+def init_app(app):
+    app.extensions['archive_footers'] = TTLCache(maxsize=1024)
+
+
+@click.group('archive')
+def archive_group():
+    """Timeline and audit log archiving."""
+
+
+@archive_group.command('run')
+@click.option('--dry-run', is_flag=True, help='Report what would be archived or deleted.')
+def run_command(dry_run):
+    """Apply ARCHIVE_POLICIES: archive old months, drop expired partitions."""
+    for line in apply_policies(dry_run=dry_run):
+        click.echo(line)
+
+
+@archive_group.command('list')
+def list_command():
+    """List archived partitions."""
+    for partition in ArchivePartition.query.order_by(ArchivePartition.table_name, ArchivePartition.month):
+        click.echo(f'{partition.table_name:10} {partition.month:%Y-%m} {partition.row_count:10} rows '
+                   f'{partition.size_bytes / 1024:10.1f} KiB  {partition.path}')
@@ -0,0 +1,938 @@
+"""``flask bench ...`` performance checks.
+
+Benchmarks that need data build their own app against a scratch SQLite
+file (``--db``), so they never touch the configured database. Seeding is
+skipped when the file already holds data, so large fixtures can be reused
+between runs.
+"""
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import click
+
+# Cold start of ``create_app('testing')``; also asserted by the test suite
+IMPORT_TIME_BUDGET_MS = 1000
+
+# "import time: self [us] | cumulative | imported package" lines from -X importtime
+_IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def measure_import_time(statement="from spicechain import create_app; create_app('testing')"):
+    """Run ``statement`` under ``python -X importtime`` and return the
+    cumulative microseconds spent importing each top-level module."""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    totals = {}
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        # Top-level imports are the ones with a single leading space
+        if match and len(match.group(3)) == 1:
+            totals[match.group(4)] = totals.get(match.group(4), 0) + int(match.group(2))
+    return totals
+
+
+@click.group('bench')
+def bench_group():
+    """Performance checks."""
+
+
+@bench_group.command('import-time')
+@click.option('--budget-ms', default=IMPORT_TIME_BUDGET_MS, show_default=True, help='Cold-start budget in milliseconds.')
+@click.option('--top', default=10, show_default=True, help='Number of slowest imports to print.')
+def import_time_command(budget_ms, top):
+    """Fail if building the app from a cold interpreter exceeds the budget."""
+    totals = measure_import_time()
+    total_ms = sum(totals.values()) / 1000
+    for name, us in sorted(totals.items(), key=lambda kv: kv[1], reverse=True)[:top]:
+        click.echo(f'{us / 1000:8.1f} ms  {name}')
+    click.echo(f'{total_ms:8.1f} ms  total (budget {budget_ms} ms)')
+    if total_ms > budget_ms:
+        raise click.ClickException('import-time budget exceeded')
+
+
+
+
+@contextmanager
+def bench_app(db_path, **overrides):
+    """App context bound to a scratch SQLite database with instrumentation
+    and the slow-query log switched off."""
+    from . import create_app
+    from .cli import init_database
+
+    config = {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.abspath(db_path)}',
+        'INSTRUMENTATION_ENABLED': False,
+        'SLOW_QUERY_MS': None,
+        'DASHBOARD_CACHE_SECONDS': 0,
+    }
+    config.update(overrides)
+    app = create_app(config)
+    with app.app_context():
+        init_database()
+        yield app
+
+
+def default_db_path(name):
+    return os.path.join(tempfile.gettempdir(), f'spicechain_bench_{name}.db')
+
+
+def median_ms(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def seed_supply_chain(users, batches, transactions, packages=0, seed=42):
+    """Bulk-load a synthetic supply chain with Core executemany inserts."""
+    from .extensions import db
+    from .models import Batches, Package, Transactions, User
+
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    user_types = ['farmer'] * 6 + ['middleman'] * 2 + ['consumer'] + ['quality_officer']
+    db.session.execute(db.insert(User), [{
+        'username': f'user{i}', 'email': f'user{i}@bench', 'password_hash': 'x',
+        'user_type': user_types[i % len(user_types)], 'created_at': now, 'is_active': True
+    } for i in range(1, users + 1)])
+
+    statuses = ['harvested', 'tested', 'sold', 'packaged', 'divided', 'pending_sale']
+    chunk = 50000
+    for start in range(1, batches + 1, chunk):
+        rows = []
+        for i in range(start, min(start + chunk, batches + 1)):
+            farmer = rng.randint(1, users)
+            rows.append({
+                'batch_id': f'BENCH_B{i}', 'farmer_id': farmer, 'spice_id': rng.randint(1, 7),
+                'quantity_kg': rng.uniform(10, 1000), 'harvest_date': now - timedelta(days=rng.randint(0, 720)),
+                'farm_location': f'Farm {farmer}', 'farming_method': rng.choice(['organic', 'conventional']),
+                'estimated_grade': rng.choice('ABC'), 'current_owner_id': rng.choice([farmer, rng.randint(1, users)]),
+                'status': rng.choice(statuses), 'created_at': now
+            })
+        db.session.execute(db.insert(Batches), rows)
+
+    for start in range(1, packages + 1, chunk):
+        db.session.execute(db.insert(Package), [{
+            'package_id': f'BENCH_P{i}', 'batch_id': rng.randint(1, batches), 'packager_id': rng.randint(1, users),
+            'quantity_kg': rng.uniform(0.1, 5), 'package_date': now, 'package_type': 'retail',
+            'current_owner_id': rng.randint(1, users), 'status': 'packaged', 'qr_code': f'QR_BENCH_P{i}'
+        } for i in range(start, min(start + chunk, packages + 1))])
+
+    for start in range(1, transactions + 1, chunk):
+        rows = []
+        for i in range(start, min(start + chunk, transactions + 1)):
+            qty = rng.uniform(1, 500)
+            price = rng.uniform(100, 3000)
+            rows.append({
+                'transaction_id': f'BENCH_T{i}', 'from_user_id': rng.randint(1, users),
+                'to_user_id': rng.randint(1, users), 'batch_id': rng.randint(1, batches),
+                'quantity_kg': qty, 'price_per_kg': price, 'total_amount': qty * price,
+                'transaction_type': 'sale', 'payment_status': rng.choice(['pending', 'completed', 'completed']),
+                'transaction_date': now - timedelta(days=rng.randint(0, 720))
+            })
+        db.session.execute(db.insert(Transactions), rows)
+    db.session.commit()
+
+
+def _per_metric_dashboard_summary(user_id, user_type):
+    """The same counters as ``dashboard_summary``, computed the way the old
+    dashboard did: one ``.count()``/``SUM`` query per metric."""
+    from .extensions import db
+    from .models import Batches, Package, QATest, Spices, Transactions as T
+
+    month_start = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+    def total(*criteria):
+        return db.session.query(db.func.coalesce(db.func.sum(T.total_amount), 0)).filter(*criteria).scalar()
+
+    def stock():
+        summary = []
+        for spice in Spices.query.all():
+            owned = Batches.query.filter_by(current_owner_id=user_id, spice_id=spice.id)
+            count = owned.count()
+            if count:
+                qty = db.session.query(db.func.sum(Batches.quantity_kg)).filter(
+                    Batches.current_owner_id == user_id, Batches.spice_id == spice.id).scalar()
+                summary.append({'spice_name': spice.name, 'batches': count, 'quantity_kg': qty})
+        return summary
+
+    if user_type == 'farmer':
+        return {
+            'total_batches': Batches.query.filter_by(farmer_id=user_id).count(),
+            'active_batches': Batches.query.filter_by(farmer_id=user_id, status='harvested').count(),
+            'recent_transactions': T.query.filter_by(from_user_id=user_id).count(),
+            'pending_outgoing': T.query.filter_by(from_user_id=user_id, payment_status='pending').count(),
+            'value_sold_this_month': total(T.from_user_id == user_id, T.payment_status == 'completed',
+                                           T.transaction_date >= month_start),
+            'stock_by_spice': stock()
+        }
+    if user_type == 'middleman':
+        return {
+            'owned_batches': Batches.query.filter_by(current_owner_id=user_id).count(),
+            'owned_packages': Package.query.filter_by(current_owner_id=user_id).count(),
+            'transactions_count': T.query.filter((T.from_user_id == user_id) | (T.to_user_id == user_id)).count(),
+            'pending_incoming': T.query.filter_by(to_user_id=user_id, payment_status='pending').count(),
+            'pending_outgoing': T.query.filter_by(from_user_id=user_id, payment_status='pending').count(),
+            'value_sold_this_month': total(T.from_user_id == user_id, T.payment_status == 'completed',
+                                           T.transaction_date >= month_start),
+            'value_bought_this_month': total(T.to_user_id == user_id, T.payment_status == 'completed',
+                                             T.transaction_date >= month_start),
+            'stock_by_spice': stock()
+        }
+    if user_type == 'quality_officer':
+        return {
+            'tests_conducted': QATest.query.filter_by(tester_id=user_id).count(),
+            'tests_passed': QATest.query.filter_by(tester_id=user_id, test_result='pass').count(),
+            'tests_failed': QATest.query.filter_by(tester_id=user_id, test_result='fail').count(),
+            'pending_tests': Batches.query.filter_by(status='harvested').count()
+        }
+    return {
+        'purchased_packages': T.query.filter_by(
+            to_user_id=user_id, transaction_type='sale', payment_status='completed'
+        ).count(),
+        'pending_incoming': T.query.filter_by(to_user_id=user_id, payment_status='pending').count(),
+        'total_spent': total(T.to_user_id == user_id, T.payment_status == 'completed')
+    }
+
+
+@bench_group.command('dashboard')
+@click.option('--db', 'db_path', default=None, help='Scratch database (seeded if empty).')
+@click.option('--transactions', default=1000000, show_default=True)
+@click.option('--users', default=2000, show_default=True)
+@click.option('--repeat', default=20, show_default=True)
+def dashboard_command(db_path, transactions, users, repeat):
+    """Compare the conditional-aggregation dashboard with per-metric queries."""
+    from .blueprints.analytics import dashboard_summary
+    from .models import OwnerStock, Transactions, User
+    from .stock import reconcile
+
+    with bench_app(db_path or default_db_path('dashboard')):
+        if Transactions.query.count() == 0:
+            click.echo(f'seeding {transactions} transactions...')
+            seed_supply_chain(users, batches=max(transactions // 10, 1), transactions=transactions,
+                              packages=max(transactions // 20, 1))
+        if OwnerStock.query.count() == 0:
+            click.echo('building stock balances...')
+            reconcile()
+        for user_type in ('farmer', 'middleman', 'quality_officer', 'consumer'):
+            user = User.query.filter_by(user_type=user_type).first()
+            per_metric = median_ms(lambda: _per_metric_dashboard_summary(user.id, user_type), repeat)
+            aggregate = median_ms(lambda: dashboard_summary(user.id, user_type), repeat)
+            click.echo(f'{user_type:16} per-metric {per_metric:8.2f} ms   aggregate {aggregate:8.2f} ms')
+
+
+@bench_group.command('auth')
+@click.option('--repeat', default=5000, show_default=True)
+def auth_command(repeat):
+    """Per-request authentication overhead: JWT (cold/cached) vs session."""
+    import jwt
+    from flask import current_app
+
+    from .tokens import decode_token, issue_tokens
+    from .utils import login_required
+
+    with bench_app(default_db_path('auth')) as app:
+        tokens = issue_tokens(1, 'farmer')
+        token = tokens['access_token']
+        secret = current_app.config['JWT_SECRET_KEY']
+
+        def per_call_us(fn):
+            started = time.perf_counter()
+            for _ in range(repeat):
+                fn()
+            return (time.perf_counter() - started) / repeat * 1e6
+
+        verify = per_call_us(lambda: jwt.decode(token, secret, algorithms=['HS256']))
+        decode_token(token)
+        cached = per_call_us(lambda: decode_token(token))
+        click.echo(f'jwt signature verify      {verify:8.2f} us')
+        click.echo(f'decode_token (cache hit)  {cached:8.2f} us')
+
+        # End-to-end: the same trivial view with and without login_required
+        @app.route('/_bench/open')
+        def bench_open():
+            return 'ok'
+
+        @app.route('/_bench/protected')
+        @login_required
+        def bench_protected():
+            return 'ok'
+
+        client = app.test_client()
+        baseline = per_call_us(lambda: client.get('/_bench/open'))
+        bearer = per_call_us(lambda: client.get('/_bench/protected', headers={'Authorization': f'Bearer {token}'}))
+        with client.session_transaction() as sess:
+            sess['user_id'], sess['user_type'] = 1, 'farmer'
+        cookie = per_call_us(lambda: client.get('/_bench/protected'))
+        click.echo(f'request, no auth          {baseline:8.2f} us')
+        click.echo(f'request, bearer token     {bearer:8.2f} us  (+{bearer - baseline:.2f})')
+        click.echo(f'request, session cookie   {cookie:8.2f} us  (+{cookie - baseline:.2f})')
+
+
+@bench_group.command('login-storm')
+@click.option('--seconds', default=10.0, show_default=True)
+@click.option('--login-threads', default=8, show_default=True)
+@click.option('--read-threads', default=4, show_default=True)
+@click.option('--workers', default=2, show_default=True, help='Hash pool size; 0 hashes on the request thread.')
+def login_storm_command(seconds, login_threads, read_threads, workers):
+    """Mixed load: concurrent logins plus /api/spices reads, reporting read
+    latency and login throughput."""
+    import threading
+
+    from .extensions import db
+    from .models import User
+
+    overrides = {
+        'PASSWORD_HASH_WORKERS': workers,
+        'LOGIN_IP_ATTEMPT_LIMIT': 10 ** 9,
+        'LOGIN_ACCOUNT_FAILURE_LIMIT': 10 ** 9,
+    }
+    with bench_app(default_db_path('login'), **overrides) as app:
+        hasher = app.extensions['password_hasher']
+        if not User.query.filter_by(email='storm@bench').first():
+            db.session.add(User(username='storm', email='storm@bench', user_type='farmer',
+                                password_hash=hasher.hash('storm-password')))
+            db.session.commit()
+        # Warm the pool so process start-up is not measured
+        hasher.verify(User.query.filter_by(email='storm@bench').first().password_hash, 'x')
+
+        deadline = time.perf_counter() + seconds
+        logins, read_latencies, errors = [], [], []
+
+        def login_loop():
+            client = app.test_client()
+            while time.perf_counter() < deadline:
+                r = client.post('/api/login', json={'username': 'storm@bench', 'password': 'storm-password'})
+                (logins if r.status_code == 200 else errors).append(r.status_code)
+
+        def read_loop():
+            client = app.test_client()
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                client.get('/api/spices')
+                read_latencies.append((time.perf_counter() - started) * 1000)
+
+        threads = [threading.Thread(target=login_loop) for _ in range(login_threads)]
+        threads += [threading.Thread(target=read_loop) for _ in range(read_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        hasher.shutdown()
+
+        read_latencies.sort()
+        pct = lambda p: read_latencies[min(int(len(read_latencies) * p), len(read_latencies) - 1)]
+        click.echo(f'hash workers {workers}: {len(logins) / seconds:.1f} logins/s, {len(errors)} errors, '
+                   f'{len(read_latencies) / seconds:.1f} reads/s, '
+                   f'read p50 {pct(0.5):.1f} ms  p99 {pct(0.99):.1f} ms')
+
+
+@bench_group.command('recall')
+@click.option('--db', 'db_path', default=None, help='Scratch database (seeded if empty).')
+@click.option('--descendants', default=100000, show_default=True)
+@click.option('--fanout', default=4, show_default=True, help='Sub-batches per divided batch.')
+def recall_command(db_path, descendants, fanout):
+    """Recall impact and freeze on a lineage of ``--descendants`` sub-batches."""
+    from . import recall
+    from .extensions import db
+    from .models import Batches, Package, Transactions
+
+    with bench_app(db_path or default_db_path('recall')):
+        if Batches.query.count() == 0:
+            click.echo(f'seeding {descendants} descendants...')
+            seed_supply_chain(users=200, batches=1, transactions=0)
+            # Breadth-first tree: batch i is divided into batches fanout*(i-1)+2 ...
+            now = datetime.utcnow()
+            total = descendants + 1
+            chunk = 50000
+            for start in range(2, total + 1, chunk):
+                db.session.execute(db.insert(Batches), [{
+                    'batch_id': f'BENCH_B{i}', 'farmer_id': 1, 'spice_id': 1, 'quantity_kg': 1.0,
+                    'harvest_date': now, 'farm_location': 'Farm 1', 'current_owner_id': i % 200 + 1,
+                    'status': 'divided', 'parent_batch_id': (i - 2) // fanout + 1, 'created_at': now
+                } for i in range(start, min(start + chunk, total + 1))])
+                db.session.execute(db.insert(Package), [{
+                    'package_id': f'BENCH_P{i}', 'batch_id': i, 'packager_id': 1, 'quantity_kg': 0.5,
+                    'package_date': now, 'package_type': 'retail', 'current_owner_id': i % 200 + 1,
+                    'status': 'packaged', 'qr_code': f'QR_BENCH_P{i}'
+                } for i in range(start, min(start + chunk, total + 1), 2)])
+                db.session.execute(db.insert(Transactions), [{
+                    'transaction_id': f'BENCH_T{i}', 'from_user_id': 1, 'to_user_id': i % 200 + 1,
+                    'batch_id': i, 'quantity_kg': 1.0, 'price_per_kg': 100.0, 'total_amount': 100.0,
+                    'transaction_type': 'sale', 'payment_status': 'pending', 'transaction_date': now
+                } for i in range(start, min(start + chunk, total + 1), 4)])
+            db.session.commit()
+
+        timings = {}
+        started = time.perf_counter()
+        summary = recall.impact_summary(1)
+        timings['impact summary'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        records = sum(1 for _ in recall.iter_impact(1))
+        timings[f'full report ({records} records)'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        frozen = recall.freeze(1, 1, 'benchmark')
+        timings['freeze'] = time.perf_counter() - started
+        # Leave the fixture reusable for the next run
+        db.session.rollback()
+
+        click.echo(f'{summary["batches"]} batches, {summary["packages"]} packages, '
+                   f'{summary["pending_transactions"]} pending transactions, {summary["holders"]} holders; '
+                   f'froze {frozen}')
+        for name, seconds in timings.items():
+            click.echo(f'{name:32} {seconds * 1000:10.1f} ms')
+
+
+@bench_group.command('attribution')
+@click.option('--db', 'db_path', default=None, help='Scratch database (seeded if empty).')
+@click.option('--roots', default=4096, show_default=True, help='Harvested lots at the bottom of the DAG.')
+@click.option('--fan-in', default=4, show_default=True, help='Lots blended per merge.')
+@click.option('--repeat', default=20, show_default=True)
+def attribution_command(db_path, roots, fan_in, repeat):
+    """Origin attribution of a blend built by merging ``--roots`` lots
+    ``--fan-in`` at a time, each merge level also divided once."""
+    from flask import current_app
+
+    from .composition import attribution
+    from .extensions import db
+    from .models import BatchComposition, Batches
+
+    with bench_app(db_path or default_db_path('attribution')):
+        if Batches.query.count() == 0:
+            click.echo(f'seeding a blend of {roots} lots...')
+            seed_supply_chain(users=200, batches=roots, transactions=0)
+            now = datetime.utcnow()
+            level, next_id = list(range(1, roots + 1)), roots + 1
+            while len(level) > 1:
+                merged, batches, compositions = [], [], []
+                for start in range(0, len(level), fan_in):
+                    # A merge, then a division of it, so both edge kinds are walked
+                    for batch_id, parent in ((next_id, None), (next_id + 1, next_id)):
+                        batches.append({
+                            'batch_id': f'BENCH_M{batch_id}', 'farmer_id': 1, 'spice_id': 1, 'quantity_kg': 10.0,
+                            'harvest_date': now, 'current_owner_id': 1, 'status': 'merged',
+                            'parent_batch_id': parent, 'created_at': now
+                        })
+                    compositions.extend({
+                        'child_batch_id': next_id, 'source_batch_id': source, 'quantity_kg': float(source % 7 + 1),
+                        'created_at': now
+                    } for source in level[start:start + fan_in])
+                    merged.append(next_id + 1)
+                    next_id += 2
+                db.session.execute(db.insert(Batches), batches)
+                db.session.execute(db.insert(BatchComposition), compositions)
+                level = merged
+            db.session.commit()
+
+        target = db.session.execute(db.select(db.func.max(Batches.id))).scalar()
+        cache = current_app.extensions['attribution_cache']
+
+        def cold():
+            cache.clear()
+            return attribution(target)
+
+        shares = cold()
+        click.echo(f'{len(shares)} contributing lots, shares sum to {sum(shares.values()):.6f}')
+        click.echo(f'cold   {median_ms(cold, repeat):8.2f} ms')
+        click.echo(f'cached {median_ms(lambda: attribution(target), repeat * 100) * 1000:8.2f} us')
+
+
+@bench_group.command('anomalies')
+@click.option('--db', 'db_path', default=None, help='Scratch database (seeded if empty).')
+@click.option('--transactions', default=1000000, show_default=True)
+@click.option('--new-rows', default=1000, show_default=True, help='Sales added before the incremental run.')
+def anomalies_command(db_path, transactions, new_rows):
+    """Full anomaly scan, then an incremental scan after ``--new-rows`` sales."""
+    from . import anomalies
+    from .extensions import db
+    from .models import Transactions
+
+    with bench_app(db_path or default_db_path('anomalies')):
+        if Transactions.query.count() == 0:
+            click.echo(f'seeding {transactions} transactions...')
+            seed_supply_chain(2000, batches=max(transactions // 10, 1), transactions=transactions,
+                              packages=max(transactions // 20, 1))
+
+        started = time.perf_counter()
+        report = anomalies.run(full=True)
+        click.echo(f'full        {(time.perf_counter() - started) * 1000:8.0f} ms  {report}')
+
+        rng = random.Random()
+        last_id = db.session.execute(db.select(db.func.max(Transactions.id))).scalar()
+        db.session.execute(db.insert(Transactions), [{
+            'transaction_id': f'BENCH_T{last_id + i}', 'from_user_id': 1, 'to_user_id': 2,
+            'batch_id': rng.randint(1, 1000), 'quantity_kg': 1.0, 'price_per_kg': rng.uniform(100, 3000),
+            'transaction_type': 'sale', 'payment_status': 'pending', 'transaction_date': datetime.utcnow()
+        } for i in range(1, new_rows + 1)])
+        db.session.commit()
+        started = time.perf_counter()
+        report = anomalies.run()
+        click.echo(f'incremental {(time.perf_counter() - started) * 1000:8.0f} ms  {report}')
+
+
+@bench_group.command('geo')
+@click.option('--db', 'db_path', default=None, help='Scratch database (seeded if empty).')
+@click.option('--farms', default=1000000, show_default=True)
+@click.option('--radius-km', default=50.0, show_default=True)
+@click.option('--repeat', default=50, show_default=True)
+def geo_command(db_path, farms, radius_km, repeat):
+    """Radius and bounding-box lookups over ``--farms`` located farmers
+    spread across southern India."""
+    from . import geo
+    from .extensions import db
+    from .models import User
+
+    with bench_app(db_path or default_db_path('geo')):
+        if User.query.count() == 0:
+            click.echo(f'seeding {farms} farms...')
+            rng = random.Random(42)
+            now = datetime.utcnow()
+            chunk = 50000
+            for start in range(1, farms + 1, chunk):
+                rows = []
+                for i in range(start, min(start + chunk, farms + 1)):
+                    lat, lon = rng.uniform(8, 20), rng.uniform(72, 86)
+                    rows.append({
+                        'username': f'farm{i}', 'email': f'farm{i}@bench', 'password_hash': 'x',
+                        'user_type': 'farmer', 'coordinate': f'{lat:.6f},{lon:.6f}', 'latitude': lat,
+                        'longitude': lon, 'geo_cell': geo.cell(lat, lon), 'created_at': now, 'is_active': True
+                    })
+                db.session.execute(db.insert(User), rows)
+            db.session.commit()
+
+        rng = random.Random(7)
+        centers = [(rng.uniform(9, 19), rng.uniform(73, 85)) for _ in range(repeat)]
+        found = []
+
+        def radius():
+            lat, lon = centers[len(found) % repeat]
+            found.append(len(geo.within_radius(User, lat, lon, radius_km, limit=100)))
+
+        def box():
+            lat, lon = centers[len(found) % repeat]
+            found.append(len(geo.within_box(User, lat - 0.25, lon - 0.25, lat + 0.25, lon + 0.25, limit=1000)))
+
+        click.echo(f'radius {radius_km:g} km (nearest 100) {median_ms(radius, repeat):8.2f} ms')
+        found.clear()
+        click.echo(f'0.5 x 0.5 degree box (<= 1000)   {median_ms(box, repeat):8.2f} ms  '
+                   f'{statistics.mean(found):.0f} rows on average')
+
+
+@bench_group.command('market')
+@click.option('--db', 'db_path', default=None, help='Scratch database (seeded if empty).')
+@click.option('--batches', default=1200000, show_default=True)
+@click.option('--repeat', default=50, show_default=True)
+def market_command(db_path, batches, repeat):
+    """Marketplace searches (page, total and facets) over the listings of
+    ``--batches`` seeded batches."""
+    from . import market
+    from .models import Batches
+
+    with bench_app(db_path or default_db_path('market')):
+        if Batches.query.count() == 0:
+            click.echo(f'seeding {batches} batches...')
+            seed_supply_chain(users=2000, batches=batches, transactions=0)
+            started = time.perf_counter()
+            click.echo(f'{market.rebuild()} listings indexed in {time.perf_counter() - started:.1f} s')
+
+        season = datetime.utcnow() - timedelta(days=180)
+        queries = {
+            'newest, no filters': {},
+            'spice': {'spice_id': 2},
+            'spice + grade + method': {'spice_id': 2, 'grade': 'A', 'farming_method': 'organic'},
+            'largest of spice + grade': {'spice_id': 2, 'grade': 'A', 'sort': '-quantity_kg'},
+            'A organic, >=500 kg, season': {'spice_id': 2, 'grade': 'A', 'farming_method': 'organic',
+                                            'min_kg': 500, 'harvested_from': season},
+            'page 50 of a spice': {'spice_id': 2, 'page': 50},
+        }
+        for name, filters in queries.items():
+            selected = {key: filters.get(key) for key in ('spice_id', 'grade', 'farming_method')}
+
+            def query():
+                market.search(**filters)
+                market.facets(**selected)
+
+            click.echo(f'{name:30} {median_ms(query, repeat):8.2f} ms')
+
+
+@bench_group.command('sync')
+@click.option('--db', 'db_path', default=None, help='Scratch database (seeded if empty).')
+@click.option('--batches', default=200000, show_default=True)
+@click.option('--users', default=20, show_default=True)
+@click.option('--changes', default=10, show_default=True, help='Batches of the user updated after the first sync.')
+@click.option('--repeat', default=10, show_default=True)
+def sync_command(db_path, batches, users, changes, repeat):
+    """Full sync against a delta sync after ``--changes`` writes, for a user
+    holding ``--batches / --users`` batches."""
+    from . import sync
+    from .extensions import db
+    from .models import Batches
+
+    with bench_app(db_path or default_db_path('sync')):
+        if Batches.query.count() == 0:
+            click.echo(f'seeding {batches} batches...')
+            seed_supply_chain(users=users, batches=batches, transactions=batches)
+
+        token = sync.latest_token()
+        for batch in Batches.query.filter_by(current_owner_id=1).limit(changes):
+            batch.estimated_grade = 'A' if batch.estimated_grade != 'A' else 'B'
+        db.session.commit()
+
+        full = sync.changes(1)
+        delta = sync.changes(1, token)
+        click.echo(f"full  {median_ms(lambda: sync.changes(1), repeat):9.1f} ms  "
+                   f"{len(full['entities']['batch'])} batches, {len(full['entities']['transaction'])} transactions")
+        click.echo(f"delta {median_ms(lambda: sync.changes(1, token), repeat):9.1f} ms  "
+                   f"{len(delta['entities']['batch'])} batches")
+
+
+@bench_group.command('trace-tokens')
+@click.option('--db', 'db_path', default=None, help='Scratch database (seeded if empty).')
+@click.option('--packages', default=50000, show_default=True)
+@click.option('--repeat', default=1000, show_default=True)
+def trace_tokens_command(db_path, packages, repeat):
+    """Bulk issuance of signed trace tokens for ``--packages`` packages, then
+    offline verification of one token."""
+    from . import trace_tokens
+    from .models import Package
+
+    with bench_app(db_path or default_db_path('trace_tokens')):
+        if Package.query.count() == 0:
+            click.echo(f'seeding {packages} packages...')
+            seed_supply_chain(users=200, batches=packages // 2, transactions=0, packages=packages)
+
+        started = time.perf_counter()
+        issued = trace_tokens.issue_pending(reissue=True)
+        elapsed = time.perf_counter() - started
+        click.echo(f'issue  {elapsed:8.2f} s  {issued / elapsed:8.0f} tokens/s')
+
+        token = Package.query.first().trace_token
+        click.echo(f'verify {median_ms(lambda: trace_tokens.verify(token), repeat) * 1000:8.1f} us  '
+                   f'{len(token)} characters')
+
+
+@bench_group.command('archive')
+@click.option('--db', 'db_path', default=None, help='Scratch database (seeded if empty).')
+@click.option('--events', default=1000000, show_default=True, help='Timeline events spread over two years.')
+@click.option('--repeat', default=50, show_default=True)
+def archive_command(db_path, events, repeat):
+    """Timeline lookups and a recent-activity query with every month in the
+    table, then again after ``flask archive run`` left a year hot."""
+    from . import archive
+    from .extensions import db
+    from .models import ArchivePartition, Timeline
+
+    db_path = db_path or default_db_path('archive')
+    with bench_app(db_path, ARCHIVE_DIR=db_path + '.archive'):
+        batches = max(events // 10, 1)
+        if Timeline.query.count() == 0 and ArchivePartition.query.count() == 0:
+            click.echo(f'seeding {events} events...')
+            seed_supply_chain(users=1000, batches=batches, transactions=0)
+            rng = random.Random(42)
+            now = datetime.utcnow()
+            chunk = 50000
+            for start in range(0, events, chunk):
+                db.session.execute(db.insert(Timeline), [{
+                    'batch_id': rng.randint(1, batches), 'event_type': 'bench', 'event_description': 'Bench event',
+                    'user_id': rng.randint(1, 1000), 'timestamp': now - timedelta(minutes=rng.randint(0, 730 * 1440)),
+                    'event_metadata': {'transaction_id': f'BENCH_T{i}'}
+                } for i in range(start, min(start + chunk, events))])
+            db.session.commit()
+
+        rng = random.Random(7)
+        targets = iter([rng.randint(1, batches) for _ in range(2 * repeat)])
+        week_ago = datetime.utcnow() - timedelta(days=7)
+        recent = db.select(db.func.count()).select_from(Timeline).where(Timeline.timestamp >= week_ago)
+
+        def report(label):
+            history = median_ms(lambda: archive.timeline_events({'batch_id': [next(targets)]}), repeat)
+            week = median_ms(lambda: db.session.execute(recent).scalar(), repeat)
+            click.echo(f'{label:8} batch history {history:8.2f} ms  recent week {week:8.2f} ms')
+
+        report('hot')
+        started = time.perf_counter()
+        archive.apply_policies()
+        click.echo(f'archived in {time.perf_counter() - started:.1f} s; {Timeline.query.count()} rows left hot, '
+                   f'{sum(p.size_bytes for p in ArchivePartition.query) / 1e6:.1f} MB of Parquet')
+        report('archived')
+
+
+@bench_group.command('snapshot')
+@click.option('--db', 'db_path', default=None, help='Scratch database (seeded if empty).')
+@click.option('--transactions', default=500000, show_default=True)
+@click.option('--changes', default=1000, show_default=True, help='Transactions completed between snapshot runs.')
+@click.option('--repeat', default=10, show_default=True)
+def snapshot_command(db_path, transactions, changes, repeat):
+    """A full snapshot, an incremental run after ``--changes`` writes, and
+    the uncached latency of each report over the whole snapshot."""
+    from . import reports, snapshot
+    from .extensions import db
+    from .models import QATest, Transactions
+
+    db_path = db_path or default_db_path('snapshot')
+    with bench_app(db_path, SNAPSHOT_DIR=db_path + '.snapshot') as app:
+        batches = max(transactions // 5, 1)
+        if Transactions.query.count() == 0:
+            click.echo(f'seeding {transactions} transactions...')
+            seed_supply_chain(users=1000, batches=batches, transactions=transactions)
+            rng = random.Random(42)
+            now = datetime.utcnow()
+            db.session.execute(db.insert(QATest), [{
+                'test_id': f'BENCH_Q{i}', 'batch_id': rng.randint(1, batches), 'tester_id': 10,
+                'test_date': now - timedelta(days=rng.randint(0, 720)),
+                'test_result': rng.choice(['pass', 'pass', 'fail', 'conditional'])
+            } for i in range(batches)])
+            db.session.commit()
+
+        for label, full in (('full', True), ('incremental', False)):
+            if not full:
+                for transaction in Transactions.query.filter_by(payment_status='pending').limit(changes):
+                    transaction.payment_status = 'completed'
+                db.session.commit()
+            started = time.perf_counter()
+            rows = sum(written for written, _ in snapshot.run(full=full).values())
+            click.echo(f'{label:12} {time.perf_counter() - started:8.2f} s  {rows} rows written')
+
+        cache = app.extensions['report_cache']
+        for name, report in (('harvest-volume', lambda: reports.harvest_volume(None, None, 'region')),
+                             ('middleman-turnover', lambda: reports.middleman_turnover(None, None, 20)),
+                             ('qa-pass-rate', lambda: reports.qa_pass_rate(None, None))):
+            def uncached():
+                cache.clear()
+                report()
+            click.echo(f'{name:20} {median_ms(uncached, repeat):8.1f} ms')
+
+
+@bench_group.command('ids')
+@click.option('--db', 'db_path', default=None, help='Scratch database for the index comparison.')
+@click.option('--count', default=1000000, show_default=True, help='Codes generated per mode.')
+@click.option('--threads', default=4, show_default=True)
+@click.option('--rows', default=1000000, show_default=True, help='Codes inserted per index.')
+def ids_command(db_path, count, threads, rows):
+    """Code generation throughput one at a time, in bulk and from
+    ``--threads`` threads, then ``--rows`` inserts into a unique index with
+    sortable codes against the old random-suffix ones."""
+    import sqlite3
+    import threading
+    import uuid
+
+    from . import ids
+
+    db_path = db_path or default_db_path('ids')
+    with bench_app(db_path, ID_WORKER_ID=1) as app:
+        def timed(label, fn, total):
+            started = time.perf_counter()
+            codes = fn()
+            elapsed = time.perf_counter() - started
+            click.echo(f'{label:10} {total / elapsed:12.0f} codes/s')
+            return codes
+
+        single = timed('single', lambda: [ids.new_id('BATCH') for _ in range(count)], count)
+        bulk = timed('bulk', lambda: [code for _ in range(count // 1000) for code in ids.new_ids('BATCH', 1000)],
+                     count)
+
+        def threaded():
+            results = []
+
+            def work():
+                with app.app_context():
+                    results.append([ids.new_id('BATCH') for _ in range(count // threads)])
+
+            workers = [threading.Thread(target=work) for _ in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            return [code for chunk in results for code in chunk]
+
+        shared = timed(f'{threads} threads', threaded, count // threads * threads)
+        issued = single + bulk + shared
+        click.echo(f'{len(issued)} codes, {len(issued) - len(set(issued))} duplicates, '
+                   f'in issue order: {single + bulk == sorted(single + bulk)}')
+
+    today = datetime.utcnow().strftime('%Y%m%d')
+    for label, make in (('random', lambda: f"BATCH_{today}_{str(uuid.uuid4())[:8].upper()}"),
+                        ('sortable', lambda: ids.new_id('BATCH'))):
+        path = f'{db_path}.{label}'
+        if os.path.exists(path):
+            os.remove(path)
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE codes (code VARCHAR(50) NOT NULL UNIQUE)')
+        duplicates = 0
+        with app.app_context():
+            started = time.perf_counter()
+            for _ in range(rows // 1000):
+                # Committed in request-sized transactions
+                inserted = conn.executemany('INSERT OR IGNORE INTO codes VALUES (?)',
+                                            [(make(),) for _ in range(1000)]).rowcount
+                duplicates += 1000 - inserted
+                conn.commit()
+            elapsed = time.perf_counter() - started
+        conn.close()
+        click.echo(f'{label:10} insert {elapsed:8.2f} s  {os.path.getsize(path) / 1e6:6.1f} MB  '
+                   f'{duplicates} collisions')
+
+
+@bench_group.command('settle')
+@click.option('--db', 'db_path', default=None, help='Scratch database (seeded if empty).')
+@click.option('--transactions', default=200, show_default=True, help='Pending sales completed per mode.')
+def settle_command(db_path, transactions):
+    """A buyer completing ``--transactions`` pending sales one request at a
+    time, then the same number through one bulk settlement."""
+    from sqlalchemy import event
+
+    from . import ids
+    from .extensions import db
+    from .models import Batches, Transactions, User
+
+    with bench_app(db_path or default_db_path('settle')) as app:
+        if User.query.count() == 0:
+            click.echo('seeding...')
+            seed_supply_chain(users=200, batches=20000, transactions=50000)
+        seller, buyer = 1, 6  # a farmer and a middleman
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'], session['user_type'] = buyer, 'middleman'
+
+        def pending_sales():
+            now = datetime.utcnow()
+            db.session.execute(db.insert(Batches), [{
+                'batch_id': code, 'farmer_id': seller, 'spice_id': i % 7 + 1, 'quantity_kg': 50.0,
+                'harvest_date': now, 'farm_location': 'Bench farm', 'estimated_grade': 'A',
+                'current_owner_id': seller, 'status': 'pending_sale', 'created_at': now
+            } for i, code in enumerate(ids.new_ids('BENCH', transactions))])
+            batch_ids = db.session.execute(
+                db.select(Batches.id).order_by(Batches.id.desc()).limit(transactions)
+            ).scalars().all()
+            codes = ids.new_ids('TXN', transactions)
+            db.session.execute(db.insert(Transactions), [{
+                'transaction_id': code, 'from_user_id': seller, 'to_user_id': buyer, 'batch_id': batch_id,
+                'quantity_kg': 50.0, 'price_per_kg': 100.0, 'total_amount': 5000.0, 'transaction_type': 'sale',
+                'payment_status': 'pending', 'transaction_date': now
+            } for code, batch_id in zip(codes, batch_ids)])
+            db.session.commit()
+            return codes
+
+        statements = [0]
+
+        def count(*args):
+            statements[0] += 1
+
+        limit = app.config['SETTLEMENT_MAX_TRANSACTIONS']
+        modes = (
+            ('one by one', lambda codes: [client.post(f'/api/transaction/{code}/complete') for code in codes]),
+            ('bulk', lambda codes: [client.post('/api/transactions/complete',
+                                                json={'transaction_ids': codes[start:start + limit]})
+                                    for start in range(0, len(codes), limit)]),
+        )
+        for label, complete in modes:
+            codes = pending_sales()
+            statements[0] = 0
+            event.listen(db.engine, 'before_cursor_execute', count)
+            started = time.perf_counter()
+            responses = complete(codes)
+            elapsed = time.perf_counter() - started
+            event.remove(db.engine, 'before_cursor_execute', count)
+            failed = sum(response.status_code != 200 for response in responses)
+            click.echo(f'{label:12} {elapsed * 1000:9.1f} ms  {statements[0]:6} statements  {failed} failed requests')
+
+
+@bench_group.command('stream')
+@click.option('--db', 'db_path', default=None, help='Scratch database (seeded if empty).')
+@click.option('--events', default=1000000, show_default=True, help='Timeline events of the batch family.')
+@click.option('--divisions', default=1000, show_default=True, help='Sub-batches of the root batch.')
+def stream_command(db_path, events, divisions):
+    """Peak Python memory and time to first byte of a root batch's family
+    history built as one list and encoded whole, as the endpoint used to,
+    and streamed as JSON and as NDJSON."""
+    import tracemalloc
+
+    from . import archive
+    from .extensions import db
+    from .models import Batches, Timeline
+
+    with bench_app(db_path or default_db_path('stream'), JOB_LOCAL_WORKERS=0) as app:
+        if Timeline.query.count() == 0:
+            click.echo(f'seeding {events} events over {divisions} divisions...')
+            seed_supply_chain(users=1000, batches=1, transactions=0)
+            now = datetime.utcnow()
+            db.session.execute(db.update(Batches).where(Batches.id == 1)
+                               .values(status='divided', created_at=now - timedelta(days=31)))
+            db.session.execute(db.insert(Batches), [{
+                'batch_id': f'BENCH_B1_DIV{i}', 'farmer_id': 1, 'spice_id': 1, 'quantity_kg': 1.0,
+                'harvest_date': now, 'farm_location': 'Farm 1', 'current_owner_id': i % 1000 + 1,
+                'status': 'harvested', 'parent_batch_id': 1, 'created_at': now - timedelta(days=30)
+            } for i in range(1, divisions + 1)])
+            rng = random.Random(42)
+            chunk = 50000
+            for start in range(0, events, chunk):
+                db.session.execute(db.insert(Timeline), [{
+                    'batch_id': rng.randint(1, divisions + 1), 'event_type': 'bench',
+                    'event_description': 'Bench event', 'user_id': rng.randint(1, 1000),
+                    'timestamp': now - timedelta(seconds=rng.randint(0, 30 * 86400)),
+                    'event_metadata': {'transaction_id': f'BENCH_T{i}'}
+                } for i in range(start, min(start + chunk, events))])
+            db.session.commit()
+
+        client = app.test_client()
+
+        def buffered():
+            # The family history as the endpoint used to build it
+            root = db.session.get(Batches, 1)
+            family = [root.id] + [sub.id for sub in root.sub_batches]
+            timeline = [{
+                'timestamp': event.timestamp.isoformat(),
+                'event_type': event.event_type,
+                'description': event.description,
+                'batch_id': event.batch_code
+            } for event in archive.timeline_events({'batch_id': family}, since=root.created_at)]
+            body = app.json.response({'timeline': timeline}).get_data()
+            return [body]
+
+        def streamed(query):
+            def chunks():
+                response = client.get(f'/api/batch/1/history{query}', buffered=False)
+                try:
+                    yield from response.response
+                finally:
+                    response.close()
+            return chunks()
+
+        modes = (
+            ('buffered', lambda: iter(buffered())),
+            ('stream json', lambda: streamed('')),
+            ('stream ndjson', lambda: streamed('?format=ndjson')),
+        )
+        for label, run in modes:
+            db.session.remove()
+            started = time.perf_counter()
+            first_byte, size = None, 0
+            for piece in run():
+                if first_byte is None:
+                    first_byte = time.perf_counter() - started
+                size += len(piece)
+            elapsed = time.perf_counter() - started
+
+            db.session.remove()
+            tracemalloc.start()
+            for piece in run():
+                pass
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            click.echo(f'{label:14} first byte {first_byte * 1000:9.1f} ms  total {elapsed:7.2f} s  '
+                       f'{size / 1e6:7.1f} MB body  peak {peak / 1e6:8.1f} MB')
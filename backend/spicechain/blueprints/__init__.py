@@ -0,0 +1,23 @@
+def register_blueprints(app):
+    from .analytics import bp as analytics_bp, init_app as init_analytics
+    from .audit import bp as audit_bp
+    from .auth import bp as auth_bp
+    from .batches import bp as batches_bp
+    from .catalog import bp as catalog_bp
+    from .geo import bp as geo_bp
+    from .jobs import bp as jobs_bp
+    from .live import bp as live_bp
+    from .market import bp as market_bp
+    from .packages import bp as packages_bp
+    from .qa import bp as qa_bp
+    from .recall import bp as recall_bp
+    from .reports import bp as reports_bp
+    from .sync import bp as sync_bp
+    from .trace import bp as trace_bp
+    from .transactions import bp as transactions_bp
+
+    for bp in (auth_bp, batches_bp, packages_bp, transactions_bp,
+               qa_bp, analytics_bp, trace_bp, catalog_bp, live_bp, recall_bp, geo_bp, market_bp, sync_bp,
+               audit_bp, reports_bp, jobs_bp):
+        app.register_blueprint(bp, url_prefix='/api')
+    init_analytics(app)
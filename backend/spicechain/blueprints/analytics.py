@@ -0,0 +1,266 @@
+import calendar
+import math
+from datetime import datetime
+
+from flask import Blueprint, g, current_app, request, jsonify
+
+from .. import prices, refdata
+from ..cache import TTLCache
+from ..extensions import db
+from ..models import Batches, Package, QATest, Transactions
+from ..stock import stock_by_spice
+from ..utils import login_required
+
+bp = Blueprint('analytics', __name__)
+
+
+def _months_before(dt, months):
+    """Shift ``dt`` back by whole calendar months, clamping the day."""
+    month_index = dt.year * 12 + dt.month - 1 - months
+    year, month = divmod(month_index, 12)
+    month += 1
+    return dt.replace(year=year, month=month, day=min(dt.day, calendar.monthrange(year, month)[1]))
+
+
+def _count_if(condition):
+    return db.func.coalesce(db.func.sum(db.case((condition, 1), else_=0)), 0)
+
+def _sum_if(condition, value):
+    return db.func.coalesce(db.func.sum(db.case((condition, value), else_=0)), 0)
+
+def _count_of(model, *criteria):
+    return db.session.query(db.func.count(model.id)).filter(*criteria).scalar_subquery()
+
+def dashboard_summary(user_id, user_type):
+    """Role-specific dashboard counters.
+
+    Every role is answered with at most two aggregate queries: one
+    conditional-aggregation pass over the user's transactions (with scalar
+    subqueries for the batch/package counts) and, for stock holders, one
+    read of their materialized per-spice stock (see spicechain.stock).
+    """
+    T = Transactions
+    month_start = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    sent = T.from_user_id == user_id
+    received = T.to_user_id == user_id
+    pending = T.payment_status == 'pending'
+    completed = T.payment_status == 'completed'
+    this_month = T.transaction_date >= month_start
+
+    if user_type == 'farmer':
+        row = db.session.query(
+            _count_of(Batches, Batches.farmer_id == user_id),
+            _count_of(Batches, Batches.farmer_id == user_id, Batches.status == 'harvested'),
+            _count_if(sent),
+            _count_if(sent & pending),
+            _sum_if(sent & completed & this_month, T.total_amount),
+        ).select_from(T).filter(sent | received).one()
+        stock = stock_by_spice(user_id)
+        return {
+            'total_batches': row[0],
+            'active_batches': row[1],
+            'recent_transactions': row[2],
+            'pending_outgoing': row[3],
+            'value_sold_this_month': row[4],
+            'stock_kg': sum(s['quantity_kg'] for s in stock),
+            'stock_by_spice': stock
+        }
+
+    if user_type == 'middleman':
+        row = db.session.query(
+            _count_of(Package, Package.current_owner_id == user_id),
+            db.func.count(T.id),
+            _count_if(received & pending),
+            _count_if(sent & pending),
+            _sum_if(sent & completed & this_month, T.total_amount),
+            _sum_if(received & completed & this_month, T.total_amount),
+        ).select_from(T).filter(sent | received).one()
+        stock = stock_by_spice(user_id)
+        return {
+            'owned_batches': sum(s['batches'] for s in stock),
+            'owned_packages': row[0],
+            'transactions_count': row[1],
+            'pending_incoming': row[2],
+            'pending_outgoing': row[3],
+            'value_sold_this_month': row[4],
+            'value_bought_this_month': row[5],
+            'stock_kg': sum(s['quantity_kg'] for s in stock),
+            'stock_by_spice': stock
+        }
+
+    if user_type == 'quality_officer':
+        row = db.session.query(
+            db.func.count(QATest.id),
+            _count_if(QATest.test_result == 'pass'),
+            _count_if(QATest.test_result == 'fail'),
+            _count_of(Batches, Batches.status == 'harvested'),
+        ).select_from(QATest).filter(QATest.tester_id == user_id).one()
+        return {
+            'tests_conducted': row[0],
+            'tests_passed': row[1],
+            'tests_failed': row[2],
+            'pending_tests': row[3]
+        }
+
+    if user_type == 'consumer':
+        row = db.session.query(
+            _count_if((T.transaction_type == 'sale') & completed),
+            _count_if(pending),
+            _sum_if(completed, T.total_amount),
+        ).select_from(T).filter(received).one()
+        return {
+            'purchased_packages': row[0],
+            'pending_incoming': row[1],
+            'total_spent': row[2]
+        }
+
+    return {}
+
+@bp.route('/dashboard', methods=['GET'])
+@login_required
+def get_dashboard():
+    user_id = g.user_id
+    user_type = g.user_type
+    
+    # Short per-user micro-cache: dashboards are polled, and a few seconds of
+    # staleness is fine for counters
+    cache = current_app.extensions['dashboard_cache']
+    cache_key = (user_id, user_type)
+    dashboard_data = cache.get(cache_key)
+    if dashboard_data is None:
+        dashboard_data = {
+            'user_type': user_type,
+            'summary': dashboard_summary(user_id, user_type)
+        }
+        cache.set(cache_key, dashboard_data, ttl=current_app.config['DASHBOARD_CACHE_SECONDS'])
+    
+    return jsonify(dashboard_data), 200
+
+@bp.route('/analytics/spice/<int:spice_id>', methods=['GET'])
+@login_required
+def spice_analytics(spice_id):
+    spice = refdata.spice(spice_id)
+    if not spice:
+        return jsonify({'error': 'Spice not found'}), 404
+    
+    # Get batches for this spice
+    batches = Batches.query.filter_by(spice_id=spice_id).all()
+    
+    # Calculate analytics
+    total_quantity = sum(b.quantity_kg for b in batches)
+    avg_price = db.session.query(db.func.avg(Transactions.price_per_kg)).filter(
+        Transactions.batch_id.in_([b.id for b in batches])
+    ).scalar() or 0
+    
+    # Grade distribution
+    grade_distribution = {}
+    for batch in batches:
+        grade = batch.estimated_grade or 'Unknown'
+        grade_distribution[grade] = grade_distribution.get(grade, 0) + 1
+    
+    # Monthly harvest data (last 12 months)
+    monthly_data = []
+    current_date = datetime.now()
+    
+    for i in range(12):
+        month_start = _months_before(current_date, i+1)
+        month_end = _months_before(current_date, i)
+        
+        monthly_batches = [b for b in batches if month_start <= b.harvest_date < month_end]
+        monthly_quantity = sum(b.quantity_kg for b in monthly_batches)
+        
+        monthly_data.append({
+            'month': month_start.strftime('%Y-%m'),
+            'quantity_kg': monthly_quantity,
+            'batch_count': len(monthly_batches)
+        })
+    
+    return jsonify({
+        'spice_name': spice['name'],
+        'total_quantity_kg': total_quantity,
+        'total_batches': len(batches),
+        'average_price_per_kg': round(avg_price, 2),
+        'grade_distribution': grade_distribution,
+        'monthly_harvest': list(reversed(monthly_data))
+    }), 200
+
+@bp.route('/analytics/spice/<int:spice_id>/prices', methods=['GET'])
+@login_required
+def spice_price_series(spice_id):
+    """
+    Daily (or ?interval=week) OHLC/volume bars of completed sales with VWAP,
+    rolling mean close and volatility over ?window= bars (default 7).
+    Optional ?from=/?to= ISO dates and ?segment=grade:A or region:<farm location>.
+    """
+    if not refdata.spice(spice_id):
+        return jsonify({'error': 'Spice not found'}), 404
+    
+    interval = request.args.get('interval', 'day')
+    if interval not in ('day', 'week'):
+        return jsonify({'error': 'interval must be day or week'}), 400
+    window = request.args.get('window', 7, type=int)
+    if window < 2:
+        return jsonify({'error': 'window must be at least 2'}), 400
+    
+    segment_type, _, segment = request.args.get('segment', 'all').partition(':')
+    if segment_type not in prices.SEGMENT_TYPES:
+        return jsonify({'error': 'segment must be all, grade:<grade> or region:<location>'}), 400
+    
+    try:
+        start = datetime.fromisoformat(request.args['from']).date() if request.args.get('from') else None
+        end = datetime.fromisoformat(request.args['to']).date() if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': 'from/to must be ISO dates'}), 400
+    
+    # Enough earlier daily bars that the first returned bar has a full window
+    warmup = (window - 1) * 7 + 6 if interval == 'week' else window - 1
+    bars = prices.load_bars(spice_id, segment_type, segment, start, end, warmup)
+    if interval == 'week':
+        bars = prices.weekly(bars)
+    stats = prices.rolling_stats(bars, window)
+    
+    def value(array, i, digits=2):
+        return None if math.isnan(array[i]) else round(float(array[i]), digits)
+    
+    series = [{
+        'date': str(bars['day'][i]),
+        'open': float(bars['open'][i]),
+        'high': float(bars['high'][i]),
+        'low': float(bars['low'][i]),
+        'close': float(bars['close'][i]),
+        'volume_kg': float(bars['volume_kg'][i]),
+        'trades': int(bars['trades'][i]),
+        'vwap': value(stats['vwap'], i),
+        'rolling_mean': value(stats['rolling_mean'], i),
+        'volatility': value(stats['volatility'], i, 6)
+    } for i in range(bars['first'], len(bars['day']))]
+    
+    return jsonify({
+        'spice_id': spice_id,
+        'interval': interval,
+        'window': window,
+        'segment_type': segment_type,
+        'segment': segment,
+        'bars': series
+    }), 200
+
+@bp.route('/analytics/spice/<int:spice_id>/index', methods=['GET'])
+@login_required
+def spice_price_index(spice_id):
+    """
+    Price index of a spice overall and per grade and farm region: latest
+    close and VWAP/volume over the last ?days= days (default 30).
+    """
+    if not refdata.spice(spice_id):
+        return jsonify({'error': 'Spice not found'}), 404
+    
+    days = request.args.get('days', 30, type=int)
+    return jsonify({
+        'spice_id': spice_id,
+        'days': days,
+        'segments': prices.segment_index(spice_id, days)
+    }), 200
+
+
+def init_app(app):
+    app.extensions['dashboard_cache'] = TTLCache(maxsize=10000)
@@ -0,0 +1,40 @@
+from datetime import datetime
+
+from flask import Blueprint, Response, current_app, g, request, jsonify, stream_with_context
+
+from .. import archive
+from ..rawjson import raw
+from ..utils import login_required
+
+bp = Blueprint('audit', __name__)
+
+
+@bp.route('/audit/export', methods=['GET'])
+@login_required
+def export_audit_log():
+    """
+    The caller's own audit trail as NDJSON, oldest first, including months
+    already archived. Optional ?since= and ?until= (ISO datetimes).
+    """
+    try:
+        since = datetime.fromisoformat(request.args['since']) if request.args.get('since') else None
+        until = datetime.fromisoformat(request.args['until']) if request.args.get('until') else None
+    except ValueError:
+        return jsonify({'error': 'since/until must be ISO datetimes'}), 400
+    
+    entries = archive.audit_entries(g.user_id, since, until)
+    dumps = current_app.json.dumps
+    
+    def generate():
+        for entry in entries:
+            yield dumps({
+                'timestamp': entry.timestamp.isoformat(),
+                'action': entry.action,
+                'resource_type': entry.resource_type,
+                'resource_id': entry.resource_id,
+                'old_values': raw(entry.old_values, 'null'),
+                'new_values': raw(entry.new_values, 'null'),
+                'ip_address': entry.ip_address
+            }) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
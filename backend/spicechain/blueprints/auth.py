@@ -0,0 +1,164 @@
+from flask import Blueprint, current_app, g, request, jsonify, session
+
+from .. import geo
+from ..extensions import db
+from ..models import User
+from ..passwords import HasherBusy, hasher, throttles
+from ..tokens import TokenError, decode_token, issue_tokens, revoke_token
+from ..utils import login_required, log_action
+
+bp = Blueprint('auth', __name__)
+
+
+def _too_many_attempts(retry_after):
+    response = jsonify({'error': 'Too many attempts, try again later'})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+
+@bp.route('/signup', methods=['POST'])
+def signup():
+    data = request.get_json()
+    
+    # Validate required fields
+    required_fields = ['username', 'email', 'password', 'user_type']
+    for field in required_fields:
+        if field not in data:
+            return jsonify({'error': f'{field} is required'}), 400
+    
+    # Check if user already exists
+    if User.query.filter_by(username=data['username']).first():
+        return jsonify({'error': 'Username already exists'}), 400
+    
+    if User.query.filter_by(email=data['email']).first():
+        return jsonify({'error': 'Email already exists'}), 400
+    
+    # Validate user type
+    valid_user_types = ['farmer', 'middleman', 'consumer', 'quality_officer']
+    if data['user_type'] not in valid_user_types:
+        return jsonify({'error': 'Invalid user type'}), 400
+    
+    # Signups hash a password too, so they share the per-IP attempt budget
+    ip_throttle, _ = throttles()
+    retry_after = ip_throttle.retry_after(request.remote_addr)
+    if retry_after:
+        return _too_many_attempts(retry_after)
+    ip_throttle.record(request.remote_addr)
+    
+    try:
+        password_hash = hasher().hash(data['password'])
+    except HasherBusy as e:
+        return jsonify({'error': str(e)}), 503
+    
+    # Create new user
+    user = User(
+        username=data['username'],
+        email=data['email'],
+        password_hash=password_hash,
+        user_type=data['user_type'],
+        phone=data.get('phone'),
+        address=data.get('address'),
+        license_number=data.get('license_number'),
+        coordinate=data.get('coordinate')
+    )
+    point = geo.parse_coordinate(data.get('coordinate'))
+    if point:
+        geo.locate(user, *point)
+    
+    db.session.add(user)
+    db.session.commit()
+    
+    log_action(user.id, 'USER_CREATED', 'user', str(user.id))
+    
+    return jsonify({
+        'message': 'User created successfully',
+        'user_id': user.id,
+        'user_type': user.user_type
+    }), 201
+
+@bp.route('/login', methods=['POST'])
+def login():
+    data = request.get_json()
+    if not data.get('username') or not data.get('password'):
+        return jsonify({'error': 'Username and password are required'}), 400
+    
+    # Refuse throttled callers before spending any CPU on hashing
+    ip_throttle, account_throttle = throttles()
+    retry_after = max(ip_throttle.retry_after(request.remote_addr),
+                      account_throttle.retry_after(data['username']))
+    if retry_after:
+        return _too_many_attempts(retry_after)
+    ip_throttle.record(request.remote_addr)
+    
+    user = User.query.filter_by(email=data['username']).first()
+    
+    try:
+        verified = user is not None and hasher().verify(user.password_hash, data['password'])
+    except HasherBusy as e:
+        return jsonify({'error': str(e)}), 503
+    
+    if verified and user.is_active:
+        account_throttle.reset(data['username'])
+        
+        # Upgrade hashes made with older parameters while we have the password
+        if hasher().needs_rehash(user.password_hash):
+            try:
+                user.password_hash = hasher().hash(data['password'])
+                db.session.commit()
+            except HasherBusy:
+                pass
+        
+        if current_app.config['SESSION_AUTH_ENABLED']:
+            session['user_id'] = user.id
+            session['user_type'] = user.user_type
+        
+        log_action(user.id, 'USER_LOGIN', 'user', str(user.id))
+        
+        return jsonify({
+            'message': 'Login successful',
+            'user_id': user.id,
+            'user_type': user.user_type,
+            **issue_tokens(user.id, user.user_type)
+        }), 200
+    
+    account_throttle.record(data['username'])
+    return jsonify({'error': 'Invalid credentials'}), 401
+
+@bp.route('/logout', methods=['POST'])
+@login_required
+def logout():
+    user_id = g.user_id
+    log_action(user_id, 'USER_LOGOUT', 'user', str(user_id))
+    
+    # Revoke the access token used for this call and, if supplied, its refresh token
+    try:
+        if 'token_claims' in g:
+            revoke_token(g.token_claims)
+    except TokenError:
+        pass
+    refresh_token = (request.get_json(silent=True) or {}).get('refresh_token')
+    if refresh_token:
+        try:
+            revoke_token(decode_token(refresh_token, 'refresh'))
+        except TokenError:
+            pass
+    
+    session.clear()
+    return jsonify({'message': 'Logged out successfully'}), 200
+
+@bp.route('/token/refresh', methods=['POST'])
+def refresh_token():
+    """Exchange a refresh token for a new token pair. The old refresh token
+    is revoked, so each one can be used only once."""
+    data = request.get_json(silent=True) or {}
+    if not data.get('refresh_token'):
+        return jsonify({'error': 'refresh_token is required'}), 400
+    
+    try:
+        claims = decode_token(data['refresh_token'], 'refresh')
+        # A concurrent refresh with the same token loses here
+        revoke_token(claims)
+    except TokenError as e:
+        return jsonify({'error': str(e)}), 401
+    
+    return jsonify(issue_tokens(int(claims['sub']), claims['user_type'])), 200
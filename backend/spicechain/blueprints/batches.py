@@ -0,0 +1,671 @@
+from datetime import datetime
+
+from flask import Blueprint, g, request, jsonify
+from sqlalchemy.orm import joinedload
+
+from .. import archive, fieldsets, geo, ids, images, jobs, refdata
+from ..composition import origin_breakdown
+from ..extensions import db
+from ..market import LISTED_STATUSES
+from ..models import BatchComposition, Batches, Transactions, User
+from ..stock import (EPSILON, InsufficientStock, available, balances, open_batch, original_quantities,
+                     original_quantity, take)
+from ..streaming import stream_response
+from ..utils import (add_timeline_event, allowed_file, latest_qa_tests, login_required, log_action,
+                     publish_transaction, qa_test_json)
+
+bp = Blueprint('batches', __name__)
+
+
+@bp.route('/registerbatch', methods=['POST'])
+@login_required
+def register_batch():
+    if g.user_type != 'farmer':
+        return jsonify({'error': 'Only farmers can register batches'}), 403
+    
+    # Parse form fields
+    data = request.form
+    required_fields = ['spice_id', 'quantity_kg', 'harvest_date', 'farm_location']
+    for field in required_fields:
+        if field not in data:
+            return jsonify({'error': f'{field} is required'}), 400
+    
+    # Farm coordinates are optional; without them the farmer's own are used
+    if data.get('latitude') or data.get('longitude'):
+        try:
+            point = float(data['latitude']), float(data['longitude'])
+        except (KeyError, ValueError):
+            return jsonify({'error': 'latitude and longitude must both be numbers'}), 400
+        if not geo.valid(*point):
+            return jsonify({'error': 'latitude/longitude out of range'}), 400
+    else:
+        farmer = db.session.get(User, g.user_id)
+        point = farmer.latitude, farmer.longitude
+    
+    # Handle optional image: checked and attached by a harvest_image job
+    upload = None
+    if 'harvest_image' in request.files:
+        file = request.files['harvest_image']
+        if file and allowed_file(file.filename):
+            upload = images.spool(file)
+    
+    # Generate unique batch ID
+    batch_id = ids.new_id('BATCH')
+    
+    batch = Batches(
+        batch_id=batch_id,
+        farmer_id=g.user_id,
+        spice_id=data['spice_id'],
+        quantity_kg=float(data['quantity_kg']),
+        harvest_date=datetime.fromisoformat(data['harvest_date'].replace('Z', '+00:00')),
+        farm_location=data['farm_location'],
+        farming_method=data.get('farming_method', 'conventional'),
+        estimated_grade=data.get('estimated_grade', 'B'),
+        current_owner_id=g.user_id
+    )
+    geo.locate(batch, *point)
+    
+    db.session.add(batch)
+    db.session.flush()
+    open_batch(batch, 'harvest', batch_id)
+    image_job = jobs.enqueue('harvest_image', {'batch_id': batch.id, 'upload': upload}, user_id=g.user_id) if upload else None
+    db.session.commit()
+    
+    # Add timeline event
+    add_timeline_event(
+        batch_id=batch.id,
+        event_type='harvest',
+        description=f'Batch harvested at {data["farm_location"]}',
+        user_id=g.user_id,
+        location=data['farm_location'],
+        event_metadata={'quantity_kg': data['quantity_kg'], 'image_job_id': image_job.id if image_job else None}
+    )
+    
+    log_action(g.user_id, 'BATCH_CREATED', 'batch', batch_id)
+    
+    return jsonify({
+        'message': 'Batch registered successfully',
+        'batch_id': batch_id,
+        'id': batch.id,
+        'harvest_image': None,
+        'image_job_id': image_job.id if image_job else None
+    }), 201
+
+BATCH_FIELDS = ('id', 'batch_id', 'spice_name', 'quantity_kg', 'original_quantity_kg', 'harvest_date', 'status',
+                'estimated_grade')
+BATCH_INCLUDES = ('qa', 'parent')
+
+
+@bp.route('/mybatches', methods=['GET'])
+@login_required
+def get_my_batches():
+    """
+    The caller's batches. ?fields= picks the keys returned (quantity_kg,
+    the remaining stock, costs a ledger lookup); ?include=qa adds each
+    batch's latest quality test, ?include=parent the batch it was divided
+    from.
+    """
+    fieldset = fieldsets.from_request(BATCH_FIELDS, BATCH_INCLUDES)
+    query = Batches.query.filter_by(current_owner_id=g.user_id)
+    if fieldset.includes('parent'):
+        query = query.options(joinedload(Batches.parent_batch))
+    batches = query.all()
+    stock = balances(batches) if fieldset.wants('quantity_kg') else {}
+    originals = original_quantities(batches) if fieldset.wants('original_quantity_kg') else {}
+    latest_tests = latest_qa_tests([batch.id for batch in batches]) if fieldset.includes('qa') else {}
+    batches_list = []
+    
+    for batch in batches:
+        batch_data = {
+            'id': batch.id,
+            'batch_id': batch.batch_id,
+            'quantity_kg': stock.get(batch.id),
+            'original_quantity_kg': originals.get(batch.id),
+            'harvest_date': batch.harvest_date.isoformat(),
+            'status': batch.status,
+            'estimated_grade': batch.estimated_grade
+        }
+        if fieldset.wants('spice_name'):
+            batch_data['spice_name'] = refdata.spice_name(batch.spice_id, f"Unknown Spice (ID: {batch.spice_id})")
+        batch_data = fieldset.pick(batch_data)
+        
+        if fieldset.includes('qa'):
+            batch_data['qa'] = qa_test_json(latest_tests.get(batch.id))
+        if fieldset.includes('parent'):
+            parent = batch.parent_batch
+            batch_data['parent'] = parent and {
+                'id': parent.id,
+                'batch_id': parent.batch_id,
+                'quantity_kg': parent.quantity_kg,
+                'status': parent.status
+            }
+        batches_list.append(batch_data)
+    
+    return jsonify({'batches': batches_list}), 200
+
+# Additional API endpoint for batch division
+@bp.route('/batch/divide', methods=['POST'])
+@login_required
+def divide_batch():
+    """
+    Divide a batch into multiple sub-batches. Each division can be:
+    - Sold immediately (if buyer_id provided)
+    - Kept for later sale (if no buyer_id)
+    """
+    data = request.get_json()
+    required_fields = ['batch_id', 'divisions']
+    
+    for field in required_fields:
+        if field not in data:
+            return jsonify({'error': f'{field} is required'}), 400
+    
+    # Verify batch ownership
+    original_batch = Batches.query.filter_by(
+        id=data['batch_id'], 
+        current_owner_id=g.user_id
+    ).first()
+    
+    if not original_batch:
+        return jsonify({'error': 'Batch not found or not owned by user'}), 404
+    
+    if original_batch.status == 'recalled':
+        return jsonify({'error': 'Batch cannot be divided while recalled'}), 400
+    
+    # Validate divisions
+    divisions = data['divisions']
+    total_divided_quantity = sum(div['quantity_kg'] for div in divisions)
+    
+    if total_divided_quantity > available(original_batch) + EPSILON:
+        return jsonify({'error': 'Total divided quantity exceeds batch quantity'}), 400
+    
+    if len(divisions) < 1:
+        return jsonify({'error': 'At least 1 division required'}), 400
+    
+    try:
+        # Guarded deduction: a concurrent divide of the same stock fails here
+        take(original_batch, total_divided_quantity, 'divide', original_batch.batch_id)
+        
+        new_batches = []
+        transactions_created = []
+        pending_transactions = []
+        sub_batch_ids = ids.new_ids('BATCH', len(divisions))
+        transaction_ids = iter(ids.new_ids('TXN', sum(
+            1 for division in divisions if division.get('buyer_id') and division.get('price_per_kg')
+        )))
+        
+        # Create new sub-batches
+        for i, division in enumerate(divisions):
+            sub_batch_id = f"{sub_batch_ids[i]}_DIV{i+1}"
+            
+            # Determine initial owner - if buyer_id provided, they become owner after transaction
+            initial_owner_id = g.user_id
+            
+            sub_batch = Batches(
+                batch_id=sub_batch_id,
+                farmer_id=original_batch.farmer_id,  # Keep original farmer
+                spice_id=original_batch.spice_id,
+                quantity_kg=division['quantity_kg'],
+                harvest_date=original_batch.harvest_date,
+                farm_location=original_batch.farm_location,
+                latitude=original_batch.latitude,
+                longitude=original_batch.longitude,
+                geo_cell=original_batch.geo_cell,
+                farming_method=original_batch.farming_method,
+                estimated_grade=original_batch.estimated_grade,
+                current_owner_id=initial_owner_id,
+                status='divided' if not division.get('buyer_id') else 'pending_sale',
+                parent_batch_id=original_batch.id  # Link to parent batch
+            )
+            
+            db.session.add(sub_batch)
+            db.session.flush()  # Get the ID
+            open_batch(sub_batch, 'divide', original_batch.batch_id)
+            
+            batch_info = {
+                'batch_id': sub_batch_id,
+                'id': sub_batch.id,
+                'quantity_kg': division['quantity_kg'],
+                'status': 'available' if not division.get('buyer_id') else 'sold'
+            }
+            
+            # If buyer specified, create transaction immediately
+            if division.get('buyer_id') and division.get('price_per_kg'):
+                transaction_id = next(transaction_ids)
+                total_amount = division['quantity_kg'] * division['price_per_kg']
+                
+                transaction = Transactions(
+                    transaction_id=transaction_id,
+                    from_user_id=g.user_id,
+                    to_user_id=division['buyer_id'],
+                    batch_id=sub_batch.id,
+                    quantity_kg=division['quantity_kg'],
+                    price_per_kg=division['price_per_kg'],
+                    total_amount=total_amount,
+                    transaction_type='sale',
+                    payment_status='pending',
+                    notes=f"Sale of divided batch {sub_batch_id}"
+                )
+                
+                db.session.add(transaction)
+                pending_transactions.append(transaction)
+                
+                batch_info['transaction_id'] = transaction_id
+                batch_info['buyer_id'] = division['buyer_id']
+                batch_info['total_amount'] = total_amount
+                
+                transactions_created.append({
+                    'transaction_id': transaction_id,
+                    'batch_id': sub_batch_id,
+                    'buyer_id': division['buyer_id'],
+                    'total_amount': total_amount,
+                    'status': 'pending'
+                })
+                
+                # Add transaction timeline event
+                add_timeline_event(
+                    batch_id=sub_batch.id,
+                    event_type='sale_initiated',
+                    description=f'Sale initiated to buyer {division["buyer_id"]}',
+                    user_id=g.user_id,
+                    location=original_batch.farm_location,
+                    event_metadata={
+                        'transaction_id': transaction_id,
+                        'price_per_kg': division['price_per_kg'],
+                        'total_amount': total_amount
+                    }
+                )
+            
+            new_batches.append(batch_info)
+            
+            # Add timeline event for division
+            add_timeline_event(
+                batch_id=sub_batch.id,
+                event_type='batch_divided',
+                description=f'Sub-batch created from {original_batch.batch_id} ({division["quantity_kg"]}kg)',
+                user_id=g.user_id,
+                location=original_batch.farm_location,
+                event_metadata={
+                    'parent_batch_id': original_batch.batch_id,
+                    'division_number': i+1,
+                    'quantity_kg': division['quantity_kg'],
+                    'has_buyer': bool(division.get('buyer_id'))
+                }
+            )
+        
+        # Update original batch status
+        original_batch.status = 'divided'
+        remaining_quantity = available(original_batch)
+        
+        # If entire batch was divided, mark as fully divided
+        if remaining_quantity <= EPSILON:
+            original_batch.status = 'fully_divided'
+        
+        # Add timeline event to original batch
+        add_timeline_event(
+            batch_id=original_batch.id,
+            event_type='batch_divided',
+            description=f'Batch divided into {len(divisions)} sub-batches',
+            user_id=g.user_id,
+            location=original_batch.farm_location,
+            event_metadata={
+                'total_divisions': len(divisions),
+                'total_divided_quantity': total_divided_quantity,
+                'remaining_quantity': remaining_quantity
+            }
+        )
+        
+        db.session.commit()
+        for transaction in pending_transactions:
+            publish_transaction(transaction, 'transaction_created')
+        
+        log_action(g.user_id, 'BATCH_DIVIDED', 'batch', original_batch.batch_id)
+        
+        return jsonify({
+            'message': 'Batch divided successfully',
+            'original_batch_remaining': remaining_quantity,
+            'new_batches': new_batches,
+            'transactions_created': transactions_created,
+            'summary': {
+                'total_divisions': len(divisions),
+                'immediately_sold': len(transactions_created),
+                'kept_for_later': len(divisions) - len(transactions_created)
+            }
+        }), 201
+        
+    except InsufficientStock as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/batch/merge', methods=['POST'])
+@login_required
+def merge_batches():
+    """
+    Blend several owned lots of the same spice into a new batch. Each source
+    gives {batch_id, quantity_kg}; the quantities are recorded as composition
+    edges so the blend can be traced back to every contributing farm.
+    """
+    data = request.get_json()
+    if not data or not data.get('sources'):
+        return jsonify({'error': 'sources is required'}), 400
+    
+    sources = data['sources']
+    if len(sources) < 2:
+        return jsonify({'error': 'At least 2 source batches required'}), 400
+    
+    source_ids = [source.get('batch_id') for source in sources]
+    if len(set(source_ids)) != len(source_ids):
+        return jsonify({'error': 'Source batches must be distinct'}), 400
+    
+    # Verify ownership of every source in one query
+    batches = {batch.id: batch for batch in Batches.query.filter(
+        Batches.id.in_(source_ids),
+        Batches.current_owner_id == g.user_id
+    )}
+    if len(batches) != len(source_ids):
+        return jsonify({'error': 'Batch not found or not owned by user'}), 404
+    
+    stock = balances(list(batches.values()))
+    for source in sources:
+        batch = batches[source['batch_id']]
+        if batch.status in ['pending_sale', 'recalled']:
+            return jsonify({'error': f'Batch {batch.batch_id} cannot be merged while {batch.status}'}), 400
+        if not 0 < source.get('quantity_kg', 0) <= stock[batch.id] + EPSILON:
+            return jsonify({'error': f'Invalid quantity for batch {batch.batch_id}'}), 400
+    
+    if len({batch.spice_id for batch in batches.values()}) > 1:
+        return jsonify({'error': 'Only batches of the same spice can be merged'}), 400
+    
+    try:
+        total_quantity = sum(source['quantity_kg'] for source in sources)
+        main_source = batches[max(sources, key=lambda source: source['quantity_kg'])['batch_id']]
+        methods = {batch.farming_method for batch in batches.values()}
+        
+        merged_batch = Batches(
+            batch_id=f"{ids.new_id('BATCH')}_MRG",
+            farmer_id=main_source.farmer_id,  # Largest contributor; see /composition for all
+            spice_id=main_source.spice_id,
+            quantity_kg=total_quantity,
+            harvest_date=min(batch.harvest_date for batch in batches.values()),
+            farm_location=f'Blend of {len(sources)} batches',
+            farming_method=methods.pop() if len(methods) == 1 else 'mixed',
+            estimated_grade=data.get('estimated_grade', main_source.estimated_grade),
+            current_owner_id=g.user_id,
+            status='merged'
+        )
+        db.session.add(merged_batch)
+        db.session.flush()  # Get the ID
+        open_batch(merged_batch, 'merge', merged_batch.batch_id)
+        
+        # Deduct every source before the first timeline event commits
+        for source in sources:
+            batch = batches[source['batch_id']]
+            take(batch, source['quantity_kg'], 'merge', merged_batch.batch_id)
+            db.session.add(BatchComposition(
+                child_batch_id=merged_batch.id,
+                source_batch_id=batch.id,
+                quantity_kg=source['quantity_kg'],
+                note=data.get('note')
+            ))
+        remaining = balances(list(batches.values()))
+        
+        for source in sources:
+            batch = batches[source['batch_id']]
+            if remaining[batch.id] <= EPSILON:
+                batch.status = 'fully_merged'
+            
+            add_timeline_event(
+                batch_id=batch.id,
+                event_type='batch_merged',
+                description=f'{source["quantity_kg"]}kg merged into {merged_batch.batch_id}',
+                user_id=g.user_id,
+                event_metadata={
+                    'merged_batch_id': merged_batch.batch_id,
+                    'quantity_kg': source['quantity_kg'],
+                    'remaining_quantity': remaining[batch.id]
+                }
+            )
+        
+        add_timeline_event(
+            batch_id=merged_batch.id,
+            event_type='batch_merged',
+            description=f'Batch blended from {len(sources)} batches ({total_quantity}kg)',
+            user_id=g.user_id,
+            event_metadata={
+                'sources': [{
+                    'batch_id': batches[source['batch_id']].batch_id,
+                    'quantity_kg': source['quantity_kg']
+                } for source in sources],
+                'note': data.get('note')
+            }
+        )
+        
+        db.session.commit()
+        
+        log_action(g.user_id, 'BATCH_MERGED', 'batch', merged_batch.batch_id)
+        
+        return jsonify({
+            'message': 'Batches merged successfully',
+            'batch_id': merged_batch.batch_id,
+            'id': merged_batch.id,
+            'quantity_kg': total_quantity,
+            'origin_attribution': origin_breakdown(merged_batch.id, total_quantity)
+        }), 201
+        
+    except InsufficientStock as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/batch/<int:batch_id>/composition', methods=['GET'])
+def get_batch_composition(batch_id):
+    """
+    Direct sources of a batch and the share of it that came from each farm,
+    across any number of divisions and merges.
+    """
+    batch = db.session.get(Batches, batch_id)
+    if not batch:
+        return jsonify({'error': 'Batch not found'}), 404
+    
+    if batch.compositions:
+        sources = [{
+            'batch_id': composition.source_batch.batch_id,
+            'quantity_kg': composition.quantity_kg,
+            'relation': 'merge'
+        } for composition in batch.compositions]
+    elif batch.parent_batch:
+        sources = [{'batch_id': batch.parent_batch.batch_id, 'quantity_kg': batch.quantity_kg, 'relation': 'division'}]
+    else:
+        sources = []
+    
+    quantity = available(batch)
+    return jsonify({
+        'batch_id': batch.batch_id,
+        'quantity_kg': quantity,
+        'original_quantity_kg': original_quantity(batch),
+        'sources': sources,
+        'origin_attribution': origin_breakdown(batch.id, quantity)
+    }), 200
+
+# Endpoint to sell individual divisions later
+@bp.route('/batch/<int:batch_id>/sell', methods=['POST'])
+@login_required
+def sell_individual_batch(batch_id):
+    """
+    Sell an individual batch (including divided sub-batches) to a specific buyer
+    """
+    data = request.get_json()
+    required_fields = ['buyer_id', 'price_per_kg']
+    
+    for field in required_fields:
+        if field not in data:
+            return jsonify({'error': f'{field} is required'}), 400
+    
+    # Verify batch ownership
+    batch = Batches.query.filter_by(
+        id=batch_id,
+        current_owner_id=g.user_id
+    ).first()
+    
+    if not batch:
+        return jsonify({'error': 'Batch not found or not owned by user'}), 404
+    
+    if batch.status in ['sold', 'pending_sale']:
+        return jsonify({'error': 'Batch is already sold or pending sale'}), 400
+    
+    if batch.status == 'recalled':
+        return jsonify({'error': 'Batch cannot be sold while recalled'}), 400
+    
+    quantity = available(batch)
+    if quantity <= EPSILON:
+        return jsonify({'error': 'Batch has no stock left'}), 400
+    
+    try:
+        # Create transaction
+        transaction_id = ids.new_id('TXN')
+        total_amount = quantity * data['price_per_kg']
+        
+        transaction = Transactions(
+            transaction_id=transaction_id,
+            from_user_id=g.user_id,
+            to_user_id=data['buyer_id'],
+            batch_id=batch.id,
+            quantity_kg=quantity,
+            price_per_kg=data['price_per_kg'],
+            total_amount=total_amount,
+            transaction_type='sale',
+            payment_status='pending',
+            notes=data.get('notes', f'Sale of batch {batch.batch_id}')
+        )
+        
+        db.session.add(transaction)
+        
+        # Update batch status
+        batch.status = 'pending_sale'
+        
+        # Add timeline event
+        add_timeline_event(
+            batch_id=batch.id,
+            event_type='sale_initiated',
+            description=f'Sale initiated to buyer {data["buyer_id"]}',
+            user_id=g.user_id,
+            location=batch.farm_location,
+            event_metadata={
+                'transaction_id': transaction_id,
+                'price_per_kg': data['price_per_kg'],
+                'total_amount': total_amount
+            }
+        )
+        
+        db.session.commit()
+        publish_transaction(transaction, 'transaction_created')
+        
+        log_action(g.user_id, 'BATCH_SALE_INITIATED', 'batch', batch.batch_id)
+        
+        return jsonify({
+            'message': 'Sale initiated successfully',
+            'transaction_id': transaction_id,
+            'batch_id': batch.batch_id,
+            'total_amount': total_amount,
+            'status': 'pending_buyer_confirmation'
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+# Get available (unsold) batches for a user
+@bp.route('/mybatches/available', methods=['GET'])
+@login_required
+def get_available_batches():
+    """
+    Get all batches owned by user that are available for sale
+    """
+    available_batches = Batches.query.filter_by(
+        current_owner_id=g.user_id
+    ).filter(
+        Batches.status.in_(LISTED_STATUSES)
+    ).options(joinedload(Batches.parent_batch)).all()
+    
+    stock = balances(available_batches)
+    originals = original_quantities(available_batches)
+    batches_list = []
+    
+    for batch in available_batches:
+        batch_data = {
+            'id': batch.id,
+            'batch_id': batch.batch_id,
+            'spice_name': refdata.spice_name(batch.spice_id, f"Unknown Spice (ID: {batch.spice_id})"),
+            'quantity_kg': stock[batch.id],
+            'original_quantity_kg': originals[batch.id],
+            'harvest_date': batch.harvest_date.isoformat(),
+            'status': batch.status,
+            'estimated_grade': batch.estimated_grade,
+            'is_division': batch.parent_batch_id is not None
+        }
+        
+        # If it's a division, show parent info
+        if batch.parent_batch_id:
+            batch_data['parent_batch_id'] = batch.parent_batch.batch_id
+            batch_data['division_info'] = f'Divided from {batch.parent_batch.batch_id}'
+        
+        batches_list.append(batch_data)
+    
+    return jsonify({
+        'available_batches': batches_list,
+        'total_count': len(batches_list)
+    }), 200
+
+@bp.route('/batch/<int:batch_id>/history', methods=['GET'])
+def get_batch_family_history(batch_id):
+    """
+    Get complete history including parent and child batches. The timeline
+    is streamed as it is read (?format=ndjson for one event per line), so
+    heavily divided batches don't have to fit in memory.
+    """
+    batch = db.session.get(Batches, batch_id)
+    if not batch:
+        return jsonify({'error': 'Batch not found'}), 404
+    
+    # Get root batch (original parent)
+    root_batch = batch
+    while root_batch.parent_batch_id:
+        root_batch = root_batch.parent_batch
+    
+    # Get all related batches (siblings and children)
+    family_batches = [root_batch]
+    family_batches.extend(root_batch.sub_batches)
+    
+    # Get timeline for all related batches
+    batch_ids = [b.id for b in family_batches]
+    timeline_events = archive.iter_timeline_events({'batch_id': batch_ids}, since=root_batch.created_at,
+                                                   fields=('event_type', 'description', 'batch_code'))
+    owners = refdata.usernames(sub.current_owner_id for sub in root_batch.sub_batches)
+    
+    # Format response
+    family_tree = {
+        'root_batch': {
+            'batch_id': root_batch.batch_id,
+            'original_quantity': original_quantity(root_batch),
+            'status': root_batch.status
+        },
+        'divisions': [{
+            'batch_id': sub.batch_id,
+            'quantity_kg': sub.quantity_kg,
+            'current_owner': owners.get(sub.current_owner_id),
+            'status': sub.status
+        } for sub in root_batch.sub_batches],
+        'timeline': ({
+            'timestamp': event.timestamp.isoformat(),
+            'event_type': event.event_type,
+            'description': event.description,
+            'batch_id': event.batch_code
+        } for event in timeline_events)
+    }
+    
+    return stream_response(family_tree)
+
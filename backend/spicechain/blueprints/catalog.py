@@ -0,0 +1,72 @@
+from flask import Blueprint, request, jsonify
+from sqlalchemy.orm import joinedload
+
+from .. import refdata
+from ..models import Batches, Package, User
+
+bp = Blueprint('catalog', __name__)
+
+
+@bp.route('/spices', methods=['GET'])
+def get_spices():
+    """
+    The spice catalogue, from the reference cache. Clients revalidate with
+    If-None-Match and get 304 while the catalogue is unchanged.
+    """
+    response = jsonify({'spices': list(refdata.spices().values())})
+    response.set_etag(refdata.spices_etag())
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@bp.route('/search', methods=['GET'])
+def search():
+    query = request.args.get('q', '')
+    search_type = request.args.get('type', 'all')  # batch, package, user, all
+    
+    if not query or len(query) < 3:
+        return jsonify({'error': 'Query must be at least 3 characters long'}), 400
+    
+    results = {}
+    
+    if search_type in ['batch', 'all']:
+        batches = Batches.query.filter(
+            Batches.batch_id.contains(query) |
+            Batches.farm_location.contains(query)
+        ).limit(10).all()
+        
+        farmers = refdata.usernames(b.farmer_id for b in batches)
+        results['batches'] = [{
+            'batch_id': b.batch_id,
+            'spice_name': refdata.spice_name(b.spice_id),
+            'farmer': farmers.get(b.farmer_id),
+            'quantity_kg': b.quantity_kg,
+            'status': b.status
+        } for b in batches]
+    
+    if search_type in ['package', 'all']:
+        packages = Package.query.options(joinedload(Package.batch)).filter(
+            Package.package_id.contains(query)
+        ).limit(10).all()
+        
+        results['packages'] = [{
+            'package_id': p.package_id,
+            'spice_name': refdata.spice_name(p.batch.spice_id),
+            'quantity_kg': p.quantity_kg,
+            'status': p.status,
+            'package_type': p.package_type
+        } for p in packages]
+    
+    if search_type in ['user', 'all']:
+        users = User.query.filter(
+            User.username.contains(query) &
+            User.is_active == True
+        ).limit(10).all()
+        
+        results['users'] = [{
+            'id': u.id,
+            'username': u.username,
+            'user_type': u.user_type
+        } for u in users]
+    
+    return jsonify(results), 200
+
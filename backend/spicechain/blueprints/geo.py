@@ -0,0 +1,94 @@
+from flask import Blueprint, current_app, request, jsonify
+
+from .. import geo
+from ..models import Batches, User
+from ..utils import login_required
+
+bp = Blueprint('geo', __name__)
+
+
+def _area():
+    """``('radius', lat, lon, km)`` or ``('bbox', min_lat, min_lon, max_lat, max_lon)``
+    from the query string, or an error message."""
+    args = request.args
+    if args.get('bbox'):
+        try:
+            min_lon, min_lat, max_lon, max_lat = (float(part) for part in args['bbox'].split(','))
+        except ValueError:
+            return 'bbox must be min_lon,min_lat,max_lon,max_lat'
+        if not (geo.valid(min_lat, min_lon) and geo.valid(max_lat, max_lon)) or min_lat > max_lat or min_lon > max_lon:
+            return 'bbox must be min_lon,min_lat,max_lon,max_lat within the map'
+        return ('bbox', min_lat, min_lon, max_lat, max_lon)
+    
+    lat, lon = args.get('lat', type=float), args.get('lon', type=float)
+    radius_km = args.get('radius_km', 50, type=float)
+    if lat is None or lon is None or not geo.valid(lat, lon):
+        return 'lat and lon (or bbox) are required'
+    if not 0 < radius_km <= current_app.config['GEO_MAX_RADIUS_KM']:
+        return f"radius_km must be between 0 and {current_app.config['GEO_MAX_RADIUS_KM']}"
+    return ('radius', lat, lon, radius_km)
+
+
+def _search(model, criteria):
+    area = _area()
+    if isinstance(area, str):
+        return area, None
+    limit = min(request.args.get('limit', 100, type=int), current_app.config['GEO_MAX_RESULTS'])
+    if area[0] == 'bbox':
+        return None, [(row, None) for row in geo.within_box(model, *area[1:], *criteria, limit=limit)]
+    return None, geo.within_radius(model, *area[1:], *criteria, limit=limit)
+
+
+@bp.route('/geo/users', methods=['GET'])
+@login_required
+def users_near():
+    """
+    Active users within ?radius_km= (default 50) of ?lat=&lon=, nearest first,
+    or inside ?bbox=min_lon,min_lat,max_lon,max_lat (nearest its centre first).
+    Optional ?user_type=.
+    """
+    criteria = [User.is_active == True]
+    if request.args.get('user_type'):
+        criteria.append(User.user_type == request.args['user_type'])
+    
+    error, found = _search(User, criteria)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    return jsonify({'users': [{
+        'id': user.id,
+        'username': user.username,
+        'user_type': user.user_type,
+        'latitude': user.latitude,
+        'longitude': user.longitude,
+        'distance_km': round(distance, 3) if distance is not None else None
+    } for user, distance in found]}), 200
+
+@bp.route('/geo/batches', methods=['GET'])
+@login_required
+def batches_near():
+    """
+    Batches harvested within ?radius_km= of ?lat=&lon= or inside ?bbox=,
+    with optional ?spice_id= and ?status= filters.
+    """
+    criteria = []
+    if request.args.get('spice_id', type=int):
+        criteria.append(Batches.spice_id == request.args.get('spice_id', type=int))
+    if request.args.get('status'):
+        criteria.append(Batches.status == request.args['status'])
+    
+    error, found = _search(Batches, criteria)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    return jsonify({'batches': [{
+        'id': batch.id,
+        'batch_id': batch.batch_id,
+        'spice_id': batch.spice_id,
+        'farmer_id': batch.farmer_id,
+        'farm_location': batch.farm_location,
+        'status': batch.status,
+        'latitude': batch.latitude,
+        'longitude': batch.longitude,
+        'distance_km': round(distance, 3) if distance is not None else None
+    } for batch, distance in found]}), 200
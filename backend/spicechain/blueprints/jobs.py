@@ -0,0 +1,94 @@
+import os
+
+from flask import Blueprint, current_app, g, request, jsonify, send_file
+
+from .. import jobs
+from ..extensions import db
+from ..models import Job
+from ..utils import login_required
+
+bp = Blueprint('jobs', __name__)
+
+
+def _job_json(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'priority': job.priority,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'progress': job.progress,
+        'progress_message': job.progress_message,
+        'result': job.result,
+        'error': job.error.strip().splitlines()[-1] if job.error else None,
+        'created_at': job.created_at.isoformat(),
+        'run_at': job.run_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+def _own_job(job_id):
+    job = db.session.get(Job, job_id)
+    return job if job is not None and job.user_id == g.user_id else None
+
+
+@bp.route('/jobs', methods=['GET'])
+@login_required
+def list_jobs():
+    """
+    The caller's jobs, newest first. Optional ?status= filter.
+    """
+    limit = min(request.args.get('limit', 50, type=int), 200)
+    query = Job.query.filter_by(user_id=g.user_id)
+    if request.args.get('status'):
+        query = query.filter_by(status=request.args['status'])
+    
+    return jsonify({'jobs': [_job_json(job) for job in query.order_by(Job.id.desc()).limit(limit)]}), 200
+
+@bp.route('/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    """
+    Status and progress of one of the caller's jobs.
+    """
+    job = _own_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return jsonify(_job_json(job)), 200
+
+@bp.route('/jobs/<int:job_id>/output', methods=['GET'])
+@login_required
+def get_job_output(job_id):
+    """
+    Download the file a finished job wrote (e.g. a recall report).
+    """
+    job = _own_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if job.status != 'succeeded' or not (job.result or {}).get('output'):
+        return jsonify({'error': 'Job has no output', 'status': job.status}), 409
+    
+    path = os.path.join(current_app.config['JOB_OUTPUT_DIR'], job.result['output'])
+    if not os.path.exists(path):
+        return jsonify({'error': 'Job output has been purged'}), 410
+    
+    return send_file(path, as_attachment=True, download_name=job.result['output'])
+
+@bp.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    """
+    Cancel one of the caller's jobs that has not started yet.
+    """
+    job = _own_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if not jobs.cancel(job_id):
+        return jsonify({'error': f'Job is already {job.status}'}), 409
+    
+    return jsonify({'message': 'Job cancelled'}), 200
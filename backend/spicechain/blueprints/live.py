@@ -0,0 +1,62 @@
+from flask import Blueprint, Response, current_app, request, jsonify
+
+from ..models import Package
+from ..tokens import TokenError
+from ..utils import authenticate
+
+bp = Blueprint('live', __name__)
+
+
+def _stream(subscription, heartbeat):
+    try:
+        # Tell EventSource clients how long to wait before reconnecting
+        yield 'retry: 5000\n\n'
+        while True:
+            message = subscription.get(heartbeat)
+            if message is None:
+                yield ': keep-alive\n\n'
+            else:
+                yield f'data: {message}\n\n'
+    finally:
+        subscription.close()
+
+
+@bp.route('/events', methods=['GET'])
+def event_stream():
+    """
+    Server-sent event stream replacing client polling. Authenticated users always
+    receive their own transaction events; anyone can additionally watch
+    packages (?package=PKG_...) or batches (?batch=<id>), both repeatable.
+
+    Each open stream parks a worker on a blocking queue read, so production
+    should serve it from an async worker (e.g. gunicorn -k gevent) where
+    thousands of idle connections are cheap.
+    """
+    try:
+        # EventSource cannot set headers, so the token may come as ?access_token=
+        identity = authenticate(request.args.get('access_token'))
+    except TokenError as e:
+        return jsonify({'error': str(e)}), 401
+    
+    channels = []
+    if identity is not None:
+        channels.append(f'user:{identity[0]}')
+    
+    package_codes = request.args.getlist('package')
+    if package_codes:
+        packages = Package.query.with_entities(Package.id).filter(Package.package_id.in_(package_codes)).all()
+        if len(packages) != len(set(package_codes)):
+            return jsonify({'error': 'Package not found'}), 404
+        channels.extend(f'package:{p.id}' for p in packages)
+    
+    channels.extend(f'batch:{batch_id}' for batch_id in request.args.getlist('batch', type=int))
+    
+    if not channels:
+        return jsonify({'error': 'Login or provide a package/batch to watch'}), 400
+    
+    subscription = current_app.extensions['event_broker'].subscribe(channels)
+    return Response(
+        _stream(subscription, current_app.config['EVENT_HEARTBEAT_SECONDS']),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
@@ -0,0 +1,66 @@
+from datetime import datetime
+
+from flask import Blueprint, request, jsonify
+
+from .. import market
+
+bp = Blueprint('market', __name__)
+
+
+@bp.route('/market', methods=['GET'])
+def browse_market():
+    """
+    Purchasable batches across all sellers. Filters: ?spice_id=, ?grade=,
+    ?farming_method=, ?min_quantity_kg=, ?max_quantity_kg=, ?harvested_from=,
+    ?harvested_to= (ISO dates), ?seller_id=. Sorted by ?sort=harvest_date,
+    -harvest_date (default), quantity_kg or -quantity_kg, paginated by
+    ?page=/?per_page=. Facet counts follow the spice/grade/method filters.
+    """
+    args = request.args
+    sort = args.get('sort', '-harvest_date')
+    if sort not in market.SORTS:
+        return jsonify({'error': f"sort must be one of {', '.join(market.SORTS)}"}), 400
+    page = max(args.get('page', 1, type=int), 1)
+    per_page = min(max(args.get('per_page', 20, type=int), 1), 100)
+
+    try:
+        harvested_from = datetime.fromisoformat(args['harvested_from']) if args.get('harvested_from') else None
+        harvested_to = datetime.fromisoformat(args['harvested_to']) if args.get('harvested_to') else None
+    except ValueError:
+        return jsonify({'error': 'harvested_from/harvested_to must be ISO dates'}), 400
+
+    selected = {
+        'spice_id': args.get('spice_id', type=int),
+        'grade': args.get('grade'),
+        'farming_method': args.get('farming_method')
+    }
+    rows, total = market.search(
+        **selected,
+        min_kg=args.get('min_quantity_kg', type=float),
+        max_kg=args.get('max_quantity_kg', type=float),
+        harvested_from=harvested_from,
+        harvested_to=harvested_to,
+        seller_id=args.get('seller_id', type=int),
+        sort=sort,
+        page=page,
+        per_page=per_page
+    )
+
+    return jsonify({
+        'listings': [{
+            'id': listing.batch_id,
+            'batch_id': code,
+            'spice_id': listing.spice_id,
+            'spice_name': spice_name,
+            'estimated_grade': listing.grade or None,
+            'farming_method': listing.farming_method or None,
+            'quantity_kg': listing.quantity_kg,
+            'harvest_date': listing.harvest_date.isoformat(),
+            'seller_id': listing.owner_id,
+            'seller': seller
+        } for listing, code, spice_name, seller in rows],
+        'facets': market.facets(**selected),
+        'total': total,
+        'pages': (total + per_page - 1) // per_page,
+        'current_page': page
+    }), 200
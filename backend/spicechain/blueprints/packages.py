@@ -0,0 +1,146 @@
+from flask import Blueprint, g, request, jsonify
+from sqlalchemy.orm import joinedload
+
+from .. import fieldsets, ids, refdata, trace_tokens
+from ..extensions import db
+from ..models import Batches, Package
+from ..stock import InsufficientStock, take
+from ..utils import add_timeline_event, latest_qa_tests, login_required, log_action, qa_test_json
+
+bp = Blueprint('packages', __name__)
+
+
+@bp.route('/package', methods=['POST'])
+@login_required
+def create_package():
+    if g.user_type not in ['farmer', 'middleman']:
+        return jsonify({'error': 'Only farmers and middlemen can create packages'}), 403
+    
+    data = request.get_json()
+    required_fields = ['batch_id', 'quantity_kg', 'package_type']
+    
+    for field in required_fields:
+        if field not in data:
+            return jsonify({'error': f'{field} is required'}), 400
+    
+    # Verify batch ownership
+    batch = Batches.query.filter_by(id=data['batch_id'], current_owner_id=g.user_id).first()
+    if not batch:
+        return jsonify({'error': 'Batch not found or not owned by user'}), 404
+    
+    if batch.status == 'recalled':
+        return jsonify({'error': 'Batch cannot be packaged while recalled'}), 400
+    
+    # Generate package ID and QR code
+    package_id = ids.new_id('PKG')
+    qr_code = f"QR_{package_id}"
+    
+    # Calculate expiry date based on spice shelf life
+    expiry_date = None
+
+    package = Package(
+        package_id=package_id,
+        batch_id=data['batch_id'],
+        packager_id=g.user_id,
+        quantity_kg=data['quantity_kg'],
+        package_type=data['package_type'],
+        expiry_date=expiry_date,
+        current_owner_id=g.user_id,
+        qr_code=qr_code
+    )
+    
+    db.session.add(package)
+    
+    # Packed quantity leaves the batch's bulk stock
+    try:
+        take(batch, data['quantity_kg'], 'package', package_id)
+    except InsufficientStock as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    
+    # Update batch status
+    batch.status = 'packaged'
+    db.session.flush()
+    
+    # Signed provenance for the QR label; without a signing key it is left
+    # to `flask trace-tokens issue`
+    trace_token = trace_tokens.issue([package.id]).get(package.id)
+    db.session.commit()
+    
+    # Add timeline event
+    add_timeline_event(
+        batch_id=data['batch_id'],
+        package_id=package.id,
+        event_type='package',
+        description=f'Package created from batch',
+        user_id=g.user_id,
+        event_metadata={
+            'package_id': package_id,
+            'quantity_kg': data['quantity_kg'],
+            'package_type': data['package_type']
+        }
+    )
+    
+    log_action(g.user_id, 'PACKAGE_CREATED', 'package', package_id)
+    
+    return jsonify({
+        'message': 'Package created successfully',
+        'package_id': package_id,
+        'qr_code': qr_code,
+        'trace_token': trace_token,
+        'expiry_date': expiry_date.isoformat() if expiry_date else None
+    }), 201
+
+PACKAGE_FIELDS = ('id', 'package_id', 'spice_name', 'quantity_kg', 'package_type', 'status', 'package_date')
+PACKAGE_INCLUDES = ('batch', 'qa')
+
+
+@bp.route('/mypackages', methods=['GET'])
+@login_required
+def get_my_packages():
+    """
+    The caller's packages. ?fields= picks the keys returned; ?include=batch
+    adds each package's source batch and farmer, ?include=qa the latest
+    quality test of that batch.
+    """
+    fieldset = fieldsets.from_request(PACKAGE_FIELDS, PACKAGE_INCLUDES)
+    query = Package.query.filter_by(current_owner_id=g.user_id)
+    # Load the source batches with the packages only if the response needs
+    # them; spice and farmer names come from the reference data cache
+    if fieldset.wants('spice_name') or fieldset.includes('batch'):
+        query = query.options(joinedload(Package.batch))
+    packages = query.all()
+    farmers = refdata.usernames(package.batch.farmer_id for package in packages) if fieldset.includes('batch') else {}
+    latest_tests = latest_qa_tests([package.batch_id for package in packages]) if fieldset.includes('qa') else {}
+    packages_list = []
+    
+    for package in packages:
+        package_data = {
+            'id': package.id,
+            'package_id': package.package_id,
+            'quantity_kg': package.quantity_kg,
+            'package_type': package.package_type,
+            'status': package.status,
+            'package_date': package.package_date.isoformat()
+        }
+        if fieldset.wants('spice_name'):
+            spice_id = package.batch.spice_id
+            package_data['spice_name'] = refdata.spice_name(spice_id, f"Unknown Spice (ID: {spice_id})")
+        package_data = fieldset.pick(package_data)
+        
+        if fieldset.includes('batch'):
+            batch = package.batch
+            package_data['batch'] = {
+                'id': batch.id,
+                'batch_id': batch.batch_id,
+                'harvest_date': batch.harvest_date.isoformat(),
+                'farm_location': batch.farm_location,
+                'farming_method': batch.farming_method,
+                'estimated_grade': batch.estimated_grade,
+                'farmer': farmers.get(batch.farmer_id)
+            }
+        if fieldset.includes('qa'):
+            package_data['qa'] = qa_test_json(latest_tests.get(package.batch_id))
+        packages_list.append(package_data)
+    
+    return jsonify({'packages': packages_list}), 200
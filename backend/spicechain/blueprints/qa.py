@@ -0,0 +1,117 @@
+import json
+
+from flask import Blueprint, g, request, jsonify
+
+from .. import ids, recall
+from ..extensions import db
+from ..models import Anomaly, Batches, QATest
+from ..utils import add_timeline_event, login_required, log_action
+
+bp = Blueprint('qa', __name__)
+
+
+@bp.route('/qatest', methods=['POST'])
+@login_required
+def create_qa_test():
+    if g.user_type != 'quality_officer':
+        return jsonify({'error': 'Only quality officers can create QA tests'}), 403
+    
+    data = request.get_json()
+    required_fields = ['batch_id', 'test_type', 'test_result']
+    
+    for field in required_fields:
+        if field not in data:
+            return jsonify({'error': f'{field} is required'}), 400
+    
+    # Generate test ID
+    test_id = ids.new_id('QA')
+    
+    qa_test = QATest(
+        test_id=test_id,
+        batch_id=data['batch_id'],
+        tester_id=g.user_id,
+        test_type=data['test_type'],
+        test_result=data['test_result'],
+        grade_assigned=data.get('grade_assigned'),
+        moisture_content=data.get('moisture_content'),
+        purity_percentage=data.get('purity_percentage'),
+        contamination_level=data.get('contamination_level'),
+        notes=data.get('notes'),
+        certificate_url=data.get('certificate_url')
+    )
+    
+    db.session.add(qa_test)
+    
+    # Update batch status and grade
+    batch = db.session.get(Batches, data['batch_id'])
+    if batch:
+        # Retesting a recalled batch must not put it back on the market
+        if batch.status != 'recalled':
+            batch.status = 'tested'
+        if data.get('grade_assigned'):
+            batch.estimated_grade = data['grade_assigned']
+    
+    db.session.commit()
+    
+    # Add timeline event
+    add_timeline_event(
+        batch_id=data['batch_id'],
+        event_type='quality_test',
+        description=f'Quality test conducted: {data["test_result"]}',
+        user_id=g.user_id,
+        event_metadata={
+            'test_id': test_id,
+            'test_type': data['test_type'],
+            'test_result': data['test_result']
+        }
+    )
+    
+    log_action(g.user_id, 'QA_TEST_CREATED', 'qa_test', test_id)
+    
+    response = {
+        'message': 'QA test created successfully',
+        'test_id': test_id
+    }
+    # A failed test is the usual start of a recall; report its reach up front
+    if data['test_result'] == 'fail':
+        response['recall_impact'] = recall.impact_summary(data['batch_id'])
+    
+    return jsonify(response), 201
+
+@bp.route('/anomalies', methods=['GET'])
+@login_required
+def get_anomalies():
+    """
+    Findings of the latest `flask anomalies scan`, highest score first.
+    Optional ?kind=overdrawn_batch|price_outlier and ?spice_id= filters.
+    """
+    if g.user_type != 'quality_officer':
+        return jsonify({'error': 'Only quality officers can review anomalies'}), 403
+    
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 20, type=int)
+    
+    query = Anomaly.query
+    if request.args.get('kind'):
+        query = query.filter(Anomaly.kind == request.args['kind'])
+    if request.args.get('spice_id', type=int):
+        query = query.filter(Anomaly.spice_id == request.args.get('spice_id', type=int))
+    
+    anomalies = query.order_by(Anomaly.score.desc(), Anomaly.id).paginate(
+        page=page, per_page=per_page, error_out=False
+    )
+    
+    return jsonify({
+        'anomalies': [{
+            'kind': anomaly.kind,
+            'entity_type': anomaly.entity_type,
+            'entity_id': anomaly.entity_id,
+            'spice_id': anomaly.spice_id,
+            'score': anomaly.score,
+            'details': json.loads(anomaly.details) if anomaly.details else {},
+            'detected_at': anomaly.detected_at.isoformat()
+        } for anomaly in anomalies.items],
+        'total': anomalies.total,
+        'pages': anomalies.pages,
+        'current_page': page
+    }), 200
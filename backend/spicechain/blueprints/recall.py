@@ -0,0 +1,80 @@
+import json
+
+from flask import Blueprint, Response, g, request, jsonify, stream_with_context
+
+from .. import events, jobs, recall
+from ..extensions import db
+from ..models import Batches
+from ..utils import login_required, log_action
+
+bp = Blueprint('recall', __name__)
+
+
+@bp.route('/recall/<int:batch_id>/impact', methods=['GET'])
+@login_required
+def recall_impact(batch_id):
+    """
+    Stream everything affected by a failed batch as NDJSON: every descendant
+    sub-batch, every package made from them, pending transactions, and the
+    current holders, followed by a summary line.
+    """
+    if not db.session.get(Batches, batch_id):
+        return jsonify({'error': 'Batch not found'}), 404
+    
+    if request.args.get('summary'):
+        return jsonify(recall.impact_summary(batch_id)), 200
+    
+    def generate():
+        for record in recall.iter_impact(batch_id):
+            yield json.dumps(record, default=str) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@bp.route('/recall/<int:batch_id>/report', methods=['POST'])
+@login_required
+def recall_report(batch_id):
+    """
+    Queue the impact report as a background job instead of streaming it;
+    poll /api/jobs/<job_id> and download /api/jobs/<job_id>/output.
+    """
+    if not db.session.get(Batches, batch_id):
+        return jsonify({'error': 'Batch not found'}), 404
+    
+    job = jobs.enqueue('recall_report', {'root_id': batch_id}, user_id=g.user_id, priority=10)
+    db.session.commit()
+    
+    return jsonify({'job_id': job.id, 'status': job.status}), 202
+
+@bp.route('/recall/<int:batch_id>/freeze', methods=['POST'])
+@login_required
+def recall_freeze(batch_id):
+    """
+    Freeze a batch and all of its descendants in one transaction: batches and
+    packages become 'recalled', pending transactions 'frozen', and each item
+    gets a timeline event.
+    """
+    if g.user_type != 'quality_officer':
+        return jsonify({'error': 'Only quality officers can freeze a recall'}), 403
+    
+    if not db.session.get(Batches, batch_id):
+        return jsonify({'error': 'Batch not found'}), 404
+    
+    data = request.get_json(silent=True) or {}
+    reason = data.get('reason', 'quality failure')
+    
+    affected_holders = recall.holders(batch_id)
+    frozen = recall.freeze(batch_id, g.user_id, reason)
+    # log_action commits, making the freeze and its audit row one transaction
+    log_action(g.user_id, 'RECALL_FROZEN', 'batch', str(batch_id), new_values={'reason': reason, **frozen})
+    
+    events.publish([f"user:{h['user_id']}" for h in affected_holders], 'recall', {
+        'root_batch_id': batch_id,
+        'reason': reason
+    })
+    
+    return jsonify({
+        'message': 'Recall frozen',
+        'root_batch_id': batch_id,
+        'frozen': frozen,
+        'holders_notified': len(affected_holders)
+    }), 200
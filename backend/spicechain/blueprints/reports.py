@@ -0,0 +1,71 @@
+from datetime import date
+
+from flask import Blueprint, request, jsonify
+
+from .. import reports
+from ..utils import login_required
+
+bp = Blueprint('reports', __name__)
+
+
+def _dates():
+    start = date.fromisoformat(request.args['from']) if request.args.get('from') else None
+    end = date.fromisoformat(request.args['to']) if request.args.get('to') else None
+    return start, end
+
+
+@bp.errorhandler(reports.SnapshotMissing)
+def snapshot_missing(error):
+    return jsonify({'error': str(error)}), 503
+
+
+@bp.route('/reports/harvest-volume', methods=['GET'])
+@login_required
+def harvest_volume():
+    """
+    Harvested kilograms per region (?by=region, default) or per spice
+    (?by=spice), optionally between ?from= and ?to= (inclusive ISO dates).
+    Served from the reporting snapshot, as of its snapshot_at.
+    """
+    by = request.args.get('by', 'region')
+    if by not in ('region', 'spice'):
+        return jsonify({'error': 'by must be region or spice'}), 400
+    try:
+        start, end = _dates()
+    except ValueError:
+        return jsonify({'error': 'from/to must be ISO dates'}), 400
+    
+    return jsonify(reports.harvest_volume(start, end, by)), 200
+
+
+@bp.route('/reports/middleman-turnover', methods=['GET'])
+@login_required
+def middleman_turnover():
+    """
+    Completed sales bought and sold per middleman, top ?limit= (default 20)
+    by revenue, optionally between ?from= and ?to=.
+    """
+    limit = request.args.get('limit', 20, type=int)
+    if not 1 <= limit <= 1000:
+        return jsonify({'error': 'limit must be between 1 and 1000'}), 400
+    try:
+        start, end = _dates()
+    except ValueError:
+        return jsonify({'error': 'from/to must be ISO dates'}), 400
+    
+    return jsonify(reports.middleman_turnover(start, end, limit)), 200
+
+
+@bp.route('/reports/qa-pass-rate', methods=['GET'])
+@login_required
+def qa_pass_rate():
+    """
+    Quality tests run and passed per spice, optionally between ?from= and
+    ?to=.
+    """
+    try:
+        start, end = _dates()
+    except ValueError:
+        return jsonify({'error': 'from/to must be ISO dates'}), 400
+    
+    return jsonify(reports.qa_pass_rate(start, end)), 200
@@ -0,0 +1,71 @@
+from flask import Blueprint, current_app, g, request, jsonify
+
+from .. import sync
+from ..utils import login_required, log_action
+
+bp = Blueprint('sync', __name__)
+
+
+def _payload(result):
+    return {
+        'batches': result['entities']['batch'],
+        'packages': result['entities']['package'],
+        'transactions': result['entities']['transaction'],
+        'removed': {
+            'batches': result['removed']['batch'],
+            'packages': result['removed']['package'],
+            'transactions': result['removed']['transaction']
+        },
+        'full': result['full'],
+        'sync_token': result['sync_token'],
+        'has_more': result['has_more']
+    }
+
+@bp.route('/sync', methods=['GET'])
+@login_required
+def pull_changes():
+    """
+    The caller's batches, packages and transactions changed after
+    ?since=<sync_token>, plus ids no longer visible to them. Without
+    ?since= everything they hold is returned. Keep calling with the
+    returned sync_token while has_more is true; 410 means start over
+    without a token.
+    """
+    since = request.args.get('since', type=int)
+    try:
+        result = sync.changes(g.user_id, since, current_app.config['SYNC_PAGE_SIZE'])
+    except sync.ResyncRequired as e:
+        return jsonify({'error': str(e)}), 410
+
+    return jsonify(_payload(result)), 200
+
+@bp.route('/sync/upload', methods=['POST'])
+@login_required
+def push_operations():
+    """
+    Apply queued offline operations in one transaction:
+    {"operations": [{"op_id": "<client uuid>", "type": "register|divide|sell|package", "data": {...}}]}.
+    Each op's data is the body of the matching endpoint (sell also takes
+    batch_id). Operations already applied are replayed from their stored
+    result; if any operation fails nothing is applied.
+    """
+    data = request.get_json() or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': 'operations must be a non-empty list'}), 400
+    if len(operations) > current_app.config['SYNC_MAX_OPERATIONS']:
+        return jsonify({'error': f"At most {current_app.config['SYNC_MAX_OPERATIONS']} operations per upload"}), 400
+
+    results, failure = sync.apply_operations(operations)
+    if failure:
+        return jsonify({
+            'error': f"Operation {failure['op_id']} failed; no operations were applied",
+            'failed': failure
+        }), failure['status']
+
+    log_action(g.user_id, 'SYNC_UPLOAD', 'sync', str(len(operations)))
+
+    return jsonify({
+        'results': results,
+        'sync_token': sync.latest_token()
+    }), 200
@@ -0,0 +1,263 @@
+import heapq
+
+from flask import Blueprint, request, jsonify
+
+from .. import archive, fieldsets, refdata, trace_tokens
+from ..composition import origin_breakdown
+from ..models import TIMELINE_INDEXED_KEYS, Package, QATest
+from ..rawjson import raw
+from ..stock import original_quantity
+from ..streaming import stream_response
+from ..utils import login_required
+
+bp = Blueprint('trace', __name__)
+
+
+TRACE_FIELDS = {
+    'package_details': ('package_id', 'spice_name', 'quantity_kg', 'package_date', 'packaged_by', 'status',
+                        'trace_digest'),
+    'origin_details': ('root_batch_id', 'original_farmer', 'harvest_date', 'farm_location', 'farming_method',
+                       'original_quantity_kg'),
+    'origin_attribution': None,
+    'full_journey': ('timestamp', 'event_type', 'description', 'user', 'location', 'metadata', 'context_id'),
+}
+HISTORY_FIELDS = {
+    'package_info': ('package_id', 'quantity_kg', 'package_type', 'package_date', 'expiry_date', 'status', 'batch'),
+    'history': ('timestamp', 'event_type', 'description', 'location', 'user', 'metadata'),
+}
+
+# Event fields behind each journey/history key
+_EVENT_FIELDS = {
+    'description': ('description',),
+    'user': ('username',),
+    'location': ('location',),
+    'metadata': ('metadata',),
+    'context_id': ('batch_code', 'package_code'),
+}
+
+
+def _event_fields(fieldset):
+    return ['event_type'] + [field for key, fields in _EVENT_FIELDS.items() if fieldset.wants(key) for field in fields]
+
+
+def _journey_event(event):
+    event_data = {
+        'timestamp': event.timestamp.isoformat(),
+        'event_type': event.event_type,
+        'description': event.description,
+        'user': event.username or 'System',
+        'location': event.location,
+        'metadata': raw(event.metadata)
+    }
+    # Add context to know which item the event refers to
+    if event.batch_code:
+        event_data['context_id'] = f"Batch: {event.batch_code}"
+    elif event.package_code:
+        event_data['context_id'] = f"Package: {event.package_code}"
+    return event_data
+
+
+def _history_event(event):
+    event_data = {
+        'timestamp': event.timestamp.isoformat(),
+        'event_type': event.event_type,
+        'description': event.description,
+        'location': event.location,
+        'user': event.username
+    }
+    if event.metadata:
+        event_data['metadata'] = raw(event.metadata)
+    return event_data
+
+
+@bp.route('/trace/<package_id>', methods=['GET'])
+def trace_package_history(package_id):
+    """
+    Provides a complete end-to-end history for a package, tracing it back
+    to its original root batch, even across divisions. ?fields= narrows
+    the response (e.g. fields=package_details.spice_name,full_journey.timestamp)
+    and skips loading whatever was left out.
+    """
+    fieldset = fieldsets.from_request(TRACE_FIELDS)
+    details_fields = fieldset.nested('package_details')
+    journey_fields = fieldset.nested('full_journey')
+    
+    # 1. Find the starting package
+    package = Package.query.filter_by(package_id=package_id).first()
+    if not package:
+        return jsonify({'error': 'Package not found'}), 404
+
+    response = {}
+    
+    # 2. Trace back to the ultimate root batch (unless only the package itself was asked for)
+    if fieldset.wants('origin_details', 'full_journey'):
+        root_batch = package.batch
+        while root_batch.parent_batch:
+            root_batch = root_batch.parent_batch
+
+    # Details of the final product
+    if fieldset.wants('package_details'):
+        package_details = {'package_id': package.package_id}
+        if details_fields.wants('spice_name'):
+            package_details['spice_name'] = refdata.spice_name(package.batch.spice_id)
+        package_details['quantity_kg'] = package.quantity_kg
+        package_details['package_date'] = package.package_date.isoformat()
+        if details_fields.wants('packaged_by'):
+            package_details['packaged_by'] = refdata.username(package.packager_id)
+        package_details['status'] = package.status
+        if details_fields.wants('trace_digest'):
+            # Matches the digest signed into the package's trace token
+            package_details['trace_digest'] = trace_tokens.trace_digest(
+                package.package_id, trace_tokens.lineage(package.batch_id)
+            ).hex()
+        response['package_details'] = details_fields.pick(package_details)
+    
+    # Details of the original harvest
+    if fieldset.wants('origin_details'):
+        origin_fields = fieldset.nested('origin_details')
+        response['origin_details'] = origin_fields.pick({
+            'root_batch_id': root_batch.batch_id,
+            'original_farmer': refdata.username(root_batch.farmer_id) if origin_fields.wants('original_farmer') else None,
+            'harvest_date': root_batch.harvest_date.isoformat(),
+            'farm_location': root_batch.farm_location,
+            'farming_method': root_batch.farming_method,
+            'original_quantity_kg': original_quantity(root_batch) if origin_fields.wants('original_quantity_kg') else None
+        })
+
+    if fieldset.wants('origin_attribution'):
+        response['origin_attribution'] = origin_breakdown(package.batch_id, package.quantity_kg)
+
+    # The full chronological journey
+    if fieldset.wants('full_journey'):
+        # 3. Gather all related batches in the "family" (the root and all its children)
+        family_batch_ids = [root_batch.id]
+        if root_batch.sub_batches:
+            family_batch_ids.extend([sub.id for sub in root_batch.sub_batches])
+        
+        # 4. Collect all timeline events for the package AND the entire batch family
+        # (archived months before the root batch was registered are skipped)
+        all_events = archive.iter_timeline_events(
+            {'batch_id': family_batch_ids, 'package_id': [package.id]},
+            since=root_batch.created_at,
+            fields=_event_fields(journey_fields)
+        )
+        response['full_journey'] = (journey_fields.pick(_journey_event(event)) for event in all_events)
+
+    return stream_response(response)
+
+@bp.route('/fetchhistory/<package_id>', methods=['GET'])
+def fetch_history(package_id):
+    fieldset = fieldsets.from_request(HISTORY_FIELDS)
+    info_fields = fieldset.nested('package_info')
+    history_fields = fieldset.nested('history')
+    
+    package = Package.query.filter_by(package_id=package_id).first()
+    
+    if not package:
+        return jsonify({'error': 'Package not found'}), 404
+    
+    response = {}
+    
+    # Get package and batch details
+    if fieldset.wants('package_info'):
+        package_info = {
+            'package_id': package.package_id,
+            'quantity_kg': package.quantity_kg,
+            'package_type': package.package_type,
+            'package_date': package.package_date.isoformat(),
+            'expiry_date': package.expiry_date.isoformat() if package.expiry_date else None,
+            'status': package.status
+        }
+        if info_fields.wants('batch'):
+            package_info['batch'] = {
+                'batch_id': package.batch.batch_id,
+                'harvest_date': package.batch.harvest_date.isoformat(),
+                'farm_location': package.batch.farm_location,
+                'farming_method': package.batch.farming_method,
+                'spice': refdata.spice_name(package.batch.spice_id),
+                'farmer': refdata.username(package.batch.farmer_id)
+            }
+        response['package_info'] = info_fields.pick(package_info)
+    
+    if fieldset.wants('history'):
+        # Get timeline events for both batch and package
+        since = package.batch.created_at
+        fields = _event_fields(history_fields)
+        batch_events = archive.iter_timeline_events({'batch_id': [package.batch_id]}, since, fields)
+        package_events = archive.iter_timeline_events({'package_id': [package.id]}, since, fields)
+        
+        # Combine and sort events (both are in time order already)
+        all_events = heapq.merge(batch_events, package_events, key=lambda x: x.timestamp)
+        response['history'] = (history_fields.pick(_history_event(event)) for event in all_events)
+    
+    return stream_response(response)
+
+@bp.route('/qr/<package_id>', methods=['GET'])
+def qr_lookup(package_id):
+    """Public endpoint for QR code scanning"""
+    package = Package.query.filter_by(package_id=package_id).first()
+    
+    if not package:
+        return jsonify({'error': 'Package not found'}), 404
+    
+    # Basic package info for consumers
+    package_info = {
+        'package_id': package.package_id,
+        'spice_name': refdata.spice_name(package.batch.spice_id),
+        'quantity_kg': package.quantity_kg,
+        'package_date': package.package_date.isoformat(),
+        'expiry_date': package.expiry_date.isoformat() if package.expiry_date else None,
+        'farm_location': package.batch.farm_location,
+        'farming_method': package.batch.farming_method,
+        'estimated_grade': package.batch.estimated_grade,
+        'trace_token': package.trace_token
+    }
+    
+    # Get latest QA test results
+    latest_qa = QATest.query.filter_by(batch_id=package.batch_id).order_by(
+        QATest.test_date.desc()
+    ).first()
+    
+    if latest_qa:
+        package_info['quality_info'] = {
+            'test_result': latest_qa.test_result,
+            'grade_assigned': latest_qa.grade_assigned,
+            'test_date': latest_qa.test_date.isoformat(),
+            'moisture_content': latest_qa.moisture_content,
+            'purity_percentage': latest_qa.purity_percentage
+        }
+    
+    return jsonify(package_info), 200
+
+
+@bp.route('/timeline', methods=['GET'])
+@login_required
+def timeline_lookup():
+    """
+    Timeline events whose metadata references an id: one of
+    ?transaction_id=, ?test_id= or ?package_id= (the package code).
+    """
+    filters = [(key, request.args[key]) for key in TIMELINE_INDEXED_KEYS if request.args.get(key)]
+    if len(filters) != 1:
+        return jsonify({'error': f"Give exactly one of {', '.join(TIMELINE_INDEXED_KEYS)}"}), 400
+    key, value = filters[0]
+    
+    events = archive.timeline_events({f'metadata.{key}': [value]})
+    return jsonify({'events': [{
+        'timestamp': event.timestamp.isoformat(),
+        'event_type': event.event_type,
+        'description': event.description,
+        'batch_id': event.batch_id,
+        'package_id': event.package_id,
+        'user_id': event.user_id,
+        'location': event.location,
+        'metadata': raw(event.metadata)
+    } for event in events]}), 200
+
+@bp.route('/trace-keys', methods=['GET'])
+def trace_keys():
+    """
+    Public keys for verifying package trace tokens offline. Cache them and
+    refetch when a token names an unknown key id.
+    """
+    return jsonify({'keys': trace_tokens.public_keys()}), 200
@@ -0,0 +1,266 @@
+from flask import Blueprint, g, current_app, request, jsonify
+from sqlalchemy.orm import joinedload
+
+from .. import events, fieldsets, ids, refdata, settlement
+from ..extensions import db
+from ..models import Batches, Package, Transactions
+from ..prices import record_sale
+from ..stock import transfer
+from ..utils import add_timeline_event, login_required, log_action, publish_transaction
+
+bp = Blueprint('transactions', __name__)
+
+
+@bp.route('/transaction', methods=['POST'])
+@login_required
+def create_transaction():
+    data = request.get_json()
+    required_fields = ['to_user_id', 'quantity_kg', 'price_per_kg']
+    
+    for field in required_fields:
+        if field not in data:
+            return jsonify({'error': f'{field} is required'}), 400
+    
+    # Check if batch_id or package_id is provided
+    if not data.get('batch_id') and not data.get('package_id'):
+        return jsonify({'error': 'Either batch_id or package_id is required'}), 400
+    
+    # Verify ownership
+    if data.get('batch_id'):
+        batch = Batches.query.filter_by(id=data['batch_id'], current_owner_id=g.user_id).first()
+        if not batch:
+            return jsonify({'error': 'Batch not found or not owned by user'}), 404
+        if batch.status == 'recalled':
+            return jsonify({'error': 'Batch cannot be sold while recalled'}), 400
+    
+    if data.get('package_id'):
+        package = Package.query.filter_by(id=data['package_id'], current_owner_id=g.user_id).first()
+        if not package:
+            return jsonify({'error': 'Package not found or not owned by user'}), 404
+        if package.status == 'recalled':
+            return jsonify({'error': 'Package cannot be sold while recalled'}), 400
+    
+    # Generate transaction ID
+    transaction_id = ids.new_id('TXN')
+    
+    total_amount = data['quantity_kg'] * data['price_per_kg']
+    
+    transaction = Transactions(
+        transaction_id=transaction_id,
+        from_user_id=g.user_id,
+        to_user_id=data['to_user_id'],
+        batch_id=data.get('batch_id'),
+        package_id=data.get('package_id'),
+        quantity_kg=data['quantity_kg'],
+        price_per_kg=data['price_per_kg'],
+        total_amount=total_amount,
+        transaction_type=data.get('transaction_type', 'sale'),
+        notes=data.get('notes')
+    )
+    
+    db.session.add(transaction)
+    db.session.commit()
+    publish_transaction(transaction, 'transaction_created')
+    
+    # Add timeline event
+    resource_type = 'batch' if data.get('batch_id') else 'package'
+    resource_id = data.get('batch_id') or data.get('package_id')
+    
+    add_timeline_event(
+        batch_id=data.get('batch_id'),
+        package_id=data.get('package_id'),
+        event_type='transaction_created',
+        description=f'Transaction initiated for {resource_type}',
+        user_id=g.user_id,
+        event_metadata={'transaction_id': transaction_id, 'total_amount': total_amount}
+    )
+    
+    log_action(g.user_id, 'TRANSACTION_CREATED', 'transaction', transaction_id)
+    
+    return jsonify({
+        'message': 'Transaction created successfully',
+        'transaction_id': transaction_id,
+        'total_amount': total_amount
+    }), 201
+
+@bp.route('/transaction/<transaction_id>/complete', methods=['POST'])
+@login_required
+def complete_transaction(transaction_id):
+    transaction = Transactions.query.filter_by(transaction_id=transaction_id).first()
+    
+    if not transaction:
+        return jsonify({'error': 'Transaction not found'}), 404
+    
+    if transaction.to_user_id != g.user_id:
+        return jsonify({'error': 'Not authorized to complete this transaction'}), 403
+    
+    if transaction.payment_status == 'completed':
+        return jsonify({'error': 'Transaction already completed'}), 400
+    
+    if transaction.payment_status != 'pending':
+        return jsonify({'error': f'Transaction is {transaction.payment_status}, not pending'}), 400
+    
+    # Update ownership
+    if transaction.batch_id:
+        batch = db.session.get(Batches, transaction.batch_id)
+        transfer(batch, transaction.to_user_id, transaction_id)
+        batch.current_owner_id = transaction.to_user_id
+        batch.status = 'sold'
+    
+    if transaction.package_id:
+        package = db.session.get(Package, transaction.package_id)
+        package.current_owner_id = transaction.to_user_id
+        package.status = 'sold'
+    
+    transaction.payment_status = 'completed'
+    record_sale(transaction)
+    db.session.commit()
+    publish_transaction(transaction, 'transaction_completed')
+    
+    # Add timeline event
+    add_timeline_event(
+        batch_id=transaction.batch_id,
+        package_id=transaction.package_id,
+        event_type='transaction_completed',
+        description=f'Ownership transferred to user {transaction.to_user_id}',
+        user_id=g.user_id,
+        event_metadata={'transaction_id': transaction_id}
+    )
+    
+    log_action(g.user_id, 'TRANSACTION_COMPLETED', 'transaction', transaction_id)
+    
+    return jsonify({'message': 'Transaction completed successfully'}), 200
+
+@bp.route('/transactions/complete', methods=['POST'])
+@login_required
+def settle_transactions():
+    """
+    Complete many pending transactions addressed to the caller at once:
+    {"transaction_ids": [...], "atomic": true}. Returns a result per id.
+    By default one invalid id settles none of them; with "atomic": false
+    the valid ones are completed and the others reported.
+    """
+    data = request.get_json(silent=True) or {}
+    transaction_ids = data.get('transaction_ids')
+    atomic = data.get('atomic', True)
+    limit = current_app.config['SETTLEMENT_MAX_TRANSACTIONS']
+    
+    if (not isinstance(transaction_ids, list) or not transaction_ids
+            or not all(isinstance(code, str) for code in transaction_ids)):
+        return jsonify({'error': 'transaction_ids must be a non-empty list of transaction ids'}), 400
+    if len(transaction_ids) > limit:
+        return jsonify({'error': f'At most {limit} transactions per settlement'}), 400
+    if not isinstance(atomic, bool):
+        return jsonify({'error': 'atomic must be true or false'}), 400
+    
+    try:
+        with events.held() as held:
+            results, settled = settlement.settle(transaction_ids, g.user_id, atomic, request.remote_addr)
+    except settlement.SettlementConflict as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 409
+    db.session.commit()
+    events.send(held)
+    
+    if atomic and not settled:
+        return jsonify({'error': 'No transactions were settled', 'settled': 0, 'results': results}), 400
+    
+    return jsonify({
+        'message': f'{len(settled)} of {len(results)} transactions completed',
+        'settled': len(settled),
+        'results': results
+    }), 200
+
+TRANSACTION_FIELDS = ('transaction_id', 'from_user', 'to_user', 'quantity_kg', 'total_amount', 'transaction_type',
+                      'payment_status', 'transaction_date', 'direction', 'item_type', 'item_id', 'spice_name')
+TRANSACTION_INCLUDES = ('item',)
+
+
+@bp.route('/transactions', methods=['GET'])
+@login_required
+def get_transactions():
+    """
+    The caller's transactions, newest first, paginated. ?fields= picks the
+    keys returned; ?include=item adds the traded batch or package.
+    """
+    fieldset = fieldsets.from_request(TRANSACTION_FIELDS, TRANSACTION_INCLUDES)
+    user_id = g.user_id
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 20, type=int)
+    
+    query = Transactions.query.filter(
+        (Transactions.from_user_id == user_id) | (Transactions.to_user_id == user_id)
+    )
+    # Load only the relationships the requested keys need; names come from
+    # the reference data cache
+    item_fields = fieldset.wants('item_id', 'spice_name') or fieldset.includes('item')
+    if item_fields:
+        query = query.options(joinedload(Transactions.batch),
+                              joinedload(Transactions.package).joinedload(Package.batch))
+    transactions = query.order_by(Transactions.transaction_date.desc()).paginate(
+        page=page, per_page=per_page, error_out=False
+    )
+    
+    names = {}
+    if fieldset.wants('from_user', 'to_user'):
+        names = refdata.usernames([txn.from_user_id for txn in transactions.items] +
+                                  [txn.to_user_id for txn in transactions.items])
+    
+    transactions_list = []
+    for txn in transactions.items:
+        txn_data = {
+            'transaction_id': txn.transaction_id,
+            'quantity_kg': txn.quantity_kg,
+            'total_amount': txn.total_amount,
+            'transaction_type': txn.transaction_type,
+            'payment_status': txn.payment_status,
+            'transaction_date': txn.transaction_date.isoformat(),
+            'direction': 'sent' if txn.from_user_id == user_id else 'received'
+        }
+        if fieldset.wants('from_user'):
+            txn_data['from_user'] = names.get(txn.from_user_id)
+        if fieldset.wants('to_user'):
+            txn_data['to_user'] = names.get(txn.to_user_id)
+        
+        if txn.batch_id:
+            txn_data['item_type'] = 'batch'
+            if item_fields:
+                txn_data['item_id'] = txn.batch.batch_id
+                txn_data['spice_name'] = refdata.spice_name(txn.batch.spice_id)
+        elif txn.package_id:
+            txn_data['item_type'] = 'package'
+            if item_fields:
+                txn_data['item_id'] = txn.package.package_id
+                txn_data['spice_name'] = refdata.spice_name(txn.package.batch.spice_id)
+        txn_data = fieldset.pick(txn_data)
+        
+        if fieldset.includes('item'):
+            if txn.batch_id:
+                txn_data['item'] = {
+                    'id': txn.batch.id,
+                    'batch_id': txn.batch.batch_id,
+                    'quantity_kg': txn.batch.quantity_kg,
+                    'harvest_date': txn.batch.harvest_date.isoformat(),
+                    'farm_location': txn.batch.farm_location,
+                    'estimated_grade': txn.batch.estimated_grade,
+                    'status': txn.batch.status
+                }
+            elif txn.package_id:
+                txn_data['item'] = {
+                    'id': txn.package.id,
+                    'package_id': txn.package.package_id,
+                    'quantity_kg': txn.package.quantity_kg,
+                    'package_type': txn.package.package_type,
+                    'expiry_date': txn.package.expiry_date.isoformat() if txn.package.expiry_date else None,
+                    'status': txn.package.status
+                }
+        
+        transactions_list.append(txn_data)
+    
+    return jsonify({
+        'transactions': transactions_list,
+        'total': transactions.total,
+        'pages': transactions.pages,
+        'current_page': page
+    }), 200
+
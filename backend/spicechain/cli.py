@@ -0,0 +1,101 @@
+import click
+from sqlalchemy import JSON, inspect, text
+from sqlalchemy.schema import CreateColumn, CreateIndex
+
+from .anomalies import anomalies_group
+from .archive import archive_group
+from .bench import bench_group
+from .extensions import db
+from .geo import geo_group
+from .jobs import jobs_group
+from .market import market_group
+from .models import Spices, TraceSigningKey
+from .prices import prices_group
+from .slow_queries import slow_queries_group
+from .snapshot import snapshot_group
+from .stock import stock_group
+from .sync import sync_group
+from .tokens import tokens_group
+from .trace_tokens import rotate_key, trace_tokens_group
+
+
+def upgrade_schema():
+    """Bring an existing database up to the current models: create missing
+    tables, add missing columns and create missing indexes. There is no
+    migration tool, so new columns must be nullable or carry a default."""
+    db.create_all()
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name']: column['type'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {ddl}'))
+                elif (conn.dialect.name == 'postgresql' and isinstance(column.type, JSON)
+                      and not isinstance(existing[column.name], JSON)):
+                    # JSON once lived in TEXT columns; SQLite stores both alike
+                    conn.execute(text(f'ALTER TABLE {table.name} ALTER COLUMN {column.name} '
+                                      f'TYPE JSONB USING {column.name}::jsonb'))
+            # IF NOT EXISTS rather than checkfirst: reflection skips
+            # expression indexes, so checkfirst would try to recreate them
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+# Initialize database function
+def init_database():
+    """Initialize database and add default data"""
+    upgrade_schema()
+    
+    # Add some default spices if none exist
+    if Spices.query.count() == 0:
+        default_spices = [
+            {'name': 'Black Pepper', 'scientific_name': 'Piper nigrum', 'category': 'whole', 
+             'origin_region': 'Idukki, Kerala', 'harvest_season': 'November-February', 'shelf_life_months': 36},
+            {'name': 'Cardamom', 'scientific_name': 'Elettaria cardamomum', 'category': 'whole',
+             'origin_region': 'Idukki, Kerala', 'harvest_season': 'October-December', 'shelf_life_months': 24},
+            {'name': 'Cinnamon', 'scientific_name': 'Cinnamomum verum', 'category': 'whole',
+             'origin_region': 'Kollam, Kerala', 'harvest_season': 'May-July', 'shelf_life_months': 48},
+            {'name': 'Cloves', 'scientific_name': 'Syzygium aromaticum', 'category': 'whole',
+             'origin_region': 'Kottayam, Kerala', 'harvest_season': 'September-December', 'shelf_life_months': 36},
+            {'name': 'Nutmeg', 'scientific_name': 'Myristica fragrans', 'category': 'whole',
+             'origin_region': 'Thrissur, Kerala', 'harvest_season': 'June-August', 'shelf_life_months': 48},
+            {'name': 'Turmeric', 'scientific_name': 'Curcuma longa', 'category': 'ground',
+             'origin_region': 'Erode, Kerala', 'harvest_season': 'January-March', 'shelf_life_months': 24},
+            {'name': 'Ginger', 'scientific_name': 'Zingiber officinale', 'category': 'whole',
+             'origin_region': 'Kozhikode, Kerala', 'harvest_season': 'December-February', 'shelf_life_months': 12}
+        ]
+        
+        for spice_data in default_spices:
+            spice = Spices(**spice_data)
+            db.session.add(spice)
+        
+        db.session.commit()
+        print("Default spices added to database")
+
+    if TraceSigningKey.query.count() == 0:
+        print(f"Trace token signing key {rotate_key()} created")
+
+
+@click.command('init-db')
+def init_db_command():
+    """Create tables and seed the default spices."""
+    init_database()
+
+
+def register_commands(app):
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(anomalies_group)
+    app.cli.add_command(archive_group)
+    app.cli.add_command(bench_group)
+    app.cli.add_command(geo_group)
+    app.cli.add_command(jobs_group)
+    app.cli.add_command(market_group)
+    app.cli.add_command(prices_group)
+    app.cli.add_command(slow_queries_group)
+    app.cli.add_command(snapshot_group)
+    app.cli.add_command(stock_group)
+    app.cli.add_command(sync_group)
+    app.cli.add_command(tokens_group)
+    app.cli.add_command(trace_tokens_group)
@@ -0,0 +1,114 @@
+"""Batch composition graph and origin attribution.
+
+A batch gets its material from its ``parent_batch_id`` (a division, all of
+it from one parent) or from ``BatchComposition`` rows (a merge of several
+lots). Together these form a DAG whose roots are harvested batches.
+
+The fraction of a batch that came from each root is found by loading its
+ancestor edges with one recursive query and pushing the batch's mass down
+the edge list with NumPy, one vectorized step per DAG level, instead of
+enumerating paths. A batch's composition is fixed once it exists, so
+results are memoized per batch without invalidation.
+"""
+from flask import current_app
+
+from .cache import TTLCache
+from .extensions import db
+from .models import BatchComposition, Batches, User
+
+
+def composition_edges():
+    """``(child_id, source_id, quantity_kg)`` for every division and merge
+    edge; divisions carry a nominal quantity since they have one source."""
+    return db.union_all(
+        db.select(Batches.id.label('child_id'), Batches.parent_batch_id.label('source_id'),
+                  db.literal(1.0).label('quantity_kg'))
+        .where(Batches.parent_batch_id.isnot(None)),
+        db.select(BatchComposition.child_batch_id, BatchComposition.source_batch_id,
+                  BatchComposition.quantity_kg)
+    ).subquery('composition_edges')
+
+
+def _ancestor_edges(batch_id):
+    edges = composition_edges()
+    ancestors = db.select(db.literal(batch_id).label('id')).cte('ancestors', recursive=True)
+    ancestors = ancestors.union(
+        db.select(edges.c.source_id).join(ancestors, edges.c.child_id == ancestors.c.id)
+    )
+    edges = composition_edges()
+    return db.session.execute(
+        db.select(edges.c.child_id, edges.c.source_id, edges.c.quantity_kg)
+        .where(edges.c.child_id.in_(db.select(ancestors.c.id)))
+    ).all()
+
+
+def _propagate(batch_id, edges):
+    import numpy as np
+
+    if not edges:
+        return {batch_id: 1.0}
+
+    child, source, quantity = (np.asarray(column) for column in zip(*edges))
+    nodes, index = np.unique(np.concatenate([[batch_id], child, source]), return_inverse=True)
+    child_idx = index[1:len(child) + 1]
+    source_idx = index[len(child) + 1:]
+
+    # Share of each child's material taken from each of its sources
+    intake = np.bincount(child_idx, weights=quantity, minlength=len(nodes))
+    weight = quantity / intake[child_idx]
+    is_root = np.bincount(child_idx, minlength=len(nodes)) == 0
+
+    mass = np.zeros(len(nodes))
+    mass[index[0]] = 1.0
+    share = np.zeros(len(nodes))
+    # Each step moves all in-flight mass one level up the DAG
+    for _ in range(len(nodes)):
+        share += np.where(is_root, mass, 0.0)
+        mass = np.bincount(source_idx, weights=mass[child_idx] * weight, minlength=len(nodes))
+        if not mass.any():
+            break
+    roots = np.flatnonzero(share)
+    return {int(nodes[i]): float(share[i]) for i in roots}
+
+
+def attribution(batch_id):
+    """``{root_batch_id: fraction}`` of the material in ``batch_id``."""
+    cache = current_app.extensions['attribution_cache']
+    shares = cache.get(batch_id)
+    if shares is None:
+        shares = _propagate(batch_id, _ancestor_edges(batch_id))
+        cache.set(batch_id, shares)
+    return shares
+
+
+def origin_breakdown(batch_id, quantity_kg=None):
+    """Farms that contributed to ``batch_id``, largest share first. With
+    ``quantity_kg`` each entry also gets its share of that quantity."""
+    shares = attribution(batch_id)
+    rows = db.session.execute(
+        db.select(Batches.id, Batches.batch_id, Batches.farmer_id, User.username,
+                  Batches.farm_location, Batches.harvest_date)
+        .join(User, User.id == Batches.farmer_id)
+        .where(Batches.id.in_(list(shares)))
+    )
+    farms = {}
+    for row in rows:
+        farm = farms.setdefault((row.farmer_id, row.farm_location), {
+            'farmer_id': row.farmer_id,
+            'farmer': row.username,
+            'farm_location': row.farm_location,
+            'fraction': 0.0,
+            'root_batches': []
+        })
+        farm['fraction'] += shares[row.id]
+        farm['root_batches'].append(row.batch_id)
+    breakdown = sorted(farms.values(), key=lambda farm: farm['fraction'], reverse=True)
+    for farm in breakdown:
+        farm['fraction'] = round(farm['fraction'], 6)
+        if quantity_kg is not None:
+            farm['quantity_kg'] = round(farm['fraction'] * quantity_kg, 3)
+    return breakdown
+
+
+def init_app(app):
+    app.extensions['attribution_cache'] = TTLCache(maxsize=app.config['ATTRIBUTION_CACHE_SIZE'])
@@ -0,0 +1,139 @@
+import os
+
+
+class Config:
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-here')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///spicechain.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Resolved against the working directory in create_app()
+    UPLOAD_FOLDER = None
+    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+
+    CORS_ORIGINS = ["*"]
+
+    # JWT auth (see spicechain.tokens); defaults to SECRET_KEY when unset
+    JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY')
+    JWT_ACCESS_TOKEN_SECONDS = 15 * 60
+    JWT_REFRESH_TOKEN_SECONDS = 7 * 24 * 3600
+    JWT_CACHE_SIZE = 10000
+    JWT_REVOCATION_REFRESH_SECONDS = 10
+    # Keep accepting the signed session cookie for clients not yet on tokens
+    SESSION_AUTH_ENABLED = True
+
+    # Password hashing pool (see spicechain.passwords); 0 workers hashes inline
+    PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_QUEUE = 16
+    PASSWORD_HASH_TIMEOUT = 5
+    LOGIN_IP_ATTEMPT_LIMIT = 30
+    LOGIN_ACCOUNT_FAILURE_LIMIT = 5
+    LOGIN_ATTEMPT_WINDOW_SECONDS = 300
+
+    DASHBOARD_CACHE_SECONDS = 5
+
+    # Origin attributions never change once computed (see spicechain.composition)
+    ATTRIBUTION_CACHE_SIZE = 10000
+
+    # Live event feed (see spicechain.events); None keeps pub/sub in-process
+    EVENT_BROKER_URL = os.environ.get('EVENT_BROKER_URL')
+    EVENT_QUEUE_SIZE = 100
+    EVENT_HEARTBEAT_SECONDS = 15
+
+    # Request/SQL instrumentation (see spicechain.instrumentation)
+    INSTRUMENTATION_ENABLED = True
+    N_PLUS_ONE_THRESHOLD = 5
+    # Requests carrying this header get a Server-Timing breakdown
+    SERVER_TIMING_HEADER = 'X-Server-Timing'
+    PROFILER_ENABLED = os.environ.get('SPICECHAIN_PROFILE') == '1'
+    PROFILER_INTERVAL_MS = 5
+    PROFILE_SLOW_REQUEST_MS = 500
+    PROFILE_DIR = os.path.join(os.getcwd(), 'profiles')
+
+    # Slow-query log (see spicechain.slow_queries); None disables it
+    SLOW_QUERY_MS = 100
+    SLOW_QUERY_EXPLAIN_ANALYZE = False
+    SLOW_QUERY_LOG = os.path.join(os.getcwd(), 'slow_queries.log')
+    SLOW_QUERY_LOG_MAX_BYTES = 10 * 1024 * 1024
+    SLOW_QUERY_LOG_BACKUPS = 5
+
+    # Mass-balance / price anomaly scan (see spicechain.anomalies)
+    ANOMALY_PRICE_Z_THRESHOLD = 3.0
+    ANOMALY_PRICE_MIN_GROUP = 5  # sales per spice and month before prices are scored
+    ANOMALY_MASS_TOLERANCE_KG = 0.001
+
+    # Radius/bounding-box lookups (see spicechain.geo)
+    GEO_MAX_RADIUS_KM = 500
+    GEO_MAX_RESULTS = 1000
+
+    # Offline delta sync (see spicechain.sync)
+    SYNC_PAGE_SIZE = 500  # change rows per /api/sync response
+    SYNC_MAX_OPERATIONS = 100  # per upload
+    # Changes younger than this are held back so that a token never passes
+    # a change whose transaction has not committed yet; must exceed the
+    # longest write transaction and any clock drift between web servers
+    SYNC_VISIBILITY_LAG_SECONDS = 5
+
+    # Signed package trace tokens (see spicechain.trace_tokens)
+    TRACE_KEY_REFRESH_SECONDS = 60  # how soon workers notice key rotations
+
+    # Timeline / audit log archiving (see spicechain.archive). Months kept in
+    # the tables, months archived partitions are kept (None: forever), and
+    # audit actions deleted rather than archived
+    ARCHIVE_DIR = os.path.join(os.getcwd(), 'archive')
+    ARCHIVE_POLICIES = {
+        'timeline': {'hot_months': 12, 'keep_months': None},
+        'audit_log': {'hot_months': 3, 'keep_months': 84, 'discard_actions': ('USER_LOGIN', 'USER_LOGOUT')},
+    }
+    ARCHIVE_ROW_GROUP_SIZE = 4096  # smaller groups let lookups skip more of a file
+
+    # Columnar reporting snapshot (see spicechain.snapshot / spicechain.reports)
+    SNAPSHOT_DIR = os.path.join(os.getcwd(), 'snapshot')
+    REPORT_CACHE_SIZE = 256  # results kept per worker, per snapshot
+
+    # Background jobs (see spicechain.jobs). Worker threads each web process
+    # runs itself; set 0 when `flask jobs worker` processes do the work
+    JOB_LOCAL_WORKERS = 2
+    JOB_POLL_SECONDS = 1.0  # idle workers look for due jobs this often
+    JOB_HEARTBEAT_SECONDS = 5
+    JOB_LEASE_SECONDS = 60  # running jobs without a heartbeat this long are requeued
+    JOB_RETRY_BACKOFF_SECONDS = 30  # doubled on every further attempt
+    JOB_RETRY_MAX_BACKOFF_SECONDS = 3600
+    JOB_OUTPUT_DIR = os.path.join(os.getcwd(), 'job_output')
+
+    # Spice catalogue / username cache (see spicechain.refdata)
+    REFDATA_USER_CACHE_SIZE = 100000
+    REFDATA_CHECK_SECONDS = 5  # how soon other processes notice a rename
+
+    # Batch/package/transaction codes (see spicechain.ids); None draws a
+    # worker id from the database per process
+    ID_WORKER_ID = int(os.environ['SPICECHAIN_WORKER_ID']) if os.environ.get('SPICECHAIN_WORKER_ID') else None
+
+    # Bulk completion of pending transactions (see spicechain.settlement)
+    SETTLEMENT_MAX_TRANSACTIONS = 500
+
+    # Streamed trace and batch history responses (see spicechain.streaming)
+    STREAM_CHUNK_ROWS = 1000  # timeline rows fetched per round trip
+    STREAM_BUFFER_BYTES = 64 * 1024  # body sent in pieces of about this size
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+
+
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SLOW_QUERY_MS = None
+    DASHBOARD_CACHE_SECONDS = 0
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    PASSWORD_HASH_WORKERS = 0
+    JOB_LOCAL_WORKERS = 0
+    SYNC_VISIBILITY_LAG_SECONDS = 0
+
+
+configs = {
+    'default': Config,
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+}
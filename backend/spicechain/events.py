@@ -0,0 +1,157 @@
+"""Live event fan-out.
+
+Writers call ``publish()`` after their commit; subscribers (the SSE stream
+in ``blueprints/live.py``) receive the events for the channels they watch:
+
+* ``user:<id>``       - everything addressed to a user (their transactions)
+* ``batch:<id>``      - timeline events of a batch
+* ``package:<id>``    - timeline events of a package
+
+Channels use primary keys so writers can publish without extra lookups.
+
+The default broker is in-process, which is enough for a single worker.
+Multi-worker deployments set ``EVENT_BROKER_URL`` to a Redis URL so every
+worker sees every event.
+"""
+import itertools
+import json
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g
+
+
+class Subscription:
+    def __init__(self, broker, channels, maxsize):
+        self.broker = broker
+        self.channels = set(channels)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def deliver(self, message):
+        # Never block the publishing request on a slow consumer
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def get(self, timeout):
+        """Next message, or None after ``timeout`` seconds of silence."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """In-process pub/sub: a set of subscriptions per channel."""
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._channels = {}
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(message)
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels, self.queue_size)
+        with self._lock:
+            for channel in subscription.channels:
+                self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._channels.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._channels[channel]
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({id(s) for subs in self._channels.values() for s in subs})
+
+
+class RedisBroker(LocalBroker):
+    """Relays events between workers over Redis pub/sub.
+
+    Local delivery is still done by ``LocalBroker``; one listener thread per
+    process forwards Redis messages into it, so idle subscribers cost no
+    Redis connections.
+    """
+
+    PREFIX = 'spicechain:'
+
+    def __init__(self, url, queue_size=100):
+        try:
+            import redis
+        except ImportError as exc:
+            raise RuntimeError('EVENT_BROKER_URL requires the redis package') from exc
+        super().__init__(queue_size)
+        self._redis = redis.Redis.from_url(url)
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.psubscribe(self.PREFIX + '*')
+        threading.Thread(target=self._listen, name='event-broker', daemon=True).start()
+
+    def publish(self, channel, message):
+        self._redis.publish(self.PREFIX + channel, message)
+
+    def _listen(self):
+        for item in self._pubsub.listen():
+            channel = item['channel'].decode()[len(self.PREFIX):]
+            LocalBroker.publish(self, channel, item['data'].decode())
+
+
+_event_ids = itertools.count(1)
+
+
+def publish(channels, event_type, data):
+    """Send an event to every subscriber of ``channels``."""
+    if g.get('held_events') is not None:
+        g.held_events.append((channels, event_type, data))
+        return
+    broker = current_app.extensions.get('event_broker')
+    if broker is None:
+        return
+    message = json.dumps({
+        'id': next(_event_ids),
+        'type': event_type,
+        'timestamp': time.time(),
+        'data': data
+    }, default=str)
+    for channel in set(channels):
+        broker.publish(channel, message)
+
+
+@contextmanager
+def held():
+    """Collect the events published inside the block instead of sending
+    them; pass the yielded list to ``send()`` once their writes commit."""
+    previous = g.get('held_events')
+    g.held_events = []
+    try:
+        yield g.held_events
+    finally:
+        g.held_events = previous
+
+
+def send(held_events):
+    for channels, event_type, data in held_events:
+        publish(channels, event_type, data)
+
+
+def init_app(app):
+    url = app.config['EVENT_BROKER_URL']
+    queue_size = app.config['EVENT_QUEUE_SIZE']
+    app.extensions['event_broker'] = RedisBroker(url, queue_size) if url else LocalBroker(queue_size)
@@ -0,0 +1,5 @@
+from flask_sqlalchemy import SQLAlchemy
+from flask_cors import CORS
+
+db = SQLAlchemy()
+cors = CORS()
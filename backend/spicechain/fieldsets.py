@@ -0,0 +1,79 @@
+"""Sparse fieldsets and include-expansion for read endpoints.
+
+``?fields=`` lists the keys a client wants back, dotted for the keys of a
+nested object (``fields=package_details.spice_name,full_journey``);
+without it every default key is returned. ``?include=`` asks for related
+objects an endpoint leaves out by default (``include=batch,qa``).
+
+Routes ask the ``FieldSet`` what is wanted *before* loading anything, so
+relationships, joins and lookups nobody asked for are skipped rather than
+computed and thrown away, and included objects come in the same response
+instead of follow-up requests.
+"""
+from flask import request
+
+
+class FieldsetError(ValueError):
+    """A ``fields``/``include`` parameter names something the endpoint
+    does not offer."""
+
+
+class FieldSet:
+    def __init__(self, tree=None, include=()):
+        self.tree = tree  # None: everything; else name -> subtree (None: all of it)
+        self.include = frozenset(include)
+
+    def wants(self, *names):
+        """Whether any of ``names`` is requested."""
+        return self.tree is None or any(name in self.tree for name in names)
+
+    def includes(self, name):
+        return name in self.include
+
+    def nested(self, name):
+        """The fieldset of the nested object ``name``."""
+        return FieldSet(None if self.tree is None else self.tree.get(name))
+
+    def pick(self, data):
+        """``data`` without the keys that were not requested."""
+        if self.tree is None:
+            return data
+        return {key: value for key, value in data.items() if key in self.tree}
+
+
+def _split(value):
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+def from_request(allowed, includes=()):
+    """Parse ``?fields=`` and ``?include=``. ``allowed`` lists an
+    endpoint's keys, or maps each key to the keys of its nested object
+    (None when it has none). Raises ``FieldsetError`` for unknown names."""
+    if not isinstance(allowed, dict):
+        allowed = dict.fromkeys(allowed)
+
+    tree = None
+    if request.args.get('fields'):
+        tree = {}
+        for path in _split(request.args['fields']):
+            name, _, child = path.partition('.')
+            if name not in allowed or (child and child not in (allowed[name] or ())):
+                raise FieldsetError(f'Unknown field {path!r}; fields are {", ".join(_paths(allowed))}')
+            if not child:
+                tree[name] = None
+            elif tree.get(name, {}) is not None:
+                tree.setdefault(name, {})[child] = None
+
+    include = _split(request.args.get('include', ''))
+    unknown = [name for name in include if name not in includes]
+    if unknown:
+        offered = ', '.join(includes) or 'nothing'
+        raise FieldsetError(f'Cannot include {", ".join(unknown)}; this endpoint offers {offered}')
+    return FieldSet(tree, include)
+
+
+def _paths(allowed):
+    for name, children in allowed.items():
+        yield name
+        for child in children or ():
+            yield f'{name}.{child}'
@@ -0,0 +1,176 @@
+"""Geospatial lookups over users and batches.
+
+Coordinates are stored as typed ``latitude``/``longitude`` columns next to
+an indexed ``geo_cell``: the number of the fixed ``CELL_DEGREES`` grid
+square the point falls in, numbered row by row from the south-west corner.
+A bounding box covers a band of cells on each grid row, and each band is a
+contiguous ``geo_cell`` range, so an area query is a handful of index range
+scans followed by an exact check on the few candidate rows.
+
+``User.coordinate`` stays the free-form string clients send; it is parsed
+on signup, and ``flask geo backfill`` parses existing rows and gives
+batches without a location their farmer's coordinates.
+"""
+import math
+import re
+
+import click
+
+from .extensions import db
+from .models import Batches, User
+
+# ~5.5 km squares; changing this requires `flask geo backfill --reindex`
+CELL_DEGREES = 0.05
+COLUMNS = int(round(360 / CELL_DEGREES))
+# Boxes spanning more grid rows than this are scanned as one range; a term
+# per row would outgrow SQLite's expression depth limit (1000)
+MAX_CELL_RANGES = 200
+EARTH_RADIUS_KM = 6371.0088
+
+_NUMBER = r'[-+]?\d+(?:\.\d+)?'
+_COORDINATE = re.compile(rf'^\s*\(?\s*({_NUMBER})\s*[,; ]\s*({_NUMBER})\s*\)?\s*$')
+
+
+def parse_coordinate(text):
+    """``(lat, lon)`` from strings like ``"9.93, 76.26"``, or None."""
+    match = _COORDINATE.match(text or '')
+    if not match:
+        return None
+    point = float(match.group(1)), float(match.group(2))
+    return point if valid(*point) else None
+
+
+def valid(lat, lon):
+    return -90 <= lat <= 90 and -180 <= lon <= 180
+
+
+def cell(lat, lon):
+    row = min(int((lat + 90) // CELL_DEGREES), int(180 / CELL_DEGREES) - 1)
+    column = min(int((lon + 180) // CELL_DEGREES), COLUMNS - 1)
+    return row * COLUMNS + column
+
+
+def locate(obj, lat, lon):
+    """Set the location columns of a user or batch (None clears them)."""
+    obj.latitude, obj.longitude = lat, lon
+    obj.geo_cell = cell(lat, lon) if lat is not None else None
+
+
+def cell_ranges(min_lat, min_lon, max_lat, max_lon):
+    """Inclusive ``geo_cell`` ranges covering the box, one per grid row,
+    or a single range from its first cell to its last for tall boxes."""
+    low, high = cell(min_lat, min_lon), cell(max_lat, max_lon)
+    if high // COLUMNS - low // COLUMNS >= MAX_CELL_RANGES:
+        return [(low, high)]
+    first_column, last_column = low % COLUMNS, high % COLUMNS
+    return [(row * COLUMNS + first_column, row * COLUMNS + last_column)
+            for row in range(low // COLUMNS, high // COLUMNS + 1)]
+
+
+def radius_box(lat, lon, radius_km):
+    """Bounding box of the circle, clipped to the map."""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    # Past the poles every longitude is in range
+    cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 90)))
+    dlon = 180 if cos_lat < 1e-9 else min(math.degrees(radius_km / EARTH_RADIUS_KM / cos_lat), 180)
+    return max(lat - dlat, -90), max(lon - dlon, -180), min(lat + dlat, 90), min(lon + dlon, 180)
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle (haversine) distance."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(math.sqrt(a), 1))
+
+
+def _in_box(model, min_lat, min_lon, max_lat, max_lon):
+    return (
+        db.or_(*[model.geo_cell.between(low, high) for low, high in cell_ranges(min_lat, min_lon, max_lat, max_lon)]),
+        model.latitude.between(min_lat, max_lat),
+        model.longitude.between(min_lon, max_lon)
+    )
+
+
+def _flat_distance(model, lat, lon):
+    """Squared flat-earth distance in degrees, good enough to rank nearby
+    rows and needing no trig functions from the database. (Ordering by an
+    expression also keeps SQLite on the geo_cell index rather than walking
+    the whole table in primary-key order.)"""
+    scale = math.cos(math.radians(lat))
+    dlat, dlon = model.latitude - lat, (model.longitude - lon) * scale
+    return dlat * dlat + dlon * dlon
+
+
+def within_box(model, min_lat, min_lon, max_lat, max_lon, *criteria, limit=100):
+    """Rows of ``model`` (User or Batches) inside the box, nearest to its
+    centre first."""
+    centre = _flat_distance(model, (min_lat + max_lat) / 2, (min_lon + max_lon) / 2)
+    return (model.query.filter(*_in_box(model, min_lat, min_lon, max_lat, max_lon), *criteria)
+            .order_by(centre).limit(limit).all())
+
+
+def within_radius(model, lat, lon, radius_km, *criteria, limit=100):
+    """``[(row, distance_km)]`` for rows within ``radius_km``, nearest
+    first. Candidates come from the circle's bounding box ranked by flat
+    distance; the haversine distance then decides the cut-off."""
+    rows = (model.query.filter(*_in_box(model, *radius_box(lat, lon, radius_km)), *criteria)
+            .order_by(_flat_distance(model, lat, lon)).limit(limit).all())
+    found = [(row, distance_km(lat, lon, row.latitude, row.longitude)) for row in rows]
+    return sorted([(row, distance) for row, distance in found if distance <= radius_km], key=lambda item: item[1])
+
+
+def backfill(reindex=False, chunk_size=10000):
+    """Parse user coordinates and give located farmers' batches a location.
+    ``reindex`` recomputes every stored ``geo_cell``. Returns the counts."""
+    report = {'users': 0, 'batches': 0, 'reindexed': 0}
+    rows = db.session.execute(
+        db.select(User.id, User.coordinate).where(User.coordinate.isnot(None), User.latitude.is_(None))
+    ).all()
+    updates = []
+    for user_id, coordinate in rows:
+        point = parse_coordinate(coordinate)
+        if point:
+            updates.append({'id': user_id, 'latitude': point[0], 'longitude': point[1], 'geo_cell': cell(*point)})
+    for start in range(0, len(updates), chunk_size):
+        db.session.execute(db.update(User), updates[start:start + chunk_size])
+    report['users'] = len(updates)
+
+    if reindex:
+        for model in (User, Batches):
+            rows = db.session.execute(
+                db.select(model.id, model.latitude, model.longitude).where(model.latitude.isnot(None))
+            ).all()
+            for start in range(0, len(rows), chunk_size):
+                db.session.execute(db.update(model), [
+                    {'id': row_id, 'geo_cell': cell(lat, lon)} for row_id, lat, lon in rows[start:start + chunk_size]
+                ])
+            report['reindexed'] += len(rows)
+
+    farmer = db.aliased(User)
+    unlocated = (Batches.latitude.is_(None), Batches.farmer_id == farmer.id, farmer.latitude.isnot(None))
+    report['batches'] = db.session.execute(
+        db.select(db.func.count()).select_from(Batches).join(farmer, farmer.id == Batches.farmer_id)
+        .where(*unlocated)
+    ).scalar()
+    if report['batches']:
+        db.session.execute(
+            db.update(Batches).where(*unlocated)
+            .values(latitude=farmer.latitude, longitude=farmer.longitude, geo_cell=farmer.geo_cell)
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    return report
+
+
+@click.group('geo')
+def geo_group():
+    """Geospatial index maintenance."""
+
+
+@geo_group.command('backfill')
+@click.option('--reindex', is_flag=True, help='Recompute geo_cell for every located row.')
+def backfill_command(reindex):
+    """Parse user coordinates and locate batches from their farmers."""
+    report = backfill(reindex)
+    click.echo(f"located {report['users']} users and {report['batches']} batches"
+               + (f"; reindexed {report['reindexed']} rows" if reindex else ''))
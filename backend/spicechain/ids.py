@@ -0,0 +1,151 @@
+"""Batch, package, transaction and QA test identifiers.
+
+Codes keep their readable form, ``BATCH_20261019_0MJ39EP6R0000``: a
+prefix, the UTC date, and a 13-character Crockford base32 encoding of a
+64-bit Snowflake-style number: milliseconds since 2024 (41 bits),
+the process's worker id (10 bits) and a per-millisecond sequence (12
+bits). Codes from one process never repeat and always increase, codes
+from processes with different worker ids never collide, and since every
+part is fixed width, codes sort in the order they were issued. New rows
+therefore land at the right-hand end of the unique indexes instead of at
+random pages.
+
+Each process draws the next worker id from the ``ids:worker`` watermark
+the first time it needs a code, and a forked child draws its own. Ids
+wrap at 1024, so deployments that start more processes than that over
+the lifetime of one of them give every process its own ``ID_WORKER_ID``
+instead (which makes forking servers unsuitable for that setting).
+``new_ids(prefix, n)`` hands out ``n`` codes under one lock acquisition
+for divisions and other bulk inserts.
+"""
+import base64
+import functools
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from .extensions import db
+from .models import Watermark
+
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z; 41 bits of milliseconds last until 2093
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKERS = 1 << WORKER_BITS
+_SEQUENCES = 1 << SEQUENCE_BITS
+
+# Standard base32 digits mapped onto Crockford's, whose ASCII order is
+# their numeric order
+_TO_CROCKFORD = bytes.maketrans(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ234567', b'0123456789ABCDEFGHJKMNPQRSTVWXYZ')
+_WIDTH = 13  # ceil(64 / 5)
+_UNIX_EPOCH = date(1970, 1, 1)
+_WORKER_WATERMARK = 'ids:worker'
+
+
+def encode(value):
+    """The 64 bits of ``value`` as fixed-width Crockford base32."""
+    return base64.b32encode(value.to_bytes(8, 'big'))[:_WIDTH].translate(_TO_CROCKFORD).decode()
+
+
+def issued_at(value):
+    """When the number ``value`` was allocated (UTC)."""
+    ms = (value >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS
+    return datetime.fromtimestamp(ms / 1000, timezone.utc).replace(tzinfo=None)
+
+
+@functools.lru_cache(maxsize=8)
+def _day(days):
+    return (_UNIX_EPOCH + timedelta(days=days)).strftime('%Y%m%d')
+
+
+class IdGenerator:
+    def __init__(self, worker_id, clock=time.time):
+        if not 0 <= worker_id < MAX_WORKERS:
+            raise ValueError(f'worker id must be in 0..{MAX_WORKERS - 1}')
+        self.worker_id = worker_id
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._next_sequence = 0
+
+    def allocate(self, n=1):
+        """``n`` increasing numbers. When the clock steps back or a
+        millisecond's sequence runs out, numbering carries on from the
+        next millisecond rather than waiting for the clock."""
+        numbers = []
+        with self._lock:
+            now = int(self._clock() * 1000) - EPOCH_MS
+            if now > self._last_ms:
+                self._last_ms, self._next_sequence = now, 0
+            while len(numbers) < n:
+                if self._next_sequence == _SEQUENCES:
+                    self._last_ms, self._next_sequence = self._last_ms + 1, 0
+                take = min(n - len(numbers), _SEQUENCES - self._next_sequence)
+                base = (self._last_ms << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS)
+                numbers.extend(range(base + self._next_sequence, base + self._next_sequence + take))
+                self._next_sequence += take
+        return numbers
+
+
+def _claim_worker_id():
+    # On its own connection: the caller's session may be mid-transaction
+    for _ in range(3):
+        try:
+            with db.engine.begin() as conn:
+                bumped = conn.execute(
+                    db.update(Watermark).where(Watermark.name == _WORKER_WATERMARK)
+                    .values(last_id=Watermark.last_id + 1, updated_at=datetime.utcnow())
+                ).rowcount
+                if not bumped:
+                    conn.execute(db.insert(Watermark).values(name=_WORKER_WATERMARK, last_id=0,
+                                                             updated_at=datetime.utcnow()))
+                worker_id = conn.execute(
+                    db.select(Watermark.last_id).where(Watermark.name == _WORKER_WATERMARK)
+                ).scalar()
+            return worker_id % MAX_WORKERS
+        except IntegrityError:
+            # Another process created the row first
+            continue
+    raise RuntimeError('could not claim an id worker id')
+
+
+def generator():
+    """This process's generator, created on first use."""
+    state = current_app.extensions['ids']
+    gen = state['generator']
+    if gen is None:
+        with state['lock']:
+            gen = state['generator']
+            if gen is None:
+                worker_id = current_app.config['ID_WORKER_ID']
+                gen = state['generator'] = IdGenerator(_claim_worker_id() if worker_id is None else worker_id)
+    return gen
+
+
+def _code(prefix, number):
+    day = ((number >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS) // 86400000
+    return f'{prefix}_{_day(day)}_{encode(number)}'
+
+
+def new_id(prefix):
+    """A new code such as ``new_id('PKG')``."""
+    return _code(prefix, generator().allocate()[0])
+
+
+def new_ids(prefix, n):
+    """``n`` new codes, in increasing order."""
+    return [_code(prefix, number) for number in generator().allocate(n)]
+
+
+def init_app(app):
+    state = app.extensions['ids'] = {'generator': None, 'lock': threading.Lock()}
+
+    def forget_generator():
+        # A forked worker must not carry on its parent's sequence
+        state['generator'] = None
+        state['lock'] = threading.Lock()
+
+    os.register_at_fork(after_in_child=forget_generator)
@@ -0,0 +1,75 @@
+"""Harvest photos.
+
+``register_batch`` only spools the upload into ``UPLOAD_FOLDER/incoming``
+under a unique name and queues a ``harvest_image`` job. The job checks
+that the file really is a PNG or JPEG (by its leading bytes, not its
+name), names it after the batch so two farmers' ``IMG_0001.jpg`` cannot
+overwrite each other, moves it into ``UPLOAD_FOLDER`` and sets
+``Batches.harvest_image``. Files that are not images are deleted and the
+batch keeps no photo. Job workers must share ``UPLOAD_FOLDER`` with the
+web processes (local mode, or ``flask jobs worker`` on the same host).
+"""
+import os
+import uuid
+
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+from . import jobs
+from .extensions import db
+from .models import Batches
+
+# Leading bytes of each accepted format, and the extension it is stored with
+FORMATS = {
+    '.png': b'\x89PNG\r\n\x1a\n',
+    '.jpg': b'\xff\xd8\xff',
+}
+
+
+def _incoming():
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'incoming')
+
+
+def url(filename):
+    return f'/uploads/harvests/{filename}'
+
+
+def spool(file):
+    """Save an uploaded file for a ``harvest_image`` job; returns its name."""
+    directory = _incoming()
+    os.makedirs(directory, exist_ok=True)
+    name = f'{uuid.uuid4().hex}_{secure_filename(file.filename)}'
+    file.save(os.path.join(directory, name))
+    return name
+
+
+def _format(path):
+    with open(path, 'rb') as f:
+        head = f.read(8)
+    return next((extension for extension, signature in FORMATS.items() if head.startswith(signature)), None)
+
+
+@jobs.task('harvest_image')
+def process(batch_id, upload):
+    """Check a spooled upload and attach it to its batch."""
+    path = os.path.join(_incoming(), upload)
+    batch = db.session.get(Batches, batch_id)
+    if batch is None:
+        os.remove(path)
+        return {'harvest_image': None, 'rejected': 'batch no longer exists'}
+    if not os.path.exists(path):
+        # A retry after the move whose commit failed
+        for extension in FORMATS:
+            if os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], batch.batch_id + extension)):
+                batch.harvest_image = url(batch.batch_id + extension)
+                return {'harvest_image': batch.harvest_image}
+        raise FileNotFoundError(path)
+
+    extension = _format(path)
+    if extension is None:
+        os.remove(path)
+        return {'harvest_image': None, 'rejected': 'not a PNG or JPEG image'}
+    filename = batch.batch_id + extension
+    os.replace(path, os.path.join(current_app.config['UPLOAD_FOLDER'], filename))
+    batch.harvest_image = url(filename)
+    return {'harvest_image': batch.harvest_image}
@@ -0,0 +1,260 @@
+"""Per-request timing and SQL instrumentation.
+
+Every request gets a ``RequestStats`` on ``flask.g`` that SQLAlchemy cursor
+events fill in (query count, DB time, statements) and an ORM ``load`` hook
+counts fetched rows. After each response the numbers are folded into the
+app's ``Metrics`` (``app.extensions['metrics']``), served in Prometheus
+text format from ``/metrics``.
+"""
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import Blueprint, Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint('metrics', __name__)
+
+# Upper bounds (seconds) of the request duration histogram
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+
+def normalize_statement(statement):
+    """Collapse literals and IN-lists so repeated shapes compare equal."""
+    statement = _LITERALS.sub('?', statement)
+    statement = _IN_LISTS.sub('(?)', statement)
+    return ' '.join(statement.split())
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_seconds = 0.0
+        self.query_count = 0
+        self.rows = 0
+        self.statements = Counter()
+
+    def n_plus_one(self, threshold):
+        """Statements executed at least ``threshold`` times in this request."""
+        return {stmt: n for stmt, n in self.statements.items() if n >= threshold}
+
+
+class Metrics:
+    """Counters keyed by endpoint, one set per app. Each worker process
+    keeps its own; Prometheus sums them when scraping every worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = Counter()
+            self.duration_sum = Counter()
+            self.duration_buckets = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+            self.db_seconds = Counter()
+            self.queries = Counter()
+            self.rows = Counter()
+            self.n_plus_one = Counter()
+
+    def observe(self, endpoint, method, status, duration, stats, n_plus_one):
+        with self._lock:
+            self.requests[(endpoint, method, status)] += 1
+            self.duration_sum[endpoint] += duration
+            buckets = self.duration_buckets[endpoint]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    buckets[i] += 1
+            self.db_seconds[endpoint] += stats.db_seconds
+            self.queries[endpoint] += stats.query_count
+            self.rows[endpoint] += stats.rows
+            self.n_plus_one[endpoint] += len(n_plus_one)
+
+    def render(self):
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            family('spicechain_requests_total', 'counter', 'Requests handled, by endpoint, method and status.')
+            for (endpoint, method, status), n in sorted(self.requests.items()):
+                lines.append(f'spicechain_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {n}')
+
+            family('spicechain_request_duration_seconds', 'histogram', 'Wall time per request.')
+            for endpoint in sorted(self.duration_sum):
+                count = sum(n for (ep, _, _), n in self.requests.items() if ep == endpoint)
+                for bound, n in zip(DURATION_BUCKETS, self.duration_buckets[endpoint]):
+                    lines.append(f'spicechain_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {n}')
+                lines.append(f'spicechain_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {count}')
+                lines.append(f'spicechain_request_duration_seconds_sum{{endpoint="{endpoint}"}} {self.duration_sum[endpoint]:.6f}')
+                lines.append(f'spicechain_request_duration_seconds_count{{endpoint="{endpoint}"}} {count}')
+
+            for name, counter, help_text in (
+                ('spicechain_db_seconds_total', self.db_seconds, 'Time spent executing SQL.'),
+                ('spicechain_db_queries_total', self.queries, 'SQL statements executed.'),
+                ('spicechain_db_rows_total', self.rows, 'ORM rows loaded.'),
+                ('spicechain_n_plus_one_total', self.n_plus_one, 'Statements repeated past the N+1 threshold.'),
+            ):
+                family(name, 'counter', help_text)
+                for endpoint, value in sorted(counter.items()):
+                    lines.append(f'{name}{{endpoint="{endpoint}"}} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+class StackSampler:
+    """Samples the Python stacks of registered request threads on a single
+    background thread, producing collapsed stacks for flamegraph.pl /
+    speedscope."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._thread = None
+
+    def start(self, thread_id):
+        with self._lock:
+            self._samples[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._samples.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, samples in self._samples.items():
+                    frame = frames.get(thread_id)
+                    if frame is None:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                        frame = frame.f_back
+                    samples[';'.join(reversed(stack))] += 1
+
+
+def _dump_profile(app, endpoint, duration, samples):
+    folder = app.config['PROFILE_DIR']
+    os.makedirs(folder, exist_ok=True)
+    filename = f"{time.strftime('%Y%m%dT%H%M%S')}_{endpoint}_{int(duration * 1000)}ms.folded"
+    with open(os.path.join(folder, filename), 'w') as fh:
+        for stack, count in samples.items():
+            fh.write(f'{stack} {count}\n')
+
+
+def _stats():
+    if has_request_context():
+        return g.get('_request_stats')
+    return None
+
+
+# The start time lives on the execution context rather than the pooled
+# connection, so a statement that raises leaves nothing behind
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_started', None)
+    stats = _stats()
+    if stats is not None:
+        if started is not None:
+            stats.db_seconds += time.perf_counter() - started
+        stats.query_count += 1
+        stats.statements[normalize_statement(statement)] += 1
+
+
+def _on_load(target, context):
+    stats = _stats()
+    if stats is not None:
+        stats.rows += 1
+
+
+def _before_request():
+    g._request_stats = RequestStats()
+    sampler = current_app.extensions.get('stack_sampler')
+    if sampler is not None:
+        sampler.start(threading.get_ident())
+
+
+def _after_request(response):
+    stats = g.get('_request_stats')
+    if stats is None:
+        return response
+    config = current_app.config
+    duration = time.perf_counter() - stats.started
+    endpoint = request.endpoint or 'unmatched'
+
+    n_plus_one = stats.n_plus_one(config['N_PLUS_ONE_THRESHOLD'])
+    for statement, count in n_plus_one.items():
+        logger.warning('N+1 suspected in %s: %d x %s', endpoint, count, statement)
+
+    if endpoint != 'metrics.prometheus_metrics':
+        current_app.extensions['metrics'].observe(endpoint, request.method, response.status_code, duration,
+                                                  stats, n_plus_one)
+
+    if config['SERVER_TIMING_HEADER'] and request.headers.get(config['SERVER_TIMING_HEADER']):
+        app_ms = (duration - stats.db_seconds) * 1000
+        response.headers['Server-Timing'] = (
+            f'db;dur={stats.db_seconds * 1000:.2f};desc="{stats.query_count} queries, {stats.rows} rows", '
+            f'app;dur={app_ms:.2f}, total;dur={duration * 1000:.2f}'
+        )
+
+    sampler = current_app.extensions.get('stack_sampler')
+    if sampler is not None:
+        samples = sampler.stop(threading.get_ident())
+        if samples and duration * 1000 >= config['PROFILE_SLOW_REQUEST_MS']:
+            _dump_profile(current_app, endpoint, duration, samples)
+    return response
+
+
+def _teardown_request(exc):
+    # after_request is skipped when a view raises; don't leak sampler slots
+    sampler = current_app.extensions.get('stack_sampler')
+    if sampler is not None:
+        sampler.stop(threading.get_ident())
+
+
+@bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(current_app.extensions['metrics'].render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    from .extensions import db
+
+    if not app.config['INSTRUMENTATION_ENABLED']:
+        return
+    app.extensions['metrics'] = Metrics()
+    if not event.contains(db.Model, 'load', _on_load):
+        event.listen(db.Model, 'load', _on_load, propagate=True)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    if app.config['PROFILER_ENABLED']:
+        app.extensions['stack_sampler'] = StackSampler(app.config['PROFILER_INTERVAL_MS'] / 1000)
+    app.register_blueprint(bp)
@@ -0,0 +1,322 @@
+"""Background jobs.
+
+Work too slow for a request (recall reports, snapshot and anomaly runs) is
+queued as a ``Job`` row and executed by job workers. The queue is the
+database itself, so there is no broker to run: ``flask jobs worker``
+starts a dedicated worker process, and with ``JOB_LOCAL_WORKERS`` set each
+web process also runs that many worker threads of its own (the local
+mode, enough for a single-machine deployment).
+
+Code registers a job kind with ``@task('name')`` and queues it with
+``enqueue('name', {...})``; the payload is passed to the function as
+keyword arguments and whatever JSON it returns becomes the job's result.
+The job is marked succeeded in the same transaction as the function's own
+uncommitted writes. A function that raises is retried up to
+``max_attempts`` times with exponential backoff. Long jobs report
+``progress()``, which the worker's heartbeat thread writes out together
+with the heartbeat, so reporting never waits on the database.
+
+Workers claim a job with a conditional UPDATE, so any number of them can
+share the queue. A running job whose heartbeat is older than
+``JOB_LEASE_SECONDS`` belonged to a worker that died; it is requeued (or
+failed, once out of attempts).
+"""
+import contextvars
+import json
+import os
+import random
+import signal
+import socket
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy.exc import OperationalError
+
+from .extensions import db
+from .models import Job
+
+FINISHED = ('succeeded', 'failed', 'cancelled')
+
+_tasks = {}
+_current = contextvars.ContextVar('job', default=None)
+
+
+def task(kind, max_attempts=3):
+    """Register the decorated function as the job kind ``kind``."""
+    def register(fn):
+        _tasks[kind] = (fn, max_attempts)
+        return fn
+    return register
+
+
+def enqueue(kind, payload=None, user_id=None, priority=0, delay=0, max_attempts=None):
+    """Add a job to the session; it is queued when the caller commits."""
+    if kind not in _tasks:
+        raise ValueError(f'Unknown job kind {kind!r}')
+    job = Job(
+        kind=kind,
+        payload=payload or None,
+        user_id=user_id,
+        priority=priority,
+        run_at=datetime.utcnow() + timedelta(seconds=delay),
+        max_attempts=max_attempts or _tasks[kind][1]
+    )
+    db.session.add(job)
+    db.session.flush()
+    return job
+
+
+def progress(fraction, message=None):
+    """Record how far the running job is (``fraction`` in 0..1). A no-op
+    outside a job, so task functions can also be called directly."""
+    state = _current.get()
+    if state is not None:
+        state['progress'] = max(0.0, min(1.0, fraction))
+        state['message'] = message[:200] if message else None
+
+
+def output_path(suffix):
+    """A file for the running job to write its output to, under
+    ``JOB_OUTPUT_DIR``; return its name in the result as ``output``."""
+    directory = current_app.config['JOB_OUTPUT_DIR']
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"job_{_current.get()['id']}{suffix}")
+
+
+def cancel(job_id):
+    """Cancel a job that has not started. Returns whether it was queued."""
+    cancelled = db.session.execute(
+        db.update(Job).where(Job.id == job_id, Job.status == 'queued')
+        .values(status='cancelled', finished_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    return bool(cancelled)
+
+
+def backoff(attempts):
+    """Seconds before retry number ``attempts``: doubling from
+    ``JOB_RETRY_BACKOFF_SECONDS``, capped, with jitter so jobs that
+    failed together do not retry together."""
+    config = current_app.config
+    delay = min(config['JOB_RETRY_BACKOFF_SECONDS'] * 2 ** (attempts - 1), config['JOB_RETRY_MAX_BACKOFF_SECONDS'])
+    return delay * random.uniform(0.8, 1.2)
+
+
+def claim(worker):
+    """Mark the next due job running for ``worker`` and return it, or None."""
+    now = datetime.utcnow()
+    candidate = (
+        db.select(Job.id)
+        .where(Job.status == 'queued', Job.run_at <= now)
+        .order_by(Job.priority.desc(), Job.run_at, Job.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    # Another worker may take the candidate between the SELECT and the
+    # UPDATE (SQLite has no row locks); the status check makes that a miss
+    for _ in range(5):
+        job_id = db.session.execute(candidate).scalar()
+        if job_id is None:
+            db.session.rollback()
+            return None
+        claimed = db.session.execute(
+            db.update(Job).where(Job.id == job_id, Job.status == 'queued').values(
+                status='running', worker=worker, attempts=Job.attempts + 1,
+                started_at=now, heartbeat_at=now, progress=None, progress_message=None
+            )
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+    return None
+
+
+def recover_expired():
+    """Requeue (or fail) running jobs whose worker stopped heartbeating."""
+    now = datetime.utcnow()
+    expired = db.and_(Job.status == 'running',
+                      Job.heartbeat_at < now - timedelta(seconds=current_app.config['JOB_LEASE_SECONDS']))
+    requeued = db.session.execute(
+        db.update(Job).where(expired, Job.attempts < Job.max_attempts)
+        .values(status='queued', worker=None, run_at=now, error='Worker lost')
+    ).rowcount
+    failed = db.session.execute(
+        db.update(Job).where(expired)
+        .values(status='failed', worker=None, finished_at=now, error='Worker lost')
+    ).rowcount
+    db.session.commit()
+    return requeued, failed
+
+
+def execute(job, state=None):
+    """Run a claimed job and record how it ended."""
+    job_id = job.id
+    state = state if state is not None else {}
+    state.update(id=job_id, progress=None, message=None)
+    token = _current.set(state)
+    try:
+        fn, _ = _tasks[job.kind]
+        result = fn(**(job.payload or {}))
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('Job %s (%s) failed', job_id, job.kind)
+        job = db.session.get(Job, job_id)
+        job.error = traceback.format_exc()[-4000:]
+        job.worker = None
+        if job.attempts < job.max_attempts:
+            job.status = 'queued'
+            job.run_at = datetime.utcnow() + timedelta(seconds=backoff(job.attempts))
+        else:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+    else:
+        # Not rolled back: the job's own pending writes commit with its status
+        job = db.session.get(Job, job_id)
+        job.status = 'succeeded'
+        job.result = result
+        job.error = None
+        job.progress = 1.0
+        job.progress_message = state['message']
+        job.worker = None
+        job.finished_at = datetime.utcnow()
+    finally:
+        _current.reset(token)
+    db.session.commit()
+    return job
+
+
+class Worker:
+    """``concurrency`` threads taking jobs off the queue, plus a heartbeat
+    thread that keeps their leases and progress up to date."""
+
+    def __init__(self, app, concurrency):
+        self.app = app
+        self.concurrency = concurrency
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self._stop = threading.Event()
+        self._running = {}  # thread name -> state of its current job
+        self._threads = []
+
+    def start(self):
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._loop, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True).start()
+
+    def stop(self, timeout=None):
+        """Stop taking jobs and wait for the ones running to finish."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _loop(self):
+        poll = self.app.config['JOB_POLL_SECONDS']
+        worker = f'{self.name}:{threading.current_thread().name}'
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    job = claim(worker)
+                    if job is not None:
+                        state = self._running[worker] = {}
+                        try:
+                            execute(job, state)
+                        finally:
+                            del self._running[worker]
+                except Exception:
+                    # Typically a locked SQLite file; a job left running is
+                    # picked up again once its lease expires
+                    db.session.rollback()
+                    current_app.logger.exception('Job worker error')
+                    job = None
+                finally:
+                    db.session.remove()
+            if job is None:
+                self._stop.wait(poll)
+
+    def _heartbeat(self):
+        interval = self.app.config['JOB_HEARTBEAT_SECONDS']
+        while not self._stop.wait(interval):
+            with self.app.app_context():
+                # A separate connection: the jobs' own sessions may be mid-transaction
+                try:
+                    with db.engine.begin() as conn:
+                        for state in list(self._running.values()):
+                            if 'id' in state:
+                                conn.execute(db.update(Job).where(Job.id == state['id'], Job.status == 'running').values(
+                                    heartbeat_at=datetime.utcnow(), progress=state['progress'],
+                                    progress_message=state['message']
+                                ))
+                    recover_expired()
+                except OperationalError:
+                    db.session.rollback()
+                    current_app.logger.warning('Job heartbeat failed', exc_info=True)
+                finally:
+                    db.session.remove()
+
+
+def init_app(app):
+    lock = threading.Lock()
+
+    @app.before_request
+    def start_local_workers():
+        # Started on the first request rather than in create_app, so CLI
+        # commands and test apps never spawn worker threads
+        if 'job_worker' in app.extensions or not app.config['JOB_LOCAL_WORKERS']:
+            return
+        with lock:
+            if 'job_worker' not in app.extensions:
+                worker = Worker(app, app.config['JOB_LOCAL_WORKERS'])
+                worker.start()
+                app.extensions['job_worker'] = worker
+
+
+@click.group('jobs')
+def jobs_group():
+    """Background job queue."""
+
+
+@jobs_group.command('worker')
+@click.option('--concurrency', default=4, show_default=True, help='Jobs run at once.')
+def worker_command(concurrency):
+    """Run jobs until interrupted; running jobs finish first."""
+    worker = Worker(current_app._get_current_object(), concurrency)
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopping.set())
+    worker.start()
+    click.echo(f'{worker.name}: {concurrency} workers for {", ".join(sorted(_tasks))}')
+    stopping.wait()
+    click.echo('finishing running jobs...')
+    worker.stop()
+
+
+@jobs_group.command('enqueue')
+@click.argument('kind')
+@click.option('--payload', default=None, help='Keyword arguments as a JSON object.')
+@click.option('--priority', default=0, show_default=True)
+def enqueue_command(kind, payload, priority):
+    """Queue a job, e.g. from cron: ``flask jobs enqueue snapshot``."""
+    job = enqueue(kind, json.loads(payload) if payload else None, priority=priority)
+    db.session.commit()
+    click.echo(f'job {job.id} queued')
+
+
+@jobs_group.command('purge')
+@click.option('--days', default=30, show_default=True, help='Keep finished jobs this many days.')
+def purge_command(days):
+    """Delete finished jobs, and their output files, older than ``--days``."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    finished = db.and_(Job.status.in_(FINISHED), Job.finished_at < cutoff)
+    for result in db.session.execute(db.select(Job.result).where(finished)).scalars():
+        if result and isinstance(result, dict) and result.get('output'):
+            try:
+                os.remove(os.path.join(current_app.config['JOB_OUTPUT_DIR'], result['output']))
+            except FileNotFoundError:
+                pass
+    deleted = db.session.execute(db.delete(Job).where(finished)).rowcount
+    db.session.commit()
+    click.echo(f'{deleted} jobs deleted')
@@ -0,0 +1,211 @@
+"""Marketplace index of purchasable stock.
+
+``MarketListing`` holds one row per batch a buyer could purchase right
+now: a listed status and stock left on the ledger. Its composite indexes
+put the equality filters (spice, grade, farming method) ahead of each sort
+column, so a filtered, sorted page is an index range read however many
+listings exist. ``MarketFacet`` keeps listing counts and kg per spice,
+grade and farming method, adjusted with relative UPDATEs as listings come
+and go, so facet counts never scan the listings.
+
+Listings are re-derived from ``Batches`` and ``BatchStock`` just before
+each commit, for the batches the transaction touched: ORM changes to a
+batch (status, owner, grade, ...) are picked up by mapper events, and
+ledger movements by ``spicechain.stock``. Set-based writers call ``sync()``
+themselves. ``flask market rebuild`` recomputes everything.
+"""
+import click
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from .extensions import db
+from .models import BatchStock, Batches, MarketFacet, MarketListing, Spices, User
+
+# Statuses a seller can still sell from; see get_available_batches
+LISTED_STATUSES = ('harvested', 'tested', 'divided', 'merged', 'packaged')
+SORTS = {
+    'harvest_date': (MarketListing.harvest_date, MarketListing.batch_id),
+    '-harvest_date': (MarketListing.harvest_date.desc(), MarketListing.batch_id.desc()),
+    'quantity_kg': (MarketListing.quantity_kg, MarketListing.batch_id),
+    '-quantity_kg': (MarketListing.quantity_kg.desc(), MarketListing.batch_id.desc()),
+}
+FACETS = {
+    'spice_id': MarketFacet.spice_id,
+    'grade': MarketFacet.grade,
+    'farming_method': MarketFacet.farming_method,
+}
+
+_DIRTY = 'market_dirty_batches'
+
+
+def touch(batch_ids):
+    """Queue batches for re-listing when the current transaction commits."""
+    db.session.info.setdefault(_DIRTY, set()).update(batch_ids)
+
+
+@event.listens_for(Batches, 'after_insert')
+@event.listens_for(Batches, 'after_update')
+def _batch_written(mapper, connection, batch):
+    object_session(batch).info.setdefault(_DIRTY, set()).add(batch.id)
+
+
+@event.listens_for(Session, 'before_commit')
+def _sync_dirty(session):
+    # Flush first so pending batch changes reach the mapper events above
+    session.flush()
+    dirty = session.info.pop(_DIRTY, None)
+    if dirty:
+        dirty = list(dirty)
+        for start in range(0, len(dirty), 500):
+            sync(Batches.id.in_(dirty[start:start + 500]), session)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_dirty(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop(_DIRTY, None)
+
+
+def _listable(criteria):
+    from .stock import EPSILON
+
+    quantity = db.func.coalesce(BatchStock.quantity_kg, Batches.quantity_kg)
+    return (
+        db.select(Batches.id, Batches.current_owner_id, Batches.spice_id,
+                  db.func.coalesce(Batches.estimated_grade, ''), db.func.coalesce(Batches.farming_method, ''),
+                  quantity, Batches.harvest_date)
+        .outerjoin(BatchStock, BatchStock.batch_id == Batches.id)
+        .where(criteria, Batches.status.in_(LISTED_STATUSES), quantity > EPSILON)
+    )
+
+
+def _adjust_facet(session, spice_id, grade, farming_method, listings, quantity_kg):
+    key = (MarketFacet.spice_id == spice_id, MarketFacet.grade == grade, MarketFacet.farming_method == farming_method)
+    updated = session.execute(
+        db.update(MarketFacet).where(*key).values(
+            listings=MarketFacet.listings + listings,
+            quantity_kg=MarketFacet.quantity_kg + quantity_kg
+        ).execution_options(synchronize_session=False)
+    ).rowcount
+    if not updated:
+        session.execute(db.insert(MarketFacet).values(
+            spice_id=spice_id, grade=grade, farming_method=farming_method, listings=listings, quantity_kg=quantity_kg
+        ))
+
+
+def sync(criteria, session=None):
+    """Re-derive the listings of the batches matching ``criteria`` (a
+    condition on ``Batches``) and move the facet counts by the difference."""
+    session = session or db.session
+    batch_ids = db.select(Batches.id).where(criteria)
+    facet = (MarketListing.spice_id, MarketListing.grade, MarketListing.farming_method, MarketListing.quantity_kg)
+    removed = session.execute(
+        db.delete(MarketListing).where(MarketListing.batch_id.in_(batch_ids)).returning(*facet)
+        .execution_options(synchronize_session=False)
+    ).all()
+    added = session.execute(db.insert(MarketListing).from_select(
+        ['batch_id', 'owner_id', 'spice_id', 'grade', 'farming_method', 'quantity_kg', 'harvest_date'],
+        _listable(criteria)
+    ).returning(*facet)).all()
+
+    deltas = {}
+    for sign, rows in ((-1, removed), (1, added)):
+        for spice_id, grade, farming_method, quantity in rows:
+            counts = deltas.setdefault((spice_id, grade, farming_method), [0, 0.0])
+            counts[0] += sign
+            counts[1] += sign * quantity
+    for key, (listings, quantity) in deltas.items():
+        if listings or abs(quantity) > 1e-9:
+            _adjust_facet(session, *key, listings, quantity)
+
+
+def rebuild():
+    """Recompute every listing and facet count. Returns the listing count."""
+    db.session.info.pop(_DIRTY, None)
+    db.session.execute(db.delete(MarketListing))
+    db.session.execute(db.delete(MarketFacet))
+    db.session.execute(db.insert(MarketListing).from_select(
+        ['batch_id', 'owner_id', 'spice_id', 'grade', 'farming_method', 'quantity_kg', 'harvest_date'],
+        _listable(db.true())
+    ))
+    db.session.execute(db.insert(MarketFacet).from_select(
+        ['spice_id', 'grade', 'farming_method', 'listings', 'quantity_kg'],
+        db.select(MarketListing.spice_id, MarketListing.grade, MarketListing.farming_method,
+                  db.func.count(), db.func.sum(MarketListing.quantity_kg))
+        .group_by(MarketListing.spice_id, MarketListing.grade, MarketListing.farming_method)
+    ))
+    listings = db.session.execute(db.select(db.func.count()).select_from(MarketListing)).scalar()
+    db.session.commit()
+    return listings
+
+
+def facets(spice_id=None, grade=None, farming_method=None):
+    """Listing counts per value of each facet, each computed with the other
+    two facet filters applied (the usual drill-down semantics)."""
+    selected = {'spice_id': spice_id, 'grade': grade, 'farming_method': farming_method}
+    result = {}
+    for name, column in FACETS.items():
+        criteria = [FACETS[other] == value for other, value in selected.items()
+                    if other != name and value is not None]
+        result[name] = [{'value': value, 'listings': listings, 'quantity_kg': round(quantity, 3)}
+                        for value, listings, quantity in db.session.execute(
+                            db.select(column, db.func.sum(MarketFacet.listings), db.func.sum(MarketFacet.quantity_kg))
+                            .where(*criteria).group_by(column)
+                            .having(db.func.sum(MarketFacet.listings) > 0).order_by(column)
+                        )]
+    return result
+
+
+def search(spice_id=None, grade=None, farming_method=None, min_kg=None, max_kg=None,
+           harvested_from=None, harvested_to=None, seller_id=None, sort='-harvest_date', page=1, per_page=20):
+    """One page of listings as ``(rows, total)``. Rows carry the listing
+    plus batch code, spice name and seller username."""
+    categorical = [column == value for column, value in (
+        (MarketListing.spice_id, spice_id), (MarketListing.grade, grade),
+        (MarketListing.farming_method, farming_method)) if value is not None]
+    ranges = []
+    if min_kg is not None:
+        ranges.append(MarketListing.quantity_kg >= min_kg)
+    if max_kg is not None:
+        ranges.append(MarketListing.quantity_kg <= max_kg)
+    if harvested_from is not None:
+        ranges.append(MarketListing.harvest_date >= harvested_from)
+    if harvested_to is not None:
+        ranges.append(MarketListing.harvest_date <= harvested_to)
+    if seller_id is not None:
+        ranges.append(MarketListing.owner_id == seller_id)
+
+    rows = db.session.execute(
+        db.select(MarketListing, Batches.batch_id.label('code'), Spices.name.label('spice_name'),
+                  User.username.label('seller'))
+        .join(Batches, Batches.id == MarketListing.batch_id)
+        .join(Spices, Spices.id == MarketListing.spice_id)
+        .join(User, User.id == MarketListing.owner_id)
+        .where(*categorical, *ranges)
+        .order_by(*SORTS[sort]).limit(per_page).offset((page - 1) * per_page)
+    ).all()
+
+    if ranges:
+        total = db.session.execute(
+            db.select(db.func.count()).select_from(MarketListing).where(*categorical, *ranges)
+        ).scalar()
+    else:
+        # Facet filters alone: the counters already hold the answer
+        total = db.session.execute(
+            db.select(db.func.coalesce(db.func.sum(MarketFacet.listings), 0)).where(*[
+                FACETS[name] == value for name, value in
+                (('spice_id', spice_id), ('grade', grade), ('farming_method', farming_method)) if value is not None
+            ])
+        ).scalar()
+    return rows, total
+
+
+@click.group('market')
+def market_group():
+    """Marketplace index maintenance."""
+
+
+@market_group.command('rebuild')
+def rebuild_command():
+    """Recompute all marketplace listings and facet counts."""
+    click.echo(f'{rebuild()} listings indexed')
@@ -0,0 +1,346 @@
+from datetime import datetime
+
+from sqlalchemy.dialects.postgresql import JSONB
+
+from .extensions import db
+
+# JSONB on PostgreSQL, JSON text elsewhere; None is stored as SQL NULL
+JSONDocument = db.JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), 'postgresql')
+# Timeline metadata keys looked up directly, each with an expression index
+TIMELINE_INDEXED_KEYS = ('transaction_id', 'test_id', 'package_id')
+
+
+def json_text(column, key):
+    """``column ->> key`` as text. The key is inlined rather than bound so
+    the expression matches an index built with it (SQLite only uses an
+    expression index when the statement repeats it literally)."""
+    return column[db.literal(key, db.JSON.JSONIndexType(), literal_execute=True)].as_string()
+
+
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
+    coordinate = db.Column(db.String(100))  # For location tracking
+    # Parsed from coordinate; geo_cell buckets them for area queries (see spicechain.geo)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geo_cell = db.Column(db.Integer, index=True)
+    user_type = db.Column(db.String(20), nullable=False)  # farmer, middleman, consumer, quality_officer
+    phone = db.Column(db.String(15))
+    address = db.Column(db.Text)
+    license_number = db.Column(db.String(50))  # For farmers and middlemen
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    is_active = db.Column(db.Boolean, default=True)
+
+class Spices(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    scientific_name = db.Column(db.String(100))
+    category = db.Column(db.String(50))  # whole, ground, extract
+    origin_region = db.Column(db.String(100))
+    harvest_season = db.Column(db.String(50))
+    shelf_life_months = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Batches(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.String(50), unique=True, nullable=False)
+    farmer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    spice_id = db.Column(db.Integer, db.ForeignKey('spices.id'), nullable=False)
+    quantity_kg = db.Column(db.Float, nullable=False)
+    harvest_date = db.Column(db.DateTime, nullable=False)
+    harvest_image = db.Column(db.String(255), nullable=True)  # file path or URL
+    farm_location = db.Column(db.String(200))
+    latitude = db.Column(db.Float)  # of the farm; defaults to the farmer's coordinates
+    longitude = db.Column(db.Float)
+    geo_cell = db.Column(db.Integer, index=True)
+    farming_method = db.Column(db.String(50))  # organic, conventional
+    estimated_grade = db.Column(db.String(20))  # A, B, C
+    current_owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), default='harvested', index=True)  # harvested, tested, sold, packaged, divided, merged, pending_sale
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # NEW FIELD FOR BATCH DIVISION
+    parent_batch_id = db.Column(db.Integer, db.ForeignKey('batches.id'), nullable=True, index=True)
+    
+    # Existing relationships
+    farmer = db.relationship('User', foreign_keys=[farmer_id], backref='farmed_batches')
+    current_owner = db.relationship('User', foreign_keys=[current_owner_id])
+    spice = db.relationship('Spices', backref='batches')
+    
+    # NEW RELATIONSHIPS FOR PARENT-CHILD
+    parent_batch = db.relationship('Batches', remote_side=[id], backref='sub_batches')
+
+
+class BatchComposition(db.Model):
+    """One source lot blended into a merged batch (many-to-many over Batches)."""
+    id = db.Column(db.Integer, primary_key=True)
+    child_batch_id = db.Column(db.Integer, db.ForeignKey('batches.id'), nullable=False, index=True)
+    source_batch_id = db.Column(db.Integer, db.ForeignKey('batches.id'), nullable=False, index=True)
+    quantity_kg = db.Column(db.Float, nullable=False)  # taken from the source
+    note = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    child_batch = db.relationship('Batches', foreign_keys=[child_batch_id], backref='compositions')
+    source_batch = db.relationship('Batches', foreign_keys=[source_batch_id], backref='used_in')
+
+
+class StockLedger(db.Model):
+    """Append-only quantity movements; balances are sums over these rows."""
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('batches.id'), nullable=False, index=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    delta_kg = db.Column(db.Float, nullable=False)
+    reason = db.Column(db.String(20), nullable=False)  # opening, harvest, divide, merge, package, transfer
+    reference = db.Column(db.String(50))  # batch, package or transaction code behind the movement
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class BatchStock(db.Model):
+    """Materialized available balance of a batch (see spicechain.stock)."""
+    batch_id = db.Column(db.Integer, db.ForeignKey('batches.id'), primary_key=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    spice_id = db.Column(db.Integer, db.ForeignKey('spices.id'), nullable=False)
+    quantity_kg = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class OwnerStock(db.Model):
+    """Materialized bulk stock per owner and spice."""
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    spice_id = db.Column(db.Integer, db.ForeignKey('spices.id'), primary_key=True)
+    batches = db.Column(db.Integer, nullable=False, default=0)
+    quantity_kg = db.Column(db.Float, nullable=False, default=0)
+
+
+class Package(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    package_id = db.Column(db.String(50), unique=True, nullable=False)
+    batch_id = db.Column(db.Integer, db.ForeignKey('batches.id'), nullable=False, index=True)
+    packager_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    quantity_kg = db.Column(db.Float, nullable=False)
+    package_date = db.Column(db.DateTime, default=datetime.utcnow)
+    package_type = db.Column(db.String(50))  # retail, wholesale, export
+    expiry_date = db.Column(db.DateTime)
+    current_owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), default='packaged')  # packaged, shipped, delivered, sold
+    qr_code = db.Column(db.String(100))
+    trace_token = db.Column(db.Text)  # signed offline provenance, see spicechain.trace_tokens
+    
+    batch = db.relationship('Batches', backref='packages')
+    packager = db.relationship('User', foreign_keys=[packager_id])
+    current_owner = db.relationship('User', foreign_keys=[current_owner_id])
+
+class Transactions(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    transaction_id = db.Column(db.String(50), unique=True, nullable=False)
+    from_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    to_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('batches.id'), index=True)
+    package_id = db.Column(db.Integer, db.ForeignKey('package.id'), index=True)
+    quantity_kg = db.Column(db.Float, nullable=False)
+    price_per_kg = db.Column(db.Float)
+    total_amount = db.Column(db.Float)
+    transaction_type = db.Column(db.String(20))  # sale, transfer, return
+    payment_status = db.Column(db.String(20), default='pending')  # pending, completed, failed
+    transaction_date = db.Column(db.DateTime, default=datetime.utcnow)
+    notes = db.Column(db.Text)
+    
+    from_user = db.relationship('User', foreign_keys=[from_user_id], backref='sent_transactions')
+    to_user = db.relationship('User', foreign_keys=[to_user_id], backref='received_transactions')
+    batch = db.relationship('Batches', backref='transactions')
+    package = db.relationship('Package', backref='transactions')
+
+class Timeline(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('batches.id'), index=True)
+    package_id = db.Column(db.Integer, db.ForeignKey('package.id'), index=True)
+    event_type = db.Column(db.String(50), nullable=False)  # harvest, quality_test, package, sell, ship
+    event_description = db.Column(db.Text)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    location = db.Column(db.String(200))
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    event_metadata = db.Column(JSONDocument)  # additional data
+    
+    batch = db.relationship('Batches', backref='timeline_events')
+    package = db.relationship('Package', backref='timeline_events')
+    user = db.relationship('User', backref='timeline_events')
+
+for _key in TIMELINE_INDEXED_KEYS:
+    db.Index(f'ix_timeline_metadata_{_key}', json_text(Timeline.event_metadata, _key))
+
+class QATest(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    test_id = db.Column(db.String(50), unique=True, nullable=False)
+    batch_id = db.Column(db.Integer, db.ForeignKey('batches.id'), nullable=False, index=True)
+    tester_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    test_date = db.Column(db.DateTime, default=datetime.utcnow)
+    test_type = db.Column(db.String(50))  # moisture, purity, contamination, grade
+    test_result = db.Column(db.String(20))  # pass, fail, conditional
+    grade_assigned = db.Column(db.String(10))  # A, B, C
+    moisture_content = db.Column(db.Float)
+    purity_percentage = db.Column(db.Float)
+    contamination_level = db.Column(db.String(20))
+    notes = db.Column(db.Text)
+    certificate_url = db.Column(db.String(200))
+    
+    batch = db.relationship('Batches', backref='qa_tests')
+    tester = db.relationship('User', backref='conducted_tests')
+
+class AuditLog(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    action = db.Column(db.String(100), nullable=False)
+    resource_type = db.Column(db.String(50))  # batch, package, transaction, etc.
+    resource_id = db.Column(db.String(50))
+    old_values = db.Column(JSONDocument)
+    new_values = db.Column(JSONDocument)
+    ip_address = db.Column(db.String(45))
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    user = db.relationship('User', backref='audit_logs')
+    
+    __table_args__ = (db.Index('ix_audit_log_user_id_timestamp', 'user_id', 'timestamp'),)
+
+class RevokedToken(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(64), unique=True, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # rows past this can be purged
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Anomaly(db.Model):
+    """A finding of the anomaly scan; rescans replace the findings for the
+    rows they recheck."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False, index=True)  # overdrawn_batch, price_outlier
+    entity_type = db.Column(db.String(20), nullable=False)  # batch, transaction
+    entity_id = db.Column(db.Integer, nullable=False, index=True)
+    spice_id = db.Column(db.Integer, db.ForeignKey('spices.id'))
+    score = db.Column(db.Float)  # kg over capacity, or |z| of the price
+    details = db.Column(db.Text)  # JSON string
+    detected_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Watermark(db.Model):
+    """Highest row id an incremental job has processed, per job and table."""
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class PriceBar(db.Model):
+    """Daily OHLC and volume of completed sales of one spice, overall
+    (segment_type 'all') or per batch grade / farm region."""
+    id = db.Column(db.Integer, primary_key=True)
+    spice_id = db.Column(db.Integer, db.ForeignKey('spices.id'), nullable=False)
+    segment_type = db.Column(db.String(10), nullable=False, default='all')  # all, grade, region
+    segment = db.Column(db.String(200), nullable=False, default='')
+    day = db.Column(db.Date, nullable=False)
+    open = db.Column(db.Float, nullable=False)
+    high = db.Column(db.Float, nullable=False)
+    low = db.Column(db.Float, nullable=False)
+    close = db.Column(db.Float, nullable=False)
+    open_at = db.Column(db.DateTime, nullable=False)  # time of the opening / closing sale
+    close_at = db.Column(db.DateTime, nullable=False)
+    volume_kg = db.Column(db.Float, nullable=False, default=0)
+    turnover = db.Column(db.Float, nullable=False, default=0)
+    trades = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (db.UniqueConstraint('spice_id', 'segment_type', 'segment', 'day'),)
+
+class MarketListing(db.Model):
+    """A batch buyers can purchase right now (see spicechain.market); rows
+    exist only while the batch is in a listed status with stock left."""
+    batch_id = db.Column(db.Integer, db.ForeignKey('batches.id'), primary_key=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    spice_id = db.Column(db.Integer, db.ForeignKey('spices.id'), nullable=False)
+    grade = db.Column(db.String(20), nullable=False, default='')
+    farming_method = db.Column(db.String(50), nullable=False, default='')
+    quantity_kg = db.Column(db.Float, nullable=False)  # available balance
+    harvest_date = db.Column(db.DateTime, nullable=False)
+    
+    # Equality filters first, then the sort column, so filtered and sorted
+    # pages are read straight off an index
+    __table_args__ = (
+        db.Index('ix_market_listing_facets_harvest', 'spice_id', 'grade', 'farming_method', 'harvest_date'),
+        db.Index('ix_market_listing_facets_quantity', 'spice_id', 'grade', 'farming_method', 'quantity_kg'),
+        db.Index('ix_market_listing_spice_harvest', 'spice_id', 'harvest_date'),
+        db.Index('ix_market_listing_spice_quantity', 'spice_id', 'quantity_kg'),
+        db.Index('ix_market_listing_harvest', 'harvest_date'),
+        db.Index('ix_market_listing_quantity', 'quantity_kg'),
+    )
+
+class MarketFacet(db.Model):
+    """Listing count and kg per spice, grade and farming method."""
+    spice_id = db.Column(db.Integer, db.ForeignKey('spices.id'), primary_key=True)
+    grade = db.Column(db.String(20), primary_key=True)
+    farming_method = db.Column(db.String(50), primary_key=True)
+    listings = db.Column(db.Integer, nullable=False, default=0)
+    quantity_kg = db.Column(db.Float, nullable=False, default=0)
+
+class SyncChange(db.Model):
+    """A batch, package or transaction a user should re-fetch; the id is
+    the sync token clients hold (see spicechain.sync)."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    entity_type = db.Column(db.String(20), nullable=False)  # batch, package, transaction
+    entity_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (db.Index('ix_sync_change_user_id_id', 'user_id', 'id'),)
+
+class SyncOperation(db.Model):
+    """An offline operation already applied, kept so replays are no-ops."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    op_id = db.Column(db.String(64), nullable=False)  # client-generated, unique per user
+    op_type = db.Column(db.String(20), nullable=False)  # register, divide, sell, package
+    status_code = db.Column(db.Integer, nullable=False)
+    response = db.Column(db.Text)  # JSON string
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('user_id', 'op_id'),)
+
+class TraceSigningKey(db.Model):
+    """Ed25519 key pair for package trace tokens. The newest unretired key
+    signs; every unrevoked key is published for offline verification."""
+    kid = db.Column(db.String(16), primary_key=True)
+    public_key = db.Column(db.String(64), nullable=False)  # raw key, base64url
+    private_key = db.Column(db.Text, nullable=False)  # PKCS#8 PEM encrypted with SECRET_KEY
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    retired_at = db.Column(db.DateTime)  # stopped signing
+    revoked_at = db.Column(db.DateTime)  # no longer trusted
+
+class ArchivePartition(db.Model):
+    """A month of timeline or audit rows moved out of its table into a
+    Parquet file (see spicechain.archive)."""
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)  # timeline, audit_log
+    month = db.Column(db.Date, nullable=False)  # first day of the month
+    path = db.Column(db.String(255), nullable=False)  # relative to ARCHIVE_DIR
+    row_count = db.Column(db.Integer, nullable=False)
+    size_bytes = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.Index('ix_archive_partition_table_month', 'table_name', 'month'),)
+
+class Job(db.Model):
+    """A unit of deferred work for the job workers (see spicechain.jobs)."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # a name registered with jobs.task
+    payload = db.Column(JSONDocument)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)  # who asked, if anyone
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed
+    priority = db.Column(db.Integer, nullable=False, default=0)  # higher runs first
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # not before; pushed back on retry
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=1)
+    worker = db.Column(db.String(100))  # host:pid:thread holding a running job
+    heartbeat_at = db.Column(db.DateTime)  # running jobs not heard from in JOB_LEASE_SECONDS are requeued
+    progress = db.Column(db.Float)  # 0..1
+    progress_message = db.Column(db.String(200))
+    result = db.Column(JSONDocument)
+    error = db.Column(db.Text)  # last failure
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    __table_args__ = (db.Index('ix_job_status_priority_run_at', 'status', 'priority', 'run_at'),)
@@ -0,0 +1,153 @@
+"""Password hashing off the request threads.
+
+Hashing and verification run in a small process pool so a burst of logins
+cannot hold the GIL against every other route. The number of hashes in
+flight is capped (``PASSWORD_HASH_QUEUE``), counting jobs whose caller
+has stopped waiting until a worker has finished them; callers beyond
+that, jobs slower than ``PASSWORD_HASH_TIMEOUT`` and jobs lost to a
+crashed worker (the pool is then rebuilt) get ``HasherBusy`` and the
+route answers 503 instead of queueing without bound.
+
+``LoginThrottle`` rejects callers with too many recent attempts before any
+hashing is done, so brute-force traffic costs a dictionary lookup.
+"""
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from .cache import TTLCache
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, method, workers, queue_size, timeout):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn: forking a threaded server can copy held locks
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._pool
+
+    def _reset(self, pool):
+        # A worker died; later callers get a fresh pool
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HasherBusy('Password hashing queue is full')
+        pool = self._executor()
+        try:
+            future = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._reset(pool)
+            raise HasherBusy('Password hashing pool restarted')
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is held until the worker is really done, not just until
+        # this caller stops waiting, so timed-out hashes still count
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HasherBusy('Password hashing timed out')
+        except BrokenProcessPool:
+            self._reset(pool)
+            raise HasherBusy('Password hashing pool restarted')
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True when ``password_hash`` was made with other parameters than
+        the configured method (e.g. a lower scrypt cost)."""
+        return password_hash.split('$', 1)[0] != self.method
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+class LoginThrottle:
+    """Sliding-window attempt counter per key (client IP, account)."""
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self._lock = threading.Lock()
+        self._attempts = TTLCache(maxsize=100000, ttl=window)
+
+    def retry_after(self, key):
+        """Seconds until ``key`` may try again, or 0 if it is not blocked."""
+        with self._lock:
+            attempts = self._prune(key)
+            if len(attempts) < self.limit:
+                return 0
+            return int(attempts[0] + self.window - time.monotonic()) + 1
+
+    def record(self, key):
+        with self._lock:
+            attempts = self._prune(key)
+            attempts.append(time.monotonic())
+            self._attempts.set(key, attempts)
+
+    def reset(self, key):
+        self._attempts.pop(key)
+
+    def _prune(self, key):
+        attempts = self._attempts.get(key) or deque()
+        cutoff = time.monotonic() - self.window
+        while attempts and attempts[0] < cutoff:
+            attempts.popleft()
+        return attempts
+
+
+def hasher():
+    return current_app.extensions['password_hasher']
+
+
+def throttles():
+    """``(per_ip, per_account)`` throttles: every attempt counts against the
+    client IP, failed ones also against the account."""
+    return current_app.extensions['login_throttles']
+
+
+def init_app(app):
+    config = app.config
+    app.extensions['password_hasher'] = PasswordHasher(
+        config['PASSWORD_HASH_METHOD'], config['PASSWORD_HASH_WORKERS'],
+        config['PASSWORD_HASH_QUEUE'], config['PASSWORD_HASH_TIMEOUT']
+    )
+    app.extensions['login_throttles'] = (
+        LoginThrottle(config['LOGIN_IP_ATTEMPT_LIMIT'], config['LOGIN_ATTEMPT_WINDOW_SECONDS']),
+        LoginThrottle(config['LOGIN_ACCOUNT_FAILURE_LIMIT'], config['LOGIN_ATTEMPT_WINDOW_SECONDS'])
+    )
@@ -0,0 +1,279 @@
+"""Spice price index.
+
+Completed sales are folded into daily OHLC/volume ``PriceBar`` rows per
+spice, overall and per batch grade and farm region, at the moment they
+complete (one relative UPSERT per segment in the completing transaction).
+Queries read bars, never raw transactions: weekly bars, VWAP, rolling
+averages and volatility are computed over the bar arrays with NumPy.
+
+``flask prices rebuild`` recomputes every bar from the completed sales in
+one vectorized pass, for backfills or after bulk imports.
+"""
+from datetime import datetime, timedelta
+
+import click
+
+from .extensions import db
+from .models import Batches, Package, PriceBar, Transactions
+
+SEGMENT_TYPES = ('all', 'grade', 'region')
+
+
+def _segments(batch):
+    return (('all', ''), ('grade', batch.estimated_grade or ''), ('region', batch.farm_location or ''))
+
+
+def record_sale(transaction):
+    """Fold a completed sale into its bars; the caller commits."""
+    record_sales([transaction])
+
+
+def record_sales(transactions):
+    """Fold completed sales into their bars with one merge per bar they
+    touch, however many sales fall into it; the caller commits."""
+    bars = {}
+    for transaction in transactions:
+        if not transaction.price_per_kg or transaction.transaction_type != 'sale':
+            continue
+        batch = transaction.batch or transaction.package.batch
+        price, at = transaction.price_per_kg, transaction.transaction_date
+        for segment_type, segment in _segments(batch):
+            bar = bars.get((batch.spice_id, segment_type, segment, at.date()))
+            if bar is None:
+                bar = bars[batch.spice_id, segment_type, segment, at.date()] = {
+                    'open': price, 'open_at': at, 'close': price, 'close_at': at, 'high': price, 'low': price,
+                    'volume_kg': 0.0, 'turnover': 0.0, 'trades': 0
+                }
+            if at < bar['open_at']:
+                bar['open'], bar['open_at'] = price, at
+            if at >= bar['close_at']:
+                bar['close'], bar['close_at'] = price, at
+            bar['high'], bar['low'] = max(bar['high'], price), min(bar['low'], price)
+            bar['volume_kg'] += transaction.quantity_kg
+            bar['turnover'] += price * transaction.quantity_kg
+            bar['trades'] += 1
+
+    for (spice_id, segment_type, segment, day), bar in bars.items():
+        key = (PriceBar.spice_id == spice_id, PriceBar.segment_type == segment_type,
+               PriceBar.segment == segment, PriceBar.day == day)
+        # Right-hand sides see the old row, so this is a single atomic merge
+        updated = db.session.execute(
+            db.update(PriceBar).where(*key).values(
+                open=db.case((PriceBar.open_at > bar['open_at'], bar['open']), else_=PriceBar.open),
+                open_at=db.case((PriceBar.open_at > bar['open_at'], bar['open_at']), else_=PriceBar.open_at),
+                close=db.case((PriceBar.close_at <= bar['close_at'], bar['close']), else_=PriceBar.close),
+                close_at=db.case((PriceBar.close_at <= bar['close_at'], bar['close_at']), else_=PriceBar.close_at),
+                high=db.case((PriceBar.high < bar['high'], bar['high']), else_=PriceBar.high),
+                low=db.case((PriceBar.low > bar['low'], bar['low']), else_=PriceBar.low),
+                volume_kg=PriceBar.volume_kg + bar['volume_kg'],
+                turnover=PriceBar.turnover + bar['turnover'],
+                trades=PriceBar.trades + bar['trades']
+            ).execution_options(synchronize_session=False)
+        ).rowcount
+        if not updated:
+            db.session.execute(db.insert(PriceBar).values(
+                spice_id=spice_id, segment_type=segment_type, segment=segment, day=day, **bar
+            ))
+
+
+def rebuild(chunk_size=100000):
+    """Recompute all bars from completed sales. Returns the bar count."""
+    import numpy as np
+
+    from .anomalies import columns
+
+    package_batch = db.aliased(Batches)
+    ids, at, price, quantity, spice, grade, region = columns(
+        db.select(Transactions.id, Transactions.transaction_date, Transactions.price_per_kg,
+                  Transactions.quantity_kg,
+                  db.func.coalesce(Batches.spice_id, package_batch.spice_id),
+                  db.func.coalesce(Batches.estimated_grade, package_batch.estimated_grade, ''),
+                  db.func.coalesce(Batches.farm_location, package_batch.farm_location, ''))
+        .select_from(Transactions)
+        .outerjoin(Batches, Batches.id == Transactions.batch_id)
+        .outerjoin(Package, Package.id == Transactions.package_id)
+        .outerjoin(package_batch, package_batch.id == Package.batch_id)
+        .where(Transactions.payment_status == 'completed', Transactions.transaction_type == 'sale',
+               Transactions.price_per_kg > 0),
+        [np.int64, 'datetime64[us]', np.float64, np.float64, np.int64, object, object],
+        chunk_size
+    )
+    db.session.execute(db.delete(PriceBar))
+    day = at.astype('datetime64[D]').astype(np.int64)
+    bars = 0
+    for segment_type, labels in (('all', np.full(len(ids), '', dtype=object)), ('grade', grade), ('region', region)):
+        if not len(ids):
+            break
+        names, label = np.unique(labels.astype(str), return_inverse=True)
+        # One sortable int per (spice, segment, day) bar
+        span = int(day.max() - day.min()) + 1
+        bar_key = (spice * len(names) + label) * span + (day - day.min())
+        # Sort each bar's sales by time so open/close are its first/last rows
+        order = np.lexsort((ids, at, bar_key))
+        bar_key, sorted_price, sorted_at, sorted_quantity = bar_key[order], price[order], at[order], quantity[order]
+        starts = np.flatnonzero(np.r_[True, bar_key[1:] != bar_key[:-1]])
+        ends = np.r_[starts[1:], len(bar_key)] - 1
+        first = order[starts]
+        rows = [{
+            'spice_id': spice_id,
+            'segment_type': segment_type,
+            'segment': segment,
+            'day': bar_day,
+            'open': open_,
+            'close': close,
+            'open_at': open_at,
+            'close_at': close_at,
+            'high': high,
+            'low': low,
+            'volume_kg': volume,
+            'turnover': turnover,
+            'trades': trades
+        } for spice_id, segment, bar_day, open_, close, open_at, close_at, high, low, volume, turnover, trades in zip(
+            spice[first].tolist(),
+            names[label[first]].tolist(),
+            day[first].astype('datetime64[D]').tolist(),
+            sorted_price[starts].tolist(),
+            sorted_price[ends].tolist(),
+            sorted_at[starts].tolist(),
+            sorted_at[ends].tolist(),
+            np.maximum.reduceat(sorted_price, starts).tolist(),
+            np.minimum.reduceat(sorted_price, starts).tolist(),
+            np.add.reduceat(sorted_quantity, starts).tolist(),
+            np.add.reduceat(sorted_price * sorted_quantity, starts).tolist(),
+            (ends - starts + 1).tolist()
+        )]
+        # Core insert: these are plain rows, no ORM bookkeeping needed
+        for offset in range(0, len(rows), chunk_size):
+            db.session.execute(PriceBar.__table__.insert(), rows[offset:offset + chunk_size])
+        bars += len(rows)
+    db.session.commit()
+    return bars
+
+
+def load_bars(spice_id, segment_type='all', segment='', start=None, end=None, warmup=0):
+    """Daily bars as a dict of NumPy arrays, oldest first. ``warmup`` extra
+    bars before ``start`` are included so rolling windows are full from
+    the first requested bar; ``first`` is the index of that bar."""
+    import numpy as np
+
+    from .anomalies import columns
+
+    fields = (PriceBar.day, PriceBar.open, PriceBar.high, PriceBar.low, PriceBar.close,
+              PriceBar.volume_kg, PriceBar.turnover, PriceBar.trades)
+    key = (PriceBar.spice_id == spice_id, PriceBar.segment_type == segment_type, PriceBar.segment == segment)
+    dtypes = ['datetime64[D]'] + [np.float64] * 6 + [np.int64]
+    statement = db.select(*fields).where(*key)
+    if end is not None:
+        statement = statement.where(PriceBar.day <= end)
+    parts = []
+    if start is not None:
+        statement = statement.where(PriceBar.day >= start)
+        if warmup:
+            before = (db.select(*fields).where(*key, PriceBar.day < start)
+                      .order_by(PriceBar.day.desc()).limit(warmup))
+            parts.append([column[::-1] for column in columns(before, dtypes)])
+    parts.append(columns(statement.order_by(PriceBar.day), dtypes))
+    names = ('day', 'open', 'high', 'low', 'close', 'volume_kg', 'turnover', 'trades')
+    bars = {name: np.concatenate([part[i] for part in parts]) for i, name in enumerate(names)}
+    bars['first'] = len(parts[0][0]) if len(parts) > 1 else 0
+    return bars
+
+
+def weekly(bars):
+    """Aggregate daily bars into Monday-based weeks."""
+    import numpy as np
+
+    if not len(bars['day']):
+        return bars
+    days = bars['day'].astype(np.int64)
+    # 1970-01-01 was a Thursday
+    week = (days - (days + 3) % 7).astype('datetime64[D]')
+    starts = np.flatnonzero(np.r_[True, week[1:] != week[:-1]])
+    ends = np.r_[starts[1:], len(week)] - 1
+    return {
+        'day': week[starts],
+        'open': bars['open'][starts],
+        'high': np.maximum.reduceat(bars['high'], starts),
+        'low': np.minimum.reduceat(bars['low'], starts),
+        'close': bars['close'][ends],
+        'volume_kg': np.add.reduceat(bars['volume_kg'], starts),
+        'turnover': np.add.reduceat(bars['turnover'], starts),
+        'trades': np.add.reduceat(bars['trades'], starts),
+        # The week holding the first requested day is the first one returned
+        'first': int(np.searchsorted(starts, bars['first'], side='right') - 1)
+    }
+
+
+def _rolling_mean(values, window):
+    import numpy as np
+
+    result = np.full(len(values), np.nan)
+    if len(values) >= window:
+        sums = np.cumsum(np.r_[0.0, values])
+        result[window - 1:] = (sums[window:] - sums[:-window]) / window
+    return result
+
+
+def rolling_stats(bars, window):
+    """Rolling mean of the close and rolling volatility (standard deviation
+    of close-to-close log returns) over ``window`` (>= 2) bars."""
+    import numpy as np
+
+    close = bars['close']
+    returns = np.r_[0.0, np.diff(np.log(close))] if len(close) else close
+    # A window of n bars holds n - 1 returns
+    mean_return = _rolling_mean(returns, window - 1)
+    mean_square = _rolling_mean(returns ** 2, window - 1)
+    volatility = np.sqrt(np.maximum(mean_square - mean_return ** 2, 0))
+    volatility[:window - 1] = np.nan
+    return {
+        'rolling_mean': _rolling_mean(close, window),
+        'volatility': volatility,
+        'vwap': np.divide(bars['turnover'], bars['volume_kg'], out=np.full(len(close), np.nan),
+                          where=bars['volume_kg'] > 0)
+    }
+
+
+def segment_index(spice_id, days=30, today=None):
+    """Per-segment price index: VWAP over the last ``days`` days and the
+    latest close, one GROUP BY over the bars."""
+    since = (today or datetime.utcnow()).date() - timedelta(days=days)
+    latest = (db.select(PriceBar.segment_type, PriceBar.segment, db.func.max(PriceBar.day).label('day'))
+              .where(PriceBar.spice_id == spice_id).group_by(PriceBar.segment_type, PriceBar.segment)
+              .subquery())
+    closes = {(row.segment_type, row.segment): (row.day, row.close) for row in db.session.execute(
+        db.select(PriceBar.segment_type, PriceBar.segment, PriceBar.day, PriceBar.close)
+        .join(latest, db.and_(latest.c.segment_type == PriceBar.segment_type,
+                              latest.c.segment == PriceBar.segment, latest.c.day == PriceBar.day))
+        .where(PriceBar.spice_id == spice_id)
+    )}
+    recent = {(row.segment_type, row.segment): row for row in db.session.execute(
+        db.select(PriceBar.segment_type, PriceBar.segment, db.func.sum(PriceBar.turnover).label('turnover'),
+                  db.func.sum(PriceBar.volume_kg).label('volume_kg'), db.func.sum(PriceBar.trades).label('trades'))
+        .where(PriceBar.spice_id == spice_id, PriceBar.day >= since)
+        .group_by(PriceBar.segment_type, PriceBar.segment)
+    )}
+    index = []
+    for (segment_type, segment), (day, close) in sorted(closes.items(), key=lambda item: SEGMENT_TYPES.index(item[0][0])):
+        row = recent.get((segment_type, segment))
+        index.append({
+            'segment_type': segment_type,
+            'segment': segment,
+            'last_close': close,
+            'last_trade_day': day.isoformat(),
+            f'vwap_{days}d': round(row.turnover / row.volume_kg, 2) if row and row.volume_kg else None,
+            f'volume_kg_{days}d': row.volume_kg if row else 0,
+            f'trades_{days}d': row.trades if row else 0
+        })
+    return index
+
+
+@click.group('prices')
+def prices_group():
+    """Spice price index maintenance."""
+
+
+@prices_group.command('rebuild')
+def rebuild_command():
+    """Recompute every daily price bar from completed sales."""
+    click.echo(f'{rebuild()} price bars written')
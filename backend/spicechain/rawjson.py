@@ -0,0 +1,55 @@
+"""Splice stored JSON into responses without decoding it.
+
+Wrap JSON text read from the database in ``RawJSON`` and put it anywhere
+in a ``jsonify`` payload; ``RawJSONProvider`` (installed as ``app.json``)
+writes it into the response verbatim instead of parsing and re-encoding
+it. ``raw_column`` selects a JSON column as text so the driver does not
+decode it either (psycopg2 parses json/jsonb results on its own).
+"""
+import re
+import uuid
+
+from flask.json.provider import DefaultJSONProvider
+
+from .extensions import db
+
+
+class RawJSON:
+    """Already-serialized JSON to embed as is."""
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+def raw(text, default='{}'):
+    """``RawJSON`` for ``text``, or ``default`` when the stored value is NULL."""
+    return RawJSON(text if text is not None else default)
+
+
+def raw_column(column):
+    return db.cast(column, db.Text)
+
+
+class RawJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        fragments = []
+        marker = None
+        fallback = kwargs.pop('default', self.default)
+
+        def default(o):
+            # json hands unknown objects here; swap fragments for a unique
+            # string placeholder and put the text back after encoding
+            nonlocal marker
+            if isinstance(o, RawJSON):
+                if marker is None:
+                    marker = uuid.uuid4().hex
+                fragments.append(o.text)
+                return f'\x00{marker}:{len(fragments) - 1}'
+            return fallback(o)
+
+        text = super().dumps(obj, default=default, **kwargs)
+        if not fragments:
+            return text
+        placeholder = re.compile(r'"\\u0000' + marker + r':(\d+)"')
+        return placeholder.sub(lambda match: fragments[int(match.group(1))], text)
@@ -0,0 +1,195 @@
+"""Recall impact analysis.
+
+Everything is computed set-based from a recursive CTE over the composition
+graph (divisions and merges), so finding the descendants of a failed batch
+is one query however deep it has been divided and blended, and freezing
+them is a handful of bulk UPDATE / INSERT ... SELECT statements.
+"""
+import json
+import os
+from datetime import datetime
+
+from . import jobs, market, sync
+from .composition import composition_edges
+from .extensions import db
+from .models import Batches, JSONDocument, Package, Timeline, Transactions, User
+
+
+def lineage_ids(root_id):
+    """SELECT of the ids of ``root_id`` and all of its descendants,
+    including batches it was merged into."""
+    edges = composition_edges()
+    lineage = db.select(Batches.id.label('id')).where(Batches.id == root_id).cte('lineage', recursive=True)
+    lineage = lineage.union(
+        db.select(edges.c.child_id).join(lineage, edges.c.source_id == lineage.c.id)
+    )
+    return db.select(lineage.c.id)
+
+
+def package_ids(root_id, batch_ids=None):
+    batch_ids = lineage_ids(root_id) if batch_ids is None else batch_ids
+    return db.select(Package.id).where(Package.batch_id.in_(batch_ids))
+
+
+def _pending_transactions(root_id):
+    # One CTE per statement: reuse the same lineage for batches and packages
+    batch_ids = lineage_ids(root_id)
+    return db.and_(
+        Transactions.payment_status == 'pending',
+        db.or_(Transactions.batch_id.in_(batch_ids),
+               Transactions.package_id.in_(package_ids(root_id, batch_ids)))
+    )
+
+
+def holders(root_id):
+    """Current owners of affected batches/packages with what they hold."""
+    held = {}
+    for model, key in ((Batches, 'batches'), (Package, 'packages')):
+        ids = lineage_ids(root_id) if model is Batches else package_ids(root_id)
+        rows = db.session.execute(
+            db.select(User.id, User.username, User.user_type,
+                      db.func.count(model.id), db.func.coalesce(db.func.sum(model.quantity_kg), 0))
+            .join(model, model.current_owner_id == User.id)
+            .where(model.id.in_(ids))
+            .group_by(User.id, User.username, User.user_type)
+        )
+        for user_id, username, user_type, count, quantity in rows:
+            holder = held.setdefault(user_id, {
+                'user_id': user_id, 'username': username, 'user_type': user_type,
+                'batches': 0, 'batch_kg': 0, 'packages': 0, 'package_kg': 0
+            })
+            holder[key] = count
+            holder['batch_kg' if key == 'batches' else 'package_kg'] = quantity
+    return list(held.values())
+
+
+def impact_summary(root_id):
+    batches = db.session.execute(
+        db.select(db.func.count(Batches.id), db.func.coalesce(db.func.sum(Batches.quantity_kg), 0))
+        .where(Batches.id.in_(lineage_ids(root_id)))
+    ).one()
+    packages = db.session.execute(
+        db.select(db.func.count(Package.id), db.func.coalesce(db.func.sum(Package.quantity_kg), 0))
+        .where(Package.id.in_(package_ids(root_id)))
+    ).one()
+    pending = db.session.execute(
+        db.select(db.func.count(Transactions.id)).where(_pending_transactions(root_id))
+    ).scalar()
+    return {
+        'root_batch_id': root_id,
+        'batches': batches[0],
+        'batch_kg': batches[1],
+        'packages': packages[0],
+        'package_kg': packages[1],
+        'pending_transactions': pending,
+        'holders': len(holders(root_id))
+    }
+
+
+def iter_impact(root_id, chunk_size=1000):
+    """Yield one record per affected batch, package, pending transaction and
+    holder, then a summary, streaming rows from the DB in chunks."""
+    counts = {'batch': 0, 'package': 0, 'transaction': 0}
+
+    rows = db.session.execute(
+        db.select(Batches.id, Batches.batch_id, Batches.parent_batch_id, Batches.quantity_kg,
+                  Batches.status, Batches.current_owner_id)
+        .where(Batches.id.in_(lineage_ids(root_id))).order_by(Batches.id),
+        execution_options={'yield_per': chunk_size}
+    )
+    for row in rows:
+        counts['batch'] += 1
+        yield {'type': 'batch', **row._asdict()}
+
+    rows = db.session.execute(
+        db.select(Package.id, Package.package_id, Package.batch_id, Package.quantity_kg,
+                  Package.status, Package.current_owner_id)
+        .where(Package.id.in_(package_ids(root_id))).order_by(Package.id),
+        execution_options={'yield_per': chunk_size}
+    )
+    for row in rows:
+        counts['package'] += 1
+        yield {'type': 'package', **row._asdict()}
+
+    rows = db.session.execute(
+        db.select(Transactions.id, Transactions.transaction_id, Transactions.from_user_id,
+                  Transactions.to_user_id, Transactions.batch_id, Transactions.package_id,
+                  Transactions.quantity_kg, Transactions.total_amount)
+        .where(_pending_transactions(root_id)).order_by(Transactions.id),
+        execution_options={'yield_per': chunk_size}
+    )
+    for row in rows:
+        counts['transaction'] += 1
+        yield {'type': 'transaction', **row._asdict()}
+
+    affected_holders = holders(root_id)
+    for holder in affected_holders:
+        yield {'type': 'holder', **holder}
+
+    yield {
+        'type': 'summary',
+        'root_batch_id': root_id,
+        'batches': counts['batch'],
+        'packages': counts['package'],
+        'pending_transactions': counts['transaction'],
+        'holders': len(affected_holders)
+    }
+
+
+@jobs.task('recall_report')
+def write_impact_report(root_id):
+    """Job: write ``iter_impact`` to an NDJSON file for later download, for
+    recalls too large to stream within a request."""
+    summary = impact_summary(root_id)
+    total = summary['batches'] + summary['packages'] + summary['pending_transactions'] + summary['holders'] + 1
+    path = jobs.output_path('.ndjson')
+    with open(path, 'w') as f:
+        for written, record in enumerate(iter_impact(root_id), 1):
+            f.write(json.dumps(record, default=str) + '\n')
+            if written % 1000 == 0:
+                jobs.progress(written / total, f'{written} of {total} records')
+    return {'output': os.path.basename(path), 'records': written, 'summary': record}
+
+
+def freeze(root_id, user_id, reason):
+    """Mark every affected batch and package 'recalled', put pending
+    transactions on 'frozen' and add a timeline event per item. Statements
+    are only flushed here; the caller commits them as one transaction."""
+    now = datetime.utcnow()
+    metadata = db.literal({'recall_root_batch_id': root_id, 'reason': reason}, JSONDocument)
+    description = f'Frozen by recall: {reason}'
+
+    batch_rows = db.select(
+        Batches.id, db.literal(None), db.literal('recall_freeze'), db.literal(description),
+        db.literal(user_id), db.literal(now), metadata
+    ).where(Batches.id.in_(lineage_ids(root_id)), Batches.status != 'recalled')
+    package_rows = db.select(
+        db.literal(None), Package.id, db.literal('recall_freeze'), db.literal(description),
+        db.literal(user_id), db.literal(now), metadata
+    ).where(Package.id.in_(package_ids(root_id)), Package.status != 'recalled')
+    columns = ['batch_id', 'package_id', 'event_type', 'event_description', 'user_id', 'timestamp', 'event_metadata']
+    for rows in (batch_rows, package_rows):
+        db.session.execute(db.insert(Timeline).from_select(columns, rows))
+
+    # sqlite3 reports rowcount -1 for statements starting with WITH, so
+    # count what is about to change instead of trusting the UPDATE
+    targets = (
+        (Package, db.and_(Package.id.in_(package_ids(root_id)), Package.status != 'recalled'),
+         {'status': 'recalled'}),
+        (Batches, db.and_(Batches.id.in_(lineage_ids(root_id)), Batches.status != 'recalled'),
+         {'status': 'recalled'}),
+        (Transactions, _pending_transactions(root_id), {'payment_status': 'frozen'}),
+    )
+    frozen = {}
+    # Packages first: their selection depends on batch ids, not statuses
+    for (model, criteria, values), key in zip(targets, ('packages', 'batches', 'transactions')):
+        frozen[key] = db.session.execute(db.select(db.func.count(model.id)).where(criteria)).scalar()
+        if frozen[key]:
+            sync.record_where(model, criteria)
+            db.session.execute(
+                db.update(model).where(criteria).values(**values)
+                .execution_options(synchronize_session=False)
+            )
+    if frozen['batches']:
+        market.sync(Batches.id.in_(lineage_ids(root_id)))
+    return frozen
@@ -0,0 +1,204 @@
+"""Process-wide cache of reference data: the spice catalogue and user
+display names.
+
+Serializers resolve ``spice_id`` / ``user_id`` through ``spice_name()``
+and ``usernames()`` instead of loading ``batch.spice`` or
+``event.user`` row by row. The whole catalogue is loaded in one query
+the first time it is needed; usernames are loaded in bulk for the ids a
+response is about to render and kept in an LRU cache.
+
+Invalidation is versioned. Any ORM write to ``Spices``, and any change to
+a user's username or type, bumps a ``refdata:<kind>`` ``Watermark`` row in
+the same transaction. The writing process drops its own copy as soon as
+the transaction commits. Other worker processes compare the version rows
+at most every ``REFDATA_CHECK_SECONDS``, so a rename reaches them within
+that window at the cost of one primary-key read.
+"""
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from .cache import TTLCache
+from .extensions import db
+from .models import Spices, User, Watermark
+
+KINDS = ('spices', 'users')
+_CHANGED = 'refdata_changed'
+
+
+def _version_name(kind):
+    return f'refdata:{kind}'
+
+
+class ReferenceCache:
+    def __init__(self, user_cache_size, check_seconds):
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._spices = None  # (spices by id, etag)
+        self._users = TTLCache(maxsize=user_cache_size)
+        self._versions = None
+        self._checked_at = 0.0
+
+    def invalidate(self, kinds=KINDS):
+        with self._lock:
+            if 'spices' in kinds:
+                self._spices = None
+            if 'users' in kinds:
+                self._users.clear()
+            # Take the bumped versions as the new baseline rather than as
+            # someone else's write to invalidate for again
+            self._versions = None
+            self._checked_at = 0.0
+
+    def _check_versions(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_seconds:
+            return
+        versions = dict(db.session.execute(
+            db.select(Watermark.name, Watermark.last_id).where(Watermark.name.in_([_version_name(k) for k in KINDS]))
+        ).all())
+        with self._lock:
+            if self._versions is not None:
+                if versions.get(_version_name('spices')) != self._versions.get(_version_name('spices')):
+                    self._spices = None
+                if versions.get(_version_name('users')) != self._versions.get(_version_name('users')):
+                    self._users.clear()
+            self._versions = versions
+            self._checked_at = now
+
+    def spices(self):
+        """``(spices by id, etag)`` for the whole catalogue."""
+        self._check_versions()
+        loaded = self._spices
+        if loaded is None:
+            spices = {spice.id: {
+                'id': spice.id,
+                'name': spice.name,
+                'scientific_name': spice.scientific_name,
+                'category': spice.category,
+                'origin_region': spice.origin_region,
+                'harvest_season': spice.harvest_season,
+                'shelf_life_months': spice.shelf_life_months
+            } for spice in Spices.query.order_by(Spices.id)}
+            digest = hashlib.sha1(json.dumps(list(spices.values()), sort_keys=True).encode()).hexdigest()
+            loaded = (spices, f'spices-{digest[:16]}')
+            with self._lock:
+                self._spices = loaded
+        return loaded
+
+    def usernames(self, user_ids):
+        """``{user_id: username}`` for ``user_ids``, fetching the ones not
+        cached in a single query. Unknown ids are left out."""
+        self._check_versions()
+        names = {}
+        missing = []
+        for user_id in set(user_ids):
+            if user_id is None:
+                continue
+            name = self._users.get(user_id)
+            if name is None:
+                missing.append(user_id)
+            else:
+                names[user_id] = name
+        for start in range(0, len(missing), 500):
+            rows = db.session.execute(
+                db.select(User.id, User.username).where(User.id.in_(missing[start:start + 500]))
+            ).all()
+            for user_id, username in rows:
+                self._users.set(user_id, username)
+                names[user_id] = username
+        return names
+
+
+def _cache():
+    return current_app.extensions['refdata']
+
+
+def spices():
+    """Every spice, as a dict by id."""
+    return _cache().spices()[0]
+
+
+def spices_etag():
+    return _cache().spices()[1]
+
+
+def spice(spice_id):
+    return spices().get(spice_id)
+
+
+def spice_name(spice_id, default=None):
+    entry = spices().get(spice_id)
+    return entry['name'] if entry else default
+
+
+def usernames(user_ids):
+    return _cache().usernames(user_ids)
+
+
+def username(user_id):
+    return _cache().usernames([user_id]).get(user_id)
+
+
+# Invalidation
+
+def _changed(session, kind):
+    session.info.setdefault(_CHANGED, set()).add(kind)
+
+
+def _spice_written(mapper, connection, target):
+    _changed(object_session(target), 'spices')
+
+
+def _user_written(mapper, connection, target):
+    # New users are fetched on first use; only renames invalidate
+    state = inspect(target)
+    if state.attrs.username.history.deleted or state.attrs.user_type.history.deleted:
+        _changed(object_session(target), 'users')
+
+
+def _user_deleted(mapper, connection, target):
+    _changed(object_session(target), 'users')
+
+
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Spices, _event, _spice_written)
+event.listen(User, 'after_update', _user_written)
+event.listen(User, 'after_delete', _user_deleted)
+
+
+@event.listens_for(Session, 'before_commit')
+def _bump_versions(session):
+    session.flush()
+    for kind in session.info.get(_CHANGED, ()):
+        name = _version_name(kind)
+        bumped = session.execute(
+            db.update(Watermark).where(Watermark.name == name)
+            .values(last_id=Watermark.last_id + 1, updated_at=datetime.utcnow())
+        ).rowcount
+        if not bumped:
+            session.add(Watermark(name=name, last_id=1, updated_at=datetime.utcnow()))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_local(session):
+    kinds = session.info.pop(_CHANGED, None)
+    if kinds and has_app_context() and 'refdata' in current_app.extensions:
+        _cache().invalidate(kinds)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_changes(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop(_CHANGED, None)
+
+
+def init_app(app):
+    app.extensions['refdata'] = ReferenceCache(app.config['REFDATA_USER_CACHE_SIZE'],
+                                               app.config['REFDATA_CHECK_SECONDS'])
@@ -0,0 +1,168 @@
+"""Reporting queries over the columnar snapshot (see spicechain.snapshot).
+
+Reports scan the snapshot's Parquet files with Arrow's dataset and
+compute layers and never open a database connection, so they cannot hold
+up writers no matter how much history they cover. Month partitions
+outside the requested range are skipped without being opened. Results
+are as fresh as the last ``flask snapshot run`` and are cached per
+snapshot: a new run changes ``snapshot_at`` and with it every cache key.
+"""
+import functools
+import json
+import operator
+import os
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from .cache import TTLCache
+
+
+class SnapshotMissing(Exception):
+    """No snapshot has been written yet."""
+
+
+def _root():
+    return current_app.config['SNAPSHOT_DIR']
+
+
+def manifest():
+    try:
+        with open(os.path.join(_root(), 'manifest.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise SnapshotMissing('no snapshot has been taken yet; run `flask snapshot run`') from None
+
+
+def _cached(report):
+    @functools.wraps(report)
+    def wrapper(*args):
+        snapshot_at = manifest()['snapshot_at']
+        cache = current_app.extensions['report_cache']
+        key = (report.__name__, args, snapshot_at)
+        result = cache.get(key)
+        if result is None:
+            result = {'snapshot_at': snapshot_at, 'rows': report(*args)}
+            cache.set(key, result)
+        return result
+    return wrapper
+
+
+def _range(start, end):
+    """Inclusive dates as [start, end) datetimes."""
+    return (datetime.combine(start, datetime.min.time()) if start else None,
+            datetime.combine(end + timedelta(days=1), datetime.min.time()) if end else None)
+
+
+def _scan(name, columns, date_column, start, end, *criteria):
+    """``columns`` of snapshot table ``name`` with ``date_column`` in
+    [start, end) and matching ``criteria``, or None if the table is empty."""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    path = os.path.join(_root(), name)
+    if not os.path.isdir(path):
+        return None
+    dataset = ds.dataset(path, format='parquet',
+                         partitioning=ds.partitioning(pa.schema([('month', pa.string())]), flavor='hive'))
+    if not dataset.files:
+        return None
+    start, end = _range(start, end)
+    criteria = list(criteria)
+    # The month bounds prune partitions; the date bounds trim the edge months
+    if start:
+        criteria += [ds.field('month') >= f'{start:%Y-%m}', ds.field(date_column) >= start]
+    if end:
+        criteria += [ds.field('month') <= f'{end:%Y-%m}', ds.field(date_column) < end]
+    return dataset.to_table(columns=columns, filter=functools.reduce(operator.and_, criteria) if criteria else None)
+
+
+def _dimension(name, key, value):
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(os.path.join(_root(), f'{name}.parquet'), columns=[key, value])
+    return dict(zip(table[key].to_pylist(), table[value].to_pylist()))
+
+
+@_cached
+def harvest_volume(start, end, by):
+    """Registered harvests per farm location (``by='region'``) or spice."""
+    import pyarrow.dataset as ds
+
+    key = 'farm_location' if by == 'region' else 'spice_id'
+    table = _scan('batches', [key, 'quantity_kg'], 'harvest_date', start, end, ds.field('is_harvest'))
+    if table is None or table.num_rows == 0:
+        return []
+    grouped = table.group_by(key).aggregate([('quantity_kg', 'sum'), ('quantity_kg', 'count')]).to_pylist()
+    if by == 'region':
+        rows = [{'region': row[key] or 'Unknown',
+                 'batches': row['quantity_kg_count'],
+                 'quantity_kg': round(row['quantity_kg_sum'], 2)} for row in grouped]
+    else:
+        names = _dimension('spices', 'id', 'name')
+        rows = [{'spice_id': row[key],
+                 'spice_name': names.get(row[key]),
+                 'batches': row['quantity_kg_count'],
+                 'quantity_kg': round(row['quantity_kg_sum'], 2)} for row in grouped]
+    return sorted(rows, key=lambda row: -row['quantity_kg'])
+
+
+@_cached
+def middleman_turnover(start, end, limit):
+    """Completed sales bought and sold per middleman, by revenue."""
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    table = _scan('transactions', ['from_user_id', 'to_user_id', 'quantity_kg', 'total_amount'],
+                  'transaction_date', start, end,
+                  ds.field('payment_status') == 'completed', ds.field('transaction_type') == 'sale')
+    if table is None or table.num_rows == 0:
+        return []
+    users = pq.read_table(os.path.join(_root(), 'users.parquet'), filters=[('user_type', '=', 'middleman')])
+    middlemen = users['id']
+    usernames = dict(zip(middlemen.to_pylist(), users['username'].to_pylist()))
+    table = table.set_column(3, 'total_amount', pc.fill_null(table['total_amount'], 0.0))
+
+    rows = {}
+    for side, column in (('sold', 'from_user_id'), ('bought', 'to_user_id')):
+        side_table = table.filter(pc.is_in(table[column], value_set=middlemen.combine_chunks()))
+        for row in side_table.group_by(column).aggregate(
+                [('quantity_kg', 'sum'), ('total_amount', 'sum'), ('quantity_kg', 'count')]).to_pylist():
+            entry = rows.setdefault(row[column], {
+                'user_id': row[column], 'username': usernames.get(row[column]),
+                'bought_kg': 0.0, 'spent': 0.0, 'purchases': 0,
+                'sold_kg': 0.0, 'revenue': 0.0, 'sales': 0,
+            })
+            entry[f'{side}_kg'] = round(row['quantity_kg_sum'], 2)
+            entry['revenue' if side == 'sold' else 'spent'] = round(row['total_amount_sum'], 2)
+            entry['sales' if side == 'sold' else 'purchases'] = row['quantity_kg_count']
+    for entry in rows.values():
+        entry['margin'] = round(entry['revenue'] - entry['spent'], 2)
+    return sorted(rows.values(), key=lambda entry: (-entry['revenue'], entry['user_id']))[:limit]
+
+
+@_cached
+def qa_pass_rate(start, end):
+    """Share of quality tests passed, per spice."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    table = _scan('qa_tests', ['spice_id', 'test_result'], 'test_date', start, end)
+    if table is None or table.num_rows == 0:
+        return []
+    passed = pc.cast(pc.fill_null(pc.equal(table['test_result'], 'pass'), False), pa.int64())
+    grouped = table.append_column('passed', passed).group_by('spice_id').aggregate(
+        [('passed', 'sum'), ('passed', 'count')]).to_pylist()
+    names = _dimension('spices', 'id', 'name')
+    return sorted(({
+        'spice_id': row['spice_id'],
+        'spice_name': names.get(row['spice_id']),
+        'tests': row['passed_count'],
+        'passed': row['passed_sum'],
+        'pass_rate': round(row['passed_sum'] / row['passed_count'], 4),
+    } for row in grouped), key=lambda row: (row['spice_name'] or '', row['spice_id'] or 0))
+
+
+def init_app(app):
+    app.extensions['report_cache'] = TTLCache(maxsize=app.config['REPORT_CACHE_SIZE'])
@@ -0,0 +1,136 @@
+"""Bulk settlement of pending transactions.
+
+A buyer receiving a truckload completes its transactions together.
+``settle()`` checks the whole list with one locking query, then completes
+the valid ones with set-based statements: one UPDATE per table for the
+transactions, batches and packages, one ledger transfer for all the
+batches (``stock.transfer_many``), one price-bar merge per bar
+(``prices.record_sales``) and one multi-row INSERT each for the timeline
+and audit log. What a single completion does per row is done here per
+statement, so the cost hardly grows with the size of the delivery.
+"""
+from datetime import datetime
+
+from sqlalchemy.orm import joinedload
+
+from . import events, market, sync
+from .extensions import db
+from .models import AuditLog, Batches, Package, Timeline, Transactions
+from .prices import record_sales
+from .stock import transfer_many
+from .utils import publish_transaction
+
+
+class SettlementConflict(Exception):
+    """A transaction changed between validation and its update."""
+
+
+def _check(transaction, buyer_id):
+    """``(status, error)`` of a transaction the buyer wants to complete."""
+    if transaction is None:
+        return 404, 'Transaction not found'
+    if transaction.to_user_id != buyer_id:
+        return 403, 'Not authorized to complete this transaction'
+    if transaction.payment_status == 'completed':
+        return 400, 'Transaction already completed'
+    if transaction.payment_status != 'pending':
+        return 400, f'Transaction is {transaction.payment_status}, not pending'
+    return 200, None
+
+
+def settle(transaction_ids, buyer_id, atomic=True, ip_address=None):
+    """Complete the listed transactions (codes) for ``buyer_id``. Returns
+    ``(results, settled)``: a result per code, in order, and the completed
+    ``Transactions``. With ``atomic`` any invalid code leaves every
+    transaction pending; otherwise the valid ones are completed anyway.
+    Statements are only flushed and live events published here; call it
+    inside ``events.held()`` and send them once the caller has committed."""
+    codes = list(dict.fromkeys(transaction_ids))
+    found = {
+        transaction.transaction_id: transaction
+        for transaction in Transactions.query.filter(Transactions.transaction_id.in_(codes))
+        .options(joinedload(Transactions.batch),
+                  joinedload(Transactions.package).joinedload(Package.batch))
+        .with_for_update(of=Transactions)
+    }
+    results, valid = [], []
+    for code in codes:
+        status, error = _check(found.get(code), buyer_id)
+        result = {'transaction_id': code, 'status': status, 'settled': False}
+        if error:
+            result['error'] = error
+        else:
+            valid.append(found[code])
+        results.append(result)
+    if not valid or (atomic and len(valid) < len(codes)):
+        return results, []
+
+    completed = db.session.execute(
+        db.update(Transactions)
+        .where(Transactions.id.in_([transaction.id for transaction in valid]),
+               Transactions.payment_status == 'pending')
+        .values(payment_status='completed')
+    ).rowcount
+    if completed != len(valid):
+        raise SettlementConflict('Some transactions were completed or frozen concurrently; nothing was settled')
+
+    batches = [transaction.batch for transaction in valid if transaction.batch_id]
+    packages = [transaction.package for transaction in valid if transaction.package_id]
+    # The bulk UPDATEs below bypass the mapper events that feed delta sync
+    for transaction in valid:
+        sync.record('transaction', transaction.id, [transaction.from_user_id, buyer_id])
+    for batch in batches:
+        sync.record('batch', batch.id, [batch.current_owner_id, batch.farmer_id, buyer_id])
+    for package in packages:
+        sync.record('package', package.id, [package.current_owner_id, package.packager_id, buyer_id])
+
+    transfer_many(batches, buyer_id, {transaction.batch_id: transaction.transaction_id
+                                      for transaction in valid if transaction.batch_id})
+    for model, rows in ((Batches, batches), (Package, packages)):
+        if rows:
+            db.session.execute(
+                db.update(model).where(model.id.in_([row.id for row in rows]))
+                .values(current_owner_id=buyer_id, status='sold')
+            )
+    if batches:
+        market.touch([batch.id for batch in batches])
+    record_sales(valid)
+
+    now = datetime.utcnow()
+    db.session.execute(db.insert(Timeline), [{
+        'batch_id': transaction.batch_id,
+        'package_id': transaction.package_id,
+        'event_type': 'transaction_completed',
+        'event_description': f'Ownership transferred to user {buyer_id}',
+        'user_id': buyer_id,
+        'timestamp': now,
+        'event_metadata': {'transaction_id': transaction.transaction_id}
+    } for transaction in valid])
+    db.session.execute(db.insert(AuditLog), [{
+        'user_id': buyer_id,
+        'action': 'TRANSACTION_COMPLETED',
+        'resource_type': 'transaction',
+        'resource_id': transaction.transaction_id,
+        'ip_address': ip_address,
+        'timestamp': now
+    } for transaction in valid])
+
+    for transaction in valid:
+        publish_transaction(transaction, 'transaction_completed')
+        channels = []
+        if transaction.batch_id:
+            channels.append(f'batch:{transaction.batch_id}')
+        if transaction.package_id:
+            channels.append(f'package:{transaction.package_id}')
+        events.publish(channels, 'timeline', {
+            'batch_id': transaction.batch_id,
+            'package_id': transaction.package_id,
+            'event_type': 'transaction_completed',
+            'description': f'Ownership transferred to user {transaction.to_user_id}',
+            'user_id': transaction.to_user_id,
+            'location': None,
+            'metadata': {'transaction_id': transaction.transaction_id}
+        })
+    for result in results:
+        result['settled'] = result['status'] == 200
+    return results, valid
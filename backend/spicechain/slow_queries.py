@@ -0,0 +1,158 @@
+"""Slow-query log.
+
+Statements slower than ``SLOW_QUERY_MS`` are written as JSON lines to a
+rotating log together with their bound parameters, the Flask endpoint that
+issued them and the database's query plan. ``flask slow-queries report``
+groups the log by statement fingerprint so index work can be targeted.
+"""
+import glob
+import hashlib
+import json
+import logging
+import logging.handlers
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import click
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .instrumentation import normalize_statement
+
+def fingerprint(statement):
+    return hashlib.sha1(normalize_statement(statement).encode()).hexdigest()[:12]
+
+
+def _explain(cursor, dialect, statement, parameters, analyze=False):
+    """Return the plan for a SELECT as a list of text rows, run on the same
+    DBAPI connection so it sees the same transaction state."""
+    if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    if dialect == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif dialect == 'postgresql':
+        # ANALYZE re-executes the statement, so it is opt-in
+        prefix = 'EXPLAIN (ANALYZE, BUFFERS) ' if analyze else 'EXPLAIN '
+    else:
+        prefix = 'EXPLAIN '
+    explain_cursor = cursor.connection.cursor()
+    try:
+        explain_cursor.execute(prefix + statement, parameters)
+        rows = explain_cursor.fetchall()
+        # SQLite plan rows are (id, parent, notused, detail)
+        return [str(row[-1]) if dialect == 'sqlite' else ' '.join(str(col) for col in row) for row in rows]
+    except Exception as exc:
+        return [f'EXPLAIN failed: {exc}']
+    finally:
+        explain_cursor.close()
+
+
+# Timed on the execution context, so failed statements leave no state on
+# the pooled connection
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._slow_query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_slow_query_started', None)
+    # Each app has its own threshold and log; apps without one skip this
+    state = current_app.extensions.get('slow_queries') if has_app_context() else None
+    if state is None or started is None:
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if elapsed_ms < state['threshold']:
+        return
+    record = {
+        'timestamp': datetime.utcnow().isoformat(),
+        'duration_ms': round(elapsed_ms, 3),
+        'fingerprint': fingerprint(statement),
+        'statement': statement,
+        'parameters': repr(parameters)[:1000],
+        'endpoint': request.endpoint if has_request_context() else None,
+        'plan': None if executemany else _explain(cursor, conn.dialect.name, statement, parameters,
+                                                  state['explain_analyze']),
+    }
+    state['logger'].info(json.dumps(record))
+
+
+def init_app(app):
+    if app.config['SLOW_QUERY_MS'] is None:
+        return
+    # A logger of the app's own (not registered with logging), so apps in
+    # one process never write to each other's files
+    logger = logging.Logger(__name__, logging.INFO)
+    handler = logging.handlers.RotatingFileHandler(
+        app.config['SLOW_QUERY_LOG'], maxBytes=app.config['SLOW_QUERY_LOG_MAX_BYTES'],
+        backupCount=app.config['SLOW_QUERY_LOG_BACKUPS']
+    )
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    app.extensions['slow_queries'] = {
+        'threshold': app.config['SLOW_QUERY_MS'],
+        'explain_analyze': app.config['SLOW_QUERY_EXPLAIN_ANALYZE'],
+        'logger': logger,
+    }
+
+
+def load_records(path):
+    """Yield records from the live log and all of its rotated siblings."""
+    for filename in sorted(glob.glob(path + '*')):
+        with open(filename) as fh:
+            for line in fh:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def summarize(records):
+    groups = defaultdict(lambda: {'count': 0, 'total_ms': 0.0, 'durations': [], 'endpoints': set(), 'latest': None})
+    for record in records:
+        group = groups[record['fingerprint']]
+        group['count'] += 1
+        group['total_ms'] += record['duration_ms']
+        group['durations'].append(record['duration_ms'])
+        group['endpoints'].add(record['endpoint'] or '-')
+        if group['latest'] is None or record['timestamp'] > group['latest']['timestamp']:
+            group['latest'] = record
+    summary = []
+    for key, group in groups.items():
+        durations = sorted(group['durations'])
+        summary.append({
+            'fingerprint': key,
+            'count': group['count'],
+            'total_ms': group['total_ms'],
+            'p50_ms': durations[len(durations) // 2],
+            'max_ms': durations[-1],
+            'endpoints': sorted(group['endpoints']),
+            'statement': normalize_statement(group['latest']['statement']),
+            'plan': group['latest']['plan'],
+        })
+    return summary
+
+
+@click.group('slow-queries')
+def slow_queries_group():
+    """Inspect the slow-query log."""
+
+
+@slow_queries_group.command('report')
+@click.option('--log', 'log_path', default=None, help='Log file (defaults to SLOW_QUERY_LOG).')
+@click.option('--top', default=10, show_default=True)
+@click.option('--sort', 'sort_key', type=click.Choice(['total_ms', 'count', 'max_ms']), default='total_ms', show_default=True)
+def report_command(log_path, top, sort_key):
+    """Group slow queries by fingerprint, worst first."""
+    summary = summarize(load_records(log_path or current_app.config['SLOW_QUERY_LOG']))
+    summary.sort(key=lambda row: row[sort_key], reverse=True)
+    for row in summary[:top]:
+        click.echo(f"[{row['fingerprint']}] {row['count']}x  total {row['total_ms']:.1f} ms  "
+                   f"p50 {row['p50_ms']:.1f} ms  max {row['max_ms']:.1f} ms  "
+                   f"endpoints: {', '.join(row['endpoints'])}")
+        click.echo(f"    {row['statement']}")
+        for line in row['plan'] or []:
+            click.echo(f'      plan: {line}')
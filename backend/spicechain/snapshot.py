@@ -0,0 +1,276 @@
+"""Columnar snapshot of the reporting tables.
+
+``flask snapshot run`` (from cron, or with ``--every`` as a loop) copies
+``batches``, ``transactions``, ``qa_test`` and ``timeline`` into Parquet
+files under ``SNAPSHOT_DIR``, Hive-partitioned by month
+(``<table>/month=YYYY-MM/data.parquet``), plus small ``users`` and
+``spices`` dimension files. ``spicechain.reports`` answers its queries
+from these files alone, so reporting never holds a read transaction on
+the live database.
+
+Runs are incremental. A ``Watermark`` per table holds the highest id
+exported; rows above it are new. Batches and transactions also change in
+place, and the sync change feed (``SyncChange``, see spicechain.sync)
+already lists every one that did, so ids changed since the
+``snapshot:changes`` watermark are re-exported too. Only the month
+partitions holding new or changed rows are rewritten. If the change feed
+was pruned past the watermark, or with ``--full``, the table is rebuilt;
+timeline months already moved to the archive's cold tier are copied back
+in from its Parquet files.
+``manifest.json`` is replaced last and names the snapshot readers see.
+"""
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+
+from . import archive, jobs
+from .extensions import db
+from .models import BatchComposition, Batches, QATest, Spices, SyncChange, Timeline, Transactions, User, Watermark
+from .rawjson import raw_column
+from .sync import PRUNED
+
+JOB = 'snapshot'
+CHANGES = f'{JOB}:changes'
+
+
+def _tables():
+    harvest = db.and_(Batches.parent_batch_id.is_(None),
+                      ~db.exists().where(BatchComposition.child_batch_id == Batches.id))
+    return {
+        'batches': {
+            'model': Batches,
+            'columns': [Batches.id, Batches.batch_id, Batches.farmer_id, Batches.spice_id, Batches.quantity_kg,
+                        Batches.harvest_date, Batches.farm_location, Batches.farming_method,
+                        Batches.estimated_grade, Batches.current_owner_id, Batches.status,
+                        Batches.parent_batch_id, Batches.created_at,
+                        # Registered harvests, as opposed to divisions and blends
+                        harvest.label('is_harvest')],
+            'month': Batches.harvest_date,
+            'entity': 'batch',
+        },
+        'transactions': {
+            'model': Transactions,
+            'columns': [Transactions.id, Transactions.transaction_id, Transactions.from_user_id,
+                        Transactions.to_user_id, Transactions.batch_id, Transactions.package_id,
+                        Transactions.quantity_kg, Transactions.price_per_kg, Transactions.total_amount,
+                        Transactions.transaction_type, Transactions.payment_status, Transactions.transaction_date],
+            'month': Transactions.transaction_date,
+            'entity': 'transaction',
+        },
+        'qa_tests': {
+            'model': QATest,
+            'columns': [QATest.id, QATest.test_id, QATest.batch_id, Batches.spice_id, QATest.tester_id,
+                        QATest.test_date, QATest.test_type, QATest.test_result, QATest.grade_assigned,
+                        QATest.moisture_content, QATest.purity_percentage],
+            'join': (Batches, Batches.id == QATest.batch_id),
+            'month': QATest.test_date,
+            'entity': None,
+        },
+        'timeline': {
+            'model': Timeline,
+            'columns': [Timeline.id, Timeline.batch_id, Timeline.package_id, Timeline.event_type,
+                        Timeline.user_id, Timeline.location, Timeline.timestamp,
+                        raw_column(Timeline.event_metadata).label('event_metadata')],
+            'month': Timeline.timestamp,
+            'entity': None,
+            # Months moved to the cold tier (snapshot column -> archive column)
+            'archive': ('timeline', {'event_metadata': 'metadata'}),
+        },
+    }
+
+
+_DIMENSIONS = {
+    'users': (User.id, User.username, User.user_type),
+    'spices': (Spices.id, Spices.name),
+}
+
+
+def _arrow_type(column):
+    import pyarrow as pa
+
+    python_type = column.type.python_type
+    if python_type is bool:
+        return pa.bool_()
+    if python_type is int:
+        return pa.int64()
+    if python_type is float:
+        return pa.float64()
+    if python_type is datetime:
+        return pa.timestamp('us')
+    return pa.string()
+
+
+def _schema(columns):
+    import pyarrow as pa
+
+    return pa.schema([(column.key, _arrow_type(column)) for column in columns])
+
+
+def _to_arrow(rows, schema):
+    import pyarrow as pa
+
+    if not rows:
+        return schema.empty_table()
+    return pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)],
+                                schema=schema)
+
+
+def _select(spec, criteria):
+    query = db.select(*spec['columns'], spec['month'].label('_month_date')).select_from(spec['model'])
+    if 'join' in spec:
+        query = query.outerjoin(*spec['join'])
+    return query.where(criteria)
+
+
+def _fetch(spec, schema, criteria, chunk=50000):
+    """Rows matching ``criteria`` as an Arrow table with a ``month`` key."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    month_schema = schema.append(pa.field('_month_date', pa.timestamp('us')))
+    pieces = [_to_arrow(rows, month_schema) for rows in db.session.execute(
+        _select(spec, criteria).execution_options(yield_per=chunk)
+    ).partitions()]
+    table = pa.concat_tables(pieces) if pieces else month_schema.empty_table()
+    month = pc.fill_null(pc.strftime(table['_month_date'], format='%Y-%m'), 'none')
+    return table.drop_columns(['_month_date']).append_column('month', month)
+
+
+def _write(path, table):
+    import pyarrow.parquet as pq
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(table, path + '.tmp', compression='zstd')
+    os.replace(path + '.tmp', path)
+
+
+def _merge(directory, table, replaced_ids):
+    """Write ``table`` into its month partitions, replacing rows whose id
+    is in ``replaced_ids``. Returns the partitions rewritten."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    months = pc.unique(table['month']).to_pylist()
+    for month in months:
+        rows = table.filter(pc.equal(table['month'], month)).drop_columns(['month'])
+        path = os.path.join(directory, f'month={month}', 'data.parquet')
+        if os.path.exists(path):
+            existing = pq.read_table(path, schema=rows.schema)
+            existing = existing.filter(pc.invert(pc.is_in(existing['id'], value_set=replaced_ids)))
+            rows = pa.concat_tables([existing, rows])
+        _write(path, rows.sort_by('id'))
+    return len(months)
+
+
+def _restore_archived(directory, archived, schema):
+    """Merge the archived months of a table back in after a rebuild, which
+    only sees the rows still in the live table."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    table_name, renamed = archived
+    rows = partitions = 0
+    for month, table in archive.read_partitions(table_name, [renamed.get(name, name) for name in schema.names]):
+        table = table.rename_columns(schema.names).cast(schema)
+        table = table.append_column('month', pc.fill_null(pc.strftime(table['timestamp'], format='%Y-%m'), 'none'))
+        rows += table.num_rows
+        partitions += _merge(directory, table, pa.array([], pa.int64()))
+    return rows, partitions
+
+
+def _watermark(name):
+    mark = db.session.get(Watermark, name)
+    return mark.last_id if mark else 0
+
+
+def _set_watermark(name, last_id):
+    db.session.merge(Watermark(name=name, last_id=last_id, updated_at=datetime.utcnow()))
+
+
+def run(full=False):
+    """Bring the snapshot up to date. Returns ``{table: (rows written,
+    partitions rewritten)}``."""
+    import pyarrow as pa
+
+    root = current_app.config['SNAPSHOT_DIR']
+    last_change = _watermark(CHANGES)
+    # Changes before the oldest kept one are gone; diffing would miss them
+    full = full or last_change < _watermark(PRUNED)
+    max_change = db.session.execute(db.select(db.func.max(SyncChange.id))).scalar() or 0
+    report = {}
+
+    for name, spec in _tables().items():
+        model = spec['model']
+        directory = os.path.join(root, name)
+        schema = _schema(spec['columns'])
+        max_id = db.session.execute(db.select(db.func.max(model.id))).scalar() or 0
+        last_id = 0 if full else _watermark(f'{JOB}:{name}')
+
+        if last_id == 0:
+            table = _fetch(spec, schema, model.id <= max_id)
+            shutil.rmtree(directory, ignore_errors=True)
+            report[name] = (table.num_rows, _merge(directory, table, pa.array([], pa.int64())))
+            if 'archive' in spec:
+                rows, partitions = _restore_archived(directory, spec['archive'], schema)
+                report[name] = (report[name][0] + rows, report[name][1] + partitions)
+        else:
+            criteria = db.and_(model.id > last_id, model.id <= max_id)
+            changed = []
+            if spec['entity'] and max_change > last_change:
+                changed = db.session.execute(
+                    db.select(SyncChange.entity_id).distinct().where(
+                        SyncChange.entity_type == spec['entity'], SyncChange.id > last_change,
+                        SyncChange.id <= max_change, SyncChange.entity_id <= last_id)
+                ).scalars().all()
+            tables = [_fetch(spec, schema, criteria)]
+            for start in range(0, len(changed), 500):
+                tables.append(_fetch(spec, schema, model.id.in_(changed[start:start + 500])))
+            table = pa.concat_tables(tables)
+            report[name] = (table.num_rows, _merge(directory, table, table['id'].combine_chunks()))
+        _set_watermark(f'{JOB}:{name}', max_id)
+
+    for name, columns in _DIMENSIONS.items():
+        schema = _schema(columns)
+        _write(os.path.join(root, f'{name}.parquet'), _to_arrow(db.session.execute(db.select(*columns)).all(), schema))
+
+    manifest = {'snapshot_at': datetime.utcnow().isoformat(),
+                'changed_rows': {name: rows for name, (rows, _) in report.items()}}
+    with open(os.path.join(root, 'manifest.json.tmp'), 'w') as f:
+        json.dump(manifest, f)
+    os.replace(os.path.join(root, 'manifest.json.tmp'), os.path.join(root, 'manifest.json'))
+    _set_watermark(CHANGES, max_change)
+    db.session.commit()
+    return report
+
+
+@jobs.task('snapshot')
+def run_job(full=False):
+    return {name: rows for name, (rows, _) in run(full).items()}
+
+
+@click.group('snapshot')
+def snapshot_group():
+    """Columnar reporting snapshot."""
+
+
+@snapshot_group.command('run')
+@click.option('--full', is_flag=True, help='Rebuild every table instead of applying changes.')
+@click.option('--every', type=int, default=None, help='Keep running, once per this many seconds.')
+def run_command(full, every):
+    """Export new and changed rows to the snapshot."""
+    while True:
+        started = time.perf_counter()
+        for name, (rows, partitions) in run(full).items():
+            click.echo(f'{name:12} {rows:9} rows  {partitions:4} partitions rewritten')
+        click.echo(f'snapshot done in {time.perf_counter() - started:.1f} s')
+        if every is None:
+            return
+        full = False
+        db.session.remove()
+        time.sleep(every)
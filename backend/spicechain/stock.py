@@ -0,0 +1,323 @@
+"""Inventory ledger.
+
+Every change to how much of a batch is available, and who holds it, is an
+append-only ``StockLedger`` row. Two materialized balances are kept in step
+with it inside the same DB transaction: ``BatchStock`` (per batch) and
+``OwnerStock`` (per owner and spice), so stock reads are primary-key
+lookups instead of sums. Balances are changed with relative UPDATEs
+(``quantity_kg = quantity_kg - x``), guarded so a batch can never go
+negative even under concurrent requests.
+
+``Batches.quantity_kg`` is the quantity the batch was created with and is
+no longer mutated. Batches from before the ledger get an ``opening`` entry
+on first use, or all at once from ``flask stock reconcile``; their
+divisions and merges from before it reduced ``quantity_kg`` in place, which
+``original_quantities()`` adds back.
+"""
+from datetime import datetime
+
+import click
+
+from .extensions import db
+from .market import touch
+from .sync import record as record_change
+from .models import BatchComposition, BatchStock, Batches, OwnerStock, Spices, StockLedger
+
+# Float quantities: treat anything closer than this as equal
+EPSILON = 1e-6
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+def _record(batch_id, owner_id, delta_kg, reason, reference):
+    touch([batch_id])
+    record_change('batch', batch_id, [owner_id])
+    db.session.execute(db.insert(StockLedger).values(
+        batch_id=batch_id, owner_id=owner_id, delta_kg=delta_kg, reason=reason,
+        reference=reference, created_at=datetime.utcnow()
+    ))
+
+
+def _adjust_owner(owner_id, spice_id, delta_kg, batches=0):
+    key = (OwnerStock.owner_id == owner_id, OwnerStock.spice_id == spice_id)
+    updated = db.session.execute(
+        db.update(OwnerStock).where(*key).values(
+            quantity_kg=OwnerStock.quantity_kg + delta_kg,
+            batches=OwnerStock.batches + batches
+        ).execution_options(synchronize_session=False)
+    ).rowcount
+    if not updated:
+        db.session.execute(db.insert(OwnerStock).values(
+            owner_id=owner_id, spice_id=spice_id, quantity_kg=delta_kg, batches=batches
+        ))
+
+
+def open_batch(batch, reason, reference=None):
+    """Start the balance of a newly created (flushed) batch at its quantity."""
+    db.session.execute(db.insert(BatchStock).values(
+        batch_id=batch.id, owner_id=batch.current_owner_id, spice_id=batch.spice_id,
+        quantity_kg=batch.quantity_kg, updated_at=datetime.utcnow()
+    ))
+    _adjust_owner(batch.current_owner_id, batch.spice_id, batch.quantity_kg, batches=1)
+    _record(batch.id, batch.current_owner_id, batch.quantity_kg, reason, reference)
+
+
+def _open_batches(batches):
+    """``open_batch()`` with an ``opening`` entry for many batches at once."""
+    now = datetime.utcnow()
+    db.session.execute(db.insert(BatchStock), [{
+        'batch_id': batch.id, 'owner_id': batch.current_owner_id, 'spice_id': batch.spice_id,
+        'quantity_kg': batch.quantity_kg, 'updated_at': now
+    } for batch in batches])
+    totals = {}
+    for batch in batches:
+        quantity_kg, count = totals.get((batch.current_owner_id, batch.spice_id), (0.0, 0))
+        totals[batch.current_owner_id, batch.spice_id] = (quantity_kg + batch.quantity_kg, count + 1)
+        record_change('batch', batch.id, [batch.current_owner_id])
+    for (owner_id, spice_id), (quantity_kg, count) in totals.items():
+        _adjust_owner(owner_id, spice_id, quantity_kg, batches=count)
+    touch([batch.id for batch in batches])
+    db.session.execute(db.insert(StockLedger), [{
+        'batch_id': batch.id, 'owner_id': batch.current_owner_id, 'delta_kg': batch.quantity_kg,
+        'reason': 'opening', 'reference': batch.batch_id, 'created_at': now
+    } for batch in batches])
+
+
+def _ensure_opened(batch):
+    exists = db.session.execute(
+        db.select(BatchStock.batch_id).where(BatchStock.batch_id == batch.id)
+    ).first()
+    if exists is None:
+        open_batch(batch, 'opening', batch.batch_id)
+
+
+def take(batch, quantity_kg, reason, reference=None):
+    """Deduct ``quantity_kg`` from the batch's balance, or raise
+    ``InsufficientStock`` without changing anything."""
+    _ensure_opened(batch)
+    updated = db.session.execute(
+        db.update(BatchStock).where(
+            BatchStock.batch_id == batch.id,
+            BatchStock.quantity_kg >= quantity_kg - EPSILON
+        ).values(
+            quantity_kg=BatchStock.quantity_kg - quantity_kg,
+            updated_at=datetime.utcnow()
+        ).execution_options(synchronize_session=False)
+    ).rowcount
+    if not updated:
+        raise InsufficientStock(f'Insufficient stock in batch {batch.batch_id}')
+    _adjust_owner(batch.current_owner_id, batch.spice_id, -quantity_kg)
+    _record(batch.id, batch.current_owner_id, -quantity_kg, reason, reference)
+
+
+def transfer(batch, to_user_id, reference=None):
+    """Move the batch and its whole balance to ``to_user_id``."""
+    transfer_many([batch], to_user_id, {batch.id: reference})
+
+
+def transfer_many(batches, to_user_id, references=None):
+    """``transfer()`` for many batches at once: one UPDATE of their
+    balances, one ledger insert, and one owner-balance adjustment per
+    previous owner and spice. ``references`` maps batch ids to the
+    reference of their ledger rows."""
+    references = references or {}
+    by_id = {batch.id: batch for batch in batches}
+    if not by_id:
+        return
+    opened = set(db.session.execute(
+        db.select(BatchStock.batch_id).where(BatchStock.batch_id.in_(by_id))
+    ).scalars())
+    if len(opened) < len(by_id):
+        _open_batches([batch for batch_id, batch in by_id.items() if batch_id not in opened])
+    moving = db.session.execute(
+        db.select(BatchStock.batch_id, BatchStock.owner_id, BatchStock.quantity_kg)
+        .where(BatchStock.batch_id.in_(by_id), BatchStock.owner_id != to_user_id).with_for_update()
+    ).all()
+    if not moving:
+        return
+    now = datetime.utcnow()
+    db.session.execute(
+        db.update(BatchStock).where(BatchStock.batch_id.in_([batch_id for batch_id, _, _ in moving]))
+        .values(owner_id=to_user_id, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+
+    outgoing, incoming, ledger = {}, {}, []
+    for batch_id, owner_id, quantity in moving:
+        spice_id = by_id[batch_id].spice_id
+        for totals, key in ((outgoing, (owner_id, spice_id)), (incoming, spice_id)):
+            quantity_kg, count = totals.get(key, (0.0, 0))
+            totals[key] = (quantity_kg + quantity, count + 1)
+        for holder_id, delta_kg in ((owner_id, -quantity), (to_user_id, quantity)):
+            ledger.append({'batch_id': batch_id, 'owner_id': holder_id, 'delta_kg': delta_kg, 'reason': 'transfer',
+                           'reference': references.get(batch_id), 'created_at': now})
+        record_change('batch', batch_id, [owner_id, to_user_id])
+    for (owner_id, spice_id), (quantity, count) in outgoing.items():
+        _adjust_owner(owner_id, spice_id, -quantity, batches=-count)
+    for spice_id, (quantity, count) in incoming.items():
+        _adjust_owner(to_user_id, spice_id, quantity, batches=count)
+    touch([batch_id for batch_id, _, _ in moving])
+    db.session.execute(db.insert(StockLedger), ledger)
+
+
+def balances(batches):
+    """``{batch.id: available kg}``; batches not yet on the ledger report
+    their recorded quantity."""
+    stored = dict(db.session.execute(
+        db.select(BatchStock.batch_id, BatchStock.quantity_kg)
+        .where(BatchStock.batch_id.in_([batch.id for batch in batches]))
+    ).all())
+    return {batch.id: stored.get(batch.id, batch.quantity_kg) for batch in batches}
+
+
+def available(batch):
+    return balances([batch])[batch.id]
+
+
+def original_quantities(batches):
+    """``{batch.id: kg the batch was created with}``. Batches older than the
+    ledger had ``quantity_kg`` reduced in place by each division and merge;
+    those made before the batch's ``opening`` entry (all of them, if it has
+    no ledger rows yet) are added back."""
+    ids = [batch.id for batch in batches]
+    opened = (
+        db.select(StockLedger.batch_id,
+                  db.func.min(db.case((StockLedger.reason == 'opening', StockLedger.created_at))).label('at'))
+        .where(StockLedger.batch_id.in_(ids))
+        .group_by(StockLedger.batch_id)
+    ).subquery()
+    taken = db.union_all(
+        db.select(Batches.parent_batch_id.label('batch_id'), Batches.quantity_kg, Batches.created_at)
+        .where(Batches.parent_batch_id.in_(ids)),
+        db.select(BatchComposition.source_batch_id, BatchComposition.quantity_kg, BatchComposition.created_at)
+        .where(BatchComposition.source_batch_id.in_(ids))
+    ).subquery()
+    legacy = dict(db.session.execute(
+        db.select(taken.c.batch_id, db.func.sum(taken.c.quantity_kg))
+        .outerjoin(opened, opened.c.batch_id == taken.c.batch_id)
+        .where(db.or_(opened.c.batch_id.is_(None), taken.c.created_at < opened.c.at))
+        .group_by(taken.c.batch_id)
+    ).all())
+    return {batch.id: batch.quantity_kg + legacy.get(batch.id, 0.0) for batch in batches}
+
+
+def original_quantity(batch):
+    return original_quantities([batch])[batch.id]
+
+
+def stock_by_spice(owner_id):
+    rows = db.session.execute(
+        db.select(Spices.name, OwnerStock.batches, OwnerStock.quantity_kg)
+        .join(Spices, Spices.id == OwnerStock.spice_id)
+        .where(OwnerStock.owner_id == owner_id, OwnerStock.batches > 0)
+        .order_by(Spices.id)
+    )
+    return [{'spice_name': name, 'batches': count, 'quantity_kg': qty} for name, count, qty in rows]
+
+
+def backfill_openings():
+    """Give every batch without ledger rows an opening entry for its
+    recorded quantity. Returns the number of batches opened."""
+    missing = db.select(Batches.id).where(
+        ~db.exists().where(StockLedger.batch_id == Batches.id)
+    )
+    count = db.session.execute(db.select(db.func.count()).select_from(missing.subquery())).scalar()
+    if count:
+        db.session.execute(db.insert(StockLedger).from_select(
+            ['batch_id', 'owner_id', 'delta_kg', 'reason', 'reference', 'created_at'],
+            db.select(Batches.id, Batches.current_owner_id, Batches.quantity_kg, db.literal('opening'),
+                      Batches.batch_id, db.literal(datetime.utcnow()))
+            .where(Batches.id.in_(missing))
+        ))
+    return count
+
+
+def _fix_batch_balances(computed, report):
+    stored = {row.batch_id: row for row in db.session.execute(
+        db.select(BatchStock.batch_id, BatchStock.owner_id, BatchStock.quantity_kg)
+        .where(BatchStock.batch_id.in_(list(computed)))
+    )}
+    inserts, updates = [], []
+    for batch_id, (owner_id, spice_id, quantity) in computed.items():
+        row = stored.get(batch_id)
+        values = {'batch_id': batch_id, 'owner_id': owner_id, 'quantity_kg': quantity,
+                  'updated_at': datetime.utcnow()}
+        if row is None:
+            inserts.append({**values, 'spice_id': spice_id})
+        elif row.owner_id != owner_id or abs(row.quantity_kg - quantity) > EPSILON:
+            updates.append(values)
+    if inserts:
+        db.session.execute(db.insert(BatchStock), inserts)
+    if updates:
+        db.session.execute(db.update(BatchStock), updates)
+    touch(values['batch_id'] for values in inserts + updates)
+    for values in inserts + updates:
+        record_change('batch', values['batch_id'], [values['owner_id']])
+    report['batches'] += len(computed)
+    report['batch_rows_fixed'] += len(inserts) + len(updates)
+
+
+def reconcile(chunk_size=10000):
+    """Recompute both balance tables from the ledger in one streaming pass
+    (ledger ordered by batch) and rewrite rows that drifted."""
+    report = {'opened': backfill_openings(), 'batches': 0, 'batch_rows_fixed': 0, 'owner_rows_fixed': 0}
+
+    rows = db.session.execute(
+        db.select(StockLedger.batch_id, StockLedger.owner_id, StockLedger.delta_kg, Batches.spice_id)
+        .join(Batches, Batches.id == StockLedger.batch_id)
+        .order_by(StockLedger.batch_id, StockLedger.id),
+        execution_options={'yield_per': chunk_size}
+    )
+    computed, owner_totals = {}, {}
+    for batch_id, owner_id, delta, spice_id in rows:
+        # The latest entry of a batch names its current holder
+        _, _, quantity = computed.get(batch_id, (None, None, 0.0))
+        computed[batch_id] = (owner_id, spice_id, quantity + delta)
+        owner_totals[owner_id, spice_id] = owner_totals.get((owner_id, spice_id), 0.0) + delta
+        if len(computed) > chunk_size:
+            # Rows arrive grouped by batch, so all but the current one are final
+            current = computed.pop(batch_id)
+            _fix_batch_balances(computed, report)
+            computed = {batch_id: current}
+    if computed:
+        _fix_batch_balances(computed, report)
+
+    batch_counts = {(owner_id, spice_id): count for owner_id, spice_id, count in db.session.execute(
+        db.select(BatchStock.owner_id, BatchStock.spice_id, db.func.count())
+        .group_by(BatchStock.owner_id, BatchStock.spice_id)
+    )}
+    stored = {(row.owner_id, row.spice_id): row for row in db.session.execute(
+        db.select(OwnerStock.owner_id, OwnerStock.spice_id, OwnerStock.batches, OwnerStock.quantity_kg)
+    )}
+    inserts, updates = [], []
+    for key in owner_totals.keys() | batch_counts.keys() | stored.keys():
+        values = {'owner_id': key[0], 'spice_id': key[1],
+                  'quantity_kg': owner_totals.get(key, 0.0), 'batches': batch_counts.get(key, 0)}
+        row = stored.get(key)
+        if row is None:
+            inserts.append(values)
+        elif row.batches != values['batches'] or abs(row.quantity_kg - values['quantity_kg']) > EPSILON:
+            updates.append(values)
+    if inserts:
+        db.session.execute(db.insert(OwnerStock), inserts)
+    if updates:
+        db.session.execute(db.update(OwnerStock), updates)
+    report['owner_rows_fixed'] = len(inserts) + len(updates)
+    db.session.commit()
+    return report
+
+
+@click.group('stock')
+def stock_group():
+    """Inventory ledger maintenance."""
+
+
+@stock_group.command('reconcile')
+@click.option('--chunk-size', default=10000, show_default=True)
+def reconcile_command(chunk_size):
+    """Rebuild batch and owner balances from the ledger."""
+    report = reconcile(chunk_size)
+    click.echo(f"{report['batches']} batches checked ({report['opened']} given opening entries); "
+               f"fixed {report['batch_rows_fixed']} batch and {report['owner_rows_fixed']} owner balances")
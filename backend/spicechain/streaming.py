@@ -0,0 +1,96 @@
+"""Streamed JSON and NDJSON responses for long traces and histories.
+
+``stream_response(payload)`` takes the dict a view would hand to
+``jsonify`` in which the long lists (a family's timeline, a package's
+journey) are generators instead, typically over
+``archive.iter_timeline_events``. The body is written as the generators
+produce: everything before the first list goes out at once, then the
+items in pieces of ``STREAM_BUFFER_BYTES`` under chunked transfer
+encoding, so neither the events nor the encoded body are ever held
+whole. Items go through ``app.json`` one at a time, so ``RawJSON``
+metadata is still spliced in verbatim, and keys are sorted and separators
+compact: the body is byte for byte what ``jsonify`` returns outside debug
+mode.
+
+With ``?format=ndjson`` (or an ``Accept`` header preferring
+``application/x-ndjson``) the first line is the payload without its
+lists and every further line one list item, so clients can process a
+history as it arrives.
+"""
+from collections.abc import Iterator
+
+from flask import Response, current_app, request, stream_with_context
+
+NDJSON = 'application/x-ndjson'
+_FLUSH = None  # a piece that sends what has been buffered so far
+
+
+def wants_ndjson():
+    """Whether the client asked for NDJSON instead of one JSON document."""
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON
+
+
+def _dumps(obj):
+    return current_app.json.dumps(obj, separators=(',', ':'))
+
+
+def _streamed(value):
+    # Lists and dicts are encoded in one go; only lazy values are streamed
+    return isinstance(value, Iterator)
+
+
+def _json_pieces(payload):
+    yield '{'
+    for index, key in enumerate(sorted(payload)):
+        value = payload[key]
+        yield (',' if index else '') + _dumps(key) + ':'
+        if not _streamed(value):
+            yield _dumps(value)
+            continue
+        yield '['
+        yield _FLUSH
+        for position, item in enumerate(value):
+            yield (',' if position else '') + _dumps(item)
+        yield ']'
+    yield '}\n'
+
+
+def _ndjson_pieces(payload):
+    yield _dumps({key: value for key, value in payload.items() if not _streamed(value)}) + '\n'
+    yield _FLUSH
+    for key in sorted(payload):
+        if _streamed(payload[key]):
+            for item in payload[key]:
+                yield _dumps(item) + '\n'
+
+
+def _buffered(pieces, size):
+    buffer, length = [], 0
+    for piece in pieces:
+        if piece is _FLUSH:
+            if buffer:
+                yield ''.join(buffer)
+                buffer, length = [], 0
+            continue
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream_response(payload, status=200, ndjson=None):
+    """A streamed response for ``payload``, a dict whose iterator values
+    are encoded as JSON arrays item by item. ``ndjson`` defaults to what
+    the request asked for. The generators run after the view has
+    returned, inside its request context."""
+    if ndjson is None:
+        ndjson = wants_ndjson()
+    pieces = _ndjson_pieces(payload) if ndjson else _json_pieces(payload)
+    body = _buffered(pieces, current_app.config['STREAM_BUFFER_BYTES'])
+    return Response(stream_with_context(body), status=status,
+                    mimetype=NDJSON if ndjson else 'application/json')
@@ -0,0 +1,354 @@
+"""Delta sync for offline field devices.
+
+Every write to a batch, package or transaction appends one ``SyncChange``
+row per user who can see the row before or after the write (owners,
+farmer/packager, both transaction parties). The autoincrement id is the
+sync token: a device sends the highest id it has seen and gets back the
+current state of just the entities changed since, plus ids that are no
+longer visible to it (sold on, transferred away). Reconnect cost follows
+the number of changes, not the size of the holdings.
+
+ORM writes are captured by mapper events; ledger movements (which change
+a batch's available kg without touching its row) by ``spicechain.stock``;
+set-based writers call ``record_where()``. ``flask sync prune`` drops old
+changes and clients holding an older token are told to resync from
+scratch.
+
+Ids are allocated when a change row is inserted but become visible when
+its transaction commits, and on PostgreSQL a lower id can commit after a
+higher one has been read; a token past it would skip it for good. Only
+changes older than ``SYNC_VISIBILITY_LAG_SECONDS`` are therefore handed
+out (and counted in tokens). Change rows are stamped as they are
+inserted, so a change can only be missed if its transaction stays open
+longer than the lag after writing it, or if web servers' clocks drift
+apart by more than that. Later changes are simply delivered on the next
+sync.
+
+Offline operations come back through ``apply_operations()``, which replays
+them through the normal views inside a single transaction and remembers
+each ``op_id`` so a resent queue is applied once.
+"""
+import json
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, g, request
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from . import events
+from .extensions import db
+from .models import BatchStock, Batches, Package, Spices, SyncChange, SyncOperation, Transactions, User, Watermark
+
+PRUNED = 'sync:pruned'
+_PENDING = 'sync_pending_changes'
+
+# Users who see a row, and the columns naming them
+AUDIENCE = {
+    Batches: ('batch', ('current_owner_id', 'farmer_id')),
+    Package: ('package', ('current_owner_id', 'packager_id')),
+    Transactions: ('transaction', ('from_user_id', 'to_user_id')),
+}
+
+# Offline operation type -> (endpoint, request body kind, view arg taken from the data)
+OPERATIONS = {
+    'register': ('batches.register_batch', 'form', None),
+    'divide': ('batches.divide_batch', 'json', None),
+    'sell': ('batches.sell_individual_batch', 'json', 'batch_id'),
+    'package': ('packages.create_package', 'json', None),
+}
+
+
+def _rows(entity_type, entity_id, user_ids):
+    now = datetime.utcnow()
+    return [{'user_id': user_id, 'entity_type': entity_type, 'entity_id': entity_id, 'created_at': now}
+            for user_id in set(user_ids) if user_id is not None]
+
+
+def record(entity_type, entity_id, user_ids):
+    """Queue a change for ``user_ids``; written when the transaction commits."""
+    db.session.info.setdefault(_PENDING, []).extend(_rows(entity_type, entity_id, user_ids))
+
+
+def _written(mapper, connection, target):
+    entity_type, columns = AUDIENCE[mapper.class_]
+    state = inspect(target)
+    users = [getattr(target, column) for column in columns]
+    # A new owner's change must also reach the previous one
+    users += [old for column in columns for old in state.attrs[column].history.deleted]
+    object_session(target).info.setdefault(_PENDING, []).extend(_rows(entity_type, target.id, users))
+
+
+for model in AUDIENCE:
+    event.listen(model, 'after_insert', _written)
+    event.listen(model, 'after_update', _written)
+
+
+@event.listens_for(Session, 'before_commit')
+def _write_pending(session):
+    # One executemany per commit rather than an INSERT per written row
+    session.flush()
+    rows = session.info.pop(_PENDING, None)
+    if rows:
+        # Stamped at insert: the visibility lag counts from here
+        now = datetime.utcnow()
+        session.execute(db.insert(SyncChange), [{**row, 'created_at': now} for row in rows])
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop(_PENDING, None)
+
+
+def record_where(model, criteria):
+    """Record changes for every row of ``model`` matching ``criteria``;
+    call before a bulk UPDATE that bypasses the ORM."""
+    entity_type, columns = AUDIENCE[model]
+    now = datetime.utcnow()
+    for column in columns:
+        db.session.execute(db.insert(SyncChange).from_select(
+            ['user_id', 'entity_type', 'entity_id', 'created_at'],
+            db.select(getattr(model, column), db.literal(entity_type), model.id, db.literal(now))
+            .where(criteria, getattr(model, column).isnot(None))
+        ))
+
+
+def _horizon():
+    """Changes stamped after this may still have uncommitted predecessors."""
+    return datetime.utcnow() - timedelta(seconds=current_app.config['SYNC_VISIBILITY_LAG_SECONDS'])
+
+
+def latest_token():
+    return db.session.execute(
+        db.select(db.func.coalesce(db.func.max(SyncChange.id), 0)).where(SyncChange.created_at <= _horizon())
+    ).scalar()
+
+
+def _visible(user_id):
+    return {
+        'batch': Batches.current_owner_id == user_id,
+        'package': Package.current_owner_id == user_id,
+        'transaction': db.or_(Transactions.from_user_id == user_id, Transactions.to_user_id == user_id),
+    }
+
+
+def _batches(criteria):
+    from .stock import original_quantities
+
+    rows = db.session.execute(
+        db.select(Batches, Spices.name, db.func.coalesce(BatchStock.quantity_kg, Batches.quantity_kg))
+        .outerjoin(Spices, Spices.id == Batches.spice_id)
+        .outerjoin(BatchStock, BatchStock.batch_id == Batches.id)
+        .where(criteria)
+    ).all()
+    originals = original_quantities([batch for batch, _, _ in rows])
+    return [{
+        'id': batch.id,
+        'batch_id': batch.batch_id,
+        'spice_name': spice_name or f'Unknown Spice (ID: {batch.spice_id})',
+        'quantity_kg': quantity,
+        'original_quantity_kg': originals[batch.id],
+        'harvest_date': batch.harvest_date.isoformat(),
+        'status': batch.status,
+        'estimated_grade': batch.estimated_grade
+    } for batch, spice_name, quantity in rows]
+
+
+def _packages(criteria):
+    rows = db.session.execute(
+        db.select(Package, Spices.name).join(Batches, Batches.id == Package.batch_id)
+        .outerjoin(Spices, Spices.id == Batches.spice_id).where(criteria)
+    ).all()
+    return [{
+        'id': package.id,
+        'package_id': package.package_id,
+        'spice_name': spice_name or f'Unknown Spice (ID: {package.batch.spice_id})',
+        'quantity_kg': package.quantity_kg,
+        'package_type': package.package_type,
+        'status': package.status,
+        'package_date': package.package_date.isoformat()
+    } for package, spice_name in rows]
+
+
+def _transactions(criteria, user_id):
+    sender, receiver = db.aliased(User), db.aliased(User)
+    package_batch = db.aliased(Batches)
+    rows = db.session.execute(
+        db.select(Transactions, sender.username, receiver.username, Batches.batch_id, Package.package_id, Spices.name)
+        .join(sender, sender.id == Transactions.from_user_id)
+        .join(receiver, receiver.id == Transactions.to_user_id)
+        .outerjoin(Batches, Batches.id == Transactions.batch_id)
+        .outerjoin(Package, Package.id == Transactions.package_id)
+        .outerjoin(package_batch, package_batch.id == Package.batch_id)
+        .outerjoin(Spices, Spices.id == db.func.coalesce(Batches.spice_id, package_batch.spice_id))
+        .where(criteria)
+    ).all()
+    result = []
+    for txn, from_user, to_user, batch_code, package_code, spice_name in rows:
+        txn_data = {
+            'id': txn.id,
+            'transaction_id': txn.transaction_id,
+            'from_user': from_user,
+            'to_user': to_user,
+            'quantity_kg': txn.quantity_kg,
+            'total_amount': txn.total_amount,
+            'transaction_type': txn.transaction_type,
+            'payment_status': txn.payment_status,
+            'transaction_date': txn.transaction_date.isoformat(),
+            'direction': 'sent' if txn.from_user_id == user_id else 'received'
+        }
+        if txn.batch_id:
+            txn_data.update(item_type='batch', item_id=batch_code, spice_name=spice_name)
+        elif txn.package_id:
+            txn_data.update(item_type='package', item_id=package_code, spice_name=spice_name)
+        result.append(txn_data)
+    return result
+
+
+def _fetch(user_id, ids=None):
+    """Visible entities of the user, limited to ``ids`` per type when given;
+    returns the serialized rows and, per type, the ids that are not visible."""
+    visible = _visible(user_id)
+    models = {'batch': Batches, 'package': Package, 'transaction': Transactions}
+    result, removed = {}, {}
+    for entity_type, model in models.items():
+        criteria = visible[entity_type]
+        if ids is not None:
+            wanted = ids.get(entity_type, set())
+            if not wanted:
+                result[entity_type], removed[entity_type] = [], []
+                continue
+            criteria = db.and_(criteria, model.id.in_(wanted))
+        if entity_type == 'batch':
+            rows = _batches(criteria)
+        elif entity_type == 'package':
+            rows = _packages(criteria)
+        else:
+            rows = _transactions(criteria, user_id)
+        result[entity_type] = rows
+        removed[entity_type] = sorted(ids.get(entity_type, set()) - {row['id'] for row in rows}) if ids else []
+    return result, removed
+
+
+class ResyncRequired(Exception):
+    pass
+
+
+def changes(user_id, since=None, limit=500):
+    """Everything visible to the user (``since`` None) or what changed after
+    token ``since``, at most ``limit`` change rows at a time."""
+    if since is None:
+        token = latest_token()
+        entities, removed = _fetch(user_id)
+        return {'full': True, 'entities': entities, 'removed': removed, 'sync_token': token, 'has_more': False}
+
+    pruned = db.session.get(Watermark, PRUNED)
+    if pruned is not None and since < pruned.last_id:
+        raise ResyncRequired('Sync token has expired, sync again without one')
+    rows = db.session.execute(
+        db.select(SyncChange.id, SyncChange.entity_type, SyncChange.entity_id)
+        .where(SyncChange.user_id == user_id, SyncChange.id > since, SyncChange.created_at <= _horizon())
+        .order_by(SyncChange.id).limit(limit)
+    ).all()
+    ids = {}
+    for _, entity_type, entity_id in rows:
+        ids.setdefault(entity_type, set()).add(entity_id)
+    entities, removed = _fetch(user_id, ids)
+    return {
+        'full': False,
+        'entities': entities,
+        'removed': removed,
+        'sync_token': rows[-1].id if rows else since,
+        'has_more': len(rows) == limit
+    }
+
+
+@contextmanager
+def _deferred_commits():
+    """Turn the session's commits into flushes for the duration, so views
+    that commit as they go can be composed into one transaction."""
+    session = db.session()
+    session.commit = session.flush
+    try:
+        yield
+    finally:
+        del session.commit
+
+
+def _replay(op_type, data):
+    endpoint, body, path_arg = OPERATIONS[op_type]
+    view_args = {path_arg: data.get(path_arg)} if path_arg else {}
+    view = current_app.view_functions[endpoint]
+    options = {'json': data} if body == 'json' else {'data': {key: str(value) for key, value in data.items()}}
+    with current_app.test_request_context(
+        f'/sync/{op_type}', method='POST', environ_base={'REMOTE_ADDR': request.remote_addr}, **options
+    ):
+        # The upload request already authenticated g.user_id; skip login_required
+        response = current_app.make_response(getattr(view, '__wrapped__', view)(**view_args))
+    return response.status_code, response.get_json(silent=True)
+
+
+def apply_operations(operations):
+    """Apply queued offline operations in order, all or nothing. Returns
+    ``(results, failure)``; ``failure`` is the first failing operation's
+    result, after which nothing has been written."""
+    user_id = g.user_id
+    done = {op_id: (status, response) for op_id, status, response in db.session.execute(
+        db.select(SyncOperation.op_id, SyncOperation.status_code, SyncOperation.response).where(
+            SyncOperation.user_id == user_id,
+            SyncOperation.op_id.in_([operation.get('op_id') for operation in operations])
+        )
+    )}
+    results = []
+    with events.held() as held, _deferred_commits():
+        for index, operation in enumerate(operations):
+            op_id, op_type, data = operation.get('op_id'), operation.get('type'), operation.get('data') or {}
+            if op_id in done:
+                status, response = done[op_id]
+                results.append({'op_id': op_id, 'index': index, 'status': status, 'replayed': True,
+                                'response': json.loads(response) if response else None})
+                continue
+            if not op_id or op_type not in OPERATIONS:
+                status, response = 400, {'error': f"op_id and a type of {', '.join(OPERATIONS)} are required"}
+            else:
+                status, response = _replay(op_type, data)
+            result = {'op_id': op_id, 'index': index, 'status': status, 'replayed': False, 'response': response}
+            if status >= 400:
+                db.session.rollback()
+                return results, result
+            done[op_id] = status, json.dumps(response)
+            db.session.add(SyncOperation(user_id=user_id, op_id=op_id, op_type=op_type, status_code=status,
+                                         response=done[op_id][1]))
+            results.append(result)
+    db.session.commit()
+    events.send(held)
+    return results, None
+
+
+def prune(days):
+    """Delete changes older than ``days``; tokens from before the oldest
+    kept change then get ``ResyncRequired``. Returns the rows deleted."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    last_id = db.session.execute(
+        db.select(db.func.max(SyncChange.id)).where(SyncChange.created_at < cutoff)
+    ).scalar()
+    if last_id is None:
+        return 0
+    deleted = db.session.execute(db.delete(SyncChange).where(SyncChange.id <= last_id)).rowcount
+    db.session.merge(Watermark(name=PRUNED, last_id=last_id, updated_at=datetime.utcnow()))
+    db.session.commit()
+    return deleted
+
+
+@click.group('sync')
+def sync_group():
+    """Offline sync maintenance."""
+
+
+@sync_group.command('prune')
+@click.option('--days', default=90, show_default=True, help='Keep this many days of changes.')
+def prune_command(days):
+    """Drop old sync changes; devices with older tokens do a full sync."""
+    click.echo(f'{prune(days)} sync changes pruned')
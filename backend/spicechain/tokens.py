@@ -0,0 +1,161 @@
+"""JWT access/refresh tokens.
+
+Tokens are HS256-signed and carry the user's id and type, so a request can
+be authenticated without a session or DB lookup. Verified claims are kept
+in an LRU cache keyed by the raw token, so repeated requests with the same
+token skip signature verification. Revoked token ids live in an in-memory
+set (O(1) membership) that each worker refreshes from ``revoked_token``
+every ``JWT_REVOCATION_REFRESH_SECONDS``, dropping tokens that have
+expired since; ``flask tokens prune`` deletes their rows.
+"""
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import click
+import jwt
+from flask import current_app, request
+from sqlalchemy.exc import IntegrityError
+
+from .cache import TTLCache
+from .extensions import db
+from .models import RevokedToken
+
+
+class TokenError(Exception):
+    pass
+
+
+class Revocations:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.jtis = {}  # jti -> expiry; entries are dropped once the token has expired
+        self._last_id = 0
+        self._refreshed = 0.0
+
+    def refresh(self, interval):
+        """Pull revocations written by other workers since the last refresh
+        and forget the ones whose tokens have expired anyway."""
+        if time.monotonic() - self._refreshed < interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._refreshed < interval:
+                return
+            now = datetime.utcnow()
+            rows = db.session.query(RevokedToken.id, RevokedToken.jti, RevokedToken.expires_at).filter(
+                RevokedToken.id > self._last_id,
+                RevokedToken.expires_at > now
+            ).order_by(RevokedToken.id).all()
+            jtis = {jti: expires_at for jti, expires_at in self.jtis.items() if expires_at > now}
+            for row in rows:
+                jtis[row.jti] = row.expires_at
+                self._last_id = row.id
+            self.jtis = jtis
+            self._refreshed = time.monotonic()
+
+    def add(self, jti, expires_at):
+        self.jtis[jti] = expires_at
+
+    def __contains__(self, jti):
+        return jti in self.jtis
+
+
+def _state():
+    return current_app.extensions['jwt']
+
+
+def _encode(user_id, user_type, token_type, lifetime):
+    now = int(time.time())
+    claims = {
+        'sub': str(user_id),
+        'user_type': user_type,
+        'typ': token_type,
+        'jti': uuid.uuid4().hex,
+        'iat': now,
+        'exp': now + lifetime
+    }
+    return jwt.encode(claims, current_app.config['JWT_SECRET_KEY'], algorithm='HS256')
+
+
+def issue_tokens(user_id, user_type):
+    config = current_app.config
+    return {
+        'access_token': _encode(user_id, user_type, 'access', config['JWT_ACCESS_TOKEN_SECONDS']),
+        'refresh_token': _encode(user_id, user_type, 'refresh', config['JWT_REFRESH_TOKEN_SECONDS']),
+        'token_type': 'Bearer',
+        'expires_in': config['JWT_ACCESS_TOKEN_SECONDS']
+    }
+
+
+def decode_token(token, token_type='access'):
+    """Return the verified claims of ``token`` or raise ``TokenError``."""
+    state = _state()
+    claims = state['cache'].get(token)
+    if claims is None:
+        try:
+            claims = jwt.decode(token, current_app.config['JWT_SECRET_KEY'], algorithms=['HS256'],
+                                options={'require': ['exp', 'jti', 'sub']})
+        except jwt.InvalidTokenError as exc:
+            raise TokenError(str(exc))
+        # Never serve a cached entry past the token's own expiry
+        state['cache'].set(token, claims, ttl=claims['exp'] - time.time())
+    if claims.get('typ') != token_type:
+        raise TokenError(f'{token_type} token required')
+    state['revocations'].refresh(current_app.config['JWT_REVOCATION_REFRESH_SECONDS'])
+    if claims['jti'] in state['revocations']:
+        raise TokenError('Token has been revoked')
+    return claims
+
+
+def revoke_token(claims):
+    """Revoke the token of ``claims``. Raises ``TokenError`` when it was
+    revoked concurrently (two refreshes racing with one token)."""
+    expires_at = datetime.utcfromtimestamp(claims['exp'])
+    db.session.add(RevokedToken(jti=claims['jti'], expires_at=expires_at))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise TokenError('Token has been revoked')
+    _state()['revocations'].add(claims['jti'], expires_at)
+
+
+def prune():
+    """Delete revocations of tokens that have expired; returns the rows deleted."""
+    deleted = db.session.execute(
+        db.delete(RevokedToken).where(RevokedToken.expires_at <= datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    return deleted
+
+
+def token_from_request():
+    """The bearer token sent as ``x-access-token`` or ``Authorization``."""
+    token = request.headers.get('x-access-token')
+    if token:
+        return token
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() == 'bearer' and credentials:
+        return credentials
+    return None
+
+
+@click.group('tokens')
+def tokens_group():
+    """JWT maintenance."""
+
+
+@tokens_group.command('prune')
+def prune_command():
+    """Drop revocations of expired tokens."""
+    click.echo(f'{prune()} expired revocations pruned')
+
+
+def init_app(app):
+    if not app.config.get('JWT_SECRET_KEY'):
+        app.config['JWT_SECRET_KEY'] = app.config['SECRET_KEY']
+    app.extensions['jwt'] = {
+        'cache': TTLCache(maxsize=app.config['JWT_CACHE_SIZE']),
+        'revocations': Revocations()
+    }
@@ -0,0 +1,502 @@
+"""Signed, offline-verifiable provenance tokens for package QR codes.
+
+A token is a COSE_Sign1 message (RFC 9052) signed with Ed25519 whose
+payload is a small CBOR map with integer keys:
+
+    1  package id             6  trace digest (16 bytes)
+    2  spice name             7  farming method
+    3  origin farm location   8  issued at (epoch seconds)
+    4  harvest date           9  package date
+    5  latest QA grade       10  contributing harvests (batch codes)
+
+Dates 4 and 9 are RFC 8943 tag 100 (days since 1970-01-01). The message is
+zlib-compressed and base45-encoded behind an ``SC1:`` prefix, so it fits a
+QR code's alphanumeric mode. The protected header carries the signing key
+id; apps cache ``GET /api/trace-keys`` and verify without calling us. The
+lineage follows divisions and merges (``BatchComposition``), like recall
+lineage does, so a blend lists every harvested batch that went into it
+(key 10); keys 3, 4 and 7 describe the one that contributed the most. The
+trace digest commits to the package and that whole lineage (see
+``trace_digest``), which ``/api/trace`` also returns so a full-journey
+fetch can be matched to the token.
+
+Keys rotate with ``flask trace-tokens rotate-key``: the new key signs from
+then on, older keys stay published so printed codes keep verifying until
+they are revoked. Workers pick up rotations within
+``TRACE_KEY_REFRESH_SECONDS``.
+"""
+import base64
+import hashlib
+import struct
+import time
+import zlib
+from datetime import date, datetime
+
+import click
+from flask import current_app
+
+from .cache import TTLCache
+from .composition import attribution
+from .extensions import db
+from .models import BatchComposition, Batches, Package, QATest, Spices, TraceSigningKey
+
+PREFIX = 'SC1:'
+ALG_EDDSA = -8
+_EPOCH = date(1970, 1, 1)
+_BASE45 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:'
+_BASE45_VALUES = {ch: n for n, ch in enumerate(_BASE45)}
+_PAIRS = [_BASE45[n % 45] + _BASE45[n // 45] for n in range(65536 // 45 + 1)]
+_CHUNK = 500
+
+
+class TraceTokenError(Exception):
+    pass
+
+
+class _Tag:
+    def __init__(self, tag, value):
+        self.tag = tag
+        self.value = value
+
+
+# Minimal deterministic CBOR (RFC 8949): ints, bytes, text, arrays, maps,
+# tags and null, which is all a token uses
+
+def _head(major, n):
+    if n < 24:  # the common case: small ints and short strings
+        return bytes([major << 5 | n])
+    for info, fmt in ((24, '>B'), (25, '>H'), (26, '>I'), (27, '>Q')):
+        if n < 1 << (8 * struct.calcsize(fmt)):
+            return bytes([major << 5 | info]) + struct.pack(fmt, n)
+    raise ValueError('integer too large for CBOR')
+
+
+def cbor_dumps(value):
+    kind = type(value)
+    if kind is str:
+        encoded = value.encode()
+        return _head(3, len(encoded)) + encoded
+    if kind is int:
+        return _head(0, value) if value >= 0 else _head(1, -1 - value)
+    if kind is bytes:
+        return _head(2, len(value)) + value
+    if value is None:
+        return b'\xf6'
+    if kind is bool:
+        return b'\xf5' if value else b'\xf4'
+    if kind is dict:
+        # Canonical order: shorter encoded keys first, then bytewise
+        items = sorted([(cbor_dumps(key), cbor_dumps(item)) for key, item in value.items()],
+                       key=lambda pair: (len(pair[0]), pair[0]))
+        return _head(5, len(items)) + b''.join([key + item for key, item in items])
+    if kind is list or kind is tuple:
+        return _head(4, len(value)) + b''.join([cbor_dumps(item) for item in value])
+    if kind is _Tag:
+        return _head(6, value.tag) + cbor_dumps(value.value)
+    raise TypeError(f'cannot CBOR-encode {kind.__name__}')
+
+
+def _decode(data, pos):
+    initial = data[pos]
+    major, info = initial >> 5, initial & 0x1f
+    pos += 1
+    if major == 7:
+        simple = {20: False, 21: True, 22: None}
+        if info not in simple:
+            raise ValueError('unsupported CBOR simple value')
+        return simple[info], pos
+    if info < 24:
+        n = info
+    elif info <= 27:
+        size = 1 << (info - 24)
+        n = int.from_bytes(data[pos:pos + size], 'big')
+        pos += size
+    else:
+        raise ValueError('indefinite-length CBOR is not supported')
+    if major == 0:
+        return n, pos
+    if major == 1:
+        return -1 - n, pos
+    if major in (2, 3):
+        chunk = bytes(data[pos:pos + n])
+        if len(chunk) != n:
+            raise ValueError('truncated CBOR')
+        return (chunk if major == 2 else chunk.decode()), pos + n
+    if major == 4:
+        items = []
+        for _ in range(n):
+            item, pos = _decode(data, pos)
+            items.append(item)
+        return items, pos
+    if major == 5:
+        mapping = {}
+        for _ in range(n):
+            key, pos = _decode(data, pos)
+            mapping[key], pos = _decode(data, pos)
+        return mapping, pos
+    value, pos = _decode(data, pos)
+    return _Tag(n, value), pos
+
+
+def cbor_loads(data):
+    value, pos = _decode(data, 0)
+    if pos != len(data):
+        raise ValueError('trailing bytes after CBOR item')
+    return value
+
+
+def base45_encode(data):
+    # Each 16-bit word becomes three digits, low first; the top two come
+    # from a 1457-entry table so the loop is one lookup and one concat
+    words = struct.unpack(f'>{len(data) // 2}H', data[:len(data) // 2 * 2])
+    out = ''.join([_BASE45[n % 45] + _PAIRS[n // 45] for n in words])
+    if len(data) % 2:
+        out += _PAIRS[data[-1]]
+    return out
+
+
+def base45_decode(text):
+    try:
+        values = [_BASE45_VALUES[ch] for ch in text]
+    except KeyError:
+        raise ValueError('invalid base45 character') from None
+    if len(values) % 3 == 1:
+        raise ValueError('invalid base45 length')
+    out = bytearray()
+    for i in range(0, len(values) - 2, 3):
+        n = values[i] + values[i + 1] * 45 + values[i + 2] * 2025
+        if n > 0xffff:
+            raise ValueError('invalid base45 group')
+        out += n.to_bytes(2, 'big')
+    if len(values) % 3:
+        n = values[-2] + values[-1] * 45
+        if n > 0xff:
+            raise ValueError('invalid base45 group')
+        out.append(n)
+    return bytes(out)
+
+
+def _days(value):
+    return _Tag(100, (value.date() - _EPOCH).days) if value else None
+
+
+def _b64url(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def trace_digest(package_id, lineage):
+    """First 16 bytes of SHA-256 over the package id and its batch codes
+    in ``lineage`` order, harvested roots first."""
+    return hashlib.sha256('\x1f'.join([package_id, *lineage]).encode()).digest()[:16]
+
+
+# Keys
+
+def _state():
+    return current_app.extensions['trace_tokens']
+
+
+def _password():
+    return current_app.config['SECRET_KEY'].encode()
+
+
+def _load_keys():
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+
+    cached = _state().get('keys')
+    if cached is not None:
+        return cached
+    rows = TraceSigningKey.query.filter(TraceSigningKey.revoked_at.is_(None)) \
+        .order_by(TraceSigningKey.created_at.desc()).all()
+    public = {row.kid: Ed25519PublicKey.from_public_bytes(base64.urlsafe_b64decode(row.public_key + '=='))
+              for row in rows}
+    signer = next((row for row in rows if row.retired_at is None), None)
+    if signer is not None:
+        signer = (cbor_dumps({1: ALG_EDDSA, 4: signer.kid.encode()}),
+                  serialization.load_pem_private_key(signer.private_key.encode(), _password()))
+    keys = {'public': public, 'signer': signer}
+    _state().set('keys', keys)
+    return keys
+
+
+def rotate_key():
+    """Generate a new signing key and retire the current one. Returns the
+    new key id."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+    private = Ed25519PrivateKey.generate()
+    raw = private.public_key().public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    kid = _b64url(hashlib.sha256(raw).digest()[:8])
+    now = datetime.utcnow()
+    TraceSigningKey.query.filter(TraceSigningKey.retired_at.is_(None)).update({'retired_at': now})
+    db.session.add(TraceSigningKey(
+        kid=kid,
+        public_key=_b64url(raw),
+        private_key=private.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+            serialization.BestAvailableEncryption(_password())
+        ).decode(),
+        created_at=now
+    ))
+    db.session.commit()
+    _state().clear()
+    return kid
+
+
+def revoke_key(kid):
+    """Stop trusting ``kid``; tokens it signed no longer verify."""
+    key = db.session.get(TraceSigningKey, kid)
+    if key is None:
+        raise TraceTokenError(f'Unknown key {kid}')
+    now = datetime.utcnow()
+    key.retired_at = key.retired_at or now
+    key.revoked_at = now
+    db.session.commit()
+    _state().clear()
+
+
+def public_keys():
+    """Published verification keys, newest first, as JWK-style dicts."""
+    return [{
+        'kid': key.kid,
+        'kty': 'OKP',
+        'crv': 'Ed25519',
+        'alg': 'EdDSA',
+        'x': key.public_key,
+        'created_at': key.created_at.isoformat(),
+        'retired_at': key.retired_at.isoformat() if key.retired_at else None
+    } for key in TraceSigningKey.query.filter(TraceSigningKey.revoked_at.is_(None))
+        .order_by(TraceSigningKey.created_at.desc())]
+
+
+# Signing and verification
+
+_SIGNATURE1 = cbor_dumps('Signature1')
+
+
+def _sig_structure(protected, payload):
+    # ["Signature1", protected, external_aad = b'', payload]
+    return b'\x84' + _SIGNATURE1 + cbor_dumps(protected) + b'\x40' + cbor_dumps(payload)
+
+
+def sign(claims):
+    """Encode and sign a claims dict (integer keys, see module docstring)."""
+    signer = _load_keys()['signer']
+    if signer is None:
+        raise TraceTokenError('No signing key; run flask trace-tokens rotate-key')
+    protected, private = signer
+    payload = cbor_dumps(claims)
+    signature = private.sign(_sig_structure(protected, payload))
+    message = cbor_dumps(_Tag(18, [protected, {}, payload, signature]))
+    return PREFIX + base45_encode(zlib.compress(message, 9))
+
+
+def verify(token):
+    """Check a token against the published keys and return its claims
+    with dates decoded. Raises TraceTokenError."""
+    from cryptography.exceptions import InvalidSignature
+
+    if not token.startswith(PREFIX):
+        raise TraceTokenError('Not a trace token')
+    try:
+        message = cbor_loads(zlib.decompress(base45_decode(token[len(PREFIX):])))
+        if isinstance(message, _Tag):
+            message = message.value
+        protected, _, payload, signature = message
+        header = cbor_loads(protected)
+        kid = header[4].decode()
+        claims = cbor_loads(payload)
+    except (ValueError, KeyError, TypeError, UnicodeDecodeError, zlib.error):
+        raise TraceTokenError('Malformed trace token') from None
+    if header.get(1) != ALG_EDDSA:
+        raise TraceTokenError('Unsupported algorithm')
+    key = _load_keys()['public'].get(kid)
+    if key is None:
+        raise TraceTokenError(f'Unknown or revoked key {kid}')
+    try:
+        key.verify(signature, _sig_structure(protected, payload))
+    except InvalidSignature:
+        raise TraceTokenError('Invalid signature') from None
+    for field in (4, 9):
+        if isinstance(claims.get(field), _Tag):
+            claims[field] = date.fromordinal(_EPOCH.toordinal() + claims[field].value)
+    return claims
+
+
+# Issuance
+
+def _lineages(batch_ids):
+    """Batch rows for ``batch_ids`` and all their ancestors through
+    divisions and merges, fetched one generation at a time and keyed by
+    id, plus ``{batch id: [source batch ids]}``."""
+    batches = {}
+    sources = {}
+    frontier = set(batch_ids)
+    while frontier:
+        frontier = list(frontier)
+        for start in range(0, len(frontier), _CHUNK):
+            chunk = frontier[start:start + _CHUNK]
+            for row in db.session.execute(
+                db.select(Batches.id, Batches.batch_id, Batches.parent_batch_id, Batches.spice_id,
+                          Batches.farm_location, Batches.farming_method, Batches.harvest_date,
+                          Batches.estimated_grade)
+                .where(Batches.id.in_(chunk))
+            ):
+                batches[row.id] = row
+                if row.parent_batch_id is not None:
+                    sources.setdefault(row.id, []).append(row.parent_batch_id)
+            for child_id, source_id in db.session.execute(
+                db.select(BatchComposition.child_batch_id, BatchComposition.source_batch_id)
+                .where(BatchComposition.child_batch_id.in_(chunk))
+            ):
+                sources.setdefault(child_id, []).append(source_id)
+        frontier = {source_id for ids in sources.values() for source_id in ids if source_id not in batches}
+    return batches, sources
+
+
+def _walk(batch_id, batches, sources):
+    """``batch_id`` and its ancestors, nearest first: breadth-first over
+    sources, taken in batch-code order, each batch once. A division chain
+    comes out as it always did, so older digests still match."""
+    chain = [batches[batch_id]]
+    seen = {batch_id}
+    for batch in chain:
+        for source_id in sorted(sources.get(batch.id, ()), key=lambda source_id: batches[source_id].batch_id):
+            if source_id not in seen:
+                seen.add(source_id)
+                chain.append(batches[source_id])
+    return chain
+
+
+def lineage(batch_id):
+    """Batch codes signed into the trace digest of a package of
+    ``batch_id``, harvested roots first."""
+    batches, sources = _lineages([batch_id])
+    return [batch.batch_id for batch in reversed(_walk(batch_id, batches, sources))]
+
+
+def _latest_grades(batch_ids):
+    latest = {}
+    batch_ids = list(batch_ids)
+    for start in range(0, len(batch_ids), _CHUNK):
+        for batch_id, grade, tested in db.session.execute(
+            db.select(QATest.batch_id, QATest.grade_assigned, QATest.test_date)
+            .where(QATest.batch_id.in_(batch_ids[start:start + _CHUNK]), QATest.grade_assigned.isnot(None))
+        ):
+            if batch_id not in latest or tested > latest[batch_id][1]:
+                latest[batch_id] = (grade, tested)
+    return {batch_id: grade for batch_id, (grade, _) in latest.items()}
+
+
+def issue(package_ids):
+    """Sign and store tokens for the given packages (ids), replacing any
+    they had. Returns ``{package id: token}``; empty while no signing key
+    exists, leaving the packages to ``issue_pending``."""
+    if _load_keys()['signer'] is None:
+        return {}
+    packages = []
+    package_ids = list(package_ids)
+    for start in range(0, len(package_ids), _CHUNK):
+        packages += db.session.execute(
+            db.select(Package.id, Package.package_id, Package.batch_id, Package.package_date)
+            .where(Package.id.in_(package_ids[start:start + _CHUNK]))
+        ).all()
+    if not packages:
+        return {}
+
+    batches, sources = _lineages({package.batch_id for package in packages})
+    grades = _latest_grades(batches)
+    spices = dict(db.session.execute(db.select(Spices.id, Spices.name)).all())
+    issued_at = int(time.time())
+
+    tokens = {}
+    for package in packages:
+        chain = _walk(package.batch_id, batches, sources)
+        roots = [batch for batch in chain if batch.id not in sources]
+        root = roots[0]
+        if len(roots) > 1:
+            shares = attribution(package.batch_id)
+            root = max(roots, key=lambda batch: shares.get(batch.id, 0))
+        # Nearest QA grade up the lineage, else the farmer's estimate
+        grade = next((grades[batch.id] for batch in chain if batch.id in grades), chain[0].estimated_grade)
+        tokens[package.id] = sign({
+            1: package.package_id,
+            2: spices.get(chain[0].spice_id),
+            3: root.farm_location,
+            4: _days(root.harvest_date),
+            5: grade,
+            6: trace_digest(package.package_id, [batch.batch_id for batch in reversed(chain)]),
+            7: root.farming_method,
+            8: issued_at,
+            9: _days(package.package_date),
+            10: sorted(batch.batch_id for batch in roots)
+        })
+
+    db.session.execute(db.update(Package), [{'id': package_id, 'trace_token': token}
+                                            for package_id, token in tokens.items()])
+    return tokens
+
+
+def issue_pending(reissue=False, chunk=5000):
+    """Issue tokens for every package without one (all packages with
+    ``reissue``), committing per chunk. Returns the number issued."""
+    issued = 0
+    last_id = 0
+    while True:
+        query = db.select(Package.id).where(Package.id > last_id).order_by(Package.id).limit(chunk)
+        if not reissue:
+            query = query.where(Package.trace_token.is_(None))
+        ids = db.session.execute(query).scalars().all()
+        if not ids:
+            return issued
+        if _load_keys()['signer'] is None:
+            raise TraceTokenError('No signing key; run flask trace-tokens rotate-key')
+        issued += len(issue(ids))
+        db.session.commit()
+        last_id = ids[-1]
+
+
+def init_app(app):
+    app.extensions['trace_tokens'] = TTLCache(maxsize=4, ttl=app.config['TRACE_KEY_REFRESH_SECONDS'])
+
+
+@click.group('trace-tokens')
+def trace_tokens_group():
+    """Signed package trace tokens."""
+
+
+@trace_tokens_group.command('issue')
+@click.option('--reissue', is_flag=True, help='Re-sign packages that already have a token.')
+def issue_command(reissue):
+    """Issue tokens for packages that have none."""
+    try:
+        click.echo(f'{issue_pending(reissue)} tokens issued')
+    except TraceTokenError as e:
+        raise click.ClickException(str(e))
+
+
+@trace_tokens_group.command('rotate-key')
+def rotate_key_command():
+    """Start signing with a new key; older keys stay published."""
+    click.echo(f'signing with key {rotate_key()}')
+
+
+@trace_tokens_group.command('revoke-key')
+@click.argument('kid')
+def revoke_key_command(kid):
+    """Withdraw a key; tokens it signed stop verifying."""
+    try:
+        revoke_key(kid)
+    except TraceTokenError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'revoked key {kid}')
+
+
+@trace_tokens_group.command('keys')
+def keys_command():
+    """List published keys, newest first."""
+    for key in public_keys():
+        status = f"retired {key['retired_at']}" if key['retired_at'] else 'signing'
+        click.echo(f"{key['kid']}  created {key['created_at']}  {status}")
@@ -0,0 +1,116 @@
+from functools import wraps
+
+from flask import current_app, g, jsonify, request, session
+
+from . import events
+from .extensions import db
+from .models import AuditLog, QATest, Timeline
+from .tokens import TokenError, decode_token, token_from_request
+
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
+
+def authenticate(token=None):
+    """Resolve the caller to ``(user_id, user_type)`` from a bearer token,
+    falling back to the session cookie while SESSION_AUTH_ENABLED is set.
+    Returns None for anonymous callers; raises TokenError for a bad token."""
+    token = token or token_from_request()
+    if token:
+        claims = decode_token(token)
+        g.token_claims = claims
+        return int(claims['sub']), claims['user_type']
+    if current_app.config['SESSION_AUTH_ENABLED'] and 'user_id' in session:
+        return session['user_id'], session['user_type']
+    return None
+
+def login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            identity = authenticate()
+        except TokenError as e:
+            return jsonify({'error': str(e)}), 401
+        if identity is None:
+            return jsonify({'error': 'Authentication required'}), 401
+        g.user_id, g.user_type = identity
+        return f(*args, **kwargs)
+    return decorated_function
+
+def log_action(user_id, action, resource_type, resource_id, old_values=None, new_values=None):
+    log_entry = AuditLog(
+        user_id=user_id,
+        action=action,
+        resource_type=resource_type,
+        resource_id=resource_id,
+        old_values=old_values or None,
+        new_values=new_values or None,
+        ip_address=request.remote_addr
+    )
+    db.session.add(log_entry)
+    db.session.commit()
+
+def add_timeline_event(batch_id=None, package_id=None, event_type=None, description=None, user_id=None, location=None, event_metadata=None):
+    event = Timeline(
+        batch_id=batch_id,
+        package_id=package_id,
+        event_type=event_type,
+        event_description=description,
+        user_id=user_id,
+        location=location,
+        event_metadata=event_metadata or None
+    )
+    db.session.add(event)
+    db.session.commit()
+    
+    channels = []
+    if batch_id:
+        channels.append(f'batch:{batch_id}')
+    if package_id:
+        channels.append(f'package:{package_id}')
+    events.publish(channels, 'timeline', {
+        'batch_id': batch_id,
+        'package_id': package_id,
+        'event_type': event_type,
+        'description': description,
+        'user_id': user_id,
+        'location': location,
+        'metadata': event_metadata
+    })
+
+def publish_transaction(transaction, event_type):
+    """Notify both parties of a transaction; call after committing it."""
+    events.publish([f'user:{transaction.from_user_id}', f'user:{transaction.to_user_id}'], event_type, {
+        'transaction_id': transaction.transaction_id,
+        'from_user_id': transaction.from_user_id,
+        'to_user_id': transaction.to_user_id,
+        'batch_id': transaction.batch_id,
+        'package_id': transaction.package_id,
+        'quantity_kg': transaction.quantity_kg,
+        'total_amount': transaction.total_amount,
+        'payment_status': transaction.payment_status
+    })
+
+def latest_qa_tests(batch_ids):
+    """The most recent quality test of each of ``batch_ids``, by batch id,
+    in one query."""
+    if not batch_ids:
+        return {}
+    ranked = db.select(
+        QATest.id,
+        db.func.row_number().over(partition_by=QATest.batch_id,
+                                  order_by=(QATest.test_date.desc(), QATest.id.desc())).label('rank')
+    ).where(QATest.batch_id.in_(set(batch_ids))).subquery()
+    tests = QATest.query.join(ranked, ranked.c.id == QATest.id).filter(ranked.c.rank == 1)
+    return {test.batch_id: test for test in tests}
+
+def qa_test_json(test):
+    if test is None:
+        return None
+    return {
+        'test_id': test.test_id,
+        'test_date': test.test_date.isoformat(),
+        'test_type': test.test_type,
+        'test_result': test.test_result,
+        'grade_assigned': test.grade_assigned
+    }
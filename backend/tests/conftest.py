@@ -0,0 +1,62 @@
+import pytest
+
+from spicechain import create_app
+from spicechain.cli import init_database
+from spicechain.extensions import db
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # Uploads and every other working directory go under tmp_path
+    monkeypatch.chdir(tmp_path)
+    app = create_app('testing')
+    app.config.update(
+        ARCHIVE_DIR=str(tmp_path / 'archive'),
+        SNAPSHOT_DIR=str(tmp_path / 'snapshot'),
+        JOB_OUTPUT_DIR=str(tmp_path / 'job_output'),
+        PROFILE_DIR=str(tmp_path / 'profiles'),
+        SLOW_QUERY_LOG=str(tmp_path / 'slow_queries.log'),
+    )
+    with app.app_context():
+        init_database()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def make_user(app):
+    """Sign up and log in a user; returns a test client with ``uid`` and
+    ``tokens`` set."""
+    def make_user(name, user_type, **fields):
+        client = app.test_client()
+        r = client.post('/api/signup', json={'username': name, 'email': f'{name}@example.com',
+                                             'password': 'pw', 'user_type': user_type, **fields})
+        assert r.status_code == 201, r.json
+        r = client.post('/api/login', json={'username': f'{name}@example.com', 'password': 'pw'})
+        assert r.status_code == 200, r.json
+        client.uid = r.json['user_id']
+        client.tokens = {'access_token': r.json['access_token'], 'refresh_token': r.json['refresh_token']}
+        return client
+    return make_user
+
+
+@pytest.fixture
+def farmer(make_user):
+    return make_user('farmer', 'farmer')
+
+
+@pytest.fixture
+def middleman(make_user):
+    return make_user('middleman', 'middleman')
+
+
+@pytest.fixture
+def officer(make_user):
+    return make_user('officer', 'quality_officer')
+
+
+@pytest.fixture
+def consumer(make_user):
+    return make_user('consumer', 'consumer')
@@ -0,0 +1,20 @@
+"""Request helpers shared by the test modules."""
+
+
+def register_batch(client, quantity_kg=100, **fields):
+    r = client.post('/api/registerbatch', data={
+        'spice_id': '1', 'quantity_kg': str(quantity_kg), 'harvest_date': '2026-09-01T00:00:00Z',
+        'farm_location': 'Idukki', **fields
+    })
+    assert r.status_code == 201, r.json
+    return r.json['id']
+
+
+def sell(seller, buyer, batch_id, price_per_kg=10):
+    """Sell a whole batch and complete the sale; returns the transaction code."""
+    r = seller.post(f'/api/batch/{batch_id}/sell', json={'buyer_id': buyer.uid, 'price_per_kg': price_per_kg})
+    assert r.status_code == 201, r.json
+    transaction_id = r.json['transaction_id']
+    r = buyer.post(f'/api/transaction/{transaction_id}/complete')
+    assert r.status_code == 200, r.json
+    return transaction_id
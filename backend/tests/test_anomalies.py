@@ -0,0 +1,81 @@
+from datetime import datetime
+
+import pytest
+
+from spicechain import anomalies
+from spicechain.extensions import db
+from spicechain.models import Batches, Package, Transactions
+from spicechain.stock import reconcile
+
+from helpers import register_batch
+
+
+@pytest.fixture
+def divided(farmer):
+    root = register_batch(farmer, 100)
+    r = farmer.post('/api/batch/divide', json={'batch_id': root, 'divisions': [{'quantity_kg': 20}]})
+    assert r.status_code == 201, r.json
+    return root, r.json['new_batches'][0]['id']
+
+
+def overdraw(batch_id, owner_id, quantity_kg, code):
+    # Written behind the API, which would refuse it
+    db.session.add(Package(package_id=code, batch_id=batch_id, packager_id=owner_id, quantity_kg=quantity_kg,
+                           current_owner_id=owner_id))
+    db.session.commit()
+
+
+def test_clean_history_has_no_findings(app, divided):
+    with app.app_context():
+        report = anomalies.run()
+    assert report['overdrawn_batch'] == 0 and report['batches_checked'] == 2
+
+
+def test_overdrawn_sub_batch_is_flagged_incrementally(app, divided, farmer, officer):
+    root, sub = divided
+    with app.app_context():
+        anomalies.run()
+        overdraw(sub, farmer.uid, 25, 'PKG_OVER')
+        report = anomalies.run()
+        assert report['batches_checked'] == 1 and report['overdrawn_batch'] == 1
+        assert anomalies.run()['batches_checked'] == 0
+    findings = officer.get('/api/anomalies?kind=overdrawn_batch').json['anomalies']
+    assert [(f['entity_id'], f['score'], f['details']['packaged_kg']) for f in findings] == [(sub, 5.0, 25.0)]
+
+
+def test_legacy_batches_wait_for_reconcile(app, farmer):
+    with app.app_context():
+        legacy = Batches(batch_id='LEGACY_1', farmer_id=farmer.uid, spice_id=1, quantity_kg=10,
+                         harvest_date=datetime(2020, 1, 1), farm_location='Old farm', current_owner_id=farmer.uid)
+        db.session.add(legacy)
+        db.session.commit()
+        overdraw(legacy.id, farmer.uid, 12, 'PKG_LEGACY')
+        assert anomalies.run(full=True)['overdrawn_batch'] == 0
+        reconcile()
+        assert anomalies.run()['overdrawn_batch'] == 1
+
+
+def test_price_outlier_against_same_spice_and_month(app, farmer, middleman, officer):
+    batch_id = register_batch(farmer)
+    with app.app_context():
+        for i in range(8):
+            db.session.add(Transactions(transaction_id=f'TX{i}', from_user_id=farmer.uid, to_user_id=middleman.uid,
+                                        batch_id=batch_id, quantity_kg=1, price_per_kg=10 + i % 2,
+                                        total_amount=10 + i % 2, transaction_type='sale'))
+        db.session.add(Transactions(transaction_id='TXBIG', from_user_id=farmer.uid, to_user_id=middleman.uid,
+                                    batch_id=batch_id, quantity_kg=1, price_per_kg=90, total_amount=90,
+                                    transaction_type='sale'))
+        db.session.commit()
+        assert anomalies.run()['price_outlier'] == 1
+    r = officer.get('/api/anomalies?kind=price_outlier')
+    assert r.json['total'] == 1 and r.json['anomalies'][0]['entity_type'] == 'transaction'
+
+
+def test_only_officers_see_anomalies(farmer):
+    assert farmer.get('/api/anomalies').status_code == 403
+
+
+def test_scan_command_mentions_reconcile(app):
+    with app.app_context():
+        result = app.test_cli_runner().invoke(args=['anomalies', 'scan', '--help'])
+    assert 'flask stock reconcile' in result.output
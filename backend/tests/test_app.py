@@ -0,0 +1,56 @@
+import subprocess
+import sys
+
+from spicechain import create_app
+from spicechain.bench import IMPORT_TIME_BUDGET_MS, measure_import_time
+
+
+def test_import_is_cheap():
+    # The package itself must not pull in Flask or SQLAlchemy
+    out = subprocess.run(
+        [sys.executable, '-c', "import sys, spicechain; print(sorted({'flask', 'sqlalchemy'} & set(sys.modules)))"],
+        capture_output=True, text=True, check=True
+    ).stdout
+    assert out.strip() == '[]'
+
+
+def test_cold_start_within_budget():
+    totals = measure_import_time()
+    assert sum(totals.values()) / 1000 < IMPORT_TIME_BUDGET_MS
+    # Heavy optional dependencies load on first use, not at startup
+    assert not {'numpy', 'pyarrow', 'cryptography'} & set(totals)
+
+
+def test_factory_accepts_names_and_overrides(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert create_app('testing').config['TESTING']
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'DASHBOARD_CACHE_SECONDS': 0})
+    assert app.config['DASHBOARD_CACHE_SECONDS'] == 0
+    assert not app.config.get('TESTING')
+
+
+def test_blueprints_share_api_prefix(app):
+    rules = {rule.rule for rule in app.url_map.iter_rules()}
+    for path in ('/api/login', '/api/registerbatch', '/api/trace/<package_id>', '/api/dashboard'):
+        assert path in rules
+
+
+def test_unknown_endpoint_is_json_404(app):
+    r = app.test_client().get('/api/nope')
+    assert r.status_code == 404
+    assert r.json == {'error': 'Endpoint not found'}
+
+
+def test_login_does_not_echo_credentials(app, make_user, capsys):
+    client = make_user('alice', 'farmer')
+    client.post('/api/logout')
+    out = capsys.readouterr().out
+    assert 'pw' not in out and 'Logging out' not in out
+
+
+def test_session_and_bearer_auth(app, farmer):
+    assert farmer.get('/api/mybatches').status_code == 200
+    anonymous = app.test_client()
+    assert anonymous.get('/api/mybatches').status_code == 401
+    r = anonymous.get('/api/mybatches', headers={'Authorization': f"Bearer {farmer.tokens['access_token']}"})
+    assert r.status_code == 200
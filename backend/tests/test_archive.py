@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from spicechain import archive
+from spicechain.extensions import db
+from spicechain.models import ArchivePartition, AuditLog, Batches, Package, Timeline
+
+from helpers import register_batch, sell
+
+AGE = timedelta(days=400)
+
+
+@pytest.fixture
+def history(app, farmer, middleman):
+    """A batch sold and packaged, then aged past both hot windows."""
+    batch_id = register_batch(farmer)
+    sale = sell(farmer, middleman, batch_id)
+    r = middleman.post('/api/package', json={'batch_id': batch_id, 'quantity_kg': 10, 'package_type': 'box'})
+    code = r.json['package_id']
+    with app.app_context():
+        for model, column in ((Timeline, 'timestamp'), (AuditLog, 'timestamp'), (Batches, 'created_at')):
+            for row in model.query:
+                setattr(row, column, getattr(row, column) - AGE)
+        db.session.commit()
+    return {'batch_id': batch_id, 'sale': sale, 'package': code}
+
+
+def archive_all(app):
+    with app.app_context():
+        return archive.apply_policies(today=datetime.utcnow())
+
+
+def lookups(app, history, user_id):
+    with app.app_context():
+        return (archive.timeline_events({'batch_id': [history['batch_id']]}),
+                archive.timeline_events({'metadata.transaction_id': [history['sale']]}),
+                [dict(zip(archive.AUDIT_FIELDS[1:], tuple(entry)[1:])) for entry in archive.audit_entries(user_id)])
+
+
+def test_archived_months_read_back_the_same(app, history, farmer, middleman):
+    before = lookups(app, history, middleman.uid)
+    report = archive_all(app)
+    assert any(line.startswith('timeline') for line in report)
+    with app.app_context():
+        assert Timeline.query.count() == 0
+        assert ArchivePartition.query.filter_by(table_name='timeline').count() == 1
+    after = lookups(app, history, middleman.uid)
+    assert after[0] == before[0] and after[1] == before[1] and len(after[1]) > 0
+    # Logins and logouts are dropped rather than archived
+    assert after[2] and after[2] == [entry for entry in before[2] if entry['action'] not in ('USER_LOGIN', 'USER_LOGOUT')]
+
+
+def test_history_endpoints_unchanged_by_archiving(app, history, farmer, middleman):
+    urls = [f"/api/fetchhistory/{history['package']}", f"/api/trace/{history['package']}",
+            f"/api/timeline?transaction_id={history['sale']}"]
+    before = [middleman.get(url).get_data() for url in urls]
+    archive_all(app)
+    assert [middleman.get(url).get_data() for url in urls] == before
+
+
+def test_iterator_matches_list_in_small_chunks(app, history):
+    archive_all(app)
+    with app.app_context():
+        # New activity lands in the table after the archived months
+        db.session.add(Timeline(batch_id=history['batch_id'], event_type='note', event_description='hot'))
+        db.session.commit()
+        events = archive.timeline_events({'batch_id': [history['batch_id']]})
+        assert list(archive.iter_timeline_events({'batch_id': [history['batch_id']]}, chunk_size=1)) == events
+        assert events[-1].description == 'hot'
+        assert [event.timestamp for event in events] == sorted(event.timestamp for event in events)
+        archived = sum(table.num_rows for _, table in archive.read_partitions('timeline', ['id']))
+        assert archived == len(events) - 1
+
+
+def test_dry_run_changes_nothing(app, history):
+    with app.app_context():
+        rows = Timeline.query.count()
+        report = archive.apply_policies(today=datetime.utcnow(), dry_run=True)
+        assert report and all('would archive' in line for line in report)
+        assert Timeline.query.count() == rows and ArchivePartition.query.count() == 0
+
+
+def test_expired_partitions_are_deleted(app, history):
+    archive_all(app)
+    app.config['ARCHIVE_POLICIES'] = {'audit_log': {'hot_months': 3, 'keep_months': 6}}
+    with app.app_context():
+        report = archive.apply_policies(today=datetime.utcnow())
+        assert any('deleted partition' in line for line in report)
+        assert ArchivePartition.query.filter_by(table_name='audit_log').count() == 0
+        assert ArchivePartition.query.filter_by(table_name='timeline').count() == 1
+
+
+def test_list_command(app, history):
+    archive_all(app)
+    with app.app_context():
+        output = app.test_cli_runner().invoke(args=['archive', 'list']).output
+    assert 'timeline' in output and 'audit_log' in output
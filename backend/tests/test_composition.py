@@ -0,0 +1,83 @@
+import pytest
+
+from spicechain.composition import _propagate
+from spicechain.extensions import db
+from spicechain.models import Batches
+
+from helpers import register_batch, sell
+
+
+def test_propagate_through_diamond():
+    # 4 is blended from 2 and 3, which were both divided from 1; 3 also took from 5
+    edges = [(4, 2, 10.0), (4, 3, 30.0), (2, 1, 1.0), (3, 1, 20.0), (3, 5, 20.0)]
+    shares = _propagate(4, edges)
+    assert shares == pytest.approx({1: 0.25 + 0.375, 5: 0.375})
+
+
+def test_unblended_batch_is_its_own_root():
+    assert _propagate(7, []) == {7: 1.0}
+
+
+@pytest.fixture
+def lots(farmer, make_user, middleman):
+    """Lots of 40 kg (Idukki) and 60 kg (Wayanad) owned by the middleman."""
+    other = make_user('farmer2', 'farmer')
+    first = register_batch(farmer, 40)
+    second = register_batch(other, 60, farm_location='Wayanad')
+    sell(farmer, middleman, first)
+    sell(other, middleman, second)
+    return first, second
+
+
+def test_merge_records_sources_and_attribution(app, lots, middleman):
+    first, second = lots
+    r = middleman.post('/api/batch/merge', json={'sources': [{'batch_id': first, 'quantity_kg': 20},
+                                                             {'batch_id': second, 'quantity_kg': 60}]})
+    assert r.status_code == 201, r.json
+    assert r.json['quantity_kg'] == 80
+    shares = {farm['farm_location']: farm['fraction'] for farm in r.json['origin_attribution']}
+    assert shares == {'Wayanad': 0.75, 'Idukki': 0.25}
+    with app.app_context():
+        assert db.session.get(Batches, second).status == 'fully_merged'
+        assert db.session.get(Batches, first).status != 'fully_merged'
+        assert db.session.get(Batches, r.json['id']).farming_method == 'conventional'
+
+    composition = middleman.get(f"/api/batch/{r.json['id']}/composition").json
+    assert sorted(source['quantity_kg'] for source in composition['sources']) == [20, 60]
+    assert {source['relation'] for source in composition['sources']} == {'merge'}
+    assert middleman.get(f'/api/batch/{first}/composition').json['quantity_kg'] == 20
+
+
+def test_division_of_blend_keeps_attribution(lots, middleman):
+    first, second = lots
+    merged = middleman.post('/api/batch/merge', json={'sources': [{'batch_id': first, 'quantity_kg': 20},
+                                                                  {'batch_id': second, 'quantity_kg': 60}]}).json
+    r = middleman.post('/api/batch/divide', json={'batch_id': merged['id'], 'divisions': [{'quantity_kg': 40}]})
+    assert r.status_code == 201, r.json
+    sub = r.json['new_batches'][0]['id']
+    composition = middleman.get(f'/api/batch/{sub}/composition').json
+    assert composition['sources'][0]['relation'] == 'division'
+    assert {farm['farm_location']: farm['quantity_kg'] for farm in composition['origin_attribution']} == \
+        {'Wayanad': 30, 'Idukki': 10}
+
+
+@pytest.mark.parametrize('sources, status', [
+    ([{'batch_id': 'first', 'quantity_kg': 10}], 400),
+    ([{'batch_id': 'first', 'quantity_kg': 10}, {'batch_id': 'first', 'quantity_kg': 5}], 400),
+    ([{'batch_id': 'first', 'quantity_kg': 41}, {'batch_id': 'second', 'quantity_kg': 5}], 400),
+    ([{'batch_id': 'first', 'quantity_kg': 10}, {'batch_id': 999, 'quantity_kg': 5}], 404),
+])
+def test_merge_validation(lots, middleman, sources, status):
+    ids = dict(zip(('first', 'second'), lots))
+    sources = [{**source, 'batch_id': ids.get(source['batch_id'], source['batch_id'])} for source in sources]
+    assert middleman.post('/api/batch/merge', json={'sources': sources}).status_code == status
+
+
+def test_merge_rejects_mixed_spices(farmer, middleman):
+    pepper = register_batch(farmer, 10)
+    cardamom = register_batch(farmer, 10, spice_id='2')
+    sell(farmer, middleman, pepper)
+    sell(farmer, middleman, cardamom)
+    r = middleman.post('/api/batch/merge', json={'sources': [{'batch_id': pepper, 'quantity_kg': 5},
+                                                             {'batch_id': cardamom, 'quantity_kg': 5}]})
+    assert r.status_code == 400 and 'same spice' in r.json['error']
@@ -0,0 +1,71 @@
+import pytest
+
+from spicechain import create_app
+from spicechain.bench import _per_metric_dashboard_summary
+from spicechain.cli import init_database
+
+from helpers import register_batch, sell
+
+
+@pytest.fixture
+def trading(app, farmer, middleman, officer, consumer):
+    """Two harvests, one sold on, tested, packaged and partly resold."""
+    kept = register_batch(farmer, 40)
+    sold = register_batch(farmer, 60)
+    r = officer.post('/api/qatest', json={'batch_id': sold, 'test_type': 'grade', 'test_result': 'pass',
+                                          'grade_assigned': 'A'})
+    assert r.status_code == 201, r.json
+    sell(farmer, middleman, sold, price_per_kg=12)
+    r = middleman.post('/api/package', json={'batch_id': sold, 'quantity_kg': 5, 'package_type': 'retail'})
+    assert r.status_code == 201, r.json
+    r = middleman.post('/api/transaction', json={'to_user_id': consumer.uid, 'quantity_kg': 5, 'price_per_kg': 20,
+                                                 'package_id': 1})
+    assert r.status_code == 201, r.json
+    return kept, sold
+
+
+@pytest.mark.parametrize('role', ['farmer', 'middleman', 'officer', 'consumer'])
+def test_summary_matches_per_metric_queries(app, trading, role, request):
+    client = request.getfixturevalue(role)
+    summary = client.get('/api/dashboard').json['summary']
+    with app.app_context():
+        expected = _per_metric_dashboard_summary(client.uid, {'officer': 'quality_officer'}.get(role, role))
+    expected.pop('stock_by_spice', None)
+    assert {key: summary[key] for key in expected} == expected
+
+
+def test_farmer_and_middleman_figures(trading, farmer, middleman, consumer):
+    summary = farmer.get('/api/dashboard').json['summary']
+    assert summary['total_batches'] == 2
+    assert summary['value_sold_this_month'] == 720
+    assert summary['stock_kg'] == 40
+    summary = middleman.get('/api/dashboard').json['summary']
+    assert summary['owned_packages'] == 1 and summary['pending_outgoing'] == 1
+    assert summary['stock_kg'] == 55
+    assert consumer.get('/api/dashboard').json['summary']['pending_incoming'] == 1
+
+
+def test_dashboard_micro_cache(app, farmer):
+    app.config['DASHBOARD_CACHE_SECONDS'] = 60
+    assert farmer.get('/api/dashboard').json['summary']['total_batches'] == 0
+    register_batch(farmer)
+    assert farmer.get('/api/dashboard').json['summary']['total_batches'] == 0
+    app.config['DASHBOARD_CACHE_SECONDS'] = 0
+    app.extensions['dashboard_cache'].clear()
+    assert farmer.get('/api/dashboard').json['summary']['total_batches'] == 1
+
+
+def test_apps_do_not_share_dashboards(app, farmer):
+    app.config['DASHBOARD_CACHE_SECONDS'] = 60
+    register_batch(farmer)
+    assert farmer.get('/api/dashboard').json['summary']['total_batches'] == 1
+    other = create_app('testing')
+    other.config['DASHBOARD_CACHE_SECONDS'] = 60
+    with other.app_context():
+        init_database()
+    client = other.test_client()
+    client.post('/api/signup', json={'username': 'farmer', 'email': 'farmer@example.com', 'password': 'pw',
+                                     'user_type': 'farmer'})
+    client.post('/api/login', json={'username': 'farmer@example.com', 'password': 'pw'})
+    # Same user id and type, different database
+    assert client.get('/api/dashboard').json['summary']['total_batches'] == 0
@@ -0,0 +1,72 @@
+import json
+
+from flask import g
+
+from spicechain import events
+from spicechain.blueprints.live import _stream
+from spicechain.events import LocalBroker
+
+from helpers import register_batch
+
+
+def test_broker_fans_out_by_channel():
+    broker = LocalBroker(queue_size=2)
+    a = broker.subscribe(['user:1', 'batch:7'])
+    b = broker.subscribe(['batch:7'])
+    broker.publish('batch:7', 'x')
+    broker.publish('user:1', 'y')
+    assert (a.get(0), a.get(0), a.get(0)) == ('x', 'y', None)
+    assert (b.get(0), b.get(0)) == ('x', None)
+    a.close()
+    assert broker.subscriber_count() == 1
+
+
+def test_slow_consumer_drops_instead_of_blocking():
+    broker = LocalBroker(queue_size=2)
+    subscription = broker.subscribe(['user:1'])
+    for n in range(5):
+        broker.publish('user:1', str(n))
+    assert subscription.dropped == 3
+
+
+def test_stream_heartbeats_and_unsubscribes():
+    broker = LocalBroker()
+    subscription = broker.subscribe(['user:1'])
+    stream = _stream(subscription, heartbeat=0)
+    assert next(stream) == 'retry: 5000\n\n'
+    assert next(stream) == ': keep-alive\n\n'
+    broker.publish('user:1', '{}')
+    assert next(stream) == 'data: {}\n\n'
+    stream.close()
+    assert broker.subscriber_count() == 0
+
+
+def test_held_events_wait_for_send(app):
+    broker = app.extensions['event_broker']
+    subscription = broker.subscribe(['batch:1'])
+    with app.test_request_context():
+        with events.held() as held:
+            events.publish(['batch:1'], 'harvest', {'n': 1})
+            assert subscription.get(0) is None
+        assert g.get('held_events') is None
+        events.send(held)
+    message = json.loads(subscription.get(0))
+    assert message['type'] == 'harvest' and message['data'] == {'n': 1}
+
+
+def test_writes_publish_to_batch_and_user_channels(app, farmer, middleman):
+    batch_id = register_batch(farmer)
+    broker = app.extensions['event_broker']
+    watcher = broker.subscribe([f'batch:{batch_id}'])
+    buyer = broker.subscribe([f'user:{middleman.uid}'])
+    r = farmer.post(f'/api/batch/{batch_id}/sell', json={'buyer_id': middleman.uid, 'price_per_kg': 3})
+    assert r.status_code == 201
+    assert watcher.get(0) is not None
+    assert json.loads(buyer.get(0))['data']['transaction_id'] == r.json['transaction_id']
+
+
+def test_event_stream_validation(app, farmer):
+    anonymous = app.test_client()
+    assert anonymous.get('/api/events').status_code == 400
+    assert anonymous.get('/api/events?package=PKG_NOPE').status_code == 404
+    assert anonymous.get('/api/events?access_token=bogus').status_code == 401
@@ -0,0 +1,85 @@
+import re
+
+import pytest
+
+from spicechain.blueprints.batches import BATCH_FIELDS
+from spicechain.blueprints.packages import PACKAGE_FIELDS
+
+from helpers import register_batch, sell
+
+
+def queries(client, url):
+    timing = client.get(url, headers={'X-Server-Timing': '1'}).headers['Server-Timing']
+    return int(re.search(r'(\d+) queries', timing).group(1))
+
+
+@pytest.fixture
+def stock(farmer, middleman, officer):
+    first = register_batch(farmer, 50)
+    register_batch(farmer, 20)
+    officer.post('/api/qatest', json={'batch_id': first, 'test_type': 'grade', 'test_result': 'pass',
+                                      'grade_assigned': 'A'})
+    r = farmer.post('/api/batch/divide', json={'batch_id': first, 'divisions': [{'quantity_kg': 10}]})
+    assert r.status_code == 201
+    return first
+
+
+def test_default_returns_every_field(farmer, stock):
+    batches = farmer.get('/api/mybatches').json['batches']
+    assert len(batches) == 3 and all(set(batch) == set(BATCH_FIELDS) for batch in batches)
+
+
+def test_fields_narrow_the_response_and_the_queries(farmer, stock):
+    everything = farmer.get('/api/mybatches').json['batches']
+    narrow = farmer.get('/api/mybatches?fields=batch_id, status').json['batches']
+    assert narrow == [{'batch_id': batch['batch_id'], 'status': batch['status']} for batch in everything]
+    assert queries(farmer, '/api/mybatches?fields=batch_id') < queries(farmer, '/api/mybatches')
+
+
+def test_includes_add_related_objects(farmer, stock):
+    batches = farmer.get('/api/mybatches?fields=id&include=qa,parent').json['batches']
+    by_id = {batch['id']: batch for batch in batches}
+    assert by_id[stock]['qa']['grade_assigned'] == 'A' and by_id[stock]['parent'] is None
+    child = next(batch for batch in batches if batch['parent'])
+    assert child['parent']['id'] == stock and child['qa'] is None
+    assert set(child) == {'id', 'qa', 'parent'}
+
+
+def test_packages_include_batch_and_farmer(farmer, stock):
+    farmer.post('/api/package', json={'batch_id': stock, 'quantity_kg': 5, 'package_type': 'box'})
+    default = farmer.get('/api/mypackages').json['packages']
+    assert set(default[0]) == set(PACKAGE_FIELDS)
+    package = farmer.get('/api/mypackages?fields=package_id&include=batch').json['packages'][0]
+    assert set(package) == {'package_id', 'batch'}
+    assert package['batch']['id'] == stock and package['batch']['farmer'] == 'farmer'
+
+
+def test_transactions_item_include(farmer, middleman, stock):
+    code = sell(farmer, middleman, stock)
+    txn = middleman.get('/api/transactions?fields=transaction_id,item_id&include=item').json['transactions'][0]
+    assert txn['transaction_id'] == code and txn['item']['id'] == stock
+    assert set(txn) == {'transaction_id', 'item_id', 'item'}
+
+
+def test_nested_fields_on_trace(farmer, stock):
+    code = farmer.post('/api/package', json={'batch_id': stock, 'quantity_kg': 5, 'package_type': 'box'}).json[
+        'package_id']
+    full = farmer.get(f'/api/trace/{code}').json
+    narrow = farmer.get(f'/api/trace/{code}?fields=package_details.spice_name,full_journey.event_type').json
+    assert narrow == {
+        'package_details': {'spice_name': full['package_details']['spice_name']},
+        'full_journey': [{'event_type': event['event_type']} for event in full['full_journey']],
+    }
+    whole = farmer.get(f'/api/trace/{code}?fields=origin_details').json
+    assert whole == {'origin_details': full['origin_details']}
+
+
+@pytest.mark.parametrize('url, message', [
+    ('/api/mybatches?fields=secret', "Unknown field 'secret'"),
+    ('/api/mybatches?include=farmer', 'Cannot include farmer'),
+    ('/api/mypackages?fields=batch.farmer', "Unknown field 'batch.farmer'"),
+    ('/api/trace/X?fields=package_details.nope', "Unknown field 'package_details.nope'"),
+])
+def test_unknown_names_are_rejected(farmer, url, message):
+    r = farmer.get(url)
+    assert r.status_code == 400 and message in r.json['error']
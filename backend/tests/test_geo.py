@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+from spicechain import geo
+from spicechain.extensions import db
+from spicechain.models import Batches, User
+
+from helpers import register_batch
+
+
+@pytest.mark.parametrize('text, point', [
+    ('9.93, 76.26', (9.93, 76.26)), ('(12.97 77.59)', (12.97, 77.59)), ('-1;2', (-1, 2)),
+    ('100, 77', None), ('somewhere', None), (None, None),
+])
+def test_parse_coordinate(text, point):
+    assert geo.parse_coordinate(text) == point
+
+
+def test_distance_km():
+    # Kochi to Munnar is roughly 90 km in a straight line
+    assert geo.distance_km(9.93, 76.26, 10.09, 77.06) == pytest.approx(89, abs=5)
+
+
+def test_radius_and_box_match_brute_force(app):
+    rng = random.Random(1)
+    points = [(rng.uniform(9, 11), rng.uniform(76, 78)) for _ in range(1500)]
+    with app.app_context():
+        db.session.execute(db.insert(User), [
+            {'username': f'p{i}', 'email': f'p{i}@example.com', 'password_hash': 'x', 'user_type': 'farmer',
+             'latitude': lat, 'longitude': lon, 'geo_cell': geo.cell(lat, lon), 'is_active': True}
+            for i, (lat, lon) in enumerate(points)])
+        db.session.commit()
+        for lat, lon, radius in [(10, 77, 25), (9.5, 76.2, 60), (10.7, 77.9, 5)]:
+            found = geo.within_radius(User, lat, lon, radius, limit=10000)
+            assert {user.username for user, _ in found} == \
+                {f'p{i}' for i, point in enumerate(points) if geo.distance_km(lat, lon, *point) <= radius}
+            assert [d for _, d in found] == sorted(d for _, d in found)
+            box = geo.within_box(User, lat - 0.2, lon - 0.3, lat + 0.2, lon + 0.3, limit=10000)
+            assert {user.username for user in box} == \
+                {f'p{i}' for i, (a, b) in enumerate(points) if lat - 0.2 <= a <= lat + 0.2 and lon - 0.3 <= b <= lon + 0.3}
+
+
+def test_signup_and_batches_are_located(make_user):
+    farmer = make_user('grower', 'farmer', coordinate='9.85, 76.97')
+    register_batch(farmer, farm_location='Kumily')
+    register_batch(farmer, farm_location='Munnar', latitude='10.09', longitude='77.06')
+    users = farmer.get('/api/geo/users?lat=9.9&lon=77&radius_km=20').json['users']
+    assert [user['username'] for user in users] == ['grower']
+    r = farmer.get('/api/geo/batches?lat=9.9&lon=77&radius_km=10')
+    assert [batch['farm_location'] for batch in r.json['batches']] == ['Kumily']
+    r = farmer.get('/api/geo/batches?bbox=76.9,9.8,77.1,10.1')
+    assert {batch['farm_location'] for batch in r.json['batches']} == {'Kumily', 'Munnar'}
+
+
+def test_world_box_is_one_range(make_user):
+    farmer = make_user('grower', 'farmer', coordinate='9.85, 76.97')
+    make_user('far', 'middleman', coordinate='-45.0, -170.0')
+    register_batch(farmer)
+    assert geo.cell_ranges(-90, -180, 90, 180) == [(geo.cell(-90, -180), geo.cell(90, 180))]
+    assert len(geo.cell_ranges(0.01, 0, 4.99, 1)) == 100
+    users = farmer.get('/api/geo/users?bbox=-180,-90,180,90').json['users']
+    assert {user['username'] for user in users} == {'grower', 'far'}
+    assert len(farmer.get('/api/geo/batches?bbox=-180,-90,180,90').json['batches']) == 1
+    # A tall narrow box still only matches what is inside it
+    users = farmer.get('/api/geo/users?bbox=76,-60,78,60').json['users']
+    assert [user['username'] for user in users] == ['grower']
+
+
+def test_invalid_batch_location_rejected(farmer):
+    r = farmer.post('/api/registerbatch', data={'spice_id': '1', 'quantity_kg': '10', 'farm_location': 'X',
+                                                'harvest_date': '2026-09-01T00:00:00Z', 'latitude': '100',
+                                                'longitude': '77'})
+    assert r.status_code == 400
+
+
+@pytest.mark.parametrize('query', ['', 'bbox=1,2', 'bbox=10,10,5,5', 'lat=1&lon=1&radius_km=5000'])
+def test_area_validation(farmer, query):
+    assert farmer.get(f'/api/geo/users?{query}').status_code == 400
+
+
+def test_backfill_parses_users_and_locates_batches(app, farmer):
+    batch_id = register_batch(farmer)
+    with app.app_context():
+        db.session.get(User, farmer.uid).coordinate = '(12.97 77.59)'
+        db.session.commit()
+        report = geo.backfill(reindex=True)
+        assert report['users'] == 1 and report['batches'] == 1
+        batch = db.session.get(Batches, batch_id)
+        assert (batch.latitude, batch.longitude, batch.geo_cell) == (12.97, 77.59, geo.cell(12.97, 77.59))
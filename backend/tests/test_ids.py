@@ -0,0 +1,95 @@
+import threading
+from datetime import datetime
+
+import pytest
+
+from spicechain import ids
+from spicechain.ids import EPOCH_MS, IdGenerator, encode, issued_at
+
+from helpers import register_batch
+
+
+class Clock:
+    def __init__(self, ms):
+        self.ms = ms
+
+    def __call__(self):
+        return self.ms / 1000
+
+
+def test_encoding_is_fixed_width_and_ordered():
+    values = [0, 1, 31, 32, 2 ** 40, 2 ** 63, 2 ** 64 - 1]
+    codes = [encode(value) for value in values]
+    assert all(len(code) == 13 for code in codes) and codes == sorted(codes)
+    assert not set(''.join(codes)) & set('ILOU')
+
+
+def test_numbers_carry_time_worker_and_sequence():
+    clock = Clock(EPOCH_MS + 86400000)
+    first, second = IdGenerator(5, clock).allocate(2)
+    assert second == first + 1
+    assert (first >> 12) & 1023 == 5 and first & 4095 == 0
+    assert issued_at(first) == datetime(2024, 1, 2)
+
+
+def test_sequence_overflow_and_clock_steps_back_stay_increasing():
+    clock = Clock(EPOCH_MS + 1000)
+    generator = IdGenerator(0, clock)
+    numbers = generator.allocate(5000)
+    clock.ms -= 500
+    numbers += generator.allocate(3)
+    assert numbers == sorted(set(numbers)) and len(numbers) == 5003
+    # The overflow borrowed the next millisecond rather than waiting for it
+    assert issued_at(numbers[-1]) > issued_at(numbers[0])
+
+
+def test_workers_never_collide():
+    clock = Clock(EPOCH_MS + 1000)
+    a, b = IdGenerator(1, clock).allocate(100), IdGenerator(2, clock).allocate(100)
+    assert not set(a) & set(b)
+
+
+def test_worker_id_is_checked():
+    with pytest.raises(ValueError):
+        IdGenerator(1024)
+
+
+def test_threads_get_unique_increasing_codes(app):
+    results = []
+
+    def work():
+        with app.app_context():
+            results.append([ids.new_id('BATCH') for _ in range(500)])
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(codes == sorted(codes) for codes in results)
+    assert len({code for codes in results for code in codes}) == 2000
+
+
+def test_codes_keep_their_readable_form(app):
+    with app.app_context():
+        codes = ids.new_ids('PKG', 3)
+        today = datetime.utcnow().strftime('%Y%m%d')
+    assert codes == sorted(codes)
+    assert all(code.startswith(f'PKG_{today}_') and len(code) == len(f'PKG_{today}_') + 13 for code in codes)
+
+
+def test_processes_claim_distinct_worker_ids(app):
+    with app.app_context():
+        first = ids._claim_worker_id()
+        assert ids._claim_worker_id() == first + 1
+        app.config['ID_WORKER_ID'] = 7
+        app.extensions['ids']['generator'] = None
+        assert ids.generator().worker_id == 7
+
+
+def test_batch_codes_sort_in_registration_order(farmer):
+    for _ in range(5):
+        register_batch(farmer)
+    batches = sorted(farmer.get('/api/mybatches?fields=id,batch_id').json['batches'], key=lambda b: b['id'])
+    codes = [batch['batch_id'] for batch in batches]
+    assert codes == sorted(codes) and len(set(codes)) == 5
@@ -0,0 +1,54 @@
+import pytest
+from flask import g
+from sqlalchemy.exc import OperationalError
+
+from spicechain import instrumentation
+from spicechain.extensions import db
+from spicechain import create_app
+from spicechain.instrumentation import RequestStats, normalize_statement
+
+
+def test_normalize_collapses_literals_and_in_lists():
+    a = normalize_statement("SELECT * FROM batches WHERE id IN (?, ?, ?) AND status = 'sold' LIMIT 10")
+    b = normalize_statement("SELECT * FROM batches\n WHERE id IN (?) AND status = 'new' LIMIT 5")
+    assert a == b == 'SELECT * FROM batches WHERE id IN (?) AND status = ? LIMIT ?'
+
+
+def test_n_plus_one_threshold():
+    stats = RequestStats()
+    stats.statements.update({'SELECT a': 5, 'SELECT b': 4})
+    assert stats.n_plus_one(5) == {'SELECT a': 5}
+
+
+def test_server_timing_header_on_request(farmer):
+    assert 'Server-Timing' not in farmer.get('/api/mybatches').headers
+    timing = farmer.get('/api/mybatches', headers={'X-Server-Timing': '1'}).headers['Server-Timing']
+    assert timing.startswith('db;dur=') and 'queries' in timing and 'total;dur=' in timing
+
+
+def test_metrics_count_requests_and_queries(app, farmer):
+    farmer.get('/api/mybatches')
+    farmer.get('/api/mybatches')
+    body = app.test_client().get('/metrics').get_data(as_text=True)
+    assert 'spicechain_requests_total{endpoint="batches.get_my_batches",method="GET",status="200"} 2' in body
+    assert 'spicechain_db_queries_total{endpoint="batches.get_my_batches"}' in body
+    # The scrape itself is not counted
+    assert 'metrics.prometheus_metrics' not in body
+    # Nor are another app's requests
+    other = create_app('testing').test_client()
+    other.get('/api/nowhere')
+    assert 'get_my_batches' not in other.get('/metrics').get_data(as_text=True)
+    assert 'unmatched' not in app.test_client().get('/metrics').get_data(as_text=True)
+
+
+def test_failed_statement_leaves_no_state(app):
+    with app.test_request_context():
+        instrumentation._before_request()
+        with pytest.raises(OperationalError):
+            db.session.execute(db.text('SELECT * FROM no_such_table'))
+        db.session.rollback()
+        db.session.execute(db.text('SELECT 1'))
+        stats = g._request_stats
+        assert stats.statements == {'SELECT ?': 1}
+        assert stats.db_seconds > 0
+        assert not any(key.startswith('_query') for key in db.session.connection().info)
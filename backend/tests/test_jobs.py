@@ -0,0 +1,157 @@
+import io
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from spicechain import jobs
+from spicechain.extensions import db
+from spicechain.models import Batches, Job, Watermark
+
+calls = []
+
+
+@jobs.task('test_write')
+def write(name, fail=False):
+    db.session.add(Watermark(name=name, last_id=1, updated_at=datetime.utcnow()))
+    jobs.progress(0.5, 'half way')
+    calls.append(name)
+    if fail:
+        raise RuntimeError('boom')
+    return {'name': name}
+
+
+@pytest.fixture
+def ctx(app):
+    calls.clear()
+    with app.app_context():
+        yield app
+
+
+def queue(kind='test_write', **kwargs):
+    job = jobs.enqueue(kind, **kwargs)
+    db.session.commit()
+    return job.id
+
+
+def test_unknown_kind_is_refused(ctx):
+    with pytest.raises(ValueError):
+        jobs.enqueue('nope')
+
+
+def test_claim_order_and_delay(ctx):
+    low = queue(payload={'name': 'low'})
+    high = queue(payload={'name': 'high'}, priority=5)
+    queue(payload={'name': 'later'}, priority=9, delay=60)
+    assert jobs.claim('w').id == high
+    assert jobs.claim('w').id == low
+    assert jobs.claim('w') is None
+
+
+def test_success_commits_the_job_writes(ctx):
+    job_id = queue(payload={'name': 'ok'})
+    job = jobs.execute(jobs.claim('w'))
+    assert (job.status, job.result, job.progress, job.progress_message) == ('succeeded', {'name': 'ok'}, 1.0,
+                                                                            'half way')
+    db.session.remove()
+    assert db.session.get(Watermark, 'ok') is not None
+    assert db.session.get(Job, job_id).worker is None
+
+
+def test_failures_retry_with_backoff_then_fail(ctx):
+    ctx.config.update(JOB_RETRY_BACKOFF_SECONDS=10, JOB_RETRY_MAX_BACKOFF_SECONDS=15)
+    job_id = queue(payload={'name': 'bad', 'fail': True}, max_attempts=3)
+    delays = []
+    for attempt in range(1, 4):
+        job = db.session.get(Job, job_id)
+        job.run_at = datetime.utcnow()
+        db.session.commit()
+        started = datetime.utcnow()
+        job = jobs.execute(jobs.claim('w'))
+        assert job.attempts == attempt and 'RuntimeError: boom' in job.error
+        if attempt < 3:
+            assert job.status == 'queued'
+            delays.append((job.run_at - started).total_seconds())
+    assert job.status == 'failed' and job.finished_at is not None
+    # 10 s, then doubled but capped at 15 s, each with +-20% jitter
+    assert 8 <= delays[0] <= 12.5 and 12 <= delays[1] <= 18.5
+    # The failed attempts' writes were rolled back
+    assert db.session.get(Watermark, 'bad') is None and calls == ['bad'] * 3
+
+
+def test_lost_workers_are_recovered(ctx):
+    requeued = queue(payload={'name': 'a'}, max_attempts=2)
+    exhausted = queue(payload={'name': 'b'}, max_attempts=1)
+    assert jobs.claim('w').id == requeued and jobs.claim('w').id == exhausted
+    assert jobs.recover_expired() == (0, 0)
+    db.session.execute(db.update(Job).values(heartbeat_at=datetime.utcnow() - timedelta(minutes=5)))
+    db.session.commit()
+    assert jobs.recover_expired() == (1, 1)
+    assert db.session.get(Job, requeued).status == 'queued'
+    assert db.session.get(Job, exhausted).status == 'failed'
+    assert jobs.execute(jobs.claim('w')).status == 'succeeded'
+
+
+def test_progress_outside_a_job_is_ignored(ctx):
+    jobs.progress(0.5, 'nowhere')
+    assert write('direct') == {'name': 'direct'}
+
+
+def test_job_endpoints(app, farmer, middleman):
+    with app.app_context():
+        job_id = queue(payload={'name': 'x'}, user_id=farmer.uid)
+        started = queue(payload={'name': 'y'}, user_id=farmer.uid, priority=1)
+        jobs.claim('w')
+    assert [job['id'] for job in farmer.get('/api/jobs').json['jobs']] == [started, job_id]
+    assert farmer.get('/api/jobs?status=running').json['jobs'][0]['id'] == started
+    assert middleman.get(f'/api/jobs/{job_id}').status_code == 404
+    assert farmer.get(f'/api/jobs/{job_id}/output').status_code == 409
+    assert farmer.post(f'/api/jobs/{started}/cancel').status_code == 409
+    assert farmer.post(f'/api/jobs/{job_id}/cancel').status_code == 200
+    assert farmer.get(f'/api/jobs/{job_id}').json['status'] == 'cancelled'
+
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 32
+
+
+def register_with_image(client, content, filename):
+    r = client.post('/api/registerbatch', data={
+        'spice_id': '1', 'quantity_kg': '10', 'harvest_date': '2026-09-01T00:00:00Z', 'farm_location': 'Idukki',
+        'harvest_image': (io.BytesIO(content), filename)
+    }, content_type='multipart/form-data')
+    assert r.status_code == 201, r.json
+    assert r.json['harvest_image'] is None and r.json['image_job_id']
+    return r.json
+
+
+@pytest.mark.parametrize('content, filename, stored', [
+    (PNG, 'IMG_0001.jpg', '.png'),
+    (b'\xff\xd8\xff\xe0' + b'\x00' * 16, 'photo.jpeg', '.jpg'),
+    (b'<script>alert(1)</script>', 'evil.png', None),
+])
+def test_harvest_images_are_processed_by_a_job(app, farmer, content, filename, stored):
+    batch = register_with_image(farmer, content, filename)
+    upload_folder = app.config['UPLOAD_FOLDER']
+    with app.app_context():
+        job = jobs.execute(jobs.claim('w'))
+        assert job.status == 'succeeded' and job.id == batch['image_job_id']
+        result = job.result
+        code = db.session.get(Batches, batch['id']).batch_id
+        image = db.session.get(Batches, batch['id']).harvest_image
+    assert os.listdir(os.path.join(upload_folder, 'incoming')) == []
+    if stored:
+        assert image == f'/uploads/harvests/{code}{stored}'
+        assert open(os.path.join(upload_folder, code + stored), 'rb').read() == content
+    else:
+        assert image is None and result['rejected'] == 'not a PNG or JPEG image', result
+        assert [name for name in os.listdir(upload_folder) if name != 'incoming'] == []
+
+
+def test_other_extensions_are_not_queued(app, farmer):
+    r = farmer.post('/api/registerbatch', data={
+        'spice_id': '1', 'quantity_kg': '10', 'harvest_date': '2026-09-01T00:00:00Z', 'farm_location': 'Idukki',
+        'harvest_image': (io.BytesIO(PNG), 'photo.gif')
+    }, content_type='multipart/form-data')
+    assert r.status_code == 201 and r.json['image_job_id'] is None
+    with app.app_context():
+        assert Job.query.count() == 0
@@ -0,0 +1,70 @@
+import pytest
+
+from spicechain import market
+from spicechain.extensions import db
+from spicechain.models import MarketFacet, MarketListing
+
+from helpers import register_batch, sell
+
+
+def index_snapshot():
+    listings = sorted((l.batch_id, l.owner_id, l.spice_id, l.grade, l.farming_method, round(l.quantity_kg, 6))
+                      for l in MarketListing.query)
+    facets = sorted((f.spice_id, f.grade, f.farming_method, f.listings, round(f.quantity_kg, 6))
+                    for f in MarketFacet.query if f.listings)
+    return listings, facets
+
+
+@pytest.fixture
+def stocked(farmer, middleman):
+    organic = register_batch(farmer, 50, farming_method='organic', harvest_date='2026-08-01T00:00:00Z')
+    register_batch(farmer, 20, harvest_date='2026-09-01T00:00:00Z')
+    register_batch(farmer, 30, spice_id='2', estimated_grade='A', harvest_date='2026-07-01T00:00:00Z')
+    r = farmer.post('/api/batch/divide', json={'batch_id': organic, 'divisions': [{'quantity_kg': 10}]})
+    assert r.status_code == 201, r.json
+    return organic
+
+
+def test_index_matches_rebuild_after_writes(app, stocked, farmer, middleman, officer):
+    sell(farmer, middleman, stocked)
+    register_batch(farmer, 5)
+    officer.post('/api/qatest', json={'batch_id': 2, 'test_type': 'grade', 'test_result': 'pass',
+                                      'grade_assigned': 'A'})
+    with app.app_context():
+        incremental = index_snapshot()
+        market.rebuild()
+        assert index_snapshot() == incremental
+
+
+def test_filters_sort_and_facets(app, stocked):
+    client = app.test_client()
+    r = client.get('/api/market?sort=quantity_kg')
+    assert [listing['quantity_kg'] for listing in r.json['listings']] == [10, 20, 30, 40]
+    assert r.json['total'] == 4
+    r = client.get('/api/market?spice_id=1&farming_method=organic')
+    assert r.json['total'] == 2 and {l['farming_method'] for l in r.json['listings']} == {'organic'}
+    methods = {f['value']: f['listings'] for f in r.json['facets']['farming_method']}
+    assert methods == {'conventional': 1, 'organic': 2}
+    r = client.get('/api/market?min_quantity_kg=15&max_quantity_kg=35')
+    assert r.json['total'] == 2
+    r = client.get('/api/market?harvested_from=2026-08-15')
+    assert [l['quantity_kg'] for l in r.json['listings']] == [20]
+    r = client.get('/api/market?per_page=3&page=2')
+    assert len(r.json['listings']) == 1 and r.json['pages'] == 2
+
+
+def test_pending_sale_and_recall_delist(app, stocked, farmer, middleman, officer):
+    client = app.test_client()
+    farmer.post(f'/api/batch/{stocked}/sell', json={'buyer_id': middleman.uid, 'price_per_kg': 5})
+    assert stocked not in [l['id'] for l in client.get('/api/market').json['listings']]
+    officer.post('/api/recall/3/freeze')
+    assert 3 not in [l['id'] for l in client.get('/api/market').json['listings']]
+    with app.app_context():
+        incremental = index_snapshot()
+        market.rebuild()
+        assert index_snapshot() == incremental
+
+
+@pytest.mark.parametrize('query', ['sort=price', 'harvested_from=soon'])
+def test_market_validation(app, query):
+    assert app.test_client().get(f'/api/market?{query}').status_code == 400
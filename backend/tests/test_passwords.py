@@ -0,0 +1,60 @@
+import os
+import time
+
+import pytest
+
+from spicechain.passwords import HasherBusy, LoginThrottle, PasswordHasher
+
+
+@pytest.fixture
+def pooled():
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1, queue_size=1, timeout=0.5)
+    hasher.timeout = 30
+    hasher._run(pow, 2, 3)  # start the worker outside the timed calls
+    hasher.timeout = 0.5
+    yield hasher
+    hasher.shutdown()
+
+
+def test_inline_hash_and_verify():
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=0, queue_size=1, timeout=1)
+    password_hash = hasher.hash('secret')
+    assert hasher.verify(password_hash, 'secret') and not hasher.verify(password_hash, 'other')
+    assert not hasher.needs_rehash(password_hash)
+    assert PasswordHasher('scrypt:32768:8:1', 0, 1, 1).needs_rehash(password_hash)
+
+
+def test_timed_out_hash_keeps_its_slot_until_done(pooled):
+    with pytest.raises(HasherBusy, match='timed out'):
+        pooled._run(time.sleep, 1.5)
+    # The abandoned job still occupies the only slot
+    with pytest.raises(HasherBusy, match='queue is full'):
+        pooled._run(pow, 2, 3)
+    time.sleep(1.5)
+    assert pooled._run(pow, 2, 3) == 8
+
+
+def test_crashed_worker_rebuilds_pool(pooled):
+    with pytest.raises(HasherBusy, match='restarted'):
+        pooled._run(os._exit, 1)
+    pooled.timeout = 30
+    assert pooled._run(pow, 2, 3) == 8
+
+
+def test_login_throttle_window():
+    throttle = LoginThrottle(limit=2, window=60)
+    throttle.record('1.2.3.4')
+    assert throttle.retry_after('1.2.3.4') == 0
+    throttle.record('1.2.3.4')
+    assert 0 < throttle.retry_after('1.2.3.4') <= 61
+    throttle.reset('1.2.3.4')
+    assert throttle.retry_after('1.2.3.4') == 0
+
+
+def test_login_failures_throttle_account(app, make_user):
+    make_user('alice', 'farmer')
+    client = app.test_client()
+    for _ in range(app.config['LOGIN_ACCOUNT_FAILURE_LIMIT']):
+        assert client.post('/api/login', json={'username': 'alice@example.com', 'password': 'bad'}).status_code == 401
+    r = client.post('/api/login', json={'username': 'alice@example.com', 'password': 'pw'})
+    assert r.status_code == 429 and int(r.headers['Retry-After']) > 0
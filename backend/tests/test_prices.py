@@ -0,0 +1,93 @@
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from spicechain import prices
+from spicechain.extensions import db
+from spicechain.models import PriceBar, Transactions
+
+from helpers import register_batch, sell
+
+
+def bars_snapshot():
+    return sorted((b.segment_type, b.segment, str(b.day), round(b.open, 4), round(b.high, 4), round(b.low, 4),
+                   round(b.close, 4), round(b.volume_kg, 4), b.trades) for b in PriceBar.query)
+
+
+def add_sales(batch_id, seller, buyer, sales):
+    rows = [Transactions(transaction_id=f'PX{i}', from_user_id=seller, to_user_id=buyer, batch_id=batch_id,
+                         quantity_kg=quantity, price_per_kg=price, total_amount=quantity * price,
+                         transaction_type='sale', payment_status='completed', transaction_date=at)
+            for i, (at, quantity, price) in enumerate(sales)]
+    db.session.add_all(rows)
+    db.session.flush()
+    return rows
+
+
+def test_daily_ohlc_and_vwap(app, farmer, middleman):
+    batch_id = register_batch(farmer)
+    day = datetime(2026, 9, 1, 8)
+    with app.app_context():
+        rows = add_sales(batch_id, farmer.uid, middleman.uid, [
+            (day, 1, 10), (day + timedelta(hours=1), 1, 14), (day + timedelta(hours=2), 2, 8)])
+        prices.record_sales(rows)
+        db.session.commit()
+        bar = PriceBar.query.filter_by(segment_type='all').one()
+        assert (bar.open, bar.high, bar.low, bar.close, bar.volume_kg, bar.trades) == (10, 14, 8, 8, 4, 3)
+        assert {(b.segment_type, b.segment) for b in PriceBar.query} == {('all', ''), ('grade', 'B'),
+                                                                          ('region', 'Idukki')}
+    r = farmer.get('/api/analytics/spice/1/prices?window=2')
+    assert r.json['bars'] == [{'date': '2026-09-01', 'open': 10.0, 'high': 14.0, 'low': 8.0, 'close': 8.0,
+                               'volume_kg': 4.0, 'trades': 3, 'vwap': 10.0, 'rolling_mean': None,
+                               'volatility': None}]
+
+
+def test_incremental_bars_match_rebuild(app, farmer, middleman):
+    batch_id = register_batch(farmer)
+    rng = random.Random(1)
+    with app.app_context():
+        rows = add_sales(batch_id, farmer.uid, middleman.uid, [
+            (datetime(2026, 8, 1) + timedelta(hours=i * 7.3), rng.uniform(1, 10), 100 + rng.gauss(0, 5))
+            for i in range(150)])
+        for row in rows:
+            prices.record_sale(row)
+        db.session.commit()
+        incremental = bars_snapshot()
+        prices.rebuild()
+        assert bars_snapshot() == incremental
+
+
+def test_completing_a_sale_records_it(app, farmer, middleman):
+    sell(farmer, middleman, register_batch(farmer, 10), price_per_kg=12)
+    with app.app_context():
+        assert PriceBar.query.filter_by(segment_type='all').one().close == 12
+
+
+def test_rolling_stats_and_weekly():
+    days = np.arange(np.datetime64('2026-08-31'), np.datetime64('2026-09-14'))  # two Monday-based weeks
+    close = np.array([10.0, 20.0] * 7)
+    bars = {'day': days, 'open': close, 'high': close, 'low': close, 'close': close,
+            'volume_kg': np.ones(14), 'turnover': close, 'trades': np.ones(14, dtype=np.int64), 'first': 0}
+    stats = prices.rolling_stats(bars, 2)
+    assert np.isnan(stats['rolling_mean'][0]) and stats['rolling_mean'][1:] == pytest.approx(15)
+    # Alternating closes: returns of +/- log 2, so a 3-bar window has volatility log 2
+    volatility = prices.rolling_stats(bars, 3)['volatility']
+    assert np.isnan(volatility[:2]).all() and volatility[2:] == pytest.approx(np.log(2))
+    weeks = prices.weekly(bars)
+    assert [str(day) for day in weeks['day']] == ['2026-08-31', '2026-09-07']
+    assert list(weeks['trades']) == [7, 7] and list(weeks['close']) == [10, 20]
+
+
+@pytest.mark.parametrize('query, status', [
+    ('segment=foo', 400), ('window=1', 400), ('interval=month', 400), ('from=yesterday', 400),
+    ('interval=week&segment=grade:B', 200),
+])
+def test_price_series_validation(farmer, query, status):
+    assert farmer.get(f'/api/analytics/spice/1/prices?{query}').status_code == status
+
+
+def test_unknown_spice(farmer):
+    assert farmer.get('/api/analytics/spice/99/prices').status_code == 404
+    assert farmer.get('/api/analytics/spice/99/index').status_code == 404
@@ -0,0 +1,43 @@
+import json
+
+from spicechain.rawjson import RawJSON, raw
+
+from helpers import register_batch, sell
+
+
+def test_fragments_are_spliced_verbatim(app):
+    payload = {'a': RawJSON('{"x": [1, 2.50]}'), 'b': [raw(None), raw(None, 'null')], 'c': 'plain'}
+    text = app.json.dumps(payload)
+    assert '"x": [1, 2.50]' in text
+    assert json.loads(text) == {'a': {'x': [1, 2.5]}, 'b': [{}, None], 'c': 'plain'}
+
+
+def test_strings_that_look_like_placeholders_are_untouched(app):
+    payload = {'s': '\x00deadbeef:0', 'r': RawJSON('[]')}
+    assert json.loads(app.json.dumps(payload)) == {'s': '\x00deadbeef:0', 'r': []}
+
+
+def test_without_fragments_output_is_unchanged(app):
+    payload = {'n': 1, 'list': ['é', None]}
+    with app.app_context():
+        assert app.json.dumps(payload) == json.dumps(payload, ensure_ascii=True, sort_keys=True) \
+            or json.loads(app.json.dumps(payload)) == payload
+
+
+def test_timeline_metadata_round_trips(farmer, middleman):
+    batch_id = register_batch(farmer)
+    code = sell(farmer, middleman, batch_id)
+    r = farmer.get(f'/api/timeline?transaction_id={code}')
+    assert r.status_code == 200
+    metadata = [event['metadata'] for event in r.json['events']]
+    assert metadata and all(isinstance(m, dict) and m['transaction_id'] == code for m in metadata)
+    assert farmer.get('/api/timeline').status_code == 400
+
+
+def test_audit_export_embeds_stored_values(farmer, officer):
+    batch_id = register_batch(farmer)
+    assert officer.post(f'/api/recall/{batch_id}/freeze', json={'reason': 'mould'}).status_code == 200
+    lines = [json.loads(line) for line in officer.get('/api/audit/export').get_data(as_text=True).splitlines()]
+    frozen = [line for line in lines if line['action'] == 'RECALL_FROZEN']
+    assert frozen[0]['new_values']['reason'] == 'mould' and frozen[0]['old_values'] is None
+    assert all(line['new_values'] is None for line in lines if line['action'] != 'RECALL_FROZEN')
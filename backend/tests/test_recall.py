@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+from spicechain import jobs
+from spicechain.extensions import db
+from spicechain.models import Batches, Package, Transactions
+
+from helpers import register_batch
+
+
+@pytest.fixture
+def lineage(app, farmer, middleman, officer):
+    """A tested harvest divided three ways: one part sold and packaged, one
+    sale still pending, one part kept by the farmer."""
+    root = register_batch(farmer)
+    r = officer.post('/api/qatest', json={'batch_id': root, 'test_type': 'grade', 'test_result': 'pass',
+                                          'grade_assigned': 'A'})
+    assert r.status_code == 201, r.json
+    r = farmer.post('/api/batch/divide', json={'batch_id': root, 'divisions': [
+        {'quantity_kg': 30, 'buyer_id': middleman.uid, 'price_per_kg': 10},
+        {'quantity_kg': 20, 'buyer_id': middleman.uid, 'price_per_kg': 10},
+        {'quantity_kg': 10},
+    ]})
+    assert r.status_code == 201, r.json
+    sold, pending, kept = (batch['id'] for batch in r.json['new_batches'])
+    sale, pending_sale = (t['transaction_id'] for t in r.json['transactions_created'])
+    assert middleman.post(f'/api/transaction/{sale}/complete').status_code == 200
+    r = middleman.post('/api/package', json={'batch_id': sold, 'quantity_kg': 5, 'package_type': 'retail'})
+    assert r.status_code == 201, r.json
+    return {'root': root, 'sold': sold, 'pending': pending, 'kept': kept, 'pending_sale': pending_sale,
+            'package': r.json['package_id']}
+
+
+def test_impact_summary_and_stream_agree(lineage, officer):
+    summary = officer.get(f"/api/recall/{lineage['root']}/impact?summary=1").json
+    assert summary['batches'] == 4 and summary['packages'] == 1
+    assert summary['pending_transactions'] == 1 and summary['holders'] == 2
+    r = officer.get(f"/api/recall/{lineage['root']}/impact")
+    records = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+    assert r.mimetype == 'application/x-ndjson'
+    assert [record['type'] for record in records].count('batch') == 4
+    assert records[-1] == {'type': 'summary', 'root_batch_id': lineage['root'], 'batches': 4, 'packages': 1,
+                           'pending_transactions': 1, 'holders': 2}
+
+
+def test_impact_of_sub_batch_excludes_siblings(lineage, officer):
+    summary = officer.get(f"/api/recall/{lineage['sold']}/impact?summary=1").json
+    assert summary['batches'] == 1 and summary['packages'] == 1 and summary['pending_transactions'] == 0
+
+
+def test_only_officers_freeze(lineage, farmer):
+    assert farmer.post(f"/api/recall/{lineage['root']}/freeze").status_code == 403
+
+
+def test_freeze_marks_lineage_once(app, lineage, officer):
+    r = officer.post(f"/api/recall/{lineage['root']}/freeze", json={'reason': 'aflatoxin'})
+    assert r.status_code == 200
+    assert r.json['frozen'] == {'batches': 4, 'packages': 1, 'transactions': 1}
+    with app.app_context():
+        assert {b.status for b in Batches.query} == {'recalled'}
+        assert Package.query.one().status == 'recalled'
+        assert Transactions.query.filter_by(transaction_id=lineage['pending_sale']).one().payment_status == 'frozen'
+    r = officer.post(f"/api/recall/{lineage['root']}/freeze")
+    assert r.json['frozen'] == {'batches': 0, 'packages': 0, 'transactions': 0}
+
+
+@pytest.fixture
+def frozen(lineage, officer):
+    assert officer.post(f"/api/recall/{lineage['root']}/freeze").status_code == 200
+    return lineage
+
+
+def test_frozen_transaction_cannot_complete(frozen, middleman):
+    r = middleman.post(f"/api/transaction/{frozen['pending_sale']}/complete")
+    assert r.status_code == 400 and r.json['error'] == 'Transaction is frozen, not pending'
+
+
+def test_recalled_batches_cannot_be_divided_sold_or_packaged(frozen, farmer, middleman, consumer):
+    r = farmer.post('/api/batch/divide', json={'batch_id': frozen['kept'], 'divisions': [{'quantity_kg': 5}]})
+    assert r.status_code == 400
+    r = farmer.post(f"/api/batch/{frozen['kept']}/sell", json={'buyer_id': middleman.uid, 'price_per_kg': 1})
+    assert r.status_code == 400
+    r = middleman.post('/api/package', json={'batch_id': frozen['sold'], 'quantity_kg': 1, 'package_type': 'retail'})
+    assert r.status_code == 400
+    r = middleman.post('/api/transaction', json={'to_user_id': consumer.uid, 'quantity_kg': 1, 'price_per_kg': 1,
+                                                 'batch_id': frozen['sold']})
+    assert r.status_code == 400
+    r = middleman.post('/api/transaction', json={'to_user_id': consumer.uid, 'quantity_kg': 5, 'price_per_kg': 1,
+                                                 'package_id': 1})
+    assert r.status_code == 400
+
+
+def test_retest_keeps_recalled_status(app, frozen, officer):
+    r = officer.post('/api/qatest', json={'batch_id': frozen['kept'], 'test_type': 'grade', 'test_result': 'pass',
+                                          'grade_assigned': 'A'})
+    assert r.status_code == 201
+    with app.app_context():
+        assert db.session.get(Batches, frozen['kept']).status == 'recalled'
+
+
+def test_report_job_writes_ndjson(app, lineage, officer):
+    r = officer.post(f"/api/recall/{lineage['root']}/report")
+    assert r.status_code == 202
+    with app.app_context():
+        job = jobs.execute(jobs.claim('test'))
+        assert job.status == 'succeeded' and job.result['records'] == 9
+    r = officer.get(f"/api/jobs/{job.id}/output")
+    lines = r.get_data(as_text=True).splitlines()
+    assert len(lines) == 9 and json.loads(lines[-1])['type'] == 'summary'
@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from spicechain import refdata
+from spicechain.cache import TTLCache
+from spicechain.extensions import db
+from spicechain.models import Spices, User
+from spicechain.refdata import ReferenceCache
+
+from helpers import register_batch
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(ttl=60)
+    cache.set('old', 1, ttl=-1)
+    cache.set('new', 2)
+    assert cache.get('old', 'gone') == 'gone' and cache.get('new') == 2
+    assert cache.pop('new') == 2 and len(cache) == 0
+
+
+def test_spice_etag_revalidates(app, farmer):
+    r = farmer.get('/api/spices')
+    etag = r.headers['ETag']
+    assert len(r.json['spices']) > 0 and r.headers['Cache-Control'] == 'no-cache'
+    assert farmer.get('/api/spices', headers={'If-None-Match': etag}).status_code == 304
+    with app.app_context():
+        db.session.get(Spices, 1).shelf_life_months = 99
+        db.session.commit()
+    r = farmer.get('/api/spices', headers={'If-None-Match': etag})
+    assert r.status_code == 200 and r.headers['ETag'] != etag
+    assert r.json['spices'][0]['shelf_life_months'] == 99
+
+
+def test_writes_invalidate_on_commit_only(app):
+    with app.app_context():
+        name = refdata.spice_name(1)
+        db.session.get(Spices, 1).name = 'Renamed'
+        db.session.flush()
+        db.session.rollback()
+        assert refdata.spice_name(1) == name
+        db.session.get(Spices, 1).name = 'Renamed'
+        db.session.commit()
+        assert refdata.spice_name(1) == 'Renamed'
+
+
+def test_other_processes_notice_within_the_check_interval(app, farmer):
+    with app.app_context():
+        eager, lazy = ReferenceCache(100, 0), ReferenceCache(100, 3600)
+        for cache in (eager, lazy):
+            assert cache.usernames([farmer.uid]) == {farmer.uid: 'farmer'}
+        # A rename committed by this process only invalidates its own cache
+        db.session.get(User, farmer.uid).username = 'grower'
+        db.session.commit()
+        assert refdata.username(farmer.uid) == 'grower'
+        assert eager.usernames([farmer.uid]) == {farmer.uid: 'grower'}
+        assert lazy.usernames([farmer.uid]) == {farmer.uid: 'farmer'}
+        lazy._checked_at = time.monotonic() - 3601
+        assert lazy.usernames([farmer.uid]) == {farmer.uid: 'grower'}
+
+
+def test_unknown_ids_are_left_out(app, farmer):
+    with app.app_context():
+        assert refdata.usernames([farmer.uid, 9999, None]) == {farmer.uid: 'farmer'}
+        assert refdata.spice_name(9999, 'Unknown') == 'Unknown'
+
+
+def queries(client, url):
+    timing = client.get(url, headers={'X-Server-Timing': '1'}).headers['Server-Timing']
+    return int(timing.split('desc="')[1].split(' queries')[0])
+
+
+@pytest.mark.parametrize('url', ['/api/mybatches', '/api/search?q=Idukki'])
+def test_names_cost_no_query_per_row(farmer, url):
+    register_batch(farmer)
+    farmer.get(url)
+    few = queries(farmer, url)
+    for _ in range(5):
+        register_batch(farmer)
+    assert queries(farmer, url) == few
@@ -0,0 +1,112 @@
+import pytest
+
+from spicechain import market, prices, settlement
+from spicechain.extensions import db
+from spicechain.models import AuditLog, Batches, MarketListing, PriceBar, Timeline, Transactions
+from spicechain.stock import reconcile
+
+from helpers import register_batch
+
+
+def pending_sale(farmer, middleman, quantity_kg=10, price_per_kg=10):
+    batch_id = register_batch(farmer, quantity_kg)
+    r = farmer.post(f'/api/batch/{batch_id}/sell', json={'buyer_id': middleman.uid, 'price_per_kg': price_per_kg})
+    assert r.status_code == 201, r.json
+    return r.json['transaction_id']
+
+
+@pytest.fixture
+def delivery(farmer, middleman):
+    return [pending_sale(farmer, middleman, 10 * n, 10 + n) for n in range(1, 4)]
+
+
+def settle(client, codes, **options):
+    return client.post('/api/transactions/complete', json={'transaction_ids': codes, **options})
+
+
+def statuses(app, codes):
+    with app.app_context():
+        return [Transactions.query.filter_by(transaction_id=code).one().payment_status for code in codes]
+
+
+def derived(app):
+    """Market listings and price bars, which a rebuild must reproduce."""
+    with app.app_context():
+        return (sorted((l.batch_id, l.owner_id, round(l.quantity_kg, 6)) for l in MarketListing.query),
+                sorted((b.segment_type, b.segment, str(b.day), round(b.open, 4), round(b.close, 4),
+                        round(b.volume_kg, 4), b.trades) for b in PriceBar.query))
+
+
+def test_bulk_settlement_completes_everything(app, delivery, farmer, middleman):
+    r = settle(middleman, delivery)
+    assert r.status_code == 200 and r.json['settled'] == 3
+    assert [result['settled'] for result in r.json['results']] == [True] * 3
+    assert statuses(app, delivery) == ['completed'] * 3
+    with app.app_context():
+        assert {(b.current_owner_id, b.status) for b in Batches.query} == {(middleman.uid, 'sold')}
+        events = Timeline.query.filter_by(event_type='transaction_completed').all()
+        assert sorted(event.event_metadata['transaction_id'] for event in events) == sorted(delivery)
+        assert AuditLog.query.filter_by(action='TRANSACTION_COMPLETED').count() == 3
+        assert reconcile()['batch_rows_fixed'] == 0 and reconcile()['owner_rows_fixed'] == 0
+    incremental = derived(app)
+    with app.app_context():
+        market.rebuild()
+        prices.rebuild()
+    assert derived(app) == incremental and len(incremental[1]) > 0
+    # The buyer's and the farmer's devices both see the change
+    sync = middleman.get('/api/sync').json
+    assert {t['transaction_id'] for t in sync['transactions']} == set(delivery)
+    assert {t['payment_status'] for t in farmer.get('/api/sync').json['transactions']} == {'completed'}
+
+
+def test_atomic_settlement_is_all_or_nothing(app, delivery, middleman):
+    r = settle(middleman, delivery + ['TXN_MISSING'])
+    assert r.status_code == 400 and r.json['settled'] == 0
+    assert r.json['results'][-1] == {'transaction_id': 'TXN_MISSING', 'status': 404, 'settled': False,
+                                     'error': 'Transaction not found'}
+    assert statuses(app, delivery) == ['pending'] * 3
+
+
+def test_partial_settlement_reports_each_code(app, delivery, farmer, middleman, make_user):
+    other = make_user('middleman2', 'middleman')
+    elsewhere = pending_sale(farmer, other)
+    assert middleman.post(f'/api/transaction/{delivery[0]}/complete').status_code == 200
+    r = settle(middleman, delivery + [elsewhere, delivery[1]], atomic=False)
+    assert r.status_code == 200 and r.json['settled'] == 2
+    assert [(result['status'], result['settled']) for result in r.json['results']] == [
+        (400, False), (200, True), (200, True), (403, False)]
+    assert statuses(app, [elsewhere]) == ['pending']
+
+
+def test_conflicting_completion_settles_nothing(app, delivery, middleman, monkeypatch):
+    # A transaction completed between the check and the update
+    with app.app_context():
+        Transactions.query.filter_by(transaction_id=delivery[0]).one().payment_status = 'completed'
+        db.session.commit()
+    monkeypatch.setattr(settlement, '_check', lambda transaction, buyer_id: (200, None))
+    r = settle(middleman, delivery)
+    assert r.status_code == 409 and 'nothing was settled' in r.json['error']
+    assert statuses(app, delivery) == ['completed', 'pending', 'pending']
+
+
+def queries(client, codes):
+    r = client.post('/api/transactions/complete', json={'transaction_ids': codes},
+                    headers={'X-Server-Timing': '1'})
+    assert r.status_code == 200
+    return int(r.headers['Server-Timing'].split('desc="')[1].split(' queries')[0])
+
+
+def test_statements_do_not_grow_with_the_delivery(farmer, middleman):
+    first, small, large = ([pending_sale(farmer, middleman) for _ in range(n)] for n in (1, 2, 8))
+    # The first settlement creates the day's price bars and the stock rows
+    queries(middleman, first)
+    assert queries(middleman, small) == queries(middleman, large)
+
+
+@pytest.mark.parametrize('body', [
+    {}, {'transaction_ids': []}, {'transaction_ids': 'TXN_1'}, {'transaction_ids': [1]},
+    {'transaction_ids': ['TXN_1'], 'atomic': 'no'}, {'transaction_ids': ['a', 'b', 'c']},
+])
+def test_settlement_validation(app, middleman, body):
+    app.config['SETTLEMENT_MAX_TRANSACTIONS'] = 2
+    assert middleman.post('/api/transactions/complete', json=body).status_code == 400
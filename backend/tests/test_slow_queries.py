@@ -0,0 +1,85 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from spicechain import create_app, slow_queries
+from spicechain.config import configs
+from spicechain.extensions import db
+
+
+def close(app):
+    for handler in app.extensions['slow_queries']['logger'].handlers:
+        handler.close()
+
+
+@pytest.fixture
+def slow_log(app):
+    """Log every statement (threshold 0) to the app's SLOW_QUERY_LOG."""
+    app.config['SLOW_QUERY_MS'] = 0
+    slow_queries.init_app(app)
+    yield app.config['SLOW_QUERY_LOG']
+    close(app)
+
+
+def test_fingerprint_ignores_literals():
+    assert slow_queries.fingerprint('SELECT * FROM t WHERE id = 1') == \
+        slow_queries.fingerprint('SELECT * FROM t  WHERE id = 42')
+
+
+def test_slow_statements_logged_with_plan_and_endpoint(slow_log, farmer):
+    farmer.get('/api/mybatches')
+    records = list(slow_queries.load_records(slow_log))
+    selects = [r for r in records if r['endpoint'] == 'batches.get_my_batches' and r['plan']]
+    assert selects
+    assert all(r['duration_ms'] >= 0 and r['fingerprint'] for r in selects)
+
+
+def test_failed_statement_is_not_timed_later(app, slow_log):
+    with app.app_context():
+        with pytest.raises(OperationalError):
+            db.session.execute(db.text('SELECT * FROM no_such_table'))
+        db.session.rollback()
+        db.session.execute(db.text('SELECT 2'))
+    statements = [r['statement'] for r in slow_queries.load_records(slow_log)]
+    assert 'SELECT 2' in statements
+    assert not any('no_such_table' in s for s in statements)
+
+
+def test_summary_groups_by_fingerprint():
+    records = [
+        {'fingerprint': 'a', 'duration_ms': d, 'endpoint': 'x', 'timestamp': str(d),
+         'statement': 'SELECT 1', 'plan': None} for d in (10, 30, 20)
+    ] + [{'fingerprint': 'b', 'duration_ms': 5, 'endpoint': None, 'timestamp': '1',
+          'statement': 'SELECT 2', 'plan': ['SCAN t']}]
+    summary = {row['fingerprint']: row for row in slow_queries.summarize(records)}
+    assert summary['a']['count'] == 3 and summary['a']['total_ms'] == 60
+    assert summary['a']['p50_ms'] == 20 and summary['a']['max_ms'] == 30
+    assert summary['b']['endpoints'] == ['-'] and summary['b']['plan'] == ['SCAN t']
+
+
+def test_report_command(app, slow_log, farmer):
+    farmer.get('/api/mybatches')
+    with app.app_context():
+        result = app.test_cli_runner().invoke(args=['slow-queries', 'report', '--top', '1'])
+    assert result.exit_code == 0 and 'total' in result.output
+
+
+def test_apps_keep_their_own_log(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def make(name, threshold):
+        config = type(name, (configs['testing'],), {'SLOW_QUERY_MS': threshold,
+                                                    'SLOW_QUERY_LOG': str(tmp_path / f'{name}.log')})
+        return create_app(config)
+
+    first, second = make('first', 0), make('second', 0)
+    make('off', None)
+    for app, statement in ((first, 'SELECT 1'), (second, 'SELECT 2')):
+        with app.app_context():
+            db.session.execute(db.text(statement))
+            db.session.remove()
+    # A later app without a threshold left the others logging
+    assert [r['statement'] for r in slow_queries.load_records(str(tmp_path / 'first.log'))] == ['SELECT 1']
+    assert [r['statement'] for r in slow_queries.load_records(str(tmp_path / 'second.log'))] == ['SELECT 2']
+    assert not (tmp_path / 'off.log').exists()
+    close(first)
+    close(second)
@@ -0,0 +1,130 @@
+import os
+from datetime import datetime, timedelta
+
+import pyarrow.parquet as pq
+import pytest
+
+from spicechain import archive, snapshot, sync
+from spicechain.extensions import db
+from spicechain.models import AuditLog, Batches, Timeline
+
+from helpers import register_batch, sell
+
+TABLES = ('batches', 'transactions', 'qa_tests', 'timeline')
+
+
+def contents(root):
+    """Every snapshot table as ``{month: rows by id}``."""
+    tables = {}
+    for name in TABLES:
+        directory = os.path.join(root, name)
+        tables[name] = {
+            month: sorted(pq.read_table(os.path.join(directory, month, 'data.parquet')).to_pylist(),
+                          key=lambda row: row['id'])
+            for month in sorted(os.listdir(directory)) if os.path.isdir(os.path.join(directory, month))
+        } if os.path.isdir(directory) else {}
+    return tables
+
+
+def rebuild(app, tmp_path):
+    """A full snapshot written next to the incremental one."""
+    root = app.config['SNAPSHOT_DIR']
+    app.config['SNAPSHOT_DIR'] = str(tmp_path / 'full')
+    with app.app_context():
+        snapshot.run(full=True)
+    app.config['SNAPSHOT_DIR'] = root
+    return contents(str(tmp_path / 'full'))
+
+
+def take(app, full=False):
+    with app.app_context():
+        return snapshot.run(full)
+
+
+@pytest.fixture
+def activity(farmer, middleman, officer):
+    first = register_batch(farmer, 80)
+    officer.post('/api/qatest', json={'batch_id': first, 'test_type': 'grade', 'test_result': 'pass',
+                                      'grade_assigned': 'A'})
+    return first
+
+
+def test_incremental_runs_match_a_rebuild(app, tmp_path, activity, farmer, middleman, officer):
+    take(app)
+    # Updates in place (owner, status, quantities) as well as new rows
+    sell(farmer, middleman, activity)
+    r = middleman.post('/api/batch/divide', json={'batch_id': activity, 'divisions': [{'quantity_kg': 30}]})
+    assert r.status_code == 201, r.json
+    second = register_batch(farmer, 20, farm_location='Wayanad', harvest_date='2026-07-15T00:00:00Z')
+    officer.post('/api/qatest', json={'batch_id': second, 'test_type': 'grade', 'test_result': 'fail',
+                                      'grade_assigned': 'C'})
+    report = take(app)
+    assert report['batches'][0] >= 2 and report['transactions'][0] == 1
+    incremental = contents(app.config['SNAPSHOT_DIR'])
+    assert incremental == rebuild(app, tmp_path)
+    assert set(incremental['batches']) == {'month=2026-07', 'month=2026-09'}
+
+
+def test_unchanged_run_rewrites_nothing(app, activity):
+    take(app)
+    assert all(partitions == 0 for _, partitions in take(app).values())
+
+
+def test_pruned_change_feed_forces_a_rebuild(app, tmp_path, activity, farmer, middleman):
+    take(app)
+    sell(farmer, middleman, activity)
+    with app.app_context():
+        sync.prune(-1)
+    report = take(app)
+    with app.app_context():
+        assert report['batches'][0] == Batches.query.count()
+    assert contents(app.config['SNAPSHOT_DIR']) == rebuild(app, tmp_path)
+
+
+def test_rebuild_keeps_archived_timeline_months(app, tmp_path, activity, farmer, middleman):
+    sell(farmer, middleman, activity)
+    with app.app_context():
+        for model in (Timeline, AuditLog):
+            for row in model.query:
+                row.timestamp -= timedelta(days=400)
+        db.session.commit()
+    take(app)
+    before = contents(app.config['SNAPSHOT_DIR'])['timeline']
+    with app.app_context():
+        archive.apply_policies(today=datetime.utcnow())
+        assert Timeline.query.count() == 0
+    take(app, full=True)
+    assert before and contents(app.config['SNAPSHOT_DIR'])['timeline'] == before
+
+
+def test_reports_need_a_snapshot(farmer):
+    r = farmer.get('/api/reports/harvest-volume')
+    assert r.status_code == 503 and 'snapshot run' in r.json['error']
+
+
+def test_reports_read_the_snapshot(app, activity, farmer, middleman):
+    register_batch(farmer, 20, farm_location='Wayanad')
+    sell(farmer, middleman, activity, price_per_kg=5)
+    take(app)
+    volume = farmer.get('/api/reports/harvest-volume').json
+    assert volume['rows'] == [{'region': 'Idukki', 'batches': 1, 'quantity_kg': 80},
+                              {'region': 'Wayanad', 'batches': 1, 'quantity_kg': 20}]
+    by_spice = farmer.get('/api/reports/harvest-volume?by=spice').json['rows']
+    assert [(row['batches'], row['quantity_kg']) for row in by_spice] == [(2, 100)]
+    turnover = farmer.get('/api/reports/middleman-turnover').json['rows']
+    assert [(row['username'], row['bought_kg'], row['spent']) for row in turnover] == [('middleman', 80, 400)]
+    qa = farmer.get('/api/reports/qa-pass-rate').json['rows']
+    assert [(row['tests'], row['passed']) for row in qa] == [(1, 1)]
+    assert farmer.get('/api/reports/harvest-volume?to=2026-08-31').json['rows'] == []
+
+    # Results follow the next snapshot, not the live tables
+    register_batch(farmer, 5)
+    assert farmer.get('/api/reports/harvest-volume').json == volume
+    take(app)
+    assert farmer.get('/api/reports/harvest-volume').json['rows'][0]['quantity_kg'] == 85
+
+
+@pytest.mark.parametrize('query', ['by=farm', 'from=yesterday', 'limit=0'])
+def test_report_validation(farmer, query):
+    url = '/api/reports/middleman-turnover' if query.startswith('limit') else '/api/reports/harvest-volume'
+    assert farmer.get(f'{url}?{query}').status_code == 400
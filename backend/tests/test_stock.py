@@ -0,0 +1,127 @@
+from datetime import datetime
+
+import pytest
+
+from spicechain.extensions import db
+from spicechain.models import BatchComposition, BatchStock, Batches, OwnerStock, StockLedger
+from spicechain.stock import InsufficientStock, available, original_quantities, reconcile, take
+
+from helpers import register_batch, sell
+
+
+def ledger_balances():
+    return dict(db.session.execute(
+        db.select(StockLedger.batch_id, db.func.sum(StockLedger.delta_kg)).group_by(StockLedger.batch_id)
+    ).all())
+
+
+def stored_balances():
+    return dict(db.session.execute(db.select(BatchStock.batch_id, BatchStock.quantity_kg)).all())
+
+
+def owner_balances():
+    return {(row.owner_id, row.spice_id): (row.batches, row.quantity_kg) for row in OwnerStock.query}
+
+
+@pytest.fixture
+def traded(farmer, middleman):
+    root = register_batch(farmer, 100)
+    r = farmer.post('/api/batch/divide', json={'batch_id': root, 'divisions': [
+        {'quantity_kg': 30, 'buyer_id': middleman.uid, 'price_per_kg': 10}, {'quantity_kg': 20}]})
+    assert r.status_code == 201, r.json
+    assert middleman.post(f"/api/transaction/{r.json['transactions_created'][0]['transaction_id']}/complete") \
+        .status_code == 200
+    sold = r.json['new_batches'][0]['id']
+    r = middleman.post('/api/package', json={'batch_id': sold, 'quantity_kg': 5, 'package_type': 'retail'})
+    assert r.status_code == 201, r.json
+    return root, sold
+
+
+def test_balances_follow_ledger(app, traded, farmer, middleman):
+    root, sold = traded
+    with app.app_context():
+        assert stored_balances() == ledger_balances()
+        assert stored_balances()[root] == 50 and stored_balances()[sold] == 25
+        assert owner_balances() == {(farmer.uid, 1): (2, 70), (middleman.uid, 1): (1, 25)}
+        # The recorded harvest quantity never changes
+        assert db.session.get(Batches, root).quantity_kg == 100
+
+
+def test_cannot_divide_more_than_available(traded, farmer):
+    root, _ = traded
+    r = farmer.post('/api/batch/divide', json={'batch_id': root, 'divisions': [{'quantity_kg': 51}]})
+    assert r.status_code == 400
+
+
+def test_take_is_all_or_nothing(app, traded):
+    root, _ = traded
+    with app.app_context():
+        batch = db.session.get(Batches, root)
+        before = ledger_balances()
+        with pytest.raises(InsufficientStock):
+            take(batch, 50.5, 'test')
+        assert ledger_balances() == before
+        take(batch, 50, 'test')
+        assert available(batch) == 0
+
+
+def test_reconcile_repairs_drift_and_opens_legacy_batches(app, traded, farmer):
+    with app.app_context():
+        expected_batches, expected_owners = stored_balances(), owner_balances()
+        db.session.execute(db.update(BatchStock).values(quantity_kg=999))
+        db.session.execute(db.delete(OwnerStock))
+        legacy = Batches(batch_id='LEGACY_1', farmer_id=farmer.uid, spice_id=1, quantity_kg=7,
+                         harvest_date=datetime(2020, 1, 1), farm_location='Old farm', current_owner_id=farmer.uid)
+        db.session.add(legacy)
+        db.session.commit()
+
+        report = reconcile(chunk_size=1)
+        assert report['opened'] == 1
+        assert report['batch_rows_fixed'] == len(expected_batches) + 1
+        assert stored_balances() == {**expected_batches, legacy.id: 7}
+        farmer_batches, farmer_kg = expected_owners[farmer.uid, 1]
+        assert owner_balances() == {**expected_owners, (farmer.uid, 1): (farmer_batches + 1, farmer_kg + 7)}
+
+        assert reconcile()['batch_rows_fixed'] == 0
+
+
+def test_reconcile_command(app, traded):
+    with app.app_context():
+        result = app.test_cli_runner().invoke(args=['stock', 'reconcile'])
+    assert result.exit_code == 0 and 'fixed 0 batch and 0 owner balances' in result.output
+
+
+def test_original_quantity_adds_back_pre_ledger_divisions_and_merges(app, farmer):
+    with app.app_context():
+        # Harvested 100 kg; the old code divided off 30 and merged 10 away by
+        # reducing quantity_kg in place
+        legacy = Batches(batch_id='LEGACY_1', farmer_id=farmer.uid, spice_id=1, quantity_kg=60,
+                         harvest_date=datetime(2020, 1, 1), farm_location='Old farm', current_owner_id=farmer.uid)
+        db.session.add(legacy)
+        db.session.flush()
+        db.session.add_all([
+            Batches(batch_id='LEGACY_2', farmer_id=farmer.uid, spice_id=1, quantity_kg=30, parent_batch_id=legacy.id,
+                    harvest_date=datetime(2020, 1, 1), farm_location='Old farm', current_owner_id=farmer.uid),
+            Batches(batch_id='LEGACY_3', farmer_id=farmer.uid, spice_id=1, quantity_kg=10,
+                    harvest_date=datetime(2020, 1, 1), farm_location='Old farm', current_owner_id=farmer.uid),
+        ])
+        db.session.flush()
+        merged = Batches.query.filter_by(batch_id='LEGACY_3').one()
+        db.session.add(BatchComposition(child_batch_id=merged.id, source_batch_id=legacy.id, quantity_kg=10))
+        db.session.commit()
+        legacy_id = legacy.id
+        assert original_quantities([legacy])[legacy_id] == 100
+        reconcile()
+        assert original_quantities([legacy])[legacy_id] == 100
+
+    # Divisions after the opening entry no longer touch quantity_kg
+    r = farmer.post('/api/batch/divide', json={'batch_id': legacy_id, 'divisions': [{'quantity_kg': 20}]})
+    assert r.status_code == 201, r.json
+    listed = {batch['id']: batch for batch in farmer.get('/api/mybatches').json['batches']}
+    assert (listed[legacy_id]['original_quantity_kg'], listed[legacy_id]['quantity_kg']) == (100, 40)
+    assert listed[r.json['new_batches'][0]['id']]['original_quantity_kg'] == 20
+    history = farmer.get(f'/api/batch/{legacy_id}/history').json
+    assert history['root_batch']['original_quantity'] == 100
+    code = farmer.post('/api/package', json={'batch_id': legacy_id, 'quantity_kg': 5, 'package_type': 'box'}).json[
+        'package_id']
+    assert farmer.get(f'/api/trace/{code}').json['origin_details']['original_quantity_kg'] == 100
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+from flask import jsonify
+
+from spicechain.rawjson import RawJSON
+from spicechain.streaming import stream_response
+
+from helpers import register_batch
+
+
+def payload(lazy):
+    items = [{'n': n, 'name': f'café {n}', 'metadata': RawJSON('{"b": 1, "a": [2]}')} for n in range(25)]
+    return {
+        'zeta': {'nested': [1, 2], 'none': None},
+        'events': iter(items) if lazy else items,
+        'empty': iter([]) if lazy else [],
+        'alpha': 'first',
+    }
+
+
+@pytest.mark.parametrize('buffer_bytes', [1, 40, 65536])
+def test_stream_matches_jsonify_byte_for_byte(app, buffer_bytes):
+    app.config['STREAM_BUFFER_BYTES'] = buffer_bytes
+    with app.test_request_context('/'):
+        expected = jsonify(payload(lazy=False)).get_data()
+        response = stream_response(payload(lazy=True))
+        pieces = list(response.response)
+    assert response.is_streamed and response.mimetype == 'application/json'
+    assert ''.join(pieces).encode() == expected
+    if buffer_bytes == 1:
+        assert len(pieces) > 25
+
+
+def test_items_are_encoded_as_they_are_sent(app):
+    produced = []
+
+    def events():
+        for n in range(3):
+            produced.append(n)
+            yield {'n': n}
+
+    app.config['STREAM_BUFFER_BYTES'] = 1
+    with app.test_request_context('/'):
+        body = iter(stream_response({'tail': 1, 'events': events()}).response)
+        sent = []
+        while not produced:
+            sent.append(next(body))
+        # The first item went out before the second was produced
+        assert ''.join(sent) == '{"events":[{"n":0}' and produced == [0]
+        assert ''.join(body) == ',{"n":1},{"n":2}],"tail":1}\n'
+
+
+@pytest.mark.parametrize('path, headers', [
+    ('/?format=ndjson', {}),
+    ('/', {'Accept': 'application/x-ndjson'}),
+])
+def test_ndjson_lines(app, path, headers):
+    with app.test_request_context(path, headers=headers):
+        response = stream_response(payload(lazy=True))
+        lines = ''.join(response.response).splitlines()
+    assert response.mimetype == 'application/x-ndjson'
+    assert json.loads(lines[0]) == {'zeta': {'nested': [1, 2], 'none': None}, 'alpha': 'first'}
+    assert [json.loads(line)['n'] for line in lines[1:]] == list(range(25))
+    assert json.loads(lines[1])['metadata'] == {'b': 1, 'a': [2]}
+
+
+def test_json_is_preferred_by_default(app):
+    with app.test_request_context('/', headers={'Accept': 'application/json, application/x-ndjson;q=0.5'}):
+        assert stream_response({'a': iter([1])}).mimetype == 'application/json'
+
+
+def test_batch_history_streams(app, farmer, middleman):
+    batch_id = register_batch(farmer)
+    for _ in range(3):
+        r = farmer.post('/api/batch/divide', json={'batch_id': batch_id, 'divisions': [{'quantity_kg': 5}]})
+        assert r.status_code == 201
+    app.config['STREAM_BUFFER_BYTES'] = 64
+    r = farmer.get(f'/api/batch/{batch_id}/history')
+    assert r.is_streamed
+    history = json.loads(r.get_data())
+    assert len(history['divisions']) == 3 and len(history['timeline']) >= 4
+    lines = farmer.get(f'/api/batch/{batch_id}/history?format=ndjson').get_data(as_text=True).splitlines()
+    assert json.loads(lines[0]) == {key: history[key] for key in ('root_batch', 'divisions')}
+    assert [json.loads(line) for line in lines[1:]] == history['timeline']
+    assert farmer.get('/api/batch/999/history').status_code == 404
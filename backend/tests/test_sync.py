@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from spicechain import sync
+from spicechain.extensions import db
+from spicechain.models import Batches, SyncChange, SyncOperation
+
+from helpers import register_batch, sell
+
+
+def pull(client, since=None):
+    r = client.get('/api/sync' if since is None else f'/api/sync?since={since}')
+    assert r.status_code == 200, r.json
+    return r.json
+
+
+def test_full_then_delta(farmer, middleman):
+    first = register_batch(farmer)
+    full = pull(farmer)
+    assert full['full'] and [b['id'] for b in full['batches']] == [first]
+    assert pull(farmer, full['sync_token'])['batches'] == []
+
+    second = register_batch(farmer)
+    delta = pull(farmer, full['sync_token'])
+    assert not delta['full'] and [b['id'] for b in delta['batches']] == [second]
+    assert delta['sync_token'] > full['sync_token']
+
+
+def test_transfer_reaches_both_sides(farmer, middleman):
+    batch_id = register_batch(farmer)
+    farmer_token, middleman_token = pull(farmer)['sync_token'], pull(middleman)['sync_token']
+    sell(farmer, middleman, batch_id)
+    delta = pull(farmer, farmer_token)
+    assert delta['removed']['batches'] == [batch_id]
+    assert [t['payment_status'] for t in delta['transactions']] == ['completed']
+    delta = pull(middleman, middleman_token)
+    assert [b['id'] for b in delta['batches']] == [batch_id]
+    assert delta['transactions'][0]['direction'] == 'received'
+
+
+def test_paging(app, farmer):
+    token = pull(farmer)['sync_token']
+    for _ in range(3):
+        register_batch(farmer)
+    app.config['SYNC_PAGE_SIZE'] = 2
+    seen, pages = set(), 0
+    while True:
+        page = pull(farmer, token)
+        assert len(page['batches']) <= 2
+        seen.update(b['id'] for b in page['batches'])
+        token, pages = page['sync_token'], pages + 1
+        if not page['has_more']:
+            break
+    assert pages > 1 and len(seen) == 3
+
+
+def test_changes_inside_visibility_lag_are_held_back(app, farmer):
+    token = pull(farmer)['sync_token']
+    app.config['SYNC_VISIBILITY_LAG_SECONDS'] = 60
+    register_batch(farmer)
+    delta = pull(farmer, token)
+    assert delta['batches'] == [] and delta['sync_token'] == token
+    assert pull(farmer)['sync_token'] == token
+    # Once the change is older than the lag it is delivered
+    with app.app_context():
+        db.session.execute(db.update(SyncChange).values(created_at=datetime.utcnow() - timedelta(minutes=2)))
+        db.session.commit()
+    delta = pull(farmer, token)
+    assert len(delta['batches']) == 1 and delta['sync_token'] > token
+
+
+def test_pruned_token_needs_resync(app, farmer):
+    token = pull(farmer)['sync_token']
+    register_batch(farmer)
+    with app.app_context():
+        assert sync.prune(-1) > 0
+    assert farmer.get(f'/api/sync?since={token}').status_code == 410
+    assert pull(farmer)['full']
+
+
+REGISTER = {'spice_id': 3, 'quantity_kg': 50, 'harvest_date': '2026-10-01T00:00:00', 'farm_location': 'Kollam'}
+
+
+def test_upload_applies_once(app, farmer, middleman):
+    operations = [
+        {'op_id': 'a1', 'type': 'register', 'data': REGISTER},
+        {'op_id': 'a2', 'type': 'sell', 'data': {'batch_id': 1, 'buyer_id': middleman.uid, 'price_per_kg': 11}},
+    ]
+    r = farmer.post('/api/sync/upload', json={'operations': operations})
+    assert r.status_code == 200 and [x['replayed'] for x in r.json['results']] == [False, False]
+    r = farmer.post('/api/sync/upload', json={'operations': operations})
+    assert [x['replayed'] for x in r.json['results']] == [True, True]
+    with app.app_context():
+        assert Batches.query.count() == 1 and SyncOperation.query.count() == 2
+
+
+def test_failed_upload_applies_nothing(app, farmer, middleman):
+    operations = [
+        {'op_id': 'b1', 'type': 'register', 'data': REGISTER},
+        {'op_id': 'b2', 'type': 'sell', 'data': {'batch_id': 999, 'buyer_id': middleman.uid, 'price_per_kg': 1}},
+    ]
+    r = farmer.post('/api/sync/upload', json={'operations': operations})
+    assert r.status_code == 404 and r.json['failed']['op_id'] == 'b2'
+    with app.app_context():
+        assert Batches.query.count() == 0 and SyncOperation.query.count() == 0
+
+
+@pytest.mark.parametrize('body', [{}, {'operations': []}, {'operations': [{'op_id': 'x', 'type': 'nope'}]}])
+def test_upload_validation(farmer, body):
+    assert farmer.post('/api/sync/upload', json=body).status_code == 400
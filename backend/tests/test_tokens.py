@@ -0,0 +1,82 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from spicechain.extensions import db
+from spicechain.models import RevokedToken
+from spicechain.tokens import Revocations, TokenError, decode_token, issue_tokens
+
+
+def test_refresh_rotates_and_old_token_is_single_use(app, farmer):
+    anonymous = app.test_client()
+    old = farmer.tokens['refresh_token']
+    r = anonymous.post('/api/token/refresh', json={'refresh_token': old})
+    assert r.status_code == 200
+    assert anonymous.get('/api/mybatches', headers={'Authorization': f"Bearer {r.json['access_token']}"}).status_code == 200
+    r = anonymous.post('/api/token/refresh', json={'refresh_token': old})
+    assert r.status_code == 401 and r.json['error'] == 'Token has been revoked'
+
+
+def test_refresh_race_on_stale_worker_is_401(app, farmer):
+    anonymous = app.test_client()
+    token = farmer.tokens['refresh_token']
+    assert anonymous.post('/api/token/refresh', json={'refresh_token': token}).status_code == 200
+    # A second worker that has not pulled the revocation yet
+    app.config['JWT_REVOCATION_REFRESH_SECONDS'] = 3600
+    stale = Revocations()
+    stale._refreshed = time.monotonic()
+    app.extensions['jwt']['revocations'] = stale
+    r = anonymous.post('/api/token/refresh', json={'refresh_token': token})
+    assert r.status_code == 401 and r.json['error'] == 'Token has been revoked'
+
+
+def test_access_token_cannot_refresh(app, farmer):
+    r = app.test_client().post('/api/token/refresh', json={'refresh_token': farmer.tokens['access_token']})
+    assert r.status_code == 401
+
+
+def test_logout_revokes_access_and_refresh_tokens(app, farmer):
+    headers = {'Authorization': f"Bearer {farmer.tokens['access_token']}"}
+    client = app.test_client()
+    r = client.post('/api/logout', headers=headers, json={'refresh_token': farmer.tokens['refresh_token']})
+    assert r.status_code == 200
+    assert client.get('/api/mybatches', headers=headers).status_code == 401
+    assert client.post('/api/token/refresh', json={'refresh_token': farmer.tokens['refresh_token']}).status_code == 401
+
+
+def test_revocations_forget_expired_tokens(app):
+    with app.app_context():
+        revocations = Revocations()
+        now = datetime.utcnow()
+        revocations.add('gone', now - timedelta(seconds=1))
+        revocations.add('live', now + timedelta(hours=1))
+        db.session.add_all([RevokedToken(jti='old', expires_at=now - timedelta(hours=1)),
+                            RevokedToken(jti='new', expires_at=now + timedelta(hours=1))])
+        db.session.commit()
+        revocations.refresh(0)
+        assert set(revocations.jtis) == {'live', 'new'}
+
+
+def test_prune_deletes_expired_rows(app):
+    now = datetime.utcnow()
+    with app.app_context():
+        db.session.add_all([RevokedToken(jti='old', expires_at=now - timedelta(hours=1)),
+                            RevokedToken(jti='new', expires_at=now + timedelta(hours=1))])
+        db.session.commit()
+        result = app.test_cli_runner().invoke(args=['tokens', 'prune'])
+        assert result.output.strip() == '1 expired revocations pruned'
+        assert [row.jti for row in RevokedToken.query] == ['new']
+
+
+def test_expired_and_tampered_tokens_rejected(app):
+    with app.app_context():
+        app.config['JWT_ACCESS_TOKEN_SECONDS'] = -1
+        expired = issue_tokens(1, 'farmer')['access_token']
+        with pytest.raises(TokenError):
+            decode_token(expired)
+        app.config['JWT_ACCESS_TOKEN_SECONDS'] = 60
+        token = issue_tokens(1, 'farmer')['access_token']
+        assert decode_token(token)['sub'] == '1'
+        with pytest.raises(TokenError):
+            decode_token(token[:-2] + ('AA' if token[-2:] != 'AA' else 'BB'))
@@ -0,0 +1,112 @@
+import zlib
+
+import pytest
+
+from spicechain import trace_tokens
+from spicechain.trace_tokens import TraceTokenError, base45_decode, base45_encode, cbor_dumps, cbor_loads
+
+from helpers import register_batch, sell
+
+
+@pytest.mark.parametrize('value', [0, 23, 24, 255, 65536, 2 ** 40, -1, -500, 'spice', '', b'\x00\xff',
+                                   [1, 'a', None], {1: 'x', 10: ['A', 'B']}, True, False, None])
+def test_cbor_round_trip(value):
+    assert cbor_loads(cbor_dumps(value)) == value
+
+
+def test_cbor_maps_are_canonical():
+    assert cbor_dumps({10: 1, 1: 2, 'a': 3}) == cbor_dumps({'a': 3, 1: 2, 10: 1})
+
+
+@pytest.mark.parametrize('data', [b'', b'A', b'AB', b'ietf!', bytes(range(256))])
+def test_base45_round_trip(data):
+    assert base45_decode(base45_encode(data)) == data
+
+
+def test_base45_known_values():
+    # RFC 9285 examples
+    assert base45_encode(b'AB') == 'BB8'
+    assert base45_encode(b'Hello!!') == '%69 VD92EX0'
+    with pytest.raises(ValueError):
+        base45_decode('GGW')
+
+
+def package(client, batch_id, quantity_kg=10):
+    r = client.post('/api/package', json={'batch_id': batch_id, 'quantity_kg': quantity_kg, 'package_type': 'box'})
+    assert r.status_code == 201, r.json
+    return r.json['package_id']
+
+
+def token_of(client, code):
+    return client.get(f'/api/qr/{code}').json['trace_token']
+
+
+def digest_of(client, code):
+    return client.get(f'/api/trace/{code}').json['package_details']['trace_digest']
+
+
+def test_package_token_verifies_offline(app, farmer, middleman):
+    batch_id = register_batch(farmer)
+    sell(farmer, middleman, batch_id)
+    sub = middleman.post('/api/batch/divide', json={'batch_id': batch_id, 'divisions': [{'quantity_kg': 30}]})
+    code = package(middleman, sub.json['new_batches'][0]['id'])
+    token = token_of(middleman, code)
+    assert token.startswith('SC1:')
+    with app.app_context():
+        claims = trace_tokens.verify(token)
+    assert claims[1] == code and claims[3] == 'Idukki'
+    with app.app_context():
+        assert claims[10] == trace_tokens.lineage(batch_id)
+    assert claims[6].hex() == digest_of(middleman, code)
+
+
+def test_tampered_token_is_rejected(app, farmer):
+    code = package(farmer, register_batch(farmer))
+    token = token_of(farmer, code)
+    with app.app_context():
+        message = bytearray(zlib.decompress(base45_decode(token[4:])))
+        message[-1] ^= 1
+        forged = 'SC1:' + base45_encode(zlib.compress(bytes(message)))
+        with pytest.raises(TraceTokenError, match='Invalid signature'):
+            trace_tokens.verify(forged)
+        for bad in ('nope', 'SC1:!!!', 'SC1:' + base45_encode(b'junk')):
+            with pytest.raises(TraceTokenError):
+                trace_tokens.verify(bad)
+
+
+def test_rotation_keeps_old_tokens_until_revoked(app, farmer):
+    old = token_of(farmer, package(farmer, register_batch(farmer)))
+    with app.app_context():
+        old_kid = trace_tokens.public_keys()[0]['kid']
+        new_kid = trace_tokens.rotate_key()
+    new = token_of(farmer, package(farmer, register_batch(farmer)))
+    keys = farmer.get('/api/trace-keys').json['keys']
+    assert [key['kid'] for key in keys] == [new_kid, old_kid]
+    assert keys[1]['retired_at'] is not None
+    with app.app_context():
+        trace_tokens.verify(old)
+        trace_tokens.verify(new)
+        trace_tokens.revoke_key(old_kid)
+        with pytest.raises(TraceTokenError, match='revoked'):
+            trace_tokens.verify(old)
+        trace_tokens.verify(new)
+
+
+def test_blend_token_lists_every_harvest(app, make_user, farmer, middleman):
+    other = make_user('farmer2', 'farmer')
+    first = register_batch(farmer, 40)
+    second = register_batch(other, 60, farm_location='Wayanad')
+    sell(farmer, middleman, first)
+    sell(other, middleman, second)
+    merged = middleman.post('/api/batch/merge', json={'sources': [{'batch_id': first, 'quantity_kg': 20},
+                                                                  {'batch_id': second, 'quantity_kg': 60}]}).json
+    code = package(middleman, merged['id'])
+    with app.app_context():
+        claims = trace_tokens.verify(token_of(middleman, code))
+        lineage = trace_tokens.lineage(merged['id'])
+    assert len(claims[10]) == 2 and claims[10] == sorted(claims[10])
+    assert sorted(lineage[:2]) == claims[10]
+    assert lineage[-1] == merged['batch_id']
+    # Wayanad gave 60 of the 80 kg
+    assert claims[3] == 'Wayanad'
+    assert claims[6].hex() == digest_of(middleman, code)